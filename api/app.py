@@ -1,18 +1,38 @@
 from flask import Flask, jsonify
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_caching import Cache
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from config import get_config
 import logging
-from utils.logger import setup_logger
-from utils.errors import APIError
 
-# Initialize extensions
-db = SQLAlchemy()
+class RoutingSession(Session):
+    """Session that sends plain SELECTs to the replica chosen by @replica_read"""
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if (replica is not None and bind is None and not self._flushing
+                and getattr(clause, 'is_select', False)
+                and getattr(clause, '_for_update_arg', None) is None):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+# Initialize extensions before importing utils: utils.decorators and the
+# services it pulls in import db back from this module.
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 cache = Cache()
-limiter = Limiter(key_func=get_remote_address)
+
+from utils.logger import setup_logger
+from utils.errors import APIError
+from utils.rate_limiter import limiter
+from utils.replicas import init_replicas
+from utils.demand_grid import demand_grid
+from utils.surge import surge
+from utils.payment_processor import payment_processor
+from utils.notification_dispatcher import notification_dispatcher
+from utils.event_dispatcher import event_dispatcher
+from utils.idempotency import store as idempotency_store
 
 def create_app(config=None):
     """Application factory"""
@@ -23,10 +43,21 @@ def create_app(config=None):
         config = get_config()
     app.config.from_object(config)
     
+    # Client IPs (rate limits, logs) come from X-Forwarded-For behind proxies
+    if app.config.get('PROXY_FIX_X_FOR'):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+    
     # Initialize extensions
     db.init_app(app)
     cache.init_app(app)
     limiter.init_app(app)
+    init_replicas(app)
+    demand_grid.init_app(app)
+    surge.init_app(app)
+    payment_processor.init_app(app)
+    notification_dispatcher.init_app(app)
+    event_dispatcher.init_app(app)
+    idempotency_store.init_app(app)
     
     # Setup CORS
     CORS(app, resources={
@@ -44,6 +75,9 @@ def create_app(config=None):
     # Register error handlers
     register_error_handlers(app)
     
+    # Register request middleware
+    register_middleware(app)
+    
     # Register blueprints
     register_blueprints(app)
     
@@ -58,7 +92,7 @@ def create_app(config=None):
 
 def register_blueprints(app):
     """Register all route blueprints"""
-    from routes import auth_bp, users_bp, orders_bp, deliveries_bp, payments_bp, ratings_bp, admin_bp, support_bp, health_bp
+    from routes import auth_bp, users_bp, orders_bp, deliveries_bp, payments_bp, ratings_bp, admin_bp, support_bp, health_bp, promotions_bp
     
     app.register_blueprint(health_bp)
     app.register_blueprint(auth_bp, url_prefix='/api/v1/auth')
@@ -69,6 +103,18 @@ def register_blueprints(app):
     app.register_blueprint(ratings_bp, url_prefix='/api/v1/ratings')
     app.register_blueprint(admin_bp, url_prefix='/api/v1/admin')
     app.register_blueprint(support_bp, url_prefix='/api/v1/support')
+    app.register_blueprint(promotions_bp, url_prefix='/api/v1/promotions')
+
+def register_middleware(app):
+    """Register request middleware"""
+    from middleware import request_logging, query_instrumentation, request_metrics, response_compression, conditional_requests
+    
+    request_logging(app)
+    request_metrics(app)
+    query_instrumentation(app)
+    # after_request hooks run in reverse: ETags are computed before compression
+    response_compression(app)
+    conditional_requests(app)
 
 def register_error_handlers(app):
     """Register error handlers"""
@@ -79,7 +125,10 @@ def register_error_handlers(app):
             'error': error.message,
             'code': error.code
         }
-        return jsonify(response), error.status_code
+        headers = {}
+        if getattr(error, 'retry_after', None):
+            headers['Retry-After'] = str(error.retry_after)
+        return jsonify(response), error.status_code, headers
     
     @app.errorhandler(400)
     def bad_request(error):
@@ -99,18 +148,20 @@ def register_error_handlers(app):
     
     @app.errorhandler(500)
     def internal_error(error):
-        logging.error(f"Internal server error: {error}")
+        logging.error("Internal server error: %s", error)
         return jsonify({'success': False, 'error': 'Internal server error'}), 500
 
 def register_shell_commands(app):
     """Register CLI commands"""
-    @app.shell_command()
+    import click
+    
+    @app.cli.command()
     def init_db():
         """Initialize database"""
         db.create_all()
         print("Database initialized")
     
-    @app.shell_command()
+    @app.cli.command()
     def seed_db():
         """Seed database with test data"""
         from models.user import User, UserRole
@@ -129,3 +180,176 @@ def register_shell_commands(app):
         db.session.add(admin)
         db.session.commit()
         print("Database seeded with test data")
+    
+    @app.cli.command()
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--customer-id', default=None, help='Owner of every order; otherwise read from each row')
+    @click.option('--chunk-size', default=None, type=int, help='Rows per transaction')
+    def import_orders(path, customer_id, chunk_size):
+        """Import orders from a JSON array or NDJSON file"""
+        from services.order_service import OrderService
+        
+        with open(path, 'rb') as f:
+            records = OrderService.parse_bulk_payload(f.read())
+        
+        created, errors = OrderService.create_orders_bulk(
+            records,
+            customer_id=customer_id,
+            chunk_size=chunk_size or app.config['BULK_ORDER_CHUNK_SIZE']
+        )
+        
+        for error in errors:
+            print(f"Row {error['index']}: {error['error']}")
+        print(f"Imported {len(created)} of {len(records)} orders")
+    
+    @app.cli.command()
+    @click.option('--since', default=None, help='ISO date; rebuild only buckets from this day on')
+    def rebuild_rollups(since):
+        """Recompute order analytics rollups from the orders table"""
+        from datetime import datetime
+        from services.analytics_service import AnalyticsService
+        
+        buckets = AnalyticsService.rebuild_rollups(datetime.fromisoformat(since) if since else None)
+        print(f"Rebuilt {buckets} rollup buckets")
+    
+    @app.cli.command()
+    @click.option('--days', default=None, type=int, help='Trailing window; defaults to SLA_WINDOW_DAYS')
+    def compute_sla(days):
+        """Recompute courier and zone delivery SLA stats"""
+        from services.sla_service import SlaService
+        
+        result = SlaService.compute(days)
+        print(f"SLA stats for {result['couriers']} couriers and {result['zones']} zones "
+              f"from {result['deliveries']} deliveries over {result['window_days']} days")
+    
+    @app.cli.command()
+    @click.option('--start', required=True, help='ISO date; first day of the period')
+    @click.option('--end', required=True, help='ISO date; the period ends before this day')
+    @click.option('--shards', default=None, type=int, help='Courier shards; defaults to PAYOUT_SHARDS')
+    @click.option('--workers', default=1, type=int, help='Processes paying shards in parallel')
+    def run_payouts(start, end, shards, workers):
+        """Pay couriers for delivered orders in a period; rerun to resume a failed run"""
+        from datetime import datetime
+        from services.payout_service import PayoutService
+        
+        run = PayoutService.run(datetime.fromisoformat(start), datetime.fromisoformat(end), shards, workers)
+        print(f"Paid {run.total_amount:.2f} to {run.couriers} couriers for {run.deliveries} deliveries")
+        print(f"Payout file: {run.file_path}")
+    
+    @app.cli.command()
+    @click.option('--print-sql', is_flag=True, help='Print the statements instead of running them')
+    def create_search_indexes(print_sql):
+        """Create the Postgres full-text and trigram indexes behind admin search"""
+        from services.search_service import SearchService
+        
+        if print_sql:
+            for statement in SearchService.index_statements():
+                print(f"{statement};")
+            return
+        statements = SearchService.create_indexes()
+        print(f"Ran {len(statements)} statements")
+    
+    @app.cli.command()
+    @click.option('--older-than', default=None, type=int, help='Seconds; defaults to PAYMENT_STALE_SECONDS')
+    def requeue_payments(older_than):
+        """Resubmit payments stuck in processing, e.g. after a worker restart"""
+        from services.payment_service import PaymentService
+        
+        count = PaymentService.requeue_stale_payments(older_than or app.config['PAYMENT_STALE_SECONDS'])
+        if not payment_processor.drain(timeout=app.config['PAYMENT_GATEWAY_TIMEOUT'] * app.config['PAYMENT_MAX_ATTEMPTS'] * 2):
+            print("Some payments are still processing; they will be picked up by the next run")
+        print(f"Resubmitted {count} payments")
+    
+    @app.cli.command()
+    @click.option('--timeout', default=300, type=int, help='Seconds to keep sending before giving up')
+    def send_notifications(timeout):
+        """Send every due outbox notification, e.g. from cron where no dispatcher runs in the background"""
+        from services.notification_service import NotificationService
+        import json
+        
+        if not notification_dispatcher.drain(timeout=timeout):
+            print("Notifications are still being sent; the next run picks up the rest")
+        print(json.dumps(NotificationService.stats(), indent=2))
+    
+    @app.cli.command()
+    @click.option('--days', default=None, type=int, help='Defaults to NOTIFICATION_RETENTION_DAYS')
+    def purge_notifications(days):
+        """Delete sent and failed outbox rows older than the retention period"""
+        from services.notification_service import NotificationService
+        
+        count = NotificationService.purge(days or app.config['NOTIFICATION_RETENTION_DAYS'])
+        print(f"Deleted {count} notifications")
+    
+    @app.cli.command()
+    @click.option('--seek', 'name', default=None, help='Consumer whose offset to set instead of listing them all')
+    @click.option('--position', default='latest', help="Event position, 'earliest' or 'latest'")
+    def event_consumers(name, position):
+        """Show each domain event consumer's offset and lag, or move one to replay or skip events"""
+        from services.event_service import EventService
+        import json
+        
+        if name:
+            print(f"{name} is now at position {EventService.seek(name, position)}")
+            return
+        print(json.dumps(EventService.consumers(), indent=2))
+    
+    @app.cli.command()
+    @click.option('--days', default=None, type=int, help='Defaults to EVENT_RETENTION_DAYS')
+    def purge_events(days):
+        """Delete domain events past the retention period that every consumer has processed"""
+        from services.event_service import EventService
+        
+        count = EventService.purge(days or app.config['EVENT_RETENTION_DAYS'])
+        print(f"Deleted {count} events")
+    
+    @app.cli.command()
+    @click.option('--reason', default=None, help='Recorded on every refunded payment')
+    @click.option('--zone', default=None, help='Geohash cell of the pickup location')
+    @click.option('--created-from', default=None, help='ISO date; orders created from then')
+    @click.option('--created-to', default=None, help='ISO date; orders created before then')
+    @click.option('--order-status', multiple=True, help='Order status; repeat for several')
+    @click.option('--payment-method', default=None)
+    @click.option('--job', 'job_id', default=None, help='Resume an existing refund job instead')
+    def refund_payments(reason, zone, created_from, created_to, order_status, payment_method, job_id):
+        """Refund every completed payment matching the criteria, e.g. after a zone outage"""
+        from services.refund_service import RefundService
+        
+        if job_id is None:
+            job_id = RefundService.create_job({
+                'zone': zone,
+                'created_from': created_from,
+                'created_to': created_to,
+                'order_status': list(order_status),
+                'payment_method': payment_method,
+            }, reason).id
+            print(f"Refund job {job_id}")
+        job = RefundService.run_job(job_id)
+        print(f"Refunded {job.refunded} of {job.total} payments ({job.amount_refunded:.2f}); {job.failed} failed")
+        for error in job.errors or []:
+            print(f"{error['payment_id']}: {error['error']}")
+    
+    @app.cli.command()
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--start', default=None, help='ISO date; also report payments processed from then that are missing from the file')
+    @click.option('--end', default=None, help='ISO date; end of that period')
+    @click.option('--output', default=None, help='Write every mismatch to this CSV file')
+    def reconcile_payments(path, start, end, output):
+        """Compare a gateway settlement CSV file with the payments table"""
+        import csv
+        from services.refund_service import RefundService
+        
+        start, end = RefundService.parse_period({'start': start, 'end': end})
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            report = RefundService.reconcile(f, start, end)
+        
+        print(f"{report['settlement_rows']} settlement rows, {report['payments_checked']} payments checked, "
+              f"{report['matched']} matched")
+        for kind, count in sorted(report['mismatch_counts'].items()):
+            print(f"{kind}: {count}")
+        if output:
+            fields = ['kind', 'transaction_id', 'payment_id', 'line', 'amount', 'settled_amount', 'status', 'settled_status']
+            with open(output, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fields)
+                writer.writeheader()
+                writer.writerows(report['mismatches'])
+            print(f"Mismatches written to {output}")
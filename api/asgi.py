@@ -0,0 +1,291 @@
+"""ASGI entry point
+
+Serves the high fan-in endpoints (delivery tracking, location ingest and
+order reads) on asyncio with an asyncpg pool, so a slow query parks a
+coroutine instead of a worker thread. Every other path falls through to
+the regular Flask application.
+
+    uvicorn asgi:app --app-dir api --workers 4
+"""
+import re
+import json
+import time
+import logging
+from urllib.parse import parse_qsl
+import asyncpg
+from asgiref.wsgi import WsgiToAsgi
+from app import create_app, limiter
+from models.user import UserRole
+from services.auth_service import AuthService
+from services.async_service import AsyncOrderService, AsyncDeliveryService
+from utils.errors import APIError, AuthenticationError, ValidationError, NotFoundError, RateLimitError
+from utils.metrics import registry as metrics
+from utils.http_cache import bump_versions
+
+logger = logging.getLogger(__name__)
+
+class Request:
+    """Minimal request view over an ASGI scope"""
+    __slots__ = ('method', 'path', 'headers', 'query', 'body', 'user')
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.query = _parse_query(scope.get('query_string', b''))
+        self.body = body
+        self.user = None
+
+    @property
+    def json(self):
+        if 'application/json' not in self.headers.get('content-type', ''):
+            raise ValidationError('Request body must be JSON')
+        try:
+            return json.loads(self.body or b'null')
+        except ValueError:
+            raise ValidationError('Invalid JSON')
+
+    def arg(self, name, default, type=int):
+        try:
+            return type(self.query[name])
+        except (KeyError, ValueError):
+            return default
+
+def _parse_query(raw):
+    return dict(parse_qsl(raw.decode('latin-1')))
+
+# ========== Handlers ==========
+
+async def get_delivery_tracking(conn, req, delivery_id):
+    """Get delivery tracking information"""
+    try:
+        tracking = await AsyncDeliveryService.get_delivery_tracking(conn, delivery_id)
+
+        return {
+            'success': True,
+            'delivery': tracking['delivery'].to_dict(),
+            'location_history': [
+                {
+                    'id': h.id,
+                    'latitude': h.latitude,
+                    'longitude': h.longitude,
+                    'accuracy': h.accuracy,
+                    'speed': h.speed,
+                    'timestamp': h.created_at.isoformat()
+                } for h in tracking['location_history']
+            ]
+        }, 200
+    except NotFoundError as e:
+        return {'success': False, 'error': str(e)}, 404
+
+async def update_location(conn, req, delivery_id):
+    """Update delivery location"""
+    await authenticate(conn, req, UserRole.COURIER.value)
+    allowed, retry_after = limiter.hit('location_ingest', f'user:{req.user["id"]}')
+    if not allowed:
+        raise RateLimitError(retry_after=retry_after)
+
+    data = req.json
+    missing = [f for f in ('latitude', 'longitude') if not isinstance(data, dict) or f not in data]
+    if missing:
+        raise ValidationError(f'Missing required fields: {", ".join(missing)}')
+
+    try:
+        delivery = await AsyncDeliveryService.update_delivery_location(
+            conn,
+            delivery_id,
+            data['latitude'],
+            data['longitude'],
+            data.get('accuracy'),
+            data.get('speed'),
+            data.get('heading'),
+            data.get('altitude')
+        )
+        # Raw SQL skips the ORM events that invalidate tracking ETags
+        with flask_app.app_context():
+            bump_versions([('delivery', delivery_id)])
+
+        return {
+            'success': True,
+            'message': 'Location updated successfully',
+            'delivery': delivery.to_dict()
+        }, 200
+    except (ValidationError, NotFoundError) as e:
+        return {'success': False, 'error': str(e)}, 400
+
+async def get_my_orders(conn, req):
+    """Get customer's orders"""
+    await authenticate(conn, req)
+    limit = req.arg('limit', 50)
+    offset = req.arg('offset', 0)
+
+    orders, total = await AsyncOrderService.get_customer_orders(conn, req.user['id'], limit, offset)
+
+    return {
+        'success': True,
+        'orders': [o.to_dict() for o in orders],
+        'pagination': {
+            'total': total,
+            'limit': limit,
+            'offset': offset
+        }
+    }, 200
+
+async def get_order(conn, req, order_id):
+    """Get order details"""
+    await authenticate(conn, req)
+    try:
+        order = await AsyncOrderService.get_order(conn, order_id)
+
+        return {'success': True, 'order': order.to_dict()}, 200
+    except NotFoundError as e:
+        return {'success': False, 'error': str(e)}, 404
+
+# Row ids are UUID strings; matching only those leaves fixed sub-paths
+# such as /orders/quote to the Flask routes that own them.
+ID = r'([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})'
+
+# (method, pattern, handler, endpoint) - endpoint names match the Flask
+# routes so metrics and dashboards see one series per route.
+ROUTES = [
+    ('GET', re.compile(rf'^/api/v1/deliveries/{ID}/track$'), get_delivery_tracking, 'deliveries.get_delivery_tracking'),
+    ('PUT', re.compile(rf'^/api/v1/deliveries/{ID}/location$'), update_location, 'deliveries.update_location'),
+    ('GET', re.compile(r'^/api/v1/orders/my-orders$'), get_my_orders, 'orders.get_my_orders'),
+    ('GET', re.compile(rf'^/api/v1/orders/{ID}$'), get_order, 'orders.get_order'),
+]
+
+def resolve(method, path):
+    """(handler, endpoint, args) of the async route for a request, or None for Flask"""
+    for route_method, pattern, handler, endpoint in ROUTES:
+        match = pattern.match(path)
+        if match and method == route_method:
+            return handler, endpoint, match.groups()
+    return None
+
+async def authenticate(conn, req, *roles):
+    """Async equivalent of require_auth and require_role"""
+    auth_header = req.headers.get('authorization')
+    if not auth_header:
+        raise AuthenticationError('Missing authorization token')
+    parts = auth_header.split(' ')
+    if len(parts) < 2:
+        raise AuthenticationError('Invalid authorization header format')
+
+    try:
+        payload = AuthService.decode_access_token(parts[1])
+        user = await conn.fetchrow('SELECT id, role FROM users WHERE id = $1', payload['user_id'])
+        if not user:
+            raise AuthenticationError('User not found')
+    except Exception as e:
+        logger.error("Token verification failed: %s", e)
+        raise AuthenticationError('Invalid or expired token')
+
+    if roles and user['role'] not in roles:
+        raise AuthenticationError('Insufficient permissions')
+    req.user = user
+
+# ========== Application ==========
+
+class AsyncApp:
+    """ASGI application routing hot endpoints to asyncpg and the rest to Flask"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.pool = None
+
+    async def startup(self):
+        config = self.flask_app.config
+        self.pool = await asyncpg.create_pool(
+            asyncpg_dsn(config['SQLALCHEMY_DATABASE_URI']),
+            min_size=config.get('ASYNC_DB_POOL_MIN', 5),
+            max_size=config.get('ASYNC_DB_POOL_MAX', 20),
+            command_timeout=config.get('ASYNC_DB_COMMAND_TIMEOUT', 30),
+        )
+        metrics.gauge('async_db_pool_connections', 'asyncpg pool connections by state',
+                      callback=self._pool_stats)
+
+    async def shutdown(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def _pool_stats(self):
+        if self.pool is None:
+            return []
+        idle = self.pool.get_idle_size()
+        return [((('state', 'idle'),), idle), ((('state', 'in_use'),), self.pool.get_size() - idle)]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['type'] == 'http':
+            route = resolve(scope['method'], scope['path'])
+            if route is not None:
+                return await self._dispatch(scope, receive, send, *route)
+
+        return await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.error("Async startup failed: %s", e)
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _dispatch(self, scope, receive, send, handler, endpoint, args):
+        start = time.perf_counter()
+        metrics.add('http_requests_in_flight')
+        headers = {}
+        try:
+            req = Request(scope, await _read_body(receive))
+            async with self.pool.acquire() as conn:
+                body, status = await handler(conn, req, *args)
+        except APIError as e:
+            body, status = {'success': False, 'error': e.message, 'code': e.code}, e.status_code
+            if getattr(e, 'retry_after', None):
+                headers['Retry-After'] = str(e.retry_after)
+        except Exception as e:
+            logger.error("%s error: %s", endpoint, e)
+            body, status = {'success': False, 'error': str(e)}, 400
+        finally:
+            metrics.add('http_requests_in_flight', value=-1)
+
+        route = (('blueprint', endpoint.split('.')[0]), ('endpoint', endpoint))
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - start, route)
+        metrics.inc('http_requests_total', route + (('method', scope['method']), ('status', status)))
+        metrics.maybe_flush()
+
+        payload = json.dumps(body).encode('utf-8')
+        response_headers = [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode('latin-1')),
+        ]
+        response_headers.extend((k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.items())
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': payload})
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+def asyncpg_dsn(uri):
+    """asyncpg takes plain postgresql:// URLs without a SQLAlchemy driver suffix"""
+    return re.sub(r'^postgres(?:ql)?(?:\+\w+)?://', 'postgresql://', uri)
+
+flask_app = create_app()
+app = AsyncApp(flask_app)
@@ -15,6 +15,11 @@ class Config:
         "pool_recycle": 3600,
         "pool_pre_ping": True,
     }
+    # Read replicas, comma separated; reads marked @replica_read go here
+    SQLALCHEMY_REPLICA_URIS = [u.strip() for u in os.getenv('SUPABASE_REPLICA_URLS', '').split(',') if u.strip()]
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+    REPLICA_LAG_CHECK_INTERVAL = 5.0
+    REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', '10'))
     
     # JWT
     JWT_SECRET_KEY = os.getenv('SUPABASE_JWT_SECRET', 'your-secret-key-change-this')
@@ -23,6 +28,10 @@ class Config:
     
     # Security
     CORS_ORIGINS = ['http://localhost:3000', 'http://localhost:3001', os.getenv('FRONTEND_URL', '*')]
+    # Proxies in front of the app that append to X-Forwarded-For (Vercel or a
+    # load balancer is one); the client IP is read that many hops back.
+    # Set 0 when clients connect directly, or they can pick their own IP.
+    PROXY_FIX_X_FOR = int(os.getenv('PROXY_FIX_X_FOR', '1'))
     
     # API
     API_TITLE = "Courier Delivery API"
@@ -30,15 +39,183 @@ class Config:
     API_DESCRIPTION = "Production-ready courier delivery platform API"
     
     # Rate limiting
+    # memory:// is a memory-mapped file shared by all workers on the host;
+    # set REDIS_URL to share limits across hosts.
     RATELIMIT_STORAGE_URL = os.getenv('REDIS_URL', 'memory://')
+    RATELIMIT_SHM_SLOTS = 65536
+    RATE_LIMIT_POLICIES = {
+        'register': {'limit': 20, 'period': 3600, 'burst': 5},
+        'login': {'limit': 120, 'period': 3600, 'burst': 20},
+        'location_ingest': {'limit': 120, 'period': 60, 'burst': 20},
+        'order_create': {'limit': 30, 'period': 60, 'burst': 10},
+        'order_bulk': {'limit': 20, 'period': 3600, 'burst': 5},
+        'admin_read': {'limit': 300, 'period': 60, 'burst': 60},
+        'quote': {'limit': 600, 'period': 60, 'burst': 100},
+        'promo_validate': {'limit': 60, 'period': 60, 'burst': 20},
+    }
+    
+    # Idempotency-Key replays, stored in idempotency_keys
+    IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))  # seconds a successful response is replayed
+    IDEMPOTENCY_LOCK_SECONDS = 60  # an unfinished request's claim is taken over by a retry after this
+    
+    # Bulk order import
+    BULK_ORDER_MAX_ROWS = int(os.getenv('BULK_ORDER_MAX_ROWS', '5000'))
+    BULK_ORDER_CHUNK_SIZE = int(os.getenv('BULK_ORDER_CHUNK_SIZE', '500'))
+    
+    # Payment processing
+    PAYMENT_GATEWAY = os.getenv('PAYMENT_GATEWAY')  # 'package.module:Class', or 'fake'; required in production
+    PAYMENT_GATEWAY_OPTIONS = {}  # keyword arguments for the gateway adapter
+    PAYMENT_WORKERS = int(os.getenv('PAYMENT_WORKERS', '8'))  # threads per process; 0 charges inline
+    PAYMENT_GATEWAY_TIMEOUT = 10  # seconds per charge attempt
+    PAYMENT_MAX_ATTEMPTS = 4  # timeouts and transient errors are retried up to this many attempts
+    PAYMENT_RETRY_BACKOFF = 0.5  # seconds before the first retry, doubling after each
+    PAYMENT_STATUS_FLUSH_SECONDS = 0.2  # final statuses are written in batches this often
+    PAYMENT_STATUS_BATCH_SIZE = 500
+    PAYMENT_STALE_SECONDS = 300  # processing payments older than this are resubmitted by requeue-payments
+    PAYMENT_WEBHOOK_SECRET = os.getenv('PAYMENT_WEBHOOK_SECRET', '')
+    
+    # Wallet ledger
+    LEDGER_BULK_MAX_ENTRIES = int(os.getenv('LEDGER_BULK_MAX_ENTRIES', '50000'))
+    LEDGER_BULK_CHUNK_SIZE = 1000  # entries per transaction; each locks its wallets until commit
+    
+    # Courier payouts
+    PAYOUT_COURIER_SHARE = float(os.getenv('PAYOUT_COURIER_SHARE', '0.8'))  # of base + distance fare + surcharge
+    PAYOUT_SHARDS = 8  # courier id ranges paid independently, and in parallel with --workers
+    PAYOUT_BATCH_SIZE = 1000  # couriers credited per transaction; also the checkpoint granularity
+    PAYOUT_STREAM_CHUNK = 50000  # delivered orders fetched and aggregated at a time
+    PAYOUT_DIR = os.getenv('PAYOUT_DIR', 'payouts')
+    
+    # Admin search
+    SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'auto')  # 'postgres', 'memory', or 'auto' from the database
+    SEARCH_MIN_QUERY_LENGTH = 2  # shorter prefixes match too many rows to rank quickly
+    SEARCH_MAX_LIMIT = 100
+    SEARCH_MEMORY_REFRESH_SECONDS = 300  # in-process indexes are rebuilt from the tables this often
+    
+    # Support ticket routing
+    SUPPORT_SLA_HOURS = {'critical': 1, 'high': 4, 'medium': 24, 'low': 72}  # first response due, by priority
+    SUPPORT_AGENT_ROLES = ['admin']  # active users with these roles are given tickets
+    SUPPORT_AUTO_ASSIGN = os.getenv('SUPPORT_AUTO_ASSIGN', 'true').lower() == 'true'  # else agents only claim-next
+    SUPPORT_MAX_OPEN_PER_AGENT = 10  # auto-assignment stops at this many open tickets; claim-next does not
+    SUPPORT_QUEUE_REFRESH_SECONDS = 60  # the in-process queue is reloaded from the table this often
+    SUPPORT_MESSAGES_PAGE_SIZE = 50  # messages returned with a ticket and per fetch
+    SUPPORT_POLL_TIMEOUT = 25  # longest long-poll, in seconds; keep under the proxy's idle timeout
+    SUPPORT_POLL_CHECK_SECONDS = 3  # waiters recheck the database this often for replies posted on other workers
+    SUPPORT_STREAM_SECONDS = 300  # event streams are closed after this and the client reconnects
+    SUPPORT_STREAM_HEARTBEAT_SECONDS = 15
+    SUPPORT_STREAM_RETRY_MS = 2000  # reconnect delay sent to EventSource clients
+    
+    # Bulk refunds and reconciliation
+    REFUND_CHUNK_SIZE = 200  # payments refunded per transaction; also the checkpoint granularity
+    REFUND_CONCURRENCY = int(os.getenv('REFUND_CONCURRENCY', '8'))  # gateway refund calls in flight per job
+    REFUND_MAX_ERRORS = 100  # failed refunds kept on a job for inspection
+    REFUND_JOB_LEASE_SECONDS = 600  # a running job that has not checkpointed for this long can be resumed
+    RECONCILE_MAX_MISMATCHES = 1000  # mismatches returned by the API; the CLI writes them all
+    
+    # Customer notifications
+    # channel -> 'package.module:Class', or 'fake'; required in production
+    NOTIFICATION_CHANNELS = {
+        'push': os.getenv('NOTIFICATION_PUSH_CHANNEL'),
+        'sms': os.getenv('NOTIFICATION_SMS_CHANNEL'),
+    }
+    NOTIFICATION_CHANNEL_OPTIONS = {}  # channel -> keyword arguments for its adapter
+    NOTIFICATION_WORKERS = int(os.getenv('NOTIFICATION_WORKERS', '16'))  # send threads per process; 0 sends inline
+    NOTIFICATION_BATCH_SIZE = 500  # outbox rows claimed at a time
+    NOTIFICATION_POLL_SECONDS = 2  # how soon rows committed by other processes are picked up
+    NOTIFICATION_STATUS_FLUSH_SECONDS = 0.2  # finished sends are recorded in batches this often
+    NOTIFICATION_LEASE_SECONDS = 60  # claimed rows are claimable again after this if never completed
+    NOTIFICATION_MAX_ATTEMPTS = 5
+    NOTIFICATION_RETRY_BACKOFF = 5  # seconds before the first retry, doubling after each
+    NOTIFICATION_RETENTION_DAYS = 7  # sent and failed rows kept for purge-notifications
+    
+    # Domain events
+    EVENT_SUBSCRIBERS = {}  # consumer name -> 'package.module:function' called with each batch of events
+    EVENT_SUBSCRIBER_START = 'earliest'  # where a new consumer starts: 'earliest' replays retained events, 'latest' skips them
+    EVENT_BATCH_SIZE = 500  # events read per poll and per API call at most
+    EVENT_POLL_SECONDS = 1  # how soon events committed by other processes are delivered
+    EVENT_GAP_GRACE_SECONDS = 10  # readers wait this long for a missing position's writer to commit
+    EVENT_LEASE_SECONDS = 30  # a subscriber moves to another process after its holder stops renewing for this long
+    EVENT_RETRY_SECONDS = 5  # before a subscriber that raised gets its events again
+    EVENT_RETENTION_DAYS = 30  # events every consumer has processed are kept this long for purge-events
+    
+    # Order analytics rollups
+    ROLLUP_SHARDS = int(os.getenv('ROLLUP_SHARDS', '8'))  # rows per bucket; more = less lock contention
+    ROLLUP_CACHE_TTL = int(os.getenv('ROLLUP_CACHE_TTL', '30'))  # seconds; 0 disables the in-process cache
+    
+    # Demand heatmap
+    # memory:// keeps a grid per worker process; set REDIS_URL to share one.
+    DEMAND_GRID_STORAGE_URL = os.getenv('REDIS_URL', 'memory://')
+    DEMAND_GRID_PRECISION = 6  # geohash characters; 6 is roughly 1.2 x 0.6 km
+    DEMAND_GRID_SLOT_SECONDS = 60
+    DEMAND_GRID_WINDOWS = (15, 60)  # minutes; the first is the default
+    
+    # Surge pricing
+    SURGE_ENABLED = os.getenv('SURGE_ENABLED', 'true').lower() == 'true'
+    SURGE_ZONE_PRECISION = 5  # geohash characters; 5 is roughly 5 x 5 km
+    SURGE_COURIER_TTL = 300  # seconds without a location update before a courier counts as offline
+    SURGE_BALANCED_RATIO = 1.0  # open orders per idle courier that needs no surge
+    SURGE_SENSITIVITY = 0.25  # multiplier added per open order per courier above balance
+    SURGE_MAX_MULTIPLIER = float(os.getenv('SURGE_MAX_MULTIPLIER', '3.0'))
+    SURGE_SMOOTHING_SECONDS = 120
+    SURGE_RESYNC_SECONDS = 30
+    
+    # Promo codes
+    PROMO_REFRESH_SECONDS = int(os.getenv('PROMO_REFRESH_SECONDS', '30'))  # how long an edit takes to reach other workers
+    PROMO_FLUSH_SECONDS = 5  # batching window for usage counters
+    PROMO_LEASE_SIZE = 20  # uses a worker reserves at once for codes with max_uses
+    PROMO_LEASE_IDLE_SECONDS = 30  # unused reserved uses are handed back after this
+    
+    # Delivery SLA analytics
+    SLA_WINDOW_DAYS = int(os.getenv('SLA_WINDOW_DAYS', '30'))
+    SLA_ZONE_PRECISION = 5  # geohash characters; 5 is roughly 5 x 5 km
+    SLA_MIN_DELIVERIES = 5  # couriers with fewer deliveries get no score
     
     # Cache
     CACHE_TYPE = 'simple'
     CACHE_DEFAULT_TIMEOUT = 300
+    
+    # HTTP caching and compression
+    # Version-token ETags need a cache shared by all workers (e.g. redis);
+    # with the per-process 'simple' cache only body-hash ETags are used.
+    ETAG_VERSION_TOKENS = None  # None = decide from CACHE_TYPE
+    ETAG_VERSION_TTL = 86400
+    ETAG_VERSION_ENDPOINTS = {
+        # endpoint: (version scope, view arg holding the key, requires auth)
+        'orders.get_order': ('order', 'order_id', True),
+        'orders.get_my_orders': ('customer_orders', None, True),
+        'deliveries.get_delivery_tracking': ('delivery', 'delivery_id', False),
+    }
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+    COMPRESS_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+    
+    # Logging
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+    LOG_SAMPLE_RATES = {
+        'location': float(os.getenv('LOG_SAMPLE_RATE_LOCATION', '0.01')),
+    }
+    LOG_SAMPLED_ENDPOINTS = {
+        'deliveries.update_location': 'location',
+        'users.update_location': 'location',
+    }
+    
+    # Query instrumentation
+    SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '200'))
+    QUERY_STATS_HEADERS = os.getenv('QUERY_STATS_HEADERS', 'true').lower() == 'true'
+    
+    # Async serving (asgi.py)
+    ASYNC_DB_POOL_MIN = int(os.getenv('ASYNC_DB_POOL_MIN', '5'))
+    ASYNC_DB_POOL_MAX = int(os.getenv('ASYNC_DB_POOL_MAX', '20'))
+    ASYNC_DB_COMMAND_TIMEOUT = float(os.getenv('ASYNC_DB_COMMAND_TIMEOUT', '30'))
 
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
+    PAYMENT_GATEWAY = os.getenv('PAYMENT_GATEWAY', 'fake')
+    NOTIFICATION_CHANNELS = {
+        'push': os.getenv('NOTIFICATION_PUSH_CHANNEL', 'fake'),
+        'sms': os.getenv('NOTIFICATION_SMS_CHANNEL', 'fake'),
+    }
 
 class ProductionConfig(Config):
     """Production configuration"""
@@ -47,7 +224,17 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
+    RATELIMIT_ENABLED = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = {}  # SQLite has no connection pool to size
+    SQLALCHEMY_REPLICA_URIS = []
+    CACHE_TYPE = 'SimpleCache'
+    PAYMENT_GATEWAY = os.getenv('PAYMENT_GATEWAY', 'fake')
+    PAYMENT_WORKERS = 0
+    PAYMENT_GATEWAY_OPTIONS = {'latency_ms': (0, 0), 'decline_rate': 0, 'error_rate': 0, 'timeout_rate': 0}
+    NOTIFICATION_WORKERS = 0
+    NOTIFICATION_CHANNELS = {'push': 'fake', 'sms': 'fake'}
+    NOTIFICATION_CHANNEL_OPTIONS = {'push': {'latency_ms': (0, 0), 'error_rate': 0}, 'sms': {'latency_ms': (0, 0), 'error_rate': 0}}
 
 config_by_name = {
     'development': DevelopmentConfig,
@@ -7,9 +7,19 @@ from dotenv import load_dotenv
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import bcrypt
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
 from decimal import Decimal
+from middleware import query_instrumentation, response_compression, conditional_requests
+from utils.query_stats import instrumented_connection_class
+from utils.idempotency import idempotent, store as idempotency_store, PsycopgIdempotencyBackend
+from utils.errors import APIError, ValidationError
+from utils.validators import validate_amount
+from utils.promo_catalog import PromoCatalog
+from utils.payment_gateway import load_gateway, verify_webhook
+from utils.payment_processor import PaymentProcessor
+from utils.export import parse_export_filters, export_response
+from utils.replicas import ReplicaSet, LAG_SQL, replica_name
 
 load_dotenv()
 
@@ -20,17 +30,62 @@ CORS(app)
 JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET', 'your-secret-key')
 JWT_ALGORITHM = 'HS256'
 DB_URL = os.getenv('SUPABASE_POSTGRES_URL')
+app.config['SLOW_QUERY_THRESHOLD_MS'] = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '200'))
+
+query_instrumentation(app, engines=False)
+response_compression(app)
+conditional_requests(app)
+
+def _probe_replica(url):
+    conn = psycopg2.connect(url, connect_timeout=2)
+    try:
+        cur = conn.cursor()
+        cur.execute(LAG_SQL)
+        return cur.fetchone()[0] or 0
+    finally:
+        conn.close()
+
+# Read replicas (comma separated); read-only endpoints use them when fresh enough
+replicas = ReplicaSet(
+    [(replica_name(url), url) for url in filter(None, map(str.strip, os.getenv('SUPABASE_REPLICA_URLS', '').split(',')))],
+    _probe_replica,
+    max_lag=float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5')),
+    sticky_seconds=float(os.getenv('REPLICA_STICKY_SECONDS', '10')),
+)
 
 # Database connection
-def get_db_connection():
-    """Create a database connection"""
+def get_db_connection(readonly=False):
+    """Create a database connection; read-only callers may get a replica"""
+    if readonly and replicas and not replicas.is_sticky(g.get('user_id')):
+        replica = replicas.choose()
+        if replica is not None:
+            try:
+                return psycopg2.connect(replica.handle, connect_timeout=2,
+                                        connection_factory=instrumented_connection_class())
+            except psycopg2.OperationalError as e:
+                print(f"Replica {replica.name} connection error: {e}")
+                replicas.mark_failed(replica)
+    
     try:
-        conn = psycopg2.connect(DB_URL)
+        conn = psycopg2.connect(DB_URL, connection_factory=instrumented_connection_class())
         return conn
     except Exception as e:
         print(f"Database connection error: {e}")
         raise
 
+# Idempotency-Key replays live in the database: retries may reach another instance
+idempotency_store.configure(
+    PsycopgIdempotencyBackend(get_db_connection),
+    ttl=int(os.getenv('IDEMPOTENCY_TTL', '86400')),
+)
+
+@app.after_request
+def start_read_your_writes_window(response):
+    """Keep a user's reads on the primary for a moment after they write"""
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+        replicas.mark_write(g.get('user_id'))
+    return response
+
 def init_db():
     """Initialize database tables"""
     conn = get_db_connection()
@@ -160,6 +215,20 @@ def init_db():
             )
         ''')
         
+        # Idempotency-Key claims and stored responses, shared by every instance
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key VARCHAR(64) PRIMARY KEY,
+                fingerprint VARCHAR(64) NOT NULL,
+                status_code INTEGER,
+                content_type VARCHAR(100),
+                body BYTEA,
+                locked_until TIMESTAMP NOT NULL,
+                expires_at TIMESTAMP NOT NULL
+            )
+        ''')
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys (expires_at)')
+        
         conn.commit()
         print("Database tables initialized successfully")
     except Exception as e:
@@ -201,6 +270,7 @@ def token_required(f):
             payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
             kwargs['user_id'] = payload['user_id']
             kwargs['user_role'] = payload['role']
+            g.user_id = payload['user_id']
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Token has expired'}), 401
         except jwt.InvalidTokenError:
@@ -387,6 +457,7 @@ def update_profile(user_id, user_role):
 
 @app.route('/api/orders', methods=['POST'])
 @token_required
+@idempotent()
 def create_order(user_id, user_role):
     """Create a new order"""
     if user_role != 'customer':
@@ -448,7 +519,7 @@ def create_order(user_id, user_role):
 @token_required
 def get_order(order_id, user_id, user_role):
     """Get order details"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
@@ -481,7 +552,7 @@ def get_order(order_id, user_id, user_role):
 @token_required
 def list_orders(user_id, user_role):
     """List orders based on user role"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
@@ -690,7 +761,7 @@ def rate_delivery(order_id, user_id, user_role):
 @app.route('/api/users/<int:user_id>/ratings', methods=['GET'])
 def get_user_ratings(user_id):
     """Get ratings for a user"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
@@ -720,10 +791,43 @@ def get_user_ratings(user_id):
 
 # ========== PAYMENT ENDPOINTS ==========
 
+def _write_payment_statuses(results):
+    """Write final charge statuses from the payment workers in one batch"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        rows = [(r.status, r.transaction_id, r.payment_id) for r in results]
+        cur.execute('''
+            UPDATE payments p SET status = v.status, transaction_id = COALESCE(v.transaction_id, p.transaction_id),
+                updated_at = CURRENT_TIMESTAMP
+            FROM unnest(%s::varchar[], %s::varchar[], %s::int[]) AS v(status, transaction_id, id)
+            WHERE p.id = v.id AND p.status = 'processing'
+        ''', ([r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows]))
+        cur.execute('''
+            UPDATE orders o SET payment_status = p.status
+            FROM payments p
+            WHERE p.order_id = o.id AND p.id = ANY(%s::int[])
+        ''', ([r[2] for r in rows],))
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+payment_processor = PaymentProcessor()
+payment_processor.configure(
+    load_gateway(os.getenv('PAYMENT_GATEWAY'), **({'notify': payment_processor.record_result}
+                                                  if os.getenv('PAYMENT_GATEWAY') == 'fake' else {})),
+    _write_payment_statuses,
+    # A serverless function can be frozen as soon as it responds, so charges run inside the request
+    workers=int(os.getenv('PAYMENT_WORKERS', '0')),
+)
+PAYMENT_WEBHOOK_SECRET = os.getenv('PAYMENT_WEBHOOK_SECRET', '')
+
 @app.route('/api/payments', methods=['POST'])
 @token_required
+@idempotent()
 def create_payment(user_id, user_role):
-    """Create a payment"""
+    """Create a payment and charge it; 202 while a gateway webhook is still to report the result"""
     data = request.get_json()
     
     required_fields = ['order_id', 'amount', 'payment_method']
@@ -750,20 +854,29 @@ def create_payment(user_id, user_role):
             VALUES (%s, %s, %s, %s, %s, %s)
             RETURNING *
         ''', (data['order_id'], user_id, data['amount'], data['payment_method'],
-              data.get('transaction_id', ''), 'completed'))
+              data.get('transaction_id'), 'processing'))
         
         payment = cur.fetchone()
         
         # Update order payment status
         cur.execute('''
-            UPDATE orders SET payment_status = 'completed'
+            UPDATE orders SET payment_status = 'processing'
             WHERE id = %s
         ''', (data['order_id'],))
         
         conn.commit()
+        payment_processor.submit(payment['id'], float(payment['amount']), payment['payment_method'])
+        
+        cur.execute('SELECT * FROM payments WHERE id = %s', (payment['id'],))
+        payment = cur.fetchone()
+        if payment['status'] == 'processing':
+            return jsonify({
+                'message': 'Payment is being processed',
+                'payment': dict(payment)
+            }), 202
         
         return jsonify({
-            'message': 'Payment recorded successfully',
+            'message': f"Payment {payment['status']}",
             'payment': dict(payment)
         }), 201
     
@@ -774,6 +887,20 @@ def create_payment(user_id, user_role):
         cur.close()
         conn.close()
 
+@app.route('/api/payments/webhook', methods=['POST'])
+def payment_webhook():
+    """Final charge status reported by the payment gateway"""
+    body = request.get_data()
+    if not verify_webhook(PAYMENT_WEBHOOK_SECRET, body, request.headers.get('X-Gateway-Signature')):
+        return jsonify({'error': 'Invalid webhook signature'}), 401
+    
+    data = request.get_json(force=True) or {}
+    if data.get('status') not in ('completed', 'failed') or not data.get('payment_id'):
+        return jsonify({'error': "payment_id and a status of 'completed' or 'failed' are required"}), 400
+    
+    payment_processor.record_result(int(data['payment_id']), data['status'], data.get('transaction_id'), data.get('error'))
+    return jsonify({'message': 'Accepted'}), 202
+
 @app.route('/api/payments/<int:order_id>', methods=['GET'])
 @token_required
 def get_payment(order_id, user_id, user_role):
@@ -814,7 +941,7 @@ def get_payment(order_id, user_id, user_role):
 @token_required
 def get_tracking(order_id, user_id, user_role):
     """Get real-time tracking for an order"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
@@ -857,7 +984,7 @@ def get_tracking(order_id, user_id, user_role):
 @admin_required
 def list_all_users(user_id, user_role):
     """List all users (admin only)"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
@@ -893,7 +1020,7 @@ def list_all_users(user_id, user_role):
 @admin_required
 def list_all_orders(user_id, user_role):
     """List all orders (admin only)"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
@@ -924,12 +1051,72 @@ def list_all_orders(user_id, user_role):
         cur.close()
         conn.close()
 
+# Columns written by /api/admin/export/<resource>; password hashes are never exported
+EXPORT_QUERIES = {
+    'orders': ('orders', ['id', 'order_number', 'customer_id', 'courier_id', 'status', 'payment_status',
+                          'pickup_address', 'delivery_address', 'package_description', 'package_weight',
+                          'total_amount', 'delivery_fee', 'distance_km', 'estimated_delivery',
+                          'actual_delivery', 'created_at', 'updated_at']),
+    'users': ('users', ['id', 'name', 'email', 'phone', 'role', 'city', 'country',
+                        'is_verified', 'is_active', 'created_at']),
+    'payments': ('payments', ['id', 'order_id', 'user_id', 'amount', 'payment_method',
+                              'transaction_id', 'status', 'created_at', 'updated_at']),
+}
+
+@app.route('/api/admin/export/<resource>', methods=['GET'])
+@token_required
+@admin_required
+def export_resource(resource, user_id, user_role):
+    """Stream orders, users or payments as CSV or NDJSON (admin only)"""
+    if resource not in EXPORT_QUERIES:
+        return jsonify({'error': f'Unknown export {resource}'}), 404
+    
+    filters = parse_export_filters(request.args)
+    table, columns = EXPORT_QUERIES[resource]
+    
+    query = f'SELECT {", ".join(columns)} FROM {table} WHERE 1=1'
+    params = []
+    
+    if filters['status']:
+        if resource == 'users':
+            query += ' AND is_active = %s'
+            params.append(filters['status'] == 'active')
+        else:
+            query += ' AND status = %s'
+            params.append(filters['status'])
+    if resource == 'users' and request.args.get('role'):
+        query += ' AND role = %s'
+        params.append(request.args.get('role'))
+    if filters['date_from']:
+        query += ' AND created_at >= %s'
+        params.append(filters['date_from'])
+    if filters['date_to']:
+        query += ' AND created_at < %s'
+        params.append(filters['date_to'])
+    
+    query += ' ORDER BY created_at, id'
+    
+    def rows():
+        # A named cursor keeps the result set on the server; only itersize rows
+        # are in memory at a time no matter how large the export is.
+        conn = get_db_connection(readonly=True)
+        cur = conn.cursor(name=f'export_{resource}')
+        cur.itersize = 2000
+        try:
+            cur.execute(query, params)
+            yield from cur
+        finally:
+            cur.close()
+            conn.close()
+    
+    return export_response(rows(), columns, f"{resource}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}", filters)
+
 @app.route('/api/admin/statistics', methods=['GET'])
 @token_required
 @admin_required
 def get_statistics(user_id, user_role):
     """Get platform statistics (admin only)"""
-    conn = get_db_connection()
+    conn = get_db_connection(readonly=True)
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
@@ -1036,6 +1223,29 @@ def list_support_tickets(user_id, user_role):
 
 # ========== PROMO CODE ENDPOINTS ==========
 
+class _PromoCodeStore:
+    """Loads the promo catalog; this app only validates codes, it never redeems them"""
+    
+    def load(self):
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cur.execute('''
+                SELECT id, code, discount_type, discount_value, max_uses, current_uses,
+                       valid_from, valid_until AS valid_till
+                FROM promo_codes
+                WHERE is_active = true AND valid_until >= CURRENT_TIMESTAMP
+            ''')
+            return cur.fetchall()
+        finally:
+            cur.close()
+            conn.close()
+
+promo_catalog = PromoCatalog(
+    _PromoCodeStore(),
+    refresh_seconds=float(os.getenv('PROMO_REFRESH_SECONDS', '30')),
+)
+
 @app.route('/api/promo-codes/validate', methods=['POST'])
 @token_required
 def validate_promo_code(user_id, user_role):
@@ -1045,36 +1255,26 @@ def validate_promo_code(user_id, user_role):
     if not data.get('code'):
         return jsonify({'error': 'Code required'}), 400
     
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
     try:
-        cur.execute('''
-            SELECT * FROM promo_codes 
-            WHERE code = %s AND is_active = true 
-            AND valid_from <= CURRENT_TIMESTAMP 
-            AND valid_until >= CURRENT_TIMESTAMP
-        ''', (data['code'],))
-        
-        promo = cur.fetchone()
-        
-        if not promo:
-            return jsonify({'error': 'Invalid or expired promo code'}), 404
-        
-        if promo['max_uses'] and promo['current_uses'] >= promo['max_uses']:
-            return jsonify({'error': 'Promo code usage limit reached'}), 400
+        order_amount = data.get('order_amount')
+        promo, discount = promo_catalog.check(
+            data['code'], validate_amount(order_amount) if order_amount is not None else None, user_role
+        )
         
-        return jsonify({
+        result = {
             'message': 'Promo code is valid',
-            'discount_type': promo['discount_type'],
-            'discount_value': float(promo['discount_value'])
-        }), 200
-    
+            'discount_type': promo.discount_type,
+            'discount_value': promo.discount_value
+        }
+        if discount is not None:
+            result['discount'] = discount
+        return jsonify(result), 200
+    
+    except ValidationError as e:
+        status = 404 if e.message == 'Invalid or expired promo code' else 400
+        return jsonify({'error': e.message}), status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        cur.close()
-        conn.close()
 
 # ========== HEALTH CHECK ==========
 
@@ -1085,6 +1285,13 @@ def health_check():
 
 # ========== ERROR HANDLERS ==========
 
+@app.errorhandler(APIError)
+def api_error(error):
+    headers = {}
+    if getattr(error, 'retry_after', None):
+        headers['Retry-After'] = str(error.retry_after)
+    return jsonify({'error': error.message, 'code': error.code}), error.status_code, headers
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Endpoint not found'}), 404
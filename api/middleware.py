@@ -1,6 +1,18 @@
-from flask import request, jsonify
+from flask import request, jsonify, g
 from functools import wraps
+import gzip
 import logging
+import time
+import uuid
+from utils import query_stats, http_cache
+from utils.metrics import registry as metrics
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
 
 def error_handler(app):
     """Register error handlers"""
@@ -26,12 +38,208 @@ def cors_handler(app):
         return response
 
 def request_logging(app):
-    """Log all requests"""
+    """Log one structured line per request"""
+    sampled_endpoints = app.config.get('LOG_SAMPLED_ENDPOINTS', {})
+    
     @app.before_request
-    def log_request():
-        app.logger.info(f"{request.method} {request.path}")
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.request_start = time.perf_counter()
     
     @app.after_request
     def log_response(response):
-        app.logger.info(f"Response: {response.status_code}")
+        response.headers['X-Request-ID'] = g.get('request_id', '')
+        start = g.get('request_start')
+        duration_ms = (time.perf_counter() - start) * 1000 if start is not None else None
+        app.logger.info(
+            '%s %s %s', request.method, request.path, response.status_code,
+            extra={
+                'sample': sampled_endpoints.get(request.endpoint),
+                'fields': {
+                    'event': 'request',
+                    'method': request.method,
+                    'path': request.path,
+                    'endpoint': request.endpoint,
+                    'status': response.status_code,
+                    'duration_ms': round(duration_ms, 2) if duration_ms is not None else None,
+                },
+            }
+        )
+        return response
+
+def query_instrumentation(app, engines=True):
+    """Record per-request database statistics
+
+    ``engines`` hooks SQLAlchemy engines; apps on raw psycopg2 connections
+    pass False and use ``query_stats.instrumented_connection_class``.
+    """
+    if engines:
+        query_stats.instrument_engine()
+    
+    @app.before_request
+    def start_query_stats():
+        query_stats.start_request()
+        g.slow_query_threshold_ms = app.config.get('SLOW_QUERY_THRESHOLD_MS')
+    
+    @app.after_request
+    def report_query_stats(response):
+        stats = query_stats.current_stats()
+        if stats is None:
+            return response
+        
+        if app.config.get('QUERY_STATS_HEADERS', True):
+            response.headers['Server-Timing'] = stats.server_timing()
+        
+        if stats.count:
+            record = {
+                'event': 'request_db_stats',
+                'method': request.method,
+                'endpoint': request.endpoint,
+                'path': request.path,
+                'status': response.status_code,
+            }
+            record.update(stats.to_dict())
+            query_stats.logger.info('request_db_stats', extra={'fields': record})
+        return response
+
+def request_metrics(app):
+    """Record request counts, latency and concurrency"""
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        metrics.add('http_requests_in_flight')
+    
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = (('blueprint', request.blueprint or ''), ('endpoint', request.endpoint or 'unmatched'))
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - start, route)
+            metrics.inc('http_requests_total', route + (('method', request.method), ('status', response.status_code)))
+        metrics.maybe_flush()
+        return response
+    
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        metrics.add('http_requests_in_flight', value=-1)
+
+def _token_payload():
+    """Decode the bearer token without a database lookup, or None"""
+    from services.auth_service import AuthService
+    parts = request.headers.get('Authorization', '').split(' ')
+    if len(parts) < 2:
+        return None
+    try:
+        return AuthService.decode_access_token(parts[1])
+    except Exception:
+        return None
+
+def conditional_requests(app):
+    """Emit ETags and answer If-None-Match with 304
+    
+    Endpoints listed in ETAG_VERSION_ENDPOINTS get an ETag built from the
+    resource id and a version token kept in the shared cache, so a match
+    is answered before the handler runs any query. Other JSON GET
+    responses fall back to an ETag hashed from the body.
+    """
+    version_endpoints = app.config.get('ETAG_VERSION_ENDPOINTS', {})
+    use_versions = bool(version_endpoints) and http_cache.shared_cache_configured(app.config)
+    ttl = app.config.get('ETAG_VERSION_TTL', 86400)
+    if use_versions:
+        http_cache.track_versions()
+    
+    @app.before_request
+    def check_version_etag():
+        if not use_versions or request.method != 'GET':
+            return None
+        spec = version_endpoints.get(request.endpoint)
+        if spec is None:
+            return None
+        
+        scope, view_arg, requires_auth = spec
+        key = (request.view_args or {}).get(view_arg) if view_arg else None
+        if requires_auth:
+            # An invalid token falls through so the handler returns the usual 401
+            payload = _token_payload()
+            if payload is None:
+                return None
+            if key is None:
+                key = payload['user_id']
+        if key is None:
+            return None
+        
+        try:
+            version = http_cache.get_version(scope, key, ttl)
+        except Exception as e:
+            logger.error("ETag version lookup failed: %s", e)
+            return None
+        if version is None:
+            return None
+        
+        etag = http_cache.make_etag(scope, key, version, request.query_string)
+        g.version_etag = etag
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return None
+    
+    @app.after_request
+    def add_etag(response):
+        etag = g.pop('version_etag', None)
+        if (request.method != 'GET' or response.status_code != 200
+                or response.is_streamed or 'ETag' in response.headers):
+            return response
+        
+        if etag is not None and g.get('replica_read'):
+            # A lagging replica may predate the version token; tag the body instead
+            etag = None
+        if etag is None:
+            if response.mimetype != 'application/json':
+                return response
+            etag = http_cache.body_etag(response.get_data())
+        
+        response.set_etag(etag, weak=True)
+        response.headers.setdefault('Cache-Control', 'private, no-cache')
+        return response.make_conditional(request)
+
+def _negotiate_encoding(accept_encodings):
+    """Pick br or gzip from Accept-Encoding, preferring br on a tie"""
+    gzip_q = accept_encodings['gzip']
+    br_q = accept_encodings['br'] if brotli is not None else 0
+    if br_q and br_q >= gzip_q:
+        return 'br'
+    if gzip_q:
+        return 'gzip'
+    return None
+
+def response_compression(app):
+    """Compress responses above COMPRESS_MIN_SIZE with brotli or gzip"""
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+    gzip_level = app.config.get('COMPRESS_LEVEL', 6)
+    brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', 4)
+    mimetypes = set(app.config.get('COMPRESS_MIMETYPES', ('application/json', 'text/csv', 'text/plain', 'application/x-ndjson')))
+    
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in mimetypes):
+            return response
+        
+        response.vary.add('Accept-Encoding')
+        encoding = _negotiate_encoding(request.accept_encodings)
+        if encoding is None or (response.content_length or 0) < min_size:
+            return response
+        
+        data = response.get_data()
+        if encoding == 'br':
+            data = brotli.compress(data, quality=brotli_quality)
+        else:
+            data = gzip.compress(data, compresslevel=gzip_level)
+        
+        response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
         return response
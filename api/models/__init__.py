@@ -1,15 +1,29 @@
 from .user import User, UserRole
 from .order import Order, OrderStatus, OrderStatusHistory, PaymentMethod
 from .delivery import Delivery, DeliveryStatus, DeliveryLocationHistory
-from .payment import Payment, PaymentStatus, UserWallet, WalletTransaction
+from .payment import (
+    Payment, PaymentStatus, UserWallet, WalletTransaction, PayoutStatus, PayoutRun, PayoutLine,
+    RefundJobStatus, RefundJob,
+)
 from .rating import Rating
 from .support import SupportTicket, TicketStatus, TicketPriority, TicketMessage
+from .analytics import OrderRollup, SlaStat
+from .promotion import PromoCode, PromoRedemption
+from .notification import NotificationOutbox, NotificationStatus
+from .event import DomainEvent, EventConsumer
+from .idempotency import IdempotencyKey
 
 __all__ = [
     'User', 'UserRole',
     'Order', 'OrderStatus', 'OrderStatusHistory', 'PaymentMethod',
     'Delivery', 'DeliveryStatus', 'DeliveryLocationHistory',
-    'Payment', 'PaymentStatus', 'UserWallet', 'WalletTransaction',
+    'Payment', 'PaymentStatus', 'UserWallet', 'WalletTransaction', 'PayoutStatus', 'PayoutRun', 'PayoutLine',
+    'RefundJobStatus', 'RefundJob',
     'Rating',
     'SupportTicket', 'TicketStatus', 'TicketPriority', 'TicketMessage',
+    'OrderRollup', 'SlaStat',
+    'PromoCode', 'PromoRedemption',
+    'NotificationOutbox', 'NotificationStatus',
+    'DomainEvent', 'EventConsumer',
+    'IdempotencyKey',
 ]
@@ -0,0 +1,72 @@
+from database import BaseModel, db
+
+class OrderRollup(BaseModel):
+    """Order counters pre-aggregated per hour or day
+
+    Each bucket is split over a few shard rows so concurrent order
+    transactions do not all queue on one row lock; readers sum the shards.
+    """
+    __tablename__ = 'order_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket_start', 'shard', name='uq_order_rollups_bucket'),
+    )
+
+    granularity = db.Column(db.String(10), nullable=False)  # hour, day
+    bucket_start = db.Column(db.DateTime, nullable=False, index=True)
+    shard = db.Column(db.SmallInteger, nullable=False, default=0)
+
+    orders_created = db.Column(db.Integer, nullable=False, default=0)
+    orders_delivered = db.Column(db.Integer, nullable=False, default=0)
+    orders_cancelled = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)  # total_amount of delivered orders
+    delivery_seconds_total = db.Column(db.Float, nullable=False, default=0)  # created -> delivered
+
+class SlaStat(BaseModel):
+    """Delivery-time percentiles and late rate per courier or zone
+
+    Written by the SLA job over a trailing window of delivered orders;
+    each run replaces the rows for its window. Durations are in seconds.
+    """
+    __tablename__ = 'sla_stats'
+    __table_args__ = (
+        db.UniqueConstraint('scope', 'scope_key', 'window_days', name='uq_sla_stats_scope'),
+    )
+
+    scope = db.Column(db.String(10), nullable=False)  # courier, zone
+    scope_key = db.Column(db.String(36), nullable=False)  # courier id or geohash cell
+    window_days = db.Column(db.Integer, nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False)
+
+    deliveries = db.Column(db.Integer, nullable=False, default=0)
+    late_deliveries = db.Column(db.Integer, nullable=False, default=0)
+    late_rate = db.Column(db.Float, nullable=True)  # among deliveries with an estimate
+
+    assign_to_pickup_p50 = db.Column(db.Float, nullable=True)
+    assign_to_pickup_p90 = db.Column(db.Float, nullable=True)
+    assign_to_pickup_p95 = db.Column(db.Float, nullable=True)
+    pickup_to_deliver_p50 = db.Column(db.Float, nullable=True)
+    pickup_to_deliver_p90 = db.Column(db.Float, nullable=True)
+    pickup_to_deliver_p95 = db.Column(db.Float, nullable=True)
+    assign_to_deliver_p50 = db.Column(db.Float, nullable=True)
+    assign_to_deliver_p90 = db.Column(db.Float, nullable=True)
+    assign_to_deliver_p95 = db.Column(db.Float, nullable=True)
+
+    score = db.Column(db.Float, nullable=True)  # couriers only, 0-100
+
+    def to_dict(self):
+        """Convert to dictionary"""
+        data = {
+            'scope': self.scope,
+            'key': self.scope_key,
+            'window_days': self.window_days,
+            'computed_at': self.computed_at.isoformat(),
+            'deliveries': self.deliveries,
+            'late_deliveries': self.late_deliveries,
+            'late_rate': self.late_rate,
+            'score': self.score,
+        }
+        for stage in ('assign_to_pickup', 'pickup_to_deliver', 'assign_to_deliver'):
+            data[f'{stage}_seconds'] = {
+                f'p{p}': getattr(self, f'{stage}_p{p}') for p in (50, 90, 95)
+            }
+        return data
@@ -19,6 +19,7 @@ class Delivery(BaseModel):
     
     # Status
     status = db.Column(db.String(30), default=DeliveryStatus.ASSIGNED.value)
+    version = db.Column(db.Integer, nullable=False, default=1)  # bumped by every status transition
     
     # Current location
     current_latitude = db.Column(db.Float, nullable=True)
@@ -46,6 +47,7 @@ class Delivery(BaseModel):
             'order_id': self.order_id,
             'courier_id': self.courier_id,
             'status': self.status,
+            'version': self.version,
             'current_latitude': self.current_latitude,
             'current_longitude': self.current_longitude,
             'estimated_arrival': self.estimated_arrival.isoformat() if self.estimated_arrival else None,
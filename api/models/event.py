@@ -0,0 +1,51 @@
+from database import BaseModel, db
+from datetime import datetime
+
+class DomainEvent(db.Model):
+    """A state change of an order, delivery or payment, appended in the transaction that made it
+
+    ``position`` comes from the table's sequence, so it increases in the
+    order events were written; consumers read forward from the last
+    position they processed. A writer that has not committed yet leaves a
+    hole below events committed after it, so readers stop at a hole
+    until it fills or is old enough to have been rolled back (see
+    EventService.read).
+    """
+    __tablename__ = 'domain_events'
+    __table_args__ = (
+        db.Index('ix_domain_events_aggregate', 'aggregate_type', 'aggregate_id', 'position'),
+        # SQLite would otherwise reuse the positions of deleted rows
+        {'sqlite_autoincrement': True},
+    )
+
+    position = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    aggregate_type = db.Column(db.String(20), nullable=False)  # order, delivery, payment
+    aggregate_id = db.Column(db.String(36), nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)  # e.g. order.status_changed
+    data = db.Column(db.JSON, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def to_dict(self):
+        return {
+            'position': self.position,
+            'aggregate_type': self.aggregate_type,
+            'aggregate_id': self.aggregate_id,
+            'type': self.event_type,
+            'data': self.data,
+            'created_at': self.created_at.isoformat(),
+        }
+
+class EventConsumer(BaseModel):
+    """Offset of one named consumer of the domain event log
+
+    ``position`` is the last event the consumer has processed. In-process
+    subscribers hold a lease (``owner`` until ``lease_until``) so only one
+    process at a time delivers a consumer's events; consumers reading over
+    the API leave it empty.
+    """
+    __tablename__ = 'event_consumers'
+
+    name = db.Column(db.String(64), unique=True, nullable=False)
+    position = db.Column(db.BigInteger, nullable=False, default=0)
+    owner = db.Column(db.String(100), nullable=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
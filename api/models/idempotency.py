@@ -0,0 +1,20 @@
+from database import db
+
+class IdempotencyKey(db.Model):
+    """A request claimed under an Idempotency-Key, and its response once it succeeded
+
+    ``key`` is a digest of the user, method, path and client key, so one
+    client's keys never collide with another's. While the first request
+    runs, ``status_code`` is empty and duplicates wait; if it has not
+    finished by ``locked_until`` its worker is presumed dead and a retry
+    may take the key over. Rows are replayed until ``expires_at``.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(64), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)  # digest of the request body
+    status_code = db.Column(db.Integer, nullable=True)
+    content_type = db.Column(db.String(100), nullable=True)
+    body = db.Column(db.LargeBinary, nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
@@ -0,0 +1,35 @@
+from database import BaseModel, db
+from enum import Enum
+
+class NotificationStatus(Enum):
+    """Notification outbox statuses"""
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+class NotificationOutbox(BaseModel):
+    """A notification to send, written in the same transaction as the change it reports
+
+    One row per recipient and channel. Dispatchers claim due rows by
+    moving ``available_at`` forward by a lease, so a row whose dispatcher
+    died becomes due again once the lease runs out. Rows for the same
+    recipient and channel claimed together are sent as one message, with
+    only the latest payload per topic.
+    """
+    __tablename__ = 'notification_outbox'
+    __table_args__ = (
+        db.Index('ix_notification_outbox_due', 'status', 'available_at'),
+    )
+
+    recipient_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    channel = db.Column(db.String(20), nullable=False)
+    topic = db.Column(db.String(64), nullable=False)  # what the payload is about, e.g. 'order:<id>'
+    event = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+
+    status = db.Column(db.String(20), nullable=False, default=NotificationStatus.PENDING.value)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(db.DateTime, nullable=False)  # due, or lease expiry while sending
+    sent_at = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.Text, nullable=True)
@@ -54,11 +54,12 @@ class Order(BaseModel):
     
     # Status
     status = db.Column(db.String(20), default=OrderStatus.PENDING.value)
+    version = db.Column(db.Integer, nullable=False, default=1)  # bumped by every status transition
     payment_method = db.Column(db.String(30), nullable=False, default=PaymentMethod.CARD.value)
     
     # Timeline
     pickup_time = db.Column(db.DateTime, nullable=True)
-    delivery_time = db.Column(db.DateTime, nullable=True)
+    delivery_time = db.Column(db.DateTime, nullable=True, index=True)  # payout runs select by period
     estimated_delivery_time = db.Column(db.DateTime, nullable=True)
     cancelled_at = db.Column(db.DateTime, nullable=True)
     cancellation_reason = db.Column(db.Text, nullable=True)
@@ -80,6 +81,7 @@ class Order(BaseModel):
             'package_description': self.package_description,
             'package_weight': self.package_weight,
             'status': self.status,
+            'version': self.version,
             'total_amount': self.total_amount,
             'payment_method': self.payment_method,
             'created_at': self.created_at.isoformat(),
@@ -91,7 +93,7 @@ class OrderStatusHistory(BaseModel):
     __tablename__ = 'order_status_history'
     
     order_id = db.Column(db.String(36), db.ForeignKey('orders.id'), nullable=False)
-    from_status = db.Column(db.String(20), nullable=False)
+    from_status = db.Column(db.String(20), nullable=True)  # None for the initial status
     to_status = db.Column(db.String(20), nullable=False)
     changed_by = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     reason = db.Column(db.Text, nullable=True)
@@ -25,7 +25,7 @@ class Payment(BaseModel):
     gateway = db.Column(db.String(50), nullable=True)  # stripe, razorpay, etc.
     
     # Metadata
-    metadata = db.Column(db.JSON, nullable=True)
+    payment_metadata = db.Column('metadata', db.JSON, nullable=True)  # 'metadata' is reserved on declarative models
     
     # Timestamps
     processed_at = db.Column(db.DateTime, nullable=True)
@@ -68,3 +68,122 @@ class WalletTransaction(BaseModel):
     description = db.Column(db.Text, nullable=True)
     balance_before = db.Column(db.Float, nullable=False)
     balance_after = db.Column(db.Float, nullable=False)
+
+class PayoutStatus(Enum):
+    """Payout run statuses"""
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+class PayoutRun(BaseModel):
+    """One courier payout over a period of delivered orders
+
+    Couriers are split into ``shard_count`` id ranges that are paid
+    independently; a failed run is resumed by running it again.
+    """
+    __tablename__ = 'payout_runs'
+    __table_args__ = (
+        db.UniqueConstraint('period_start', 'period_end', name='uq_payout_runs_period'),
+    )
+    
+    period_start = db.Column(db.DateTime, nullable=False)
+    period_end = db.Column(db.DateTime, nullable=False)  # exclusive
+    status = db.Column(db.String(20), nullable=False, default=PayoutStatus.RUNNING.value)
+    shard_count = db.Column(db.Integer, nullable=False)
+    courier_share = db.Column(db.Float, nullable=False)  # fraction of the fare paid to the courier
+    
+    # Totals, filled in when the run completes
+    couriers = db.Column(db.Integer, nullable=True)
+    deliveries = db.Column(db.Integer, nullable=True)
+    total_amount = db.Column(db.Float, nullable=True)
+    file_path = db.Column(db.String(255), nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'period_start': self.period_start.isoformat(),
+            'period_end': self.period_end.isoformat(),
+            'status': self.status,
+            'shard_count': self.shard_count,
+            'courier_share': self.courier_share,
+            'couriers': self.couriers,
+            'deliveries': self.deliveries,
+            'total_amount': self.total_amount,
+            'file_path': self.file_path,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'error': self.error,
+        }
+
+class PayoutLine(BaseModel):
+    """A courier's earnings in a payout run and the wallet credit paying them
+
+    Lines commit together with their wallet credits, so the lines of a
+    shard double as its checkpoint.
+    """
+    __tablename__ = 'payout_lines'
+    __table_args__ = (
+        db.UniqueConstraint('run_id', 'courier_id', name='uq_payout_lines_courier'),
+        db.Index('ix_payout_lines_run_shard', 'run_id', 'shard', 'courier_id'),
+    )
+    
+    run_id = db.Column(db.String(36), db.ForeignKey('payout_runs.id'), nullable=False)
+    courier_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    shard = db.Column(db.Integer, nullable=False)
+    deliveries = db.Column(db.Integer, nullable=False)
+    gross_fares = db.Column(db.Float, nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    wallet_transaction_id = db.Column(db.String(36), db.ForeignKey('wallet_transactions.id'), nullable=True)
+
+class RefundJobStatus(Enum):
+    """Bulk refund job statuses"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+class RefundJob(BaseModel):
+    """Refund of every completed payment matching a set of criteria
+
+    Payments are refunded in id order a chunk at a time; ``last_payment_id``
+    is the checkpoint a rerun of an interrupted job continues after.
+    """
+    __tablename__ = 'refund_jobs'
+    
+    created_by = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=True)
+    criteria = db.Column(db.JSON, nullable=False)
+    reason = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=RefundJobStatus.PENDING.value)
+    
+    # Progress
+    total = db.Column(db.Integer, nullable=True)  # matching payments when the job started
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    refunded = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    amount_refunded = db.Column(db.Float, nullable=False, default=0)
+    last_payment_id = db.Column(db.String(36), nullable=True)
+    errors = db.Column(db.JSON, nullable=True)  # first few failures as {payment_id, error}
+    
+    started_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'criteria': self.criteria,
+            'reason': self.reason,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'refunded': self.refunded,
+            'failed': self.failed,
+            'amount_refunded': round(self.amount_refunded or 0.0, 2),
+            'errors': self.errors or [],
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'error': self.error,
+        }
@@ -1,4 +1,4 @@
-from api.database import db, BaseModel
+from database import db, BaseModel
 from datetime import datetime
 
 class PromoCode(BaseModel):
@@ -31,3 +31,39 @@ class PromoCode(BaseModel):
             self.valid_from <= now <= self.valid_till and
             (self.max_uses is None or self.current_uses < self.max_uses)
         )
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'code': self.code,
+            'description': self.description,
+            'discount_type': self.discount_type,
+            'discount_value': self.discount_value,
+            'max_discount': self.max_discount,
+            'min_order_amount': self.min_order_amount,
+            'max_uses': self.max_uses,
+            'current_uses': self.current_uses,
+            'max_uses_per_user': self.max_uses_per_user,
+            'valid_from': self.valid_from.isoformat() if self.valid_from else None,
+            'valid_till': self.valid_till.isoformat() if self.valid_till else None,
+            'is_active': self.is_active,
+            'applicable_roles': self.applicable_roles,
+        }
+
+class PromoRedemption(BaseModel):
+    """One use of a promo code on an order
+
+    The unique (code, user, redemption_number) key makes two concurrent
+    redemptions of the same per-user slot fail instead of both committing.
+    """
+    __tablename__ = 'promo_redemptions'
+    __table_args__ = (
+        db.UniqueConstraint('promo_code_id', 'user_id', 'redemption_number', name='uq_promo_redemptions_slot'),
+    )
+    
+    promo_code_id = db.Column(db.String(36), db.ForeignKey('promo_codes.id'), nullable=False)
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    order_id = db.Column(db.String(36), db.ForeignKey('orders.id'), nullable=False, unique=True)
+    redemption_number = db.Column(db.Integer, nullable=False)  # 1 for the user's first use of the code
+    discount_amount = db.Column(db.Float, nullable=False)
@@ -19,6 +19,10 @@ class TicketPriority(Enum):
 class SupportTicket(BaseModel):
     """Support ticket model"""
     __tablename__ = 'support_tickets'
+    __table_args__ = (
+        # Unassigned tickets by deadline, for claim-next when the in-memory queue is cold
+        db.Index('ix_support_tickets_waiting', 'sla_due_at', postgresql_where=db.text('assigned_to IS NULL')),
+    )
     
     ticket_number = db.Column(db.String(50), unique=True, nullable=False, index=True)
     user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
@@ -31,17 +35,54 @@ class SupportTicket(BaseModel):
     priority = db.Column(db.String(20), default=TicketPriority.MEDIUM.value)
     
     assigned_to = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=True)
+    assigned_at = db.Column(db.DateTime, nullable=True)
+    sla_due_at = db.Column(db.DateTime, nullable=True)  # first response due, from SUPPORT_SLA_HOURS by priority
     resolved_at = db.Column(db.DateTime, nullable=True)
     resolution_notes = db.Column(db.Text, nullable=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)  # seq of the latest message
     
     # Relationships
-    messages = db.relationship('TicketMessage', backref='ticket', lazy=True, cascade='all, delete-orphan')
+    messages = db.relationship('TicketMessage', backref='ticket', lazy=True, cascade='all, delete-orphan',
+                               order_by='TicketMessage.seq')
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'ticket_number': self.ticket_number,
+            'user_id': self.user_id,
+            'order_id': self.order_id,
+            'subject': self.subject,
+            'status': self.status,
+            'priority': self.priority,
+            'assigned_to': self.assigned_to,
+            'assigned_at': self.assigned_at.isoformat() if self.assigned_at else None,
+            'sla_due_at': self.sla_due_at.isoformat() if self.sla_due_at else None,
+            'message_count': self.message_count,
+            'created_at': self.created_at.isoformat(),
+        }
 
 class TicketMessage(BaseModel):
     """Support ticket messages"""
     __tablename__ = 'ticket_messages'
+    __table_args__ = (
+        # Thread order; clients fetch messages after the last seq they have
+        db.UniqueConstraint('ticket_id', 'seq', name='uq_ticket_messages_ticket_seq'),
+    )
     
     ticket_id = db.Column(db.String(36), db.ForeignKey('support_tickets.id'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)  # 1, 2, ... within the ticket, in commit order
     sent_by = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
     message = db.Column(db.Text, nullable=False)
     attachment = db.Column(db.String(255), nullable=True)
+    
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'id': self.id,
+            'seq': self.seq,
+            'sent_by': self.sent_by,
+            'message': self.message,
+            'attachment': self.attachment,
+            'created_at': self.created_at.isoformat(),
+        }
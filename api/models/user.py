@@ -1,7 +1,9 @@
 from database import BaseModel, db
 from datetime import datetime
 from enum import Enum
+from utils.metrics import registry as metrics, track_in_flight
 import bcrypt
+import time
 
 class UserRole(Enum):
     """User roles"""
@@ -35,15 +37,22 @@ class User(BaseModel):
     given_ratings = db.relationship('Rating', backref='rater', lazy=True, foreign_keys='Rating.rater_id')
     received_ratings = db.relationship('Rating', backref='ratee', lazy=True, foreign_keys='Rating.ratee_id')
     payments = db.relationship('Payment', backref='user', lazy=True)
-    support_tickets = db.relationship('SupportTicket', backref='user', lazy=True)
+    support_tickets = db.relationship('SupportTicket', backref='user', lazy=True, foreign_keys='SupportTicket.user_id')
     
     def set_password(self, password):
         """Hash and set password"""
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        with track_in_flight('bcrypt_in_flight'):
+            start = time.perf_counter()
+            self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            metrics.observe('bcrypt_duration_seconds', time.perf_counter() - start)
     
     def check_password(self, password):
         """Verify password"""
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        with track_in_flight('bcrypt_in_flight'):
+            start = time.perf_counter()
+            matches = bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+            metrics.observe('bcrypt_duration_seconds', time.perf_counter() - start)
+        return matches
     
     def to_dict(self, include_sensitive=False):
         """Convert to dictionary"""
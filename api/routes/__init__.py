@@ -7,6 +7,7 @@ from .payments import payments_bp
 from .ratings import ratings_bp
 from .admin import admin_bp
 from .support import support_bp
+from .promotions import promotions_bp
 
 __all__ = [
     'health_bp',
@@ -18,4 +19,5 @@ __all__ = [
     'ratings_bp',
     'admin_bp',
     'support_bp',
+    'promotions_bp',
 ]
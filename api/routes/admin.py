@@ -1,12 +1,21 @@
-from flask import Blueprint, request, jsonify
-from utils.decorators import require_auth, require_role, validate_json
-from utils.errors import NotFoundError
+from flask import Blueprint, request, jsonify, current_app
+from utils.decorators import require_auth, require_role, validate_json, rate_limit
+from utils.errors import NotFoundError, ValidationError
+from utils.export import parse_export_filters, export_response
+from utils.demand_grid import demand_grid, DEMAND_KINDS
 from services.user_service import UserService
+from services.export_service import ExportService
+from services.analytics_service import AnalyticsService
+from services.sla_service import SlaService
+from services.search_service import SearchService
+from services.notification_service import NotificationService
+from services.event_service import EventService
 from models.user import UserRole, User
 from models.order import Order
 from models.delivery import Delivery
 from app import db
 from sqlalchemy import func
+from datetime import datetime
 import logging
 
 admin_bp = Blueprint('admin', __name__)
@@ -15,6 +24,7 @@ logger = logging.getLogger(__name__)
 @admin_bp.route('/dashboard/stats', methods=['GET'])
 @require_auth
 @require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
 def dashboard_stats():
     """Get dashboard statistics"""
     try:
@@ -54,7 +64,7 @@ def dashboard_stats():
             }
         }), 200
     except Exception as e:
-        logger.error(f"Dashboard stats error: {e}")
+        logger.error("Dashboard stats error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -63,6 +73,7 @@ def dashboard_stats():
 @admin_bp.route('/users', methods=['GET'])
 @require_auth
 @require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
 def get_all_users():
     """Get all users"""
     try:
@@ -87,7 +98,7 @@ def get_all_users():
             }
         }), 200
     except Exception as e:
-        logger.error(f"Get all users error: {e}")
+        logger.error("Get all users error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -112,7 +123,7 @@ def deactivate_user(user_id):
             'error': str(e)
         }), 404
     except Exception as e:
-        logger.error(f"Deactivate user error: {e}")
+        logger.error("Deactivate user error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -137,7 +148,7 @@ def activate_user(user_id):
             'error': str(e)
         }), 404
     except Exception as e:
-        logger.error(f"Activate user error: {e}")
+        logger.error("Activate user error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -146,6 +157,7 @@ def activate_user(user_id):
 @admin_bp.route('/orders', methods=['GET'])
 @require_auth
 @require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
 def get_all_orders():
     """Get all orders"""
     try:
@@ -170,7 +182,282 @@ def get_all_orders():
             }
         }), 200
     except Exception as e:
-        logger.error(f"Get all orders error: {e}")
+        logger.error("Get all orders error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@admin_bp.route('/search', methods=['GET'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
+def search():
+    """Ranked search over orders, users or support tickets with keyset pagination"""
+    try:
+        results, next_cursor = SearchService.search(
+            request.args.get('type', 'orders'),
+            request.args.get('q'),
+            limit=request.args.get('limit', 20, type=int),
+            cursor=request.args.get('cursor')
+        )
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'next_cursor': next_cursor
+        }), 200
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("Search error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@admin_bp.route('/notifications/stats', methods=['GET'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
+def notification_stats():
+    """Notification outbox backlog, throughput and lag"""
+    try:
+        window = max(1, min(request.args.get('window_minutes', 60, type=int), 1440))
+        
+        return jsonify({
+            'success': True,
+            'notifications': NotificationService.stats(window)
+        }), 200
+    except Exception as e:
+        logger.error("Notification stats error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@admin_bp.route('/events', methods=['GET'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
+def read_events():
+    """Next batch of domain events for a consumer, after a position, or of one order, delivery or payment"""
+    try:
+        limit = max(1, min(request.args.get('limit', 500, type=int), current_app.config['EVENT_BATCH_SIZE']))
+        consumer = request.args.get('consumer')
+        aggregate_id = request.args.get('aggregate_id')
+        
+        if aggregate_id:
+            events = EventService.history(request.args.get('aggregate_type', 'order'), aggregate_id)
+            return jsonify({
+                'success': True,
+                'events': events
+            }), 200
+        
+        if consumer:
+            # A consumer reading for the first time is created where ?start= says
+            EventService.register([consumer], request.args.get('start', current_app.config['EVENT_SUBSCRIBER_START']))
+            position, events = EventService.fetch(consumer, limit)
+        else:
+            position = max(0, request.args.get('after', 0, type=int))
+            events = EventService.read(position, limit)
+        
+        # Acknowledge next_position even when ?type= filtered every event out
+        next_position = events[-1]['position'] if events else position
+        types = set(request.args.getlist('type'))
+        if types:
+            events = [e for e in events if e['type'] in types]
+        
+        return jsonify({
+            'success': True,
+            'events': events,
+            'position': position,
+            'next_position': next_position
+        }), 200
+    except NotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except Exception as e:
+        logger.error("Read events error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@admin_bp.route('/events/consumers', methods=['GET'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
+def event_consumers():
+    """Offset, lag and lease holder of every domain event consumer"""
+    try:
+        return jsonify({
+            'success': True,
+            'events': EventService.consumers()
+        }), 200
+    except Exception as e:
+        logger.error("Event consumers error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@admin_bp.route('/events/consumers/<name>/ack', methods=['POST'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
+@validate_json('position')
+def acknowledge_events(name):
+    """Record that a consumer has processed every event up to a position"""
+    try:
+        position = request.data['position']
+        EventService.acknowledge(name, position)
+        
+        return jsonify({
+            'success': True,
+            'consumer': name,
+            'position': position
+        }), 200
+    except NotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("Acknowledge events error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@admin_bp.route('/export/<resource>', methods=['GET'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
+def export_resource(resource):
+    """Stream orders, users or payments as CSV or NDJSON"""
+    try:
+        filters = parse_export_filters(request.args)
+        filters['role'] = request.args.get('role')
+        
+        columns, rows = ExportService.stream_rows(resource, filters)
+        
+        return export_response(rows, columns, f"{resource}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}", filters)
+    except NotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("Export error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@admin_bp.route('/analytics/timeseries', methods=['GET'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
+def analytics_timeseries():
+    """Orders, revenue and delivery time per hour or day from the rollups"""
+    try:
+        granularity, start, end = AnalyticsService.parse_range(request.args)
+        
+        return jsonify({
+            'success': True,
+            'analytics': AnalyticsService.get_timeseries(granularity, start, end)
+        }), 200
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("Analytics timeseries error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@admin_bp.route('/analytics/sla', methods=['GET'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
+def sla_stats():
+    """Delivery-time percentiles and late rates per courier or zone"""
+    try:
+        scope = request.args.get('scope', 'courier')
+        sort = request.args.get('sort', 'late_rate')
+        window_days = request.args.get('window_days', type=int)
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        offset = request.args.get('offset', 0, type=int)
+        
+        stats, total = SlaService.get_stats(scope, window_days, sort, limit, offset)
+        
+        return jsonify({
+            'success': True,
+            'stats': [s.to_dict() for s in stats],
+            'total': total,
+            'limit': limit,
+            'offset': offset
+        }), 200
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("SLA stats error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@admin_bp.route('/analytics/heatmap', methods=['GET'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
+def demand_heatmap():
+    """Pickup or drop-off demand per geohash cell over a sliding window"""
+    try:
+        kind = request.args.get('kind', 'pickup')
+        if kind not in DEMAND_KINDS:
+            raise ValidationError(f'Invalid kind. Must be one of: {", ".join(DEMAND_KINDS)}')
+        window = request.args.get('window', type=int)
+        if window is not None and window not in demand_grid.window_minutes:
+            raise ValidationError(f'Invalid window. Must be one of: {", ".join(map(str, demand_grid.window_minutes))}')
+        precision = request.args.get('precision', type=int)
+        if precision is not None and precision < 1:
+            raise ValidationError('Precision must be at least 1')
+        limit = min(request.args.get('limit', 500, type=int), 5000)
+        
+        return jsonify({
+            'success': True,
+            'heatmap': demand_grid.heatmap(kind, window, precision, limit)
+        }), 200
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("Demand heatmap error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
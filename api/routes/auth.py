@@ -10,7 +10,7 @@ auth_bp = Blueprint('auth', __name__)
 logger = logging.getLogger(__name__)
 
 @auth_bp.route('/register', methods=['POST'])
-@rate_limit('10 per hour')
+@rate_limit('register')
 @validate_json('email', 'password', 'first_name', 'last_name', 'phone')
 def register():
     """Register new user"""
@@ -38,14 +38,14 @@ def register():
             }
         }), 201
     except (ValidationError, Exception) as e:
-        logger.error(f"Registration error: {e}")
+        logger.error("Registration error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 400
 
 @auth_bp.route('/login', methods=['POST'])
-@rate_limit('20 per hour')
+@rate_limit('login')
 @validate_json('email', 'password')
 def login():
     """Login user"""
@@ -65,7 +65,7 @@ def login():
             }
         }), 200
     except (AuthenticationError, Exception) as e:
-        logger.error(f"Login error: {e}")
+        logger.error("Login error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -84,7 +84,7 @@ def refresh():
             'access_token': access_token
         }), 200
     except (AuthenticationError, Exception) as e:
-        logger.error(f"Token refresh error: {e}")
+        logger.error("Token refresh error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
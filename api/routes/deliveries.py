@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify
-from utils.decorators import require_auth, validate_json, require_role
-from utils.errors import ValidationError, NotFoundError
+from utils.decorators import require_auth, validate_json, require_role, rate_limit
+from utils.errors import ValidationError, NotFoundError, ConflictError
 from services.delivery_service import DeliveryService
 from models.user import UserRole
 import logging
@@ -17,7 +17,7 @@ def assign_delivery(order_id):
     try:
         data = request.data
         
-        delivery = DeliveryService.assign_delivery(order_id, data['courier_id'])
+        delivery = DeliveryService.assign_delivery(order_id, data['courier_id'], request.user.id)
         
         return jsonify({
             'success': True,
@@ -30,7 +30,7 @@ def assign_delivery(order_id):
             'error': str(e)
         }), 400
     except Exception as e:
-        logger.error(f"Assign delivery error: {e}")
+        logger.error("Assign delivery error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -39,6 +39,7 @@ def assign_delivery(order_id):
 @deliveries_bp.route('/<delivery_id>/location', methods=['PUT'])
 @require_auth
 @require_role(UserRole.COURIER.value)
+@rate_limit('location_ingest')
 @validate_json('latitude', 'longitude')
 def update_location(delivery_id):
     """Update delivery location"""
@@ -66,7 +67,7 @@ def update_location(delivery_id):
             'error': str(e)
         }), 400
     except Exception as e:
-        logger.error(f"Update location error: {e}")
+        logger.error("Update location error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -81,20 +82,25 @@ def update_delivery_status(delivery_id):
     try:
         data = request.data
         
-        delivery = DeliveryService.update_delivery_status(delivery_id, data['status'])
+        delivery = DeliveryService.update_delivery_status(delivery_id, data['status'], expected_version=data.get('version'))
         
         return jsonify({
             'success': True,
             'message': 'Delivery status updated',
             'delivery': delivery.to_dict()
         }), 200
+    except ConflictError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
     except (ValidationError, NotFoundError) as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 400
     except Exception as e:
-        logger.error(f"Update delivery status error: {e}")
+        logger.error("Update delivery status error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -112,7 +118,7 @@ def get_active_deliveries(courier_id):
             'deliveries': [d.to_dict() for d in deliveries]
         }), 200
     except Exception as e:
-        logger.error(f"Get active deliveries error: {e}")
+        logger.error("Get active deliveries error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -144,7 +150,7 @@ def get_delivery_tracking(delivery_id):
             'error': str(e)
         }), 404
     except Exception as e:
-        logger.error(f"Get delivery tracking error: {e}")
+        logger.error("Get delivery tracking error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
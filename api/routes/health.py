@@ -1,10 +1,28 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, Response
 from app import db
+from utils.metrics import registry as metrics
 import logging
 
 health_bp = Blueprint('health', __name__)
 logger = logging.getLogger(__name__)
 
+def _pool_connections():
+    """Connection pool usage for the primary engine"""
+    pool = db.engine.pool
+    stats = []
+    for state, method in (('checked_out', 'checkedout'), ('checked_in', 'checkedin'), ('overflow', 'overflow')):
+        if hasattr(pool, method):
+            stats.append(((('state', state),), getattr(pool, method)()))
+    return stats
+
+def _pool_size():
+    """Configured connection pool size"""
+    pool = db.engine.pool
+    return [((), pool.size())] if hasattr(pool, 'size') else []
+
+metrics.gauge('db_pool_connections', 'Database pool connections by state', callback=_pool_connections)
+metrics.gauge('db_pool_size', 'Configured database pool size', callback=_pool_size)
+
 @health_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -20,9 +38,14 @@ def health_check():
             'database': 'connected'
         }), 200
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
+        logger.error("Health check failed: %s", e)
         return jsonify({
             'status': 'unhealthy',
             'service': 'Courier Delivery API',
             'error': str(e)
         }), 500
+
+@health_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus metrics endpoint"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -1,6 +1,9 @@
-from flask import Blueprint, request, jsonify
-from utils.decorators import require_auth, validate_json, require_role
-from utils.errors import ValidationError, NotFoundError
+from flask import Blueprint, request, jsonify, current_app
+from utils.decorators import require_auth, validate_json, require_role, rate_limit
+from utils.errors import ValidationError, NotFoundError, ConflictError
+from utils.idempotency import idempotent
+from utils.validators import validate_coordinates, validate_amount
+from utils.surge import surge
 from services.order_service import OrderService
 from models.user import UserRole
 import logging
@@ -10,6 +13,8 @@ logger = logging.getLogger(__name__)
 
 @orders_bp.route('', methods=['POST'])
 @require_auth
+@idempotent()
+@rate_limit('order_create')
 @validate_json('pickup_address', 'delivery_address', 'package_details', 'pricing')
 def create_order():
     """Create new order"""
@@ -22,7 +27,9 @@ def create_order():
             delivery_address=data['delivery_address'],
             package_details=data['package_details'],
             pricing=data['pricing'],
-            payment_method=data.get('payment_method', 'card')
+            payment_method=data.get('payment_method', 'card'),
+            promo_code=data.get('promo_code'),
+            customer_role=request.user.role
         )
         
         return jsonify({
@@ -31,7 +38,109 @@ def create_order():
             'order': order.to_dict()
         }), 201
     except (ValidationError, Exception) as e:
-        logger.error(f"Create order error: {e}")
+        logger.error("Create order error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@orders_bp.route('/quote', methods=['GET'])
+@rate_limit('quote')
+def quote_surge():
+    """Current surge multiplier for a pickup point; served from memory"""
+    try:
+        latitude, longitude = validate_coordinates(request.args.get('latitude'), request.args.get('longitude'))
+        fare = validate_amount(request.args.get('fare', 0))
+        
+        quote = surge.quote(latitude, longitude)
+        quote['surcharge'] = round(fare * (quote['multiplier'] - 1.0), 2)
+        
+        return jsonify({
+            'success': True,
+            'quote': quote
+        }), 200
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@orders_bp.route('/bulk', methods=['POST'])
+@require_auth
+@idempotent()
+@rate_limit('order_bulk')
+def create_orders_bulk():
+    """Create many orders from a JSON array or NDJSON body"""
+    try:
+        records = OrderService.parse_bulk_payload(request.get_data())
+        
+        max_rows = current_app.config['BULK_ORDER_MAX_ROWS']
+        if len(records) > max_rows:
+            raise ValidationError(f'At most {max_rows} orders per request')
+        if not records:
+            raise ValidationError('No orders in request body')
+        
+        created, errors = OrderService.create_orders_bulk(
+            records,
+            customer_id=request.user.id,
+            chunk_size=current_app.config['BULK_ORDER_CHUNK_SIZE']
+        )
+        
+        return jsonify({
+            'success': not errors,
+            'message': f'{len(created)} of {len(records)} orders created',
+            'orders': created,
+            'errors': errors
+        }), 201 if created else 400
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("Bulk create orders error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@orders_bp.route('/status/bulk', methods=['POST'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('order_bulk')
+@validate_json('order_ids', 'status')
+def update_order_status_bulk():
+    """Move many orders to one status, e.g. to cancel or fail them after an incident"""
+    try:
+        data = request.data
+        order_ids = data['order_ids']
+        if not isinstance(order_ids, list) or not all(isinstance(order_id, str) for order_id in order_ids):
+            raise ValidationError('order_ids must be a list of order ids')
+        max_rows = current_app.config['BULK_ORDER_MAX_ROWS']
+        if len(order_ids) > max_rows:
+            raise ValidationError(f'At most {max_rows} orders per request')
+        
+        changed, errors = OrderService.transition_orders_bulk(
+            order_ids,
+            data['status'],
+            request.user.id,
+            data.get('reason'),
+            chunk_size=current_app.config['BULK_ORDER_CHUNK_SIZE']
+        )
+        
+        return jsonify({
+            'success': not errors,
+            'message': f'{len(changed)} of {len(order_ids)} orders changed',
+            'changed': changed,
+            'errors': errors
+        }), 200
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("Bulk update order status error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -54,7 +163,7 @@ def get_order(order_id):
             'error': str(e)
         }), 404
     except Exception as e:
-        logger.error(f"Get order error: {e}")
+        logger.error("Get order error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -80,7 +189,7 @@ def get_my_orders():
             }
         }), 200
     except Exception as e:
-        logger.error(f"Get my orders error: {e}")
+        logger.error("Get my orders error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -94,7 +203,7 @@ def cancel_order(order_id):
     try:
         data = request.data
         
-        order = OrderService.cancel_order(order_id, data['reason'])
+        order = OrderService.cancel_order(order_id, data['reason'], request.user.id)
         
         return jsonify({
             'success': True,
@@ -107,7 +216,7 @@ def cancel_order(order_id):
             'error': str(e)
         }), 400
     except Exception as e:
-        logger.error(f"Cancel order error: {e}")
+        logger.error("Cancel order error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -126,7 +235,8 @@ def update_order_status(order_id):
             order_id,
             data['status'],
             request.user.id,
-            data.get('reason')
+            data.get('reason'),
+            expected_version=data.get('version')
         )
         
         return jsonify({
@@ -134,13 +244,18 @@ def update_order_status(order_id):
             'message': 'Order status updated',
             'order': order.to_dict()
         }), 200
+    except ConflictError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
     except (ValidationError, NotFoundError) as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 400
     except Exception as e:
-        logger.error(f"Update order status error: {e}")
+        logger.error("Update order status error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
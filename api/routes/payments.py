@@ -1,15 +1,21 @@
-from flask import Blueprint, request, jsonify
-from utils.decorators import require_auth, validate_json, require_role
+from flask import Blueprint, request, jsonify, current_app
+from utils.decorators import require_auth, validate_json, require_role, rate_limit
 from utils.errors import ValidationError, NotFoundError
+from utils.idempotency import idempotent
 from services.payment_service import PaymentService
+from services.refund_service import RefundService
 from models.user import UserRole
+from models.payment import PaymentStatus
+from utils.payment_gateway import verify_webhook
 import logging
+import io
 
 payments_bp = Blueprint('payments', __name__)
 logger = logging.getLogger(__name__)
 
 @payments_bp.route('/orders/<order_id>', methods=['POST'])
 @require_auth
+@idempotent()
 @validate_json('amount', 'payment_method')
 def create_payment(order_id):
     """Create payment"""
@@ -23,18 +29,41 @@ def create_payment(order_id):
             data['payment_method']
         )
         
+        # Card charges finish in the background; poll the payment or wait for its webhook
+        processing = payment.status == PaymentStatus.PROCESSING.value
         return jsonify({
             'success': True,
-            'message': 'Payment created',
+            'message': 'Payment is being processed' if processing else 'Payment created',
             'payment': payment.to_dict()
-        }), 201
+        }), 202 if processing else 201
     except (ValidationError, NotFoundError) as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 400
     except Exception as e:
-        logger.error(f"Create payment error: {e}")
+        logger.error("Create payment error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@payments_bp.route('/webhook', methods=['POST'])
+def gateway_webhook():
+    """Final charge status reported by the payment gateway"""
+    body = request.get_data()
+    if not verify_webhook(current_app.config['PAYMENT_WEBHOOK_SECRET'], body, request.headers.get('X-Gateway-Signature')):
+        return jsonify({
+            'success': False,
+            'error': 'Invalid webhook signature'
+        }), 401
+    try:
+        PaymentService.handle_webhook(request.get_json(force=True) or {})
+        
+        return jsonify({
+            'success': True
+        }), 202
+    except ValidationError as e:
         return jsonify({
             'success': False,
             'error': str(e)
@@ -65,7 +94,7 @@ def process_payment(payment_id):
             'error': str(e)
         }), 400
     except Exception as e:
-        logger.error(f"Process payment error: {e}")
+        logger.error("Process payment error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -73,6 +102,7 @@ def process_payment(payment_id):
 
 @payments_bp.route('/<payment_id>/refund', methods=['POST'])
 @require_auth
+@require_role(UserRole.ADMIN.value)
 @validate_json('reason')
 def refund_payment(payment_id):
     """Refund payment"""
@@ -92,7 +122,7 @@ def refund_payment(payment_id):
             'error': str(e)
         }), 400
     except Exception as e:
-        logger.error(f"Refund payment error: {e}")
+        logger.error("Refund payment error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -116,7 +146,7 @@ def get_wallet_balance(user_id):
             }
         }), 200
     except Exception as e:
-        logger.error(f"Get wallet balance error: {e}")
+        logger.error("Get wallet balance error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -145,7 +175,145 @@ def add_wallet_balance(user_id):
             }
         }), 200
     except (ValidationError, Exception) as e:
-        logger.error(f"Add wallet balance error: {e}")
+        logger.error("Add wallet balance error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@payments_bp.route('/wallet/bulk', methods=['POST'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@idempotent()
+@rate_limit('order_bulk')
+@validate_json('entries')
+def post_wallet_entries():
+    """Apply many wallet credits and debits in set-based batches"""
+    try:
+        entries = request.data['entries']
+        if not isinstance(entries, list) or not entries:
+            raise ValidationError("'entries' must be a non-empty list")
+        
+        max_entries = current_app.config['LEDGER_BULK_MAX_ENTRIES']
+        if len(entries) > max_entries:
+            raise ValidationError(f'At most {max_entries} entries per request')
+        
+        posted, errors = PaymentService.post_wallet_entries(
+            entries,
+            chunk_size=current_app.config['LEDGER_BULK_CHUNK_SIZE']
+        )
+        
+        return jsonify({
+            'success': not errors,
+            'message': f'{len(posted)} of {len(entries)} entries posted',
+            'transactions': [{
+                'index': index,
+                'id': values['id'],
+                'wallet_id': values['wallet_id'],
+                'balance_after': values['balance_after']
+            } for index, values in posted],
+            'errors': errors
+        }), 201 if posted else 400
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("Bulk wallet entries error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@payments_bp.route('/refunds', methods=['POST'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@idempotent()
+@rate_limit('order_bulk')
+@validate_json('reason', 'criteria')
+def create_refund_job():
+    """Refund every completed payment matching the criteria in a background job"""
+    try:
+        data = request.data
+        if not isinstance(data['criteria'], dict):
+            raise ValidationError("'criteria' must be an object")
+        
+        job = RefundService.create_job(data['criteria'], data['reason'], request.user.id)
+        RefundService.start_job(job.id)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Refund job started',
+            'job': job.to_dict()
+        }), 202
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("Create refund job error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@payments_bp.route('/refunds/<job_id>', methods=['GET'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
+def get_refund_job(job_id):
+    """Progress of a bulk refund job"""
+    try:
+        job = RefundService.get_job(job_id)
+        
+        return jsonify({
+            'success': True,
+            'job': job.to_dict()
+        }), 200
+    except NotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except Exception as e:
+        logger.error("Get refund job error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@payments_bp.route('/reconcile', methods=['POST'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('order_bulk')
+def reconcile_settlement():
+    """Compare a gateway settlement CSV, uploaded as 'file' or sent as the body, with our payments"""
+    try:
+        start, end = RefundService.parse_period(request.args)
+        upload = request.files.get('file')
+        if upload is not None:
+            lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig')
+        else:
+            lines = request.get_data(as_text=True).splitlines()
+        
+        report = RefundService.reconcile(lines, start, end)
+        
+        limit = current_app.config['RECONCILE_MAX_MISMATCHES']
+        report['truncated'] = len(report['mismatches']) > limit
+        report['mismatches'] = report['mismatches'][:limit]
+        return jsonify({
+            'success': True,
+            'reconciliation': report
+        }), 200
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        logger.error("Reconcile settlement error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -0,0 +1,117 @@
+from flask import Blueprint, request, jsonify
+from utils.decorators import require_auth, validate_json, require_role, rate_limit
+from utils.errors import ValidationError, NotFoundError, ConflictError
+from utils.validators import validate_amount
+from services.promotion_service import PromotionService
+from models.user import UserRole
+import logging
+
+promotions_bp = Blueprint('promotions', __name__)
+logger = logging.getLogger(__name__)
+
+@promotions_bp.route('/validate', methods=['POST'])
+@require_auth
+@rate_limit('promo_validate')
+@validate_json('code')
+def validate_code():
+    """Check a promo code against an order amount; served from the in-memory catalog"""
+    try:
+        data = request.data
+        order_amount = validate_amount(data['order_amount']) if data.get('order_amount') is not None else None
+
+        promo, discount = PromotionService.validate_code(data['code'], request.user, order_amount)
+
+        return jsonify({
+            'success': True,
+            'promo': {
+                'code': promo.code,
+                'discount_type': promo.discount_type,
+                'discount_value': promo.discount_value,
+                'max_discount': promo.max_discount,
+                'min_order_amount': promo.min_order_amount,
+                'valid_till': promo.valid_till.isoformat() if promo.valid_till else None
+            },
+            'discount': discount
+        }), 200
+    except ValidationError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@promotions_bp.route('', methods=['POST'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@validate_json('code', 'discount_value', 'valid_till')
+def create_code():
+    """Create a promo code"""
+    try:
+        promo = PromotionService.create_code(request.data)
+
+        return jsonify({
+            'success': True,
+            'message': 'Promo code created successfully',
+            'promo': promo.to_dict()
+        }), 201
+    except ConflictError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
+    except Exception as e:
+        logger.error("Create promo code error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@promotions_bp.route('', methods=['GET'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+@rate_limit('admin_read')
+def list_codes():
+    """List promo codes"""
+    try:
+        limit = min(request.args.get('limit', 50, type=int), 200)
+        offset = request.args.get('offset', 0, type=int)
+
+        promos, total = PromotionService.list_codes(limit, offset)
+
+        return jsonify({
+            'success': True,
+            'promos': [p.to_dict() for p in promos],
+            'total': total,
+            'limit': limit,
+            'offset': offset
+        }), 200
+    except Exception as e:
+        logger.error("List promo codes error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@promotions_bp.route('/<promo_id>/deactivate', methods=['POST'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+def deactivate_code(promo_id):
+    """Stop accepting a promo code"""
+    try:
+        promo = PromotionService.deactivate_code(promo_id)
+
+        return jsonify({
+            'success': True,
+            'message': 'Promo code deactivated',
+            'promo': promo.to_dict()
+        }), 200
+    except NotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except Exception as e:
+        logger.error("Deactivate promo code error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
@@ -35,7 +35,7 @@ def create_rating():
             'error': str(e)
         }), 400
     except Exception as e:
-        logger.error(f"Create rating error: {e}")
+        logger.error("Create rating error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -60,7 +60,7 @@ def get_user_ratings(user_id):
             }
         }), 200
     except Exception as e:
-        logger.error(f"Get user ratings error: {e}")
+        logger.error("Get user ratings error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
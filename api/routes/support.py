@@ -1,11 +1,11 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from utils.decorators import require_auth, validate_json, require_role
-from utils.errors import ValidationError, NotFoundError
-from models.support import SupportTicket, TicketMessage, TicketStatus, TicketPriority
+from utils.errors import ValidationError, NotFoundError, AuthenticationError
 from models.user import UserRole
-from app import db
+from services.support_service import SupportService
 import logging
-import uuid
+import json
+import time
 
 support_bp = Blueprint('support', __name__)
 logger = logging.getLogger(__name__)
@@ -14,37 +14,80 @@ logger = logging.getLogger(__name__)
 @require_auth
 @validate_json('subject', 'description')
 def create_ticket():
-    """Create support ticket"""
+    """Create support ticket and route it to an agent"""
     try:
-        data = request.data
-        
-        ticket_number = f"TICKET-{uuid.uuid4().hex[:8].upper()}"
+        ticket = SupportService.create_ticket(request.user.id, request.data)
         
-        ticket = SupportTicket(
-            ticket_number=ticket_number,
-            user_id=request.user.id,
-            order_id=data.get('order_id'),
-            subject=data['subject'],
-            description=data['description'],
-            priority=data.get('priority', TicketPriority.MEDIUM.value)
+        return jsonify({
+            'success': True,
+            'message': 'Ticket created successfully',
+            'ticket': ticket.to_dict()
+        }), 201
+    except Exception as e:
+        logger.error("Create ticket error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@support_bp.route('/tickets', methods=['GET'])
+@require_auth
+def list_tickets():
+    """Newest tickets first with keyset pagination; customers see only their own"""
+    try:
+        user_id = None if request.user.role == UserRole.ADMIN.value else request.user.id
+        tickets, next_cursor = SupportService.get_tickets(
+            user_id=user_id,
+            status=request.args.get('status'),
+            limit=max(1, min(request.args.get('limit', 20, type=int), 100)),
+            cursor=request.args.get('cursor')
         )
         
-        db.session.add(ticket)
-        db.session.commit()
+        return jsonify({
+            'success': True,
+            'tickets': [ticket.to_dict() for ticket in tickets],
+            'next_cursor': next_cursor
+        }), 200
+    except Exception as e:
+        logger.error("List tickets error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@support_bp.route('/tickets/claim-next', methods=['POST'])
+@require_auth
+def claim_next_ticket():
+    """Assign the most urgent waiting ticket to the calling agent"""
+    if request.user.role not in current_app.config['SUPPORT_AGENT_ROLES']:
+        raise AuthenticationError('Insufficient permissions')
+    try:
+        ticket = SupportService.claim_next(request.user.id)
         
         return jsonify({
             'success': True,
-            'message': 'Ticket created successfully',
-            'ticket': {
-                'id': ticket.id,
-                'ticket_number': ticket.ticket_number,
-                'subject': ticket.subject,
-                'status': ticket.status,
-                'created_at': ticket.created_at.isoformat()
-            }
-        }), 201
+            'message': 'Ticket claimed' if ticket else 'No tickets waiting',
+            'ticket': ticket.to_dict() if ticket else None
+        }), 200
     except Exception as e:
-        logger.error(f"Create ticket error: {e}")
+        logger.error("Claim ticket error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@support_bp.route('/queue', methods=['GET'])
+@require_auth
+@require_role(UserRole.ADMIN.value)
+def queue_status():
+    """Waiting tickets, the next due and each agent's open tickets"""
+    try:
+        return jsonify({
+            'success': True,
+            'queue': SupportService.queue_stats(request.args.get('count', 10, type=int))
+        }), 200
+    except Exception as e:
+        logger.error("Ticket queue error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -53,31 +96,19 @@ def create_ticket():
 @support_bp.route('/tickets/<ticket_id>', methods=['GET'])
 @require_auth
 def get_ticket(ticket_id):
-    """Get ticket details"""
+    """Get ticket details with the latest page of its messages"""
     try:
-        ticket = SupportTicket.query.get(ticket_id)
-        if not ticket:
-            raise NotFoundError(f'Ticket {ticket_id} not found')
+        ticket = SupportService.get_ticket(ticket_id, request.user)
+        messages = SupportService.get_messages(ticket.id, before=ticket.message_count + 1)
         
         return jsonify({
             'success': True,
-            'ticket': {
-                'id': ticket.id,
-                'ticket_number': ticket.ticket_number,
-                'subject': ticket.subject,
-                'description': ticket.description,
-                'status': ticket.status,
-                'priority': ticket.priority,
-                'messages': [
-                    {
-                        'id': m.id,
-                        'sent_by': m.sent_by,
-                        'message': m.message,
-                        'created_at': m.created_at.isoformat()
-                    } for m in ticket.messages
-                ],
-                'created_at': ticket.created_at.isoformat()
-            }
+            'ticket': dict(
+                ticket.to_dict(),
+                description=ticket.description,
+                messages=[m.to_dict() for m in messages],
+                has_earlier=bool(messages) and messages[0].seq > 1
+            )
         }), 200
     except NotFoundError as e:
         return jsonify({
@@ -85,7 +116,7 @@ def get_ticket(ticket_id):
             'error': str(e)
         }), 404
     except Exception as e:
-        logger.error(f"Get ticket error: {e}")
+        logger.error("Get ticket error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -99,35 +130,126 @@ def add_message(ticket_id):
     try:
         data = request.data
         
-        ticket = SupportTicket.query.get(ticket_id)
-        if not ticket:
-            raise NotFoundError(f'Ticket {ticket_id} not found')
+        ticket = SupportService.get_ticket(ticket_id, request.user)
+        message = SupportService.add_message(ticket, request.user.id, data['message'], data.get('attachment'))
         
-        message = TicketMessage(
-            ticket_id=ticket_id,
-            sent_by=request.user.id,
-            message=data['message']
+        return jsonify({
+            'success': True,
+            'message': 'Message added successfully',
+            'ticket_message': message.to_dict()
+        }), 201
+    except NotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except Exception as e:
+        logger.error("Add message error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@support_bp.route('/tickets/<ticket_id>/messages', methods=['GET'])
+@require_auth
+def list_messages(ticket_id):
+    """Messages after ?since=<seq>, or the page before ?before=<seq>"""
+    try:
+        ticket = SupportService.get_ticket(ticket_id, request.user)
+        limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+        messages = SupportService.get_messages(
+            ticket.id,
+            since=request.args.get('since', 0, type=int),
+            before=request.args.get('before', type=int),
+            limit=limit
         )
         
-        db.session.add(message)
-        db.session.commit()
+        return jsonify({
+            'success': True,
+            'messages': [m.to_dict() for m in messages],
+            'last_seq': ticket.message_count,
+            'status': ticket.status
+        }), 200
+    except NotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except Exception as e:
+        logger.error("List messages error: %s", e)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+@support_bp.route('/tickets/<ticket_id>/messages/poll', methods=['GET'])
+@require_auth
+def poll_messages(ticket_id):
+    """Long-poll for messages after ?since=<seq>; answers at once if there are any"""
+    try:
+        ticket = SupportService.get_ticket(ticket_id, request.user)
+        max_timeout = current_app.config.get('SUPPORT_POLL_TIMEOUT', 25)
+        timeout = max(0.0, min(request.args.get('timeout', max_timeout, type=float), max_timeout))
+        messages, status = SupportService.wait_for_messages(ticket.id, request.args.get('since', 0, type=int), timeout)
         
         return jsonify({
             'success': True,
-            'message': 'Message added successfully'
-        }), 201
+            'messages': messages,
+            'status': status
+        }), 200
     except NotFoundError as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 404
     except Exception as e:
-        logger.error(f"Add message error: {e}")
+        logger.error("Poll messages error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
         }), 400
 
+@support_bp.route('/tickets/<ticket_id>/events', methods=['GET'])
+@require_auth
+def stream_messages(ticket_id):
+    """Server-sent events: each new message as it is posted, and status changes"""
+    try:
+        ticket = SupportService.get_ticket(ticket_id, request.user)
+    except NotFoundError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    
+    config = current_app.config
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', 0, type=int)
+    
+    def events(ticket_id, since, status):
+        # Streams end after SUPPORT_STREAM_SECONDS to free the worker; EventSource
+        # reconnects by itself and resumes from Last-Event-ID
+        yield f'retry: {config.get("SUPPORT_STREAM_RETRY_MS", 2000)}\n\n'
+        deadline = time.monotonic() + config.get('SUPPORT_STREAM_SECONDS', 300)
+        heartbeat = config.get('SUPPORT_STREAM_HEARTBEAT_SECONDS', 15)
+        while time.monotonic() < deadline:
+            messages, current = SupportService.wait_for_messages(
+                ticket_id, since, min(heartbeat, max(0.0, deadline - time.monotonic()))
+            )
+            for message in messages:
+                since = message['seq']
+                yield f'id: {since}\nevent: message\ndata: {json.dumps(message)}\n\n'
+            if current != status:
+                status = current
+                yield f'event: status\ndata: {json.dumps({"status": status})}\n\n'
+            if not messages:
+                yield ': keep-alive\n\n'
+    
+    response = Response(stream_with_context(events(ticket.id, since, ticket.status)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @support_bp.route('/tickets/<ticket_id>/status', methods=['PUT'])
 @require_auth
 @require_role(UserRole.ADMIN.value)
@@ -137,16 +259,12 @@ def update_ticket_status(ticket_id):
     try:
         data = request.data
         
-        ticket = SupportTicket.query.get(ticket_id)
-        if not ticket:
-            raise NotFoundError(f'Ticket {ticket_id} not found')
-        
-        ticket.status = data['status']
-        db.session.commit()
+        ticket = SupportService.update_status(ticket_id, data['status'], data.get('resolution_notes'))
         
         return jsonify({
             'success': True,
-            'message': 'Ticket status updated'
+            'message': 'Ticket status updated',
+            'ticket': ticket.to_dict()
         }), 200
     except NotFoundError as e:
         return jsonify({
@@ -154,7 +272,7 @@ def update_ticket_status(ticket_id):
             'error': str(e)
         }), 404
     except Exception as e:
-        logger.error(f"Update ticket status error: {e}")
+        logger.error("Update ticket status error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify
-from utils.decorators import require_auth, require_role, validate_json
+from utils.decorators import require_auth, require_role, validate_json, rate_limit
 from utils.errors import ValidationError
 from services.user_service import UserService
 from models.user import UserRole
@@ -19,7 +19,7 @@ def get_user(user_id):
             'user': user.to_dict()
         }), 200
     except Exception as e:
-        logger.error(f"Get user error: {e}")
+        logger.error("Get user error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -40,7 +40,7 @@ def update_profile():
             'user': user.to_dict()
         }), 200
     except (ValidationError, Exception) as e:
-        logger.error(f"Update profile error: {e}")
+        logger.error("Update profile error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -48,6 +48,7 @@ def update_profile():
 
 @users_bp.route('/location', methods=['PUT'])
 @require_auth
+@rate_limit('location_ingest')
 @validate_json('latitude', 'longitude')
 def update_location():
     """Update user location"""
@@ -61,7 +62,7 @@ def update_location():
             'user': user.to_dict()
         }), 200
     except (ValidationError, Exception) as e:
-        logger.error(f"Update location error: {e}")
+        logger.error("Update location error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
@@ -78,7 +79,7 @@ def get_courier_stats(courier_id):
             'stats': stats
         }), 200
     except Exception as e:
-        logger.error(f"Get courier stats error: {e}")
+        logger.error("Get courier stats error: %s", e)
         return jsonify({
             'success': False,
             'error': str(e)
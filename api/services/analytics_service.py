@@ -0,0 +1,274 @@
+from app import db
+from models.analytics import OrderRollup
+from models.order import Order, OrderStatus
+from utils.errors import ValidationError
+from utils.replicas import replica_read
+from flask import current_app
+from sqlalchemy import func, or_, update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+import threading
+import random
+import time
+import uuid
+
+try:
+    import numpy as np
+except ImportError:  # optional; without it every query reads the rollup table
+    np = None
+
+ROLLUP_COUNTERS = ('orders_created', 'orders_delivered', 'orders_cancelled', 'revenue', 'delivery_seconds_total')
+GRANULARITIES = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+MAX_BUCKETS = 5000
+
+def bucket_start(ts, granularity):
+    """Start of the bucket containing ts"""
+    ts = ts.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        ts = ts.replace(hour=0)
+    return ts
+
+class RecentRollupCache:
+    """Columnar copy of the most recent buckets, refreshed every ROLLUP_CACHE_TTL seconds
+
+    One 2-D array per granularity (counter x bucket) covering the last
+    ``window`` buckets, so dashboard ranges inside the window are answered
+    by slicing instead of querying.
+    """
+
+    def __init__(self, windows):
+        self.windows = windows
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _load(self, granularity):
+        step = GRANULARITIES[granularity]
+        end = bucket_start(datetime.utcnow(), granularity) + step
+        start = end - step * self.windows[granularity]
+        data = np.zeros((len(ROLLUP_COUNTERS), self.windows[granularity]))
+        for bucket, *values in AnalyticsService._query_buckets(granularity, start, end):
+            data[:, int((bucket - start) / step)] = values
+        return start, end, data, time.monotonic()
+
+    def get(self, granularity, start, end):
+        """Counter x bucket array for [start, end), or None if outside the window"""
+        ttl = current_app.config.get('ROLLUP_CACHE_TTL', 30)
+        if np is None or not ttl or granularity not in self.windows:
+            return None
+        with self._lock:
+            entry = self._entries.get(granularity)
+            if entry is None or time.monotonic() - entry[3] > ttl:
+                entry = self._load(granularity)
+                self._entries[granularity] = entry
+        cache_start, cache_end, data, _ = entry
+        if start < cache_start or end > cache_end:
+            return None
+
+        step = GRANULARITIES[granularity]
+        first, last = int((start - cache_start) / step), int((end - cache_start) / step)
+        return data[:, first:last]
+
+recent_cache = RecentRollupCache({'hour': 72, 'day': 90})
+
+class AnalyticsService:
+    """Order analytics maintained as hourly and daily rollups"""
+
+    @staticmethod
+    def transition_increments(order, from_status, to_status):
+        """Counter increments caused by one order status transition"""
+        if from_status is None:
+            return {'orders_created': 1}
+        if to_status == from_status:
+            return {}
+        if to_status == OrderStatus.DELIVERED.value:
+            delivered_at = order.delivery_time or datetime.utcnow()
+            return {
+                'orders_delivered': 1,
+                'revenue': order.total_amount or 0,
+                'delivery_seconds_total': max(0.0, (delivered_at - order.created_at).total_seconds()),
+            }
+        if to_status == OrderStatus.CANCELLED.value:
+            return {'orders_cancelled': 1}
+        return {}
+
+    @staticmethod
+    def record_transition(order, from_status, to_status, at=None):
+        """Add a transition to the rollups inside the caller's transaction"""
+        increments = AnalyticsService.transition_increments(order, from_status, to_status)
+        if increments:
+            AnalyticsService.apply_increments([(at or datetime.utcnow(), increments)])
+
+    @staticmethod
+    def apply_increments(events, shard=None):
+        """Upsert (timestamp, {counter: amount}) events into hour and day buckets"""
+        if shard is None:
+            shard = random.randrange(current_app.config.get('ROLLUP_SHARDS', 8))
+        buckets = AnalyticsService._bucket_totals(events)
+        if buckets:
+            AnalyticsService._upsert(AnalyticsService._bucket_rows(buckets, shard))
+
+    @staticmethod
+    def _bucket_totals(events):
+        """{(granularity, bucket_start): {counter: total}} for an iterable of events"""
+        buckets = {}
+        for at, increments in events:
+            for granularity in GRANULARITIES:
+                totals = buckets.setdefault((granularity, bucket_start(at, granularity)), dict.fromkeys(ROLLUP_COUNTERS, 0))
+                for counter, amount in increments.items():
+                    totals[counter] += amount
+        return buckets
+
+    @staticmethod
+    def _bucket_rows(buckets, shard):
+        now = datetime.utcnow()
+        # Sorted so concurrent transactions lock rows in the same order
+        return [
+            dict(id=str(uuid.uuid4()), granularity=granularity, bucket_start=start, shard=shard,
+                 created_at=now, updated_at=now, **totals)
+            for (granularity, start), totals in sorted(buckets.items())
+        ]
+
+    @staticmethod
+    def _upsert(rows):
+        table = OrderRollup.__table__
+        dialect = db.session.get_bind(mapper=OrderRollup.__mapper__).dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            AnalyticsService._increment_or_insert(rows)
+            return
+
+        stmt = insert(table).values(rows)
+        increments = {counter: table.c[counter] + stmt.excluded[counter] for counter in ROLLUP_COUNTERS}
+        increments['updated_at'] = stmt.excluded.updated_at
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['granularity', 'bucket_start', 'shard'],
+            set_=increments
+        ))
+
+    @staticmethod
+    def _increment_or_insert(rows, attempts=3):
+        """Portable upsert for dialects without ON CONFLICT: increment each bucket row, inserting it when missing"""
+        table = OrderRollup.__table__
+        for row in rows:
+            bucket = (table.c.granularity == row['granularity'], table.c.bucket_start == row['bucket_start'],
+                      table.c.shard == row['shard'])
+            increments = {counter: table.c[counter] + row[counter] for counter in ROLLUP_COUNTERS}
+            increments['updated_at'] = row['updated_at']
+            for attempt in range(attempts):
+                if db.session.execute(update(table).where(*bucket).values(increments)).rowcount:
+                    break
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(table.insert().values(row))
+                    break
+                except IntegrityError:
+                    # Another transaction created the bucket row first; increment it instead
+                    if attempt == attempts - 1:
+                        raise
+
+    @staticmethod
+    def _query_buckets(granularity, start, end):
+        """(bucket_start, *counters) rows summed over shards"""
+        return db.session.query(
+            OrderRollup.bucket_start,
+            *[func.sum(getattr(OrderRollup, counter)) for counter in ROLLUP_COUNTERS]
+        ).filter(
+            OrderRollup.granularity == granularity,
+            OrderRollup.bucket_start >= start,
+            OrderRollup.bucket_start < end
+        ).group_by(OrderRollup.bucket_start).all()
+
+    @staticmethod
+    def parse_range(args):
+        """Read granularity and the from/to range from query args; defaults to the last day"""
+        granularity = args.get('granularity', 'hour').lower()
+        if granularity not in GRANULARITIES:
+            raise ValidationError(f'Invalid granularity. Must be one of: {", ".join(GRANULARITIES)}')
+        try:
+            end = datetime.fromisoformat(args['to']) if args.get('to') else datetime.utcnow()
+            start = datetime.fromisoformat(args['from']) if args.get('from') else end - timedelta(days=1)
+        except ValueError:
+            raise ValidationError("Invalid date. Use ISO 8601, e.g. 2024-01-31 or 2024-01-31T12:00:00")
+        return granularity, start, end
+
+    @staticmethod
+    @replica_read
+    def get_timeseries(granularity, start, end):
+        """Per-bucket counters for [start, end), empty buckets included"""
+        if granularity not in GRANULARITIES:
+            raise ValidationError(f'Invalid granularity. Must be one of: {", ".join(GRANULARITIES)}')
+        step = GRANULARITIES[granularity]
+        start = bucket_start(start, granularity)
+        if end <= start:
+            raise ValidationError("'from' must be before 'to'")
+        count = int((end - start) / step) + (1 if (end - start) % step else 0)
+        if count > MAX_BUCKETS:
+            raise ValidationError(f'Range too large: at most {MAX_BUCKETS} {granularity} buckets')
+        end = start + step * count
+
+        columns = recent_cache.get(granularity, start, end)
+        source = 'cache'
+        if columns is None:
+            source = 'rollups'
+            columns = [[0] * count for _ in ROLLUP_COUNTERS]
+            for bucket, *values in AnalyticsService._query_buckets(granularity, start, end):
+                index = int((bucket - start) / step)
+                for i, value in enumerate(values):
+                    columns[i][index] = value or 0
+        else:
+            columns = columns.tolist()
+
+        series = dict(zip(ROLLUP_COUNTERS, columns))
+        delivered, seconds = series['orders_delivered'], series.pop('delivery_seconds_total')
+        series['avg_delivery_minutes'] = [
+            round(s / d / 60, 2) if d else None for s, d in zip(seconds, delivered)
+        ]
+        series['revenue'] = [round(v, 2) for v in series['revenue']]
+        for counter in ('orders_created', 'orders_delivered', 'orders_cancelled'):
+            series[counter] = [int(v) for v in series[counter]]
+
+        return {
+            'granularity': granularity,
+            'buckets': [(start + step * i).isoformat() for i in range(count)],
+            'series': series,
+            'source': source,
+        }
+
+    @staticmethod
+    def rebuild_rollups(since=None, batch_size=5000):
+        """Recompute rollups from the orders table, e.g. after enabling them"""
+        query = db.session.query(
+            Order.created_at, Order.status, Order.delivery_time, Order.cancelled_at, Order.total_amount
+        ).execution_options(stream_results=True, yield_per=batch_size)
+        delete = OrderRollup.query
+        if since is not None:
+            since = bucket_start(since, 'day')
+            # Orders created earlier may have been delivered or cancelled since
+            query = query.filter(or_(Order.created_at >= since, Order.delivery_time >= since, Order.cancelled_at >= since))
+            delete = delete.filter(OrderRollup.bucket_start >= since)
+
+        def order_events():
+            for created_at, status, delivery_time, cancelled_at, total_amount in query:
+                yield created_at, {'orders_created': 1}
+                if status == OrderStatus.DELIVERED.value and delivery_time:
+                    yield delivery_time, {
+                        'orders_delivered': 1,
+                        'revenue': total_amount or 0,
+                        'delivery_seconds_total': max(0.0, (delivery_time - created_at).total_seconds()),
+                    }
+                elif status == OrderStatus.CANCELLED.value and cancelled_at:
+                    yield cancelled_at, {'orders_cancelled': 1}
+
+        # Memory grows with the number of buckets, not orders
+        rows = AnalyticsService._bucket_rows(AnalyticsService._bucket_totals(order_events()), shard=0)
+        if since is not None:
+            rows = [row for row in rows if row['bucket_start'] >= since]
+
+        delete.delete(synchronize_session=False)
+        for i in range(0, len(rows), batch_size):
+            AnalyticsService._upsert(rows[i:i + batch_size])
+        db.session.commit()
+        return len(rows)
@@ -0,0 +1,81 @@
+from models.order import Order
+from models.delivery import Delivery, DeliveryLocationHistory
+from utils.errors import NotFoundError
+from utils.validators import validate_coordinates
+from utils.metrics import registry as metrics
+from datetime import datetime
+import uuid
+
+class AsyncOrderService:
+    """Read paths of OrderService over an asyncpg connection"""
+
+    @staticmethod
+    async def get_order(conn, order_id):
+        """Get order by ID"""
+        row = await conn.fetchrow('SELECT * FROM orders WHERE id = $1', order_id)
+        if not row:
+            raise NotFoundError(f'Order {order_id} not found')
+        return Order(**dict(row))
+
+    @staticmethod
+    async def get_customer_orders(conn, customer_id, limit=50, offset=0):
+        """Get customer's orders"""
+        rows = await conn.fetch(
+            'SELECT * FROM orders WHERE customer_id = $1 ORDER BY created_at DESC LIMIT $2 OFFSET $3',
+            customer_id, limit, offset
+        )
+        total = await conn.fetchval('SELECT COUNT(*) FROM orders WHERE customer_id = $1', customer_id)
+        return [Order(**dict(r)) for r in rows], total
+
+class AsyncDeliveryService:
+    """Tracking paths of DeliveryService over an asyncpg connection"""
+
+    @staticmethod
+    async def update_delivery_location(conn, delivery_id, latitude, longitude, accuracy=None, speed=None, heading=None, altitude=None):
+        """Update delivery current location"""
+        # Validate coordinates
+        lat, lon = validate_coordinates(latitude, longitude)
+        now = datetime.utcnow()
+
+        async with conn.transaction():
+            row = await conn.fetchrow(
+                '''
+                UPDATE deliveries
+                SET current_latitude = $2, current_longitude = $3, updated_at = $4
+                WHERE id = $1
+                RETURNING *
+                ''',
+                delivery_id, lat, lon, now
+            )
+            if not row:
+                raise NotFoundError(f'Delivery {delivery_id} not found')
+
+            await conn.execute(
+                '''
+                INSERT INTO delivery_location_history
+                    (id, delivery_id, latitude, longitude, accuracy, speed, heading, altitude, created_at, updated_at)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $9)
+                ''',
+                str(uuid.uuid4()), delivery_id, lat, lon, accuracy, speed, heading, altitude, now
+            )
+
+        metrics.inc('location_updates_total', (('source', 'delivery'),))
+
+        return Delivery(**dict(row))
+
+    @staticmethod
+    async def get_delivery_tracking(conn, delivery_id):
+        """Get delivery tracking information"""
+        row = await conn.fetchrow('SELECT * FROM deliveries WHERE id = $1', delivery_id)
+        if not row:
+            raise NotFoundError(f'Delivery {delivery_id} not found')
+
+        history = await conn.fetch(
+            'SELECT * FROM delivery_location_history WHERE delivery_id = $1 ORDER BY created_at DESC',
+            delivery_id
+        )
+
+        return {
+            'delivery': Delivery(**dict(row)),
+            'location_history': [DeliveryLocationHistory(**dict(h)) for h in history]
+        }
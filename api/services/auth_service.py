@@ -83,26 +83,33 @@ class AuthService:
         return access_token, refresh_token
     
     @staticmethod
-    def verify_token(token):
-        """Verify JWT token"""
+    def decode_access_token(token):
+        """Decode and validate an access token without touching the database"""
         config = get_config()
         secret_key = config.JWT_SECRET_KEY
         
         try:
             payload = jwt.decode(token, secret_key, algorithms=['HS256'])
-            
-            if payload.get('type') != 'access':
-                raise AuthenticationError('Invalid token type')
-            
-            user = User.query.get(payload['user_id'])
-            if not user:
-                raise AuthenticationError('User not found')
-            
-            return user
         except jwt.ExpiredSignatureError:
             raise AuthenticationError('Token has expired')
         except jwt.InvalidTokenError:
             raise AuthenticationError('Invalid token')
+        
+        if payload.get('type') != 'access':
+            raise AuthenticationError('Invalid token type')
+        
+        return payload
+    
+    @staticmethod
+    def verify_token(token):
+        """Verify JWT token"""
+        payload = AuthService.decode_access_token(token)
+        
+        user = User.query.get(payload['user_id'])
+        if not user:
+            raise AuthenticationError('User not found')
+        
+        return user
     
     @staticmethod
     def refresh_access_token(refresh_token):
@@ -1,41 +1,56 @@
 from app import db
 from models.delivery import Delivery, DeliveryStatus, DeliveryLocationHistory
 from models.order import Order, OrderStatus
-from utils.errors import NotFoundError, ValidationError
+from utils.errors import NotFoundError, ValidationError, ConflictError
 from utils.validators import validate_coordinates
+from utils.metrics import registry as metrics
+from utils.replicas import replica_read
+from utils.http_cache import bump_versions
+from utils.state_machine import DELIVERY_STATES, DELIVERY_ORDER_STATUS, DELIVERY_STATUS_TIMESTAMPS
+from services.order_service import OrderService, TRANSITION_ATTEMPTS
+from services.notification_service import NotificationService
+from services.event_service import EventService, DELIVERY_ASSIGNED, DELIVERY_STATUS_CHANGED
+from utils.surge import surge
 from datetime import datetime
-from sqlalchemy import and_
+from sqlalchemy import and_, select, update
 
 class DeliveryService:
     """Delivery management service"""
     
     @staticmethod
-    def assign_delivery(order_id, courier_id):
+    def assign_delivery(order_id, courier_id, assigned_by_id=None):
         """Assign delivery to courier"""
-        order = Order.query.get(order_id)
-        if not order:
-            raise NotFoundError(f'Order {order_id} not found')
-        
         # Check if delivery already exists
         existing_delivery = Delivery.query.filter_by(order_id=order_id).first()
         if existing_delivery:
             raise ValidationError(f'Delivery already assigned for order {order_id}')
         
-        # Create delivery
-        delivery = Delivery(
-            order_id=order_id,
-            courier_id=courier_id,
-            status=DeliveryStatus.ASSIGNED.value,
-            assigned_at=datetime.utcnow()
-        )
-        
-        db.session.add(delivery)
-        db.session.flush()
-        
-        # Update order status
-        order.status = OrderStatus.ASSIGNED.value
-        
-        db.session.commit()
+        try:
+            # Update order status; raises for unknown orders and ones that can no longer be assigned
+            _, transition = OrderService.transition(
+                order_id, OrderStatus.ASSIGNED.value, assigned_by_id or courier_id, 'Courier assigned'
+            )
+            
+            # Create delivery
+            delivery = Delivery(
+                order_id=order_id,
+                courier_id=courier_id,
+                status=DeliveryStatus.ASSIGNED.value,
+                assigned_at=datetime.utcnow()
+            )
+            
+            db.session.add(delivery)
+            db.session.flush()
+            EventService.record('delivery', delivery.id, DELIVERY_ASSIGNED, {'order_id': order_id, 'courier_id': courier_id})
+            
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        OrderService.after_commit([transition] if transition else [])
+        surge.courier_busy(courier_id)
+        surge.maybe_resync()
         
         return delivery
     
@@ -69,36 +84,89 @@ class DeliveryService:
         db.session.add(location_history)
         db.session.commit()
         
+        metrics.inc('location_updates_total', (('source', 'delivery'),))
+        
         return delivery
     
     @staticmethod
-    def update_delivery_status(delivery_id, new_status):
-        """Update delivery status"""
-        delivery = Delivery.query.get(delivery_id)
-        if not delivery:
-            raise NotFoundError(f'Delivery {delivery_id} not found')
-        
-        # Validate status
-        valid_statuses = [s.value for s in DeliveryStatus]
-        if new_status not in valid_statuses:
-            raise ValidationError(f'Invalid status. Must be one of: {", ".join(valid_statuses)}')
-        
-        delivery.status = new_status
-        
-        # Update timestamps based on status
-        if new_status == DeliveryStatus.PICKED_UP.value:
-            delivery.pickup_at = datetime.utcnow()
-        elif new_status == DeliveryStatus.DELIVERED.value:
-            delivery.delivery_at = datetime.utcnow()
-        
-        # Update order status accordingly
-        order = delivery.order
-        if new_status == DeliveryStatus.IN_TRANSIT.value:
-            order.status = OrderStatus.IN_TRANSIT.value
-        elif new_status == DeliveryStatus.DELIVERED.value:
-            order.status = OrderStatus.DELIVERED.value
-        
-        db.session.commit()
+    def update_delivery_status(delivery_id, new_status, expected_version=None):
+        """Move a delivery to ``new_status`` and its order to the status that implies
+        
+        Both rows change with updates guarded on their version in one
+        transaction (see OrderService.transition), so a courier and an admin
+        changing the same order at once cannot overwrite each other.
+        """
+        DELIVERY_STATES.validate(new_status)
+        if expected_version is not None and (not isinstance(expected_version, int) or isinstance(expected_version, bool)):
+            raise ValidationError('version must be an integer')
+        
+        for _ in range(TRANSITION_ATTEMPTS):
+            current = db.session.execute(
+                select(Delivery.status, Delivery.version).where(Delivery.id == delivery_id)
+            ).first()
+            if current is None:
+                raise NotFoundError(f'Delivery {delivery_id} not found')
+            old_delivery_status, version = current
+            if expected_version is not None and version != expected_version:
+                raise ConflictError(f'Delivery {delivery_id} has changed (version {version}); reload it and retry')
+            if not DELIVERY_STATES.check(old_delivery_status, new_status):
+                return db.session.get(Delivery, delivery_id)
+            
+            values = {'status': new_status, 'version': Delivery.version + 1, 'updated_at': datetime.utcnow()}
+            if new_status in DELIVERY_STATUS_TIMESTAMPS:
+                values[DELIVERY_STATUS_TIMESTAMPS[new_status]] = values['updated_at']
+            delivery = db.session.execute(
+                update(Delivery)
+                .where(Delivery.id == delivery_id, Delivery.version == version)
+                .values(values)
+                .returning(Delivery)
+                .execution_options(populate_existing=True)
+            ).scalar()
+            if delivery is not None:
+                break
+        else:
+            raise ConflictError(f'Delivery {delivery_id} is being changed concurrently; retry')
+        
+        try:
+            # Update order status accordingly; the delivery notification below covers it
+            transition = None
+            order_status = DELIVERY_ORDER_STATUS.get(new_status)
+            if order_status:
+                try:
+                    order, transition = OrderService.transition(
+                        delivery.order_id, order_status, delivery.courier_id, f'Delivery {new_status}', notify=False
+                    )
+                except ValidationError:
+                    # A failed delivery of an order that was already closed, e.g. cancelled, leaves it alone
+                    if new_status != DeliveryStatus.FAILED.value:
+                        raise
+                    order = db.session.get(Order, delivery.order_id)
+            else:
+                order = db.session.get(Order, delivery.order_id)
+            
+            NotificationService.order_status_changed(order, delivery_status=new_status)
+            EventService.record('delivery', delivery.id, DELIVERY_STATUS_CHANGED, {
+                'order_id': delivery.order_id,
+                'courier_id': delivery.courier_id,
+                'from': old_delivery_status,
+                'to': new_status,
+            })
+            
+            finished = new_status in (DeliveryStatus.DELIVERED.value, DeliveryStatus.FAILED.value)
+            if finished:
+                courier_id = delivery.courier_id
+                latitude = delivery.current_latitude if delivery.current_latitude is not None else order.delivery_latitude
+                longitude = delivery.current_longitude if delivery.current_longitude is not None else order.delivery_longitude
+            
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        bump_versions({('delivery', delivery_id)})
+        OrderService.after_commit([transition] if transition else [])
+        if finished:
+            surge.courier_seen(courier_id, latitude, longitude, finished_delivery=True)
         
         return delivery
     
@@ -121,6 +189,7 @@ class DeliveryService:
         return deliveries
     
     @staticmethod
+    @replica_read
     def get_delivery_tracking(delivery_id):
         """Get delivery tracking information"""
         delivery = Delivery.query.get(delivery_id)
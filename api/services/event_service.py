@@ -0,0 +1,268 @@
+from app import db
+from models.event import DomainEvent, EventConsumer
+from utils.errors import NotFoundError, ValidationError
+from flask import current_app
+from sqlalchemy import select, update, delete, func, or_, case, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Event types; ``data`` always carries the ids a consumer needs without reading the row
+ORDER_CREATED = 'order.created'  # customer_id, order_number, status, total_amount, payment_method
+ORDER_STATUS_CHANGED = 'order.status_changed'  # customer_id, from, to, changed_by, reason
+DELIVERY_ASSIGNED = 'delivery.assigned'  # order_id, courier_id
+DELIVERY_STATUS_CHANGED = 'delivery.status_changed'  # order_id, courier_id, from, to
+PAYMENT_STATUS_CHANGED = 'payment.status_changed'  # order_id, user_id, from, to, amount, payment_method
+
+_tracking = False
+
+def payment_event(payment, from_status, to_status=None):
+    """payment.status_changed event tuple for record() or record_many() from a Payment or a row with its columns"""
+    return ('payment', payment.id, PAYMENT_STATUS_CHANGED, {
+        'order_id': payment.order_id,
+        'user_id': payment.user_id,
+        'from': from_status,
+        'to': to_status or payment.status,
+        'amount': payment.amount,
+        'payment_method': payment.payment_method,
+    })
+
+class EventService:
+    """Transactional log of order, delivery and payment state changes
+
+    record() and record_many() only add rows to the caller's transaction,
+    so an event exists exactly when the change it describes was committed.
+    Consumers read batches after their stored offset and move it forward
+    with acknowledge(). Delivery is at least once: a consumer that fails
+    before acknowledging sees the batch again, so handlers should be
+    idempotent on the event position.
+    """
+
+    @staticmethod
+    def record(aggregate_type, aggregate_id, event_type, data):
+        """Append one event to the current transaction; the caller commits"""
+        db.session.add(DomainEvent(
+            aggregate_type=aggregate_type,
+            aggregate_id=aggregate_id,
+            event_type=event_type,
+            data=data,
+            created_at=datetime.utcnow()
+        ))
+        db.session.info['events_pending'] = True
+
+    @staticmethod
+    def record_many(events):
+        """Multi-row insert of (aggregate_type, aggregate_id, event_type, data) tuples; the caller commits"""
+        if not events:
+            return
+        now = datetime.utcnow()
+        db.session.execute(DomainEvent.__table__.insert(), [
+            {'aggregate_type': aggregate_type, 'aggregate_id': aggregate_id, 'event_type': event_type,
+             'data': data, 'created_at': now}
+            for aggregate_type, aggregate_id, event_type, data in events
+        ])
+        db.session.info['events_pending'] = True
+
+    @staticmethod
+    def track_events(wake):
+        """Call ``wake`` after every commit that appended events"""
+        global _tracking
+        if _tracking:
+            return
+
+        def after_commit(session):
+            if session.info.pop('events_pending', False):
+                try:
+                    wake()
+                except Exception as e:
+                    # The events are committed; the next poll delivers them
+                    logger.error("Event wake-up failed: %s", e)
+
+        def after_rollback(session):
+            session.info.pop('events_pending', None)
+
+        event.listen(Session, 'after_commit', after_commit)
+        event.listen(Session, 'after_rollback', after_rollback)
+        _tracking = True
+
+    # ========== Reading ==========
+
+    @staticmethod
+    def head():
+        """Position of the newest event, or 0"""
+        return db.session.execute(select(func.max(DomainEvent.position))).scalar() or 0
+
+    @staticmethod
+    def read(after=0, limit=500):
+        """Up to ``limit`` events after position ``after``, oldest first
+
+        Positions are taken when a row is inserted, not when it commits, so
+        a missing position may belong to a transaction still in flight.
+        Reading stops at such a hole while the event after it is younger
+        than EVENT_GAP_GRACE_SECONDS; the hole's writer inserted before
+        that event did, so past the grace period it has rolled back.
+        """
+        grace = current_app.config.get('EVENT_GAP_GRACE_SECONDS', 10)
+        settled = datetime.utcnow() - timedelta(seconds=grace)
+        table = DomainEvent.__table__
+        rows = db.session.execute(
+            select(table).where(table.c.position > after).order_by(table.c.position).limit(limit)
+        ).mappings().all()
+        events = []
+        expected = after + 1
+        for row in rows:
+            if row['position'] != expected and row['created_at'] > settled:
+                break
+            events.append({
+                'position': row['position'],
+                'aggregate_type': row['aggregate_type'],
+                'aggregate_id': row['aggregate_id'],
+                'type': row['event_type'],
+                'data': row['data'],
+                'created_at': row['created_at'].isoformat(),
+            })
+            expected = row['position'] + 1
+        return events
+
+    @staticmethod
+    def history(aggregate_type, aggregate_id):
+        """Every retained event of one order, delivery or payment, oldest first"""
+        events = DomainEvent.query.filter_by(
+            aggregate_type=aggregate_type, aggregate_id=aggregate_id
+        ).order_by(DomainEvent.position).all()
+        return [e.to_dict() for e in events]
+
+    # ========== Consumers ==========
+
+    @staticmethod
+    def register(names, start='earliest'):
+        """Create the consumers that do not exist yet, at the start ('earliest') or end ('latest') of the log"""
+        existing = set(db.session.execute(
+            select(EventConsumer.name).where(EventConsumer.name.in_(names))
+        ).scalars())
+        missing = [name for name in names if name not in existing]
+        if not missing:
+            return
+        position = EventService.head() if start == 'latest' else 0
+        for name in missing:
+            db.session.add(EventConsumer(name=name, position=position))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Registered by another process at the same time
+            db.session.rollback()
+
+    @staticmethod
+    def fetch(name, limit=500):
+        """The next batch for consumer ``name``; returns (position, events)"""
+        position = db.session.execute(
+            select(EventConsumer.position).where(EventConsumer.name == name)
+        ).scalar()
+        if position is None:
+            raise NotFoundError(f'Event consumer {name} not found')
+        return position, EventService.read(position, limit)
+
+    @staticmethod
+    def acknowledge(name, position, owner=None):
+        """Move a consumer's offset forward to ``position``
+
+        With ``owner`` the offset only moves while that process holds the
+        consumer's lease. Returns False when it does not.
+        """
+        if not isinstance(position, int) or isinstance(position, bool) or position < 0:
+            raise ValidationError('position must be a non-negative integer')
+        if position > EventService.head():
+            raise ValidationError(f'position {position} is past the end of the log')
+        table = EventConsumer.__table__
+        conditions = [table.c.name == name]
+        if owner is not None:
+            conditions.append(table.c.owner == owner)
+        updated = db.session.execute(
+            update(table).where(*conditions).values(
+                # Never backwards: a slow duplicate acknowledgement must not replay events
+                position=case((table.c.position < position, position), else_=table.c.position),
+                updated_at=datetime.utcnow()
+            )
+        ).rowcount
+        db.session.commit()
+        if not updated and owner is None:
+            raise NotFoundError(f'Event consumer {name} not found')
+        return bool(updated)
+
+    @staticmethod
+    def seek(name, position):
+        """Set a consumer's offset, backwards to replay or forward to skip; 'earliest' or 'latest' work too"""
+        if position == 'earliest':
+            position = 0
+        elif position == 'latest':
+            position = EventService.head()
+        else:
+            try:
+                position = int(position)
+            except (TypeError, ValueError):
+                raise ValidationError("position must be an integer, 'earliest' or 'latest'")
+        EventService.register([name])
+        EventConsumer.query.filter_by(name=name).update({'position': position, 'updated_at': datetime.utcnow()})
+        db.session.commit()
+        return position
+
+    @staticmethod
+    def lease(names, owner, seconds):
+        """Take or renew the lease on the named consumers that are free or already ``owner``'s
+
+        Returns {name: position} for the consumers now held.
+        """
+        now = datetime.utcnow()
+        table = EventConsumer.__table__
+        rows = db.session.execute(
+            update(table).where(
+                table.c.name.in_(names),
+                or_(table.c.owner == owner, table.c.owner.is_(None), table.c.lease_until < now)
+            ).values(owner=owner, lease_until=now + timedelta(seconds=seconds))
+            .returning(table.c.name, table.c.position)
+        ).all()
+        db.session.commit()
+        return dict(rows)
+
+    @staticmethod
+    def release(owner):
+        """Give up every lease ``owner`` holds"""
+        EventConsumer.query.filter_by(owner=owner).update({'owner': None, 'lease_until': None})
+        db.session.commit()
+
+    # ========== Reporting ==========
+
+    @staticmethod
+    def consumers():
+        """Every consumer with its offset, lag behind the head and lease holder"""
+        head = EventService.head()
+        return {
+            'head': head,
+            'consumers': [
+                {
+                    'name': consumer.name,
+                    'position': consumer.position,
+                    'lag': head - consumer.position,
+                    'owner': consumer.owner,
+                    'lease_until': consumer.lease_until.isoformat() if consumer.lease_until else None,
+                    'updated_at': consumer.updated_at.isoformat(),
+                }
+                for consumer in EventConsumer.query.order_by(EventConsumer.name).all()
+            ],
+        }
+
+    @staticmethod
+    def purge(older_than_days):
+        """Delete events older than the given age that every consumer has processed; returns how many"""
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        table = DomainEvent.__table__
+        conditions = [table.c.created_at < cutoff]
+        slowest = db.session.execute(select(func.min(EventConsumer.position))).scalar()
+        if slowest is not None:
+            conditions.append(table.c.position <= slowest)
+        count = db.session.execute(delete(table).where(*conditions)).rowcount
+        db.session.commit()
+        return count
@@ -0,0 +1,69 @@
+from app import db
+from models.user import User
+from models.order import Order
+from models.payment import Payment
+from utils.errors import NotFoundError, ValidationError
+from sqlalchemy import select
+
+# Columns written for each exportable resource; secrets never leave the database
+EXPORT_COLUMNS = {
+    'orders': (Order, [
+        'id', 'order_number', 'customer_id', 'status', 'payment_method',
+        'pickup_address', 'delivery_address', 'package_description', 'package_weight',
+        'base_fare', 'distance_fare', 'surcharge', 'discount', 'total_amount',
+        'pickup_time', 'delivery_time', 'cancelled_at', 'created_at', 'updated_at',
+    ]),
+    'users': (User, [
+        'id', 'email', 'first_name', 'last_name', 'phone', 'role',
+        'is_active', 'is_verified', 'last_login', 'created_at',
+    ]),
+    'payments': (Payment, [
+        'id', 'order_id', 'user_id', 'amount', 'status', 'payment_method',
+        'transaction_id', 'gateway', 'processed_at', 'refunded_at', 'created_at',
+    ]),
+}
+
+class ExportService:
+    """Full-table exports read through server-side cursors"""
+
+    @staticmethod
+    def stream_rows(resource, filters, batch_size=2000):
+        """Return (columns, row iterator) for an export
+
+        The statement runs with stream_results, so psycopg2 uses a named
+        cursor and only ``batch_size`` rows are held in memory at a time.
+        """
+        if resource not in EXPORT_COLUMNS:
+            raise NotFoundError(f'Unknown export {resource}')
+        model, columns = EXPORT_COLUMNS[resource]
+
+        stmt = select(*[getattr(model, c) for c in columns])
+
+        if filters.get('status'):
+            if model is User:
+                if filters['status'] not in ('active', 'inactive'):
+                    raise ValidationError("User status must be 'active' or 'inactive'")
+                stmt = stmt.where(User.is_active.is_(filters['status'] == 'active'))
+            else:
+                stmt = stmt.where(model.status == filters['status'])
+        if filters.get('role') and model is User:
+            stmt = stmt.where(User.role == filters['role'])
+        if filters.get('date_from'):
+            stmt = stmt.where(model.created_at >= filters['date_from'])
+        if filters.get('date_to'):
+            stmt = stmt.where(model.created_at < filters['date_to'])
+
+        # Creation order with the id as tie-breaker keeps the export stable
+        stmt = stmt.order_by(model.created_at, model.id).execution_options(
+            stream_results=True, yield_per=batch_size
+        )
+
+        def rows():
+            result = db.session.execute(stmt)
+            try:
+                for partition in result.partitions():
+                    yield from partition
+            finally:
+                result.close()
+
+        return columns, rows()
@@ -0,0 +1,247 @@
+from app import db
+from models.payment import UserWallet, WalletTransaction
+from utils.errors import ValidationError
+from utils.validators import validate_amount
+from sqlalchemy import select, update, insert, bindparam, text
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+import uuid
+
+TRANSACTION_TYPES = ('credit', 'debit')
+
+# Balances are floats; a debit may take a wallet down to within half a cent of zero
+BALANCE_TOLERANCE = 0.005
+
+class LedgerService:
+    """Wallet balance changes as atomic SQL increments
+
+    Balances are never read into Python and written back. A single entry
+    is one guarded UPDATE (debits only match while the balance covers
+    them) plus its WalletTransaction row. Bulk entries lock their wallets
+    once in id order, then apply every wallet's net change with one
+    set-based UPDATE and insert all transaction rows in one statement.
+    """
+
+    @staticmethod
+    def _amount(amount):
+        amount = validate_amount(amount)
+        if amount <= 0:
+            raise ValidationError('Amount must be greater than zero')
+        return amount
+
+    @staticmethod
+    def ensure_wallets(user_ids):
+        """Create missing wallets; safe against concurrent creation"""
+        table = UserWallet.__table__
+        dialect = db.session.get_bind(mapper=UserWallet.__mapper__).dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            dialect_insert = None
+
+        now = datetime.utcnow()
+        rows = [{
+            'id': str(uuid.uuid4()), 'user_id': user_id, 'balance': 0, 'total_added': 0, 'total_spent': 0,
+            'created_at': now, 'updated_at': now,
+        } for user_id in sorted(set(user_ids))]
+        if not rows:
+            return
+        if dialect_insert is None:
+            LedgerService._insert_missing_wallets(rows)
+            return
+        db.session.execute(dialect_insert(table).values(rows).on_conflict_do_nothing(index_elements=['user_id']))
+
+    @staticmethod
+    def _insert_missing_wallets(rows):
+        """Portable ensure_wallets for dialects without ON CONFLICT: select, then insert what is missing"""
+        table = UserWallet.__table__
+        existing = set(db.session.execute(
+            select(table.c.user_id).where(table.c.user_id.in_([row['user_id'] for row in rows]))
+        ).scalars())
+        for row in rows:
+            if row['user_id'] in existing:
+                continue
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert().values(row))
+            except IntegrityError:
+                # Created by a concurrent transaction; anything else (e.g. an unknown user) still fails
+                if db.session.execute(select(table.c.id).where(table.c.user_id == row['user_id'])).first() is None:
+                    raise
+
+    @staticmethod
+    def post(user_id, amount, transaction_type, description=None, order_id=None):
+        """Apply one entry and commit; returns (wallet, transaction)"""
+        if transaction_type not in TRANSACTION_TYPES:
+            raise ValidationError(f"Invalid transaction type. Must be one of: {', '.join(TRANSACTION_TYPES)}")
+        amount = LedgerService._amount(amount)
+        table = UserWallet.__table__
+        now = datetime.utcnow()
+
+        try:
+            if transaction_type == 'credit':
+                LedgerService.ensure_wallets([user_id])
+                stmt = update(table).where(table.c.user_id == user_id).values(
+                    balance=table.c.balance + amount,
+                    total_added=table.c.total_added + amount,
+                    updated_at=now
+                )
+            else:
+                stmt = update(table).where(
+                    table.c.user_id == user_id,
+                    table.c.balance >= amount - BALANCE_TOLERANCE
+                ).values(
+                    balance=table.c.balance - amount,
+                    total_spent=table.c.total_spent + amount,
+                    updated_at=now
+                )
+            row = db.session.execute(stmt.returning(table.c.id, table.c.balance)).first()
+            if row is None:
+                raise ValidationError('Insufficient wallet balance')
+
+            balance_after = round(row.balance, 2)
+            transaction = WalletTransaction(
+                wallet_id=row.id,
+                order_id=order_id,
+                amount=amount,
+                transaction_type=transaction_type,
+                description=description,
+                balance_before=round(balance_after + (amount if transaction_type == 'debit' else -amount), 2),
+                balance_after=balance_after
+            )
+            db.session.add(transaction)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        return db.session.get(UserWallet, row.id), transaction
+
+    @staticmethod
+    def post_bulk(entries, chunk_size=1000):
+        """Apply many entries with set-based statements in chunked transactions
+
+        ``entries`` are dicts with user_id, amount, transaction_type and
+        optional description and order_id. Entries apply in order, so a
+        debit may spend a credit earlier in the same batch. Invalid entries
+        and debits the wallet cannot cover are reported by index and never
+        abort the rest. Returns (posted, errors); ``posted`` holds
+        (index, transaction values) pairs.
+        """
+        valid, errors = [], []
+        for index, entry in enumerate(entries):
+            try:
+                if not isinstance(entry, dict):
+                    raise ValidationError('Entry must be a JSON object')
+                if not entry.get('user_id'):
+                    raise ValidationError('user_id is required')
+                if entry.get('transaction_type') not in TRANSACTION_TYPES:
+                    raise ValidationError(f"Invalid transaction type. Must be one of: {', '.join(TRANSACTION_TYPES)}")
+                valid.append((index, entry['user_id'], LedgerService._amount(entry.get('amount')),
+                              entry['transaction_type'], entry.get('description'), entry.get('order_id')))
+            except ValidationError as e:
+                errors.append({'index': index, 'error': e.message})
+
+        posted = []
+        for start in range(0, len(valid), chunk_size):
+            try:
+                chunk_posted, chunk_errors = LedgerService.apply_chunk(valid[start:start + chunk_size])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            posted.extend(chunk_posted)
+            errors.extend(chunk_errors)
+
+        errors.sort(key=lambda error: error['index'])
+        return posted, errors
+
+    @staticmethod
+    def apply_chunk(chunk):
+        """Apply (index, user_id, amount, transaction_type, description, order_id)
+        entries in the current transaction without committing
+
+        For callers that write their own rows in the same transaction;
+        returns (posted, errors) like post_bulk().
+        """
+        table = UserWallet.__table__
+        now = datetime.utcnow()
+
+        LedgerService.ensure_wallets({user_id for _, user_id, _, kind, _, _ in chunk if kind == 'credit'})
+
+        # Lock every wallet in the chunk in a fixed order so concurrent batches cannot deadlock
+        wallets = {}
+        for wallet_id, user_id, balance in db.session.execute(
+                select(table.c.id, table.c.user_id, table.c.balance)
+                .where(table.c.user_id.in_({user_id for _, user_id, _, _, _, _ in chunk}))
+                .order_by(table.c.id)
+                .with_for_update()):
+            wallets[user_id] = [wallet_id, balance or 0.0, 0.0, 0.0]  # id, running balance, added, spent
+
+        posted, errors, transactions = [], [], []
+        for index, user_id, amount, kind, description, order_id in chunk:
+            wallet = wallets.get(user_id)
+            if wallet is None or (kind == 'debit' and wallet[1] < amount - BALANCE_TOLERANCE):
+                errors.append({'index': index, 'error': 'Insufficient wallet balance'})
+                continue
+            before = wallet[1]
+            if kind == 'credit':
+                wallet[1] += amount
+                wallet[2] += amount
+            else:
+                wallet[1] -= amount
+                wallet[3] += amount
+            values = {
+                'id': str(uuid.uuid4()),
+                'wallet_id': wallet[0],
+                'order_id': order_id,
+                'amount': amount,
+                'transaction_type': kind,
+                'description': description,
+                'balance_before': round(before, 2),
+                'balance_after': round(wallet[1], 2),
+                'created_at': now,
+                'updated_at': now,
+            }
+            transactions.append(values)
+            posted.append((index, values))
+
+        changed = [w for w in wallets.values() if w[2] or w[3]]
+        if changed:
+            LedgerService._apply_deltas(changed, now)
+            db.session.execute(insert(WalletTransaction.__table__), transactions)
+        return posted, errors
+
+    @staticmethod
+    def _apply_deltas(wallets, now):
+        """Add each wallet's net change in one statement"""
+        table = UserWallet.__table__
+        if db.session.get_bind(mapper=UserWallet.__mapper__).dialect.name == 'postgresql':
+            db.session.execute(text('''
+                UPDATE user_wallets AS w
+                SET balance = w.balance + v.added - v.spent,
+                    total_added = w.total_added + v.added,
+                    total_spent = w.total_spent + v.spent,
+                    updated_at = :now
+                FROM unnest(CAST(:ids AS varchar[]), CAST(:added AS float8[]), CAST(:spent AS float8[]))
+                    AS v(id, added, spent)
+                WHERE w.id = v.id
+            '''), {
+                'ids': [w[0] for w in wallets],
+                'added': [w[2] for w in wallets],
+                'spent': [w[3] for w in wallets],
+                'now': now,
+            })
+            return
+
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('wallet_id')).values(
+                balance=table.c.balance + bindparam('added') - bindparam('spent'),
+                total_added=table.c.total_added + bindparam('added'),
+                total_spent=table.c.total_spent + bindparam('spent'),
+                updated_at=now
+            ),
+            [{'wallet_id': w[0], 'added': w[2], 'spent': w[3]} for w in wallets]
+        )
@@ -0,0 +1,221 @@
+from app import db
+from models.notification import NotificationOutbox, NotificationStatus
+from models.user import User
+from flask import current_app
+from sqlalchemy import select, update, delete, func, event
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Customer-facing wording of order and delivery statuses
+STATUS_TEXT = {
+    'pending': 'has been received',
+    'confirmed': 'is confirmed',
+    'assigned': 'has a courier on the way to pick it up',
+    'picked_up': 'has been picked up',
+    'in_transit': 'is on its way',
+    'reached_destination': 'has arrived at the delivery address',
+    'delivered': 'has been delivered',
+    'cancelled': 'was cancelled',
+    'failed': 'could not be delivered',
+}
+
+_tracking = False
+
+class NotificationService:
+    """Transactional outbox for customer notifications
+
+    enqueue() only adds rows to the caller's session, so a notification
+    exists exactly when the change it reports was committed. The
+    dispatcher (utils.notification_dispatcher) claims, sends and completes
+    them in the background.
+    """
+
+    @staticmethod
+    def enqueue(recipient_id, topic, event_name, payload):
+        """Add one outbox row per configured channel; the caller commits"""
+        now = datetime.utcnow()
+        for channel in current_app.config.get('NOTIFICATION_CHANNELS') or {}:
+            db.session.add(NotificationOutbox(
+                recipient_id=recipient_id,
+                channel=channel,
+                topic=topic,
+                event=event_name,
+                payload=payload,
+                available_at=now,
+                created_at=now
+            ))
+        db.session.info['notifications_pending'] = True
+
+    @staticmethod
+    def order_status_changed(order, delivery_status=None):
+        """Tell the customer about an order or delivery status change"""
+        payload = {'order_id': order.id, 'order_number': order.order_number, 'status': delivery_status or order.status}
+        NotificationService.enqueue(order.customer_id, f'order:{order.id}', 'order_status', payload)
+
+    @staticmethod
+    def track_outbox(wake):
+        """Call ``wake`` after every commit that added outbox rows"""
+        global _tracking
+        if _tracking:
+            return
+
+        def after_commit(session):
+            if session.info.pop('notifications_pending', False):
+                try:
+                    wake()
+                except Exception as e:
+                    # The rows are committed; the next poll sends them
+                    logger.error("Notification wake-up failed: %s", e)
+
+        def after_rollback(session):
+            session.info.pop('notifications_pending', None)
+
+        event.listen(Session, 'after_commit', after_commit)
+        event.listen(Session, 'after_rollback', after_rollback)
+        _tracking = True
+
+    # ========== Dispatch ==========
+
+    @staticmethod
+    def claim(limit):
+        """Lease up to ``limit`` due rows to this dispatcher; returns them as dicts with their recipient"""
+        config = current_app.config
+        now = datetime.utcnow()
+        table = NotificationOutbox.__table__
+        due = (
+            select(table.c.id)
+            .where(
+                table.c.status.in_((NotificationStatus.PENDING.value, NotificationStatus.SENDING.value)),
+                table.c.available_at <= now
+            )
+            .order_by(table.c.available_at)
+            .limit(limit)
+            # Concurrent dispatchers each take different rows instead of waiting on each other's
+            .with_for_update(skip_locked=True)
+        )
+        rows = db.session.execute(
+            update(table)
+            .where(table.c.id.in_(due.scalar_subquery()))
+            .values(
+                status=NotificationStatus.SENDING.value,
+                available_at=now + timedelta(seconds=config.get('NOTIFICATION_LEASE_SECONDS', 60))
+            )
+            .returning(table.c.id, table.c.recipient_id, table.c.channel, table.c.topic, table.c.event,
+                       table.c.payload, table.c.attempts, table.c.created_at)
+        ).mappings().all()
+        db.session.commit()
+        if not rows:
+            return []
+
+        users = db.session.execute(
+            select(User.id, User.email, User.phone, User.first_name)
+            .where(User.id.in_({row['recipient_id'] for row in rows}))
+        ).mappings().all()
+        recipients = {user['id']: dict(user) for user in users}
+        db.session.commit()
+        return [
+            dict(row, recipient=recipients.get(row['recipient_id']) or {'id': row['recipient_id']})
+            for row in rows
+        ]
+
+    @staticmethod
+    def complete(results):
+        """Record the outcome of each sent message on its outbox rows"""
+        now = datetime.utcnow()
+        table = NotificationOutbox.__table__
+        sent = [row_id for result in results if result.status == 'sent' for row_id in result.ids]
+        if sent:
+            db.session.execute(
+                update(table).where(table.c.id.in_(sent))
+                .values(status=NotificationStatus.SENT.value, attempts=table.c.attempts + 1, sent_at=now, error=None)
+            )
+        for result in results:
+            if result.status == 'retry':
+                values = {'status': NotificationStatus.PENDING.value, 'available_at': now + timedelta(seconds=result.retry_in)}
+            elif result.status == 'failed':
+                values = {'status': NotificationStatus.FAILED.value}
+            else:
+                continue
+            db.session.execute(
+                update(table).where(table.c.id.in_(result.ids))
+                .values(attempts=table.c.attempts + 1, error=(result.error or '')[:500], **values)
+            )
+        db.session.commit()
+
+    @staticmethod
+    def render(channel, recipient, updates):
+        """Subject and body of one message covering every (event, payload) update"""
+        name = recipient.get('first_name') or 'there'
+        lines = [
+            f"Your order {payload['order_number']} {STATUS_TEXT.get(payload['status'], 'was updated')}."
+            for _, payload in updates
+        ]
+        if len(lines) == 1:
+            subject = lines[0].replace('Your order', 'Order', 1)
+        else:
+            subject = f'Updates on {len(lines)} orders'
+        if channel == 'sms':
+            return subject, ' '.join(lines)
+        return subject, '\n'.join([f'Hi {name},', '', *lines])
+
+    # ========== Reporting ==========
+
+    @staticmethod
+    def stats(window_minutes=60):
+        """Backlog, lag and throughput of the outbox"""
+        now = datetime.utcnow()
+        since = now - timedelta(minutes=window_minutes)
+        table = NotificationOutbox.__table__
+        counts = dict(db.session.execute(
+            select(table.c.status, func.count()).group_by(table.c.status)
+        ).all())
+        oldest_due = db.session.execute(
+            select(func.min(table.c.created_at)).where(
+                table.c.status.in_((NotificationStatus.PENDING.value, NotificationStatus.SENDING.value))
+            )
+        ).scalar()
+        by_channel = dict(db.session.execute(
+            select(table.c.channel, func.count())
+            .where(table.c.status == NotificationStatus.SENT.value, table.c.sent_at >= since)
+            .group_by(table.c.channel)
+        ).all())
+        # Lag percentiles from a bounded sample of the latest sends; the notification_lag_seconds
+        # histogram on /metrics has the full distribution
+        latest = db.session.execute(
+            select(table.c.created_at, table.c.sent_at)
+            .where(table.c.status == NotificationStatus.SENT.value, table.c.sent_at >= since)
+            .order_by(table.c.sent_at.desc())
+            .limit(1000)
+        ).all()
+        lags = sorted((sent_at - created_at).total_seconds() for created_at, sent_at in latest)
+        sent = sum(by_channel.values())
+        return {
+            'counts': {status.value: counts.get(status.value, 0) for status in NotificationStatus},
+            'backlog_age_seconds': round((now - oldest_due).total_seconds(), 1) if oldest_due else 0.0,
+            'window_minutes': window_minutes,
+            'sent': sent,
+            'sent_per_minute': round(sent / window_minutes, 2),
+            'sent_by_channel': by_channel,
+            'lag_seconds': {
+                'p50': round(lags[len(lags) // 2], 3) if lags else None,
+                'p95': round(lags[int(len(lags) * 0.95)], 3) if lags else None,
+                'max': round(lags[-1], 3) if lags else None,
+            },
+        }
+
+    @staticmethod
+    def purge(older_than_days):
+        """Delete sent and failed rows older than the given age; returns how many"""
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        table = NotificationOutbox.__table__
+        count = db.session.execute(
+            delete(table).where(
+                table.c.status.in_((NotificationStatus.SENT.value, NotificationStatus.FAILED.value)),
+                table.c.created_at < cutoff
+            )
+        ).rowcount
+        db.session.commit()
+        return count
@@ -1,17 +1,37 @@
 from app import db
 from models.order import Order, OrderStatus, OrderStatusHistory, PaymentMethod
 from models.user import User
-from utils.errors import NotFoundError, ValidationError
+from utils.errors import NotFoundError, ValidationError, ConflictError
 from utils.validators import validate_coordinates, validate_amount
+from utils.http_cache import bump_versions
+from utils.demand_grid import demand_grid
+from utils.surge import surge, OPEN_STATUSES
+from utils.replicas import replica_read, primary_only
+from utils.state_machine import ORDER_STATES, ORDER_STATUS_TIMESTAMPS
+from services.analytics_service import AnalyticsService
+from services.promotion_service import PromotionService
+from services.notification_service import NotificationService
+from services.event_service import EventService, ORDER_CREATED, ORDER_STATUS_CHANGED
+from sqlalchemy import select, update, func, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from collections import namedtuple
 from datetime import datetime, timedelta
+import json
 import uuid
 
+# Guarded updates of a status that keeps changing before a transition gives up
+TRANSITION_ATTEMPTS = 3
+
+# A committed status change, for OrderService.after_commit
+OrderTransition = namedtuple('OrderTransition', 'order_id customer_id from_status to_status pickup')
+
 class OrderService:
     """Order management service"""
     
     @staticmethod
-    def create_order(customer_id, pickup_address, delivery_address, package_details, pricing, payment_method='card'):
-        """Create new order"""
+    def create_order(customer_id, pickup_address, delivery_address, package_details, pricing, payment_method='card',
+                     promo_code=None, customer_role=None):
+        """Create new order, redeeming ``promo_code`` in the same transaction"""
         # Validate payment method
         valid_methods = [m.value for m in PaymentMethod]
         if payment_method not in valid_methods:
@@ -19,6 +39,23 @@ class OrderService:
         
         # Validate pricing
         total_amount = validate_amount(pricing.get('total_amount', 0))
+        base_fare = validate_amount(pricing.get('base_fare', 0))
+        distance_fare = validate_amount(pricing.get('distance_fare', 0))
+        
+        # The surcharge is the server's surge price, not the client's
+        client_surcharge = validate_amount(pricing.get('surcharge', 0))
+        _, surcharge = surge.surcharge(
+            float(pickup_address['latitude']), float(pickup_address['longitude']), base_fare + distance_fare
+        )
+        total_amount = round(max(0.0, total_amount - client_surcharge + surcharge), 2)
+        discount = validate_amount(pricing.get('discount', 0))
+        
+        # Claims a use of the code; handed back below unless the order commits
+        redemption = None
+        if promo_code:
+            redemption = PromotionService.reserve(promo_code, customer_id, customer_role, total_amount)
+            discount = round(discount + redemption.discount, 2)
+            total_amount = round(total_amount - redemption.discount, 2)
         
         # Generate order number
         order_number = f"ORD-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
@@ -41,58 +78,472 @@ class OrderService:
             package_weight=float(package_details['weight']),
             package_dimensions=package_details.get('dimensions'),
             special_instructions=package_details.get('special_instructions'),
-            base_fare=validate_amount(pricing.get('base_fare', 0)),
-            distance_fare=validate_amount(pricing.get('distance_fare', 0)),
-            surcharge=validate_amount(pricing.get('surcharge', 0)),
-            discount=validate_amount(pricing.get('discount', 0)),
+            base_fare=base_fare,
+            distance_fare=distance_fare,
+            surcharge=surcharge,
+            discount=discount,
             total_amount=total_amount,
             payment_method=payment_method,
             estimated_delivery_time=datetime.utcnow() + timedelta(hours=3),
         )
         
-        db.session.add(order)
-        db.session.flush()
-        
-        # Log status change
-        OrderService._log_status_change(order.id, None, OrderStatus.PENDING.value, customer_id, 'Order created')
+        try:
+            db.session.add(order)
+            db.session.flush()
+            
+            # Log status change
+            OrderService._log_status_change(order.id, None, OrderStatus.PENDING.value, customer_id, 'Order created')
+            EventService.record('order', order.id, ORDER_CREATED, OrderService._created_event_data(
+                customer_id, order_number, total_amount, payment_method
+            ))
+            AnalyticsService.record_transition(order, None, OrderStatus.PENDING.value)
+            if redemption:
+                PromotionService.record_redemption(redemption, order)
+            
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            if redemption:
+                PromotionService.finish_redemption(redemption, committed=False)
+            raise
+        if redemption:
+            PromotionService.finish_redemption(redemption, committed=True)
         
-        db.session.commit()
+        # From the inputs: the committed order is expired and would reload
+        pickup = (float(pickup_address['latitude']), float(pickup_address['longitude']))
+        demand_grid.record_orders([pickup + (float(delivery_address['latitude']), float(delivery_address['longitude']))])
+        surge.order_opened(*pickup)
+        surge.maybe_resync()
         
         return order
     
     @staticmethod
-    def update_order_status(order_id, new_status, changed_by_id, reason=None):
-        """Update order status"""
-        order = Order.query.get(order_id)
-        if not order:
-            raise NotFoundError(f'Order {order_id} not found')
+    def parse_bulk_payload(raw):
+        """Parse a JSON array or NDJSON body into (index, row, error) records"""
+        text = raw.decode('utf-8') if isinstance(raw, bytes) else raw
+        stripped = text.lstrip()
         
-        # Validate status
-        valid_statuses = [s.value for s in OrderStatus]
-        if new_status not in valid_statuses:
-            raise ValidationError(f'Invalid status. Must be one of: {", ".join(valid_statuses)}')
+        if stripped.startswith('['):
+            try:
+                rows = json.loads(stripped)
+            except ValueError as e:
+                raise ValidationError(f'Invalid JSON array: {e}')
+            return [(index, row, None) for index, row in enumerate(rows)]
         
-        old_status = order.status
-        order.status = new_status
+        # NDJSON: a malformed line is reported for that row only
+        records = []
+        for index, line in enumerate(l for l in text.splitlines() if l.strip()):
+            try:
+                records.append((index, json.loads(line), None))
+            except ValueError as e:
+                records.append((index, None, f'Invalid JSON: {e}'))
+        return records
+    
+    @staticmethod
+    def create_orders_bulk(records, customer_id=None, chunk_size=500):
+        """Create many orders with multi-row inserts in chunked transactions
         
-        # Update timestamps based on status
-        if new_status == OrderStatus.IN_TRANSIT.value:
-            order.pickup_time = datetime.utcnow()
-        elif new_status == OrderStatus.DELIVERED.value:
-            order.delivery_time = datetime.utcnow()
-        elif new_status == OrderStatus.CANCELLED.value:
-            order.cancelled_at = datetime.utcnow()
-            order.cancellation_reason = reason
+        ``records`` are (index, row, error) tuples from parse_bulk_payload.
+        When ``customer_id`` is None each row must carry its own. Invalid
+        rows are reported by index and never abort the rest of the batch.
+        Returns (created, errors).
+        """
+        now = datetime.utcnow()
+        payment_methods = {m.value for m in PaymentMethod}
         
-        db.session.flush()
+        # Resolve per-row customers with one query instead of one per row
+        known_customers = None
+        if customer_id is None:
+            wanted = {row.get('customer_id') for _, row, error in records if error is None and isinstance(row, dict)}
+            wanted.discard(None)
+            known_customers = {uid for (uid,) in db.session.query(User.id).filter(User.id.in_(wanted))} if wanted else set()
         
-        # Log status change
-        OrderService._log_status_change(order.id, old_status, new_status, changed_by_id, reason)
+        # Order numbers share one timestamp/batch prefix and a sequence suffix
+        prefix = f"ORD-{now.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6].upper()}"
+        valid, errors = [], []
         
-        db.session.commit()
+        for index, row, error in records:
+            if error is None:
+                try:
+                    if not isinstance(row, dict):
+                        raise ValidationError('Order must be a JSON object')
+                    owner = customer_id or row.get('customer_id')
+                    if known_customers is not None and owner not in known_customers:
+                        raise ValidationError(f'Customer {owner} not found')
+                    values = OrderService._bulk_order_values(row, owner, payment_methods, now)
+                except ValidationError as e:
+                    error = e.message
+            if error is not None:
+                errors.append({'index': index, 'error': error})
+                continue
+            values['id'] = str(uuid.uuid4())
+            values['order_number'] = f'{prefix}-{len(valid):05d}'
+            valid.append((index, values))
+        
+        created = []
+        for start in range(0, len(valid), chunk_size):
+            chunk = valid[start:start + chunk_size]
+            try:
+                OrderService._insert_orders([values for _, values in chunk], now)
+                OrderService._record_created(chunk)
+                db.session.commit()
+                created.extend(chunk)
+                continue
+            except SQLAlchemyError:
+                db.session.rollback()
+            
+            # The chunk hit a database error; retry row by row so only the bad rows fail
+            inserted = []
+            for index, values in chunk:
+                try:
+                    with db.session.begin_nested():
+                        OrderService._insert_orders([values], now)
+                    inserted.append((index, values))
+                except SQLAlchemyError as e:
+                    errors.append({'index': index, 'error': str(getattr(e, 'orig', None) or e).strip()})
+            # Events only for the rows that stayed, so rolled-back savepoints leave no holes in the log
+            OrderService._record_created(inserted)
+            db.session.commit()
+            created.extend(inserted)
+        
+        # Core inserts bypass the ORM events that invalidate cached ETags
+        bump_versions({('customer_orders', values['customer_id']) for _, values in created})
+        demand_grid.record_orders([
+            (values['pickup_latitude'], values['pickup_longitude'], values['delivery_latitude'], values['delivery_longitude'])
+            for _, values in created
+        ])
+        for _, values in created:
+            surge.order_opened(values['pickup_latitude'], values['pickup_longitude'])
+        
+        errors.sort(key=lambda e: e['index'])
+        return [
+            {'index': index, 'id': values['id'], 'order_number': values['order_number']}
+            for index, values in created
+        ], errors
+    
+    @staticmethod
+    def _bulk_order_values(row, customer_id, payment_methods, now):
+        """Validate one bulk row and map it to orders columns"""
+        if not customer_id:
+            raise ValidationError('Missing required field: customer_id')
+        for field in ('pickup_address', 'delivery_address', 'package_details', 'pricing'):
+            if not isinstance(row.get(field), dict):
+                raise ValidationError(f'Missing required field: {field}')
+        
+        pickup, delivery = row['pickup_address'], row['delivery_address']
+        package, pricing = row['package_details'], row['pricing']
+        for prefix, address in (('pickup_address', pickup), ('delivery_address', delivery)):
+            for field in ('address', 'latitude', 'longitude', 'contact', 'phone'):
+                if address.get(field) in (None, ''):
+                    raise ValidationError(f'Missing required field: {prefix}.{field}')
+        for field in ('description', 'weight'):
+            if package.get(field) in (None, ''):
+                raise ValidationError(f'Missing required field: package_details.{field}')
+        
+        payment_method = row.get('payment_method', PaymentMethod.CARD.value)
+        if payment_method not in payment_methods:
+            raise ValidationError(f'Invalid payment method. Must be one of: {", ".join(sorted(payment_methods))}')
+        # A code's uses are claimed per order in create_order; imports cannot redeem them
+        if row.get('promo_code'):
+            raise ValidationError('Promo codes cannot be used in bulk imports')
+        
+        pickup_lat, pickup_lon = validate_coordinates(pickup['latitude'], pickup['longitude'])
+        delivery_lat, delivery_lon = validate_coordinates(delivery['latitude'], delivery['longitude'])
+        try:
+            weight = float(package['weight'])
+        except (TypeError, ValueError):
+            raise ValidationError('Invalid package weight')
+        
+        # Surge priced as in create_order, per row
+        base_fare = validate_amount(pricing.get('base_fare', 0))
+        distance_fare = validate_amount(pricing.get('distance_fare', 0))
+        client_surcharge = validate_amount(pricing.get('surcharge', 0))
+        _, surcharge = surge.surcharge(pickup_lat, pickup_lon, base_fare + distance_fare)
+        total_amount = round(max(0.0, validate_amount(pricing.get('total_amount', 0)) - client_surcharge + surcharge), 2)
+        
+        return {
+            'customer_id': customer_id,
+            'pickup_address': pickup['address'],
+            'pickup_latitude': pickup_lat,
+            'pickup_longitude': pickup_lon,
+            'pickup_contact': pickup['contact'],
+            'pickup_phone': pickup['phone'],
+            'delivery_address': delivery['address'],
+            'delivery_latitude': delivery_lat,
+            'delivery_longitude': delivery_lon,
+            'delivery_contact': delivery['contact'],
+            'delivery_phone': delivery['phone'],
+            'package_description': package['description'],
+            'package_weight': weight,
+            'package_dimensions': package.get('dimensions'),
+            'special_instructions': package.get('special_instructions'),
+            'base_fare': base_fare,
+            'distance_fare': distance_fare,
+            'surcharge': surcharge,
+            'discount': validate_amount(pricing.get('discount', 0)),
+            'total_amount': total_amount,
+            'status': OrderStatus.PENDING.value,
+            'payment_method': payment_method,
+            'estimated_delivery_time': now + timedelta(hours=3),
+            'created_at': now,
+            'updated_at': now,
+        }
+    
+    @staticmethod
+    def _insert_orders(orders, now):
+        """Multi-row insert of orders and their initial status history"""
+        db.session.execute(Order.__table__.insert(), orders)
+        db.session.execute(OrderStatusHistory.__table__.insert(), [
+            {
+                'id': str(uuid.uuid4()),
+                'order_id': order['id'],
+                'from_status': None,
+                'to_status': OrderStatus.PENDING.value,
+                'changed_by': order['customer_id'],
+                'reason': 'Order imported',
+                'created_at': now,
+                'updated_at': now,
+            }
+            for order in orders
+        ])
+        AnalyticsService.apply_increments([(now, {'orders_created': len(orders)})])
+    
+    @staticmethod
+    def _record_created(rows):
+        """order.created events for (index, values) rows inserted by _insert_orders"""
+        EventService.record_many([
+            ('order', values['id'], ORDER_CREATED, OrderService._created_event_data(
+                values['customer_id'], values['order_number'], values['total_amount'], values['payment_method']
+            ))
+            for _, values in rows
+        ])
+    
+    @staticmethod
+    def _created_event_data(customer_id, order_number, total_amount, payment_method):
+        return {
+            'customer_id': customer_id,
+            'order_number': order_number,
+            'status': OrderStatus.PENDING.value,
+            'total_amount': total_amount,
+            'payment_method': payment_method,
+        }
+    
+    @staticmethod
+    def update_order_status(order_id, new_status, changed_by_id, reason=None, expected_version=None):
+        """Move an order to ``new_status`` if the order state machine allows it
         
+        With ``expected_version`` the change applies only to that version
+        of the order and raises ConflictError otherwise.
+        """
+        order, transition = OrderService.transition(order_id, new_status, changed_by_id, reason, expected_version)
+        db.session.commit()
+        OrderService.after_commit([transition] if transition else [])
         return order
     
+    @staticmethod
+    def transition(order_id, new_status, changed_by_id, reason=None, expected_version=None, notify=True):
+        """Change an order's status in the caller's transaction; returns (order, OrderTransition or None)
+        
+        One UPDATE ... WHERE id = ? AND status IN (statuses that may move to
+        ``new_status``) [AND version = ?] checks and applies the transition
+        and bumps the version, so a concurrent change is never overwritten.
+        Only when it misses is the order read, to report why: not found, a
+        stale ``expected_version``, a transition that is not allowed, or
+        nothing to do because the order already has ``new_status``. The
+        caller commits and then passes the transition to after_commit().
+        """
+        ORDER_STATES.validate(new_status)
+        if expected_version is not None and (not isinstance(expected_version, int) or isinstance(expected_version, bool)):
+            raise ValidationError('version must be an integer')
+        predecessors = ORDER_STATES.predecessors(new_status)
+        
+        for _ in range(TRANSITION_ATTEMPTS):
+            now = datetime.utcnow()
+            changed = OrderService._guarded_transition(order_id, predecessors, new_status, reason, now, expected_version)
+            if changed is not None:
+                order, from_status = changed
+                break
+            
+            current = db.session.execute(
+                select(Order.status, Order.version).where(Order.id == order_id)
+            ).first()
+            if current is None:
+                raise NotFoundError(f'Order {order_id} not found')
+            status, version = current
+            if expected_version is not None and version != expected_version:
+                raise ConflictError(f'Order {order_id} has changed (version {version}); reload it and retry')
+            if not ORDER_STATES.check(status, new_status):
+                return db.session.get(Order, order_id), None
+            # Moved to another allowed status between the update and the read
+        else:
+            raise ConflictError(f'Order {order_id} is being changed concurrently; retry')
+        
+        transitions = OrderService._record_transitions([(order, from_status)], new_status, changed_by_id, reason, now, notify)
+        return order, transitions[0]
+    
+    @staticmethod
+    def _guarded_transition(order_id, predecessors, new_status, reason, now, expected_version=None):
+        """(order, from_status) after moving the order out of one of ``predecessors``, or None if the guard missed"""
+        guard = [Order.id == order_id]
+        if expected_version is not None:
+            guard.append(Order.version == expected_version)
+        values = OrderService._transition_values(Order.__table__.c, new_status, reason, now)
+        
+        if db.session.get_bind(mapper=Order.__mapper__).dialect.name == 'postgresql':
+            # RETURNING sees only the new row, so join the old one for from_status;
+            # matching its version keeps it from going stale under a concurrent change
+            previous = select(Order.id, Order.status, Order.version).where(Order.id == order_id).subquery('previous')
+            row = db.session.execute(
+                update(Order)
+                .where(*guard, Order.status.in_(predecessors),
+                       Order.id == previous.c.id, Order.version == previous.c.version)
+                .values(values)
+                .returning(Order, previous.c.status)
+                .execution_options(populate_existing=True)
+            ).first()
+            return tuple(row) if row is not None else None
+        
+        # Other dialects cannot return columns of a joined table: guard on one
+        # predecessor at a time, most targets have only one
+        for from_status in predecessors:
+            order = db.session.execute(
+                update(Order)
+                .where(*guard, Order.status == from_status)
+                .values(values)
+                .returning(Order)
+                .execution_options(populate_existing=True)
+            ).scalar()
+            if order is not None:
+                return order, from_status
+        return None
+    
+    @staticmethod
+    def transition_orders_bulk(order_ids, new_status, changed_by_id, reason=None, chunk_size=500):
+        """Move many orders to ``new_status`` in chunked transactions, e.g. from batch jobs
+        
+        Each chunk reads status and version of its orders with one query and
+        changes every allowed one with one UPDATE guarded on (id, version);
+        orders changed concurrently in between are re-read and retried.
+        Orders that cannot move are reported by id and never abort the
+        rest, and orders already in ``new_status`` are left alone. Returns
+        (changed ids, errors).
+        """
+        ORDER_STATES.validate(new_status)
+        table = Order.__table__
+        changed, errors = [], []
+        order_ids = list(dict.fromkeys(order_ids))
+        
+        for start in range(0, len(order_ids), chunk_size):
+            pending = order_ids[start:start + chunk_size]
+            done = []
+            for _ in range(TRANSITION_ATTEMPTS):
+                current = {
+                    row.id: (row.status, row.version)
+                    for row in db.session.execute(
+                        select(table.c.id, table.c.status, table.c.version).where(table.c.id.in_(pending))
+                    )
+                }
+                guarded = []
+                for order_id in pending:
+                    if order_id not in current:
+                        errors.append({'order_id': order_id, 'error': f'Order {order_id} not found'})
+                        continue
+                    try:
+                        if ORDER_STATES.check(current[order_id][0], new_status):
+                            guarded.append((order_id, current[order_id][1]))
+                    except ValidationError as e:
+                        errors.append({'order_id': order_id, 'error': e.message})
+                if not guarded:
+                    pending = []
+                    break
+                
+                now = datetime.utcnow()
+                rows = db.session.execute(
+                    update(table)
+                    .where(tuple_(table.c.id, table.c.version).in_(guarded))
+                    .values(OrderService._transition_values(table.c, new_status, reason, now))
+                    .returning(table.c.id, table.c.customer_id, table.c.order_number, table.c.status, table.c.total_amount,
+                               table.c.created_at, table.c.delivery_time, table.c.pickup_latitude, table.c.pickup_longitude)
+                ).all()
+                done.extend((row, current[row.id][0]) for row in rows)
+                updated = {row.id for row in rows}
+                pending = [order_id for order_id, _ in guarded if order_id not in updated]
+                if not pending:
+                    break
+            errors.extend({'order_id': order_id, 'error': 'Order is being changed concurrently; retry'} for order_id in pending)
+            
+            transitions = OrderService._record_transitions(done, new_status, changed_by_id, reason, now) if done else []
+            db.session.commit()
+            OrderService.after_commit(transitions)
+            changed.extend(transition.order_id for transition in transitions)
+        
+        return changed, errors
+    
+    @staticmethod
+    def _transition_values(columns, new_status, reason, now):
+        """SET clause of a transition: status, the next version and the status's timestamp"""
+        values = {'status': new_status, 'version': columns.version + 1, 'updated_at': now}
+        timestamp = ORDER_STATUS_TIMESTAMPS.get(new_status)
+        if timestamp == 'pickup_time':
+            # A delivery may have recorded the actual pickup already
+            values[timestamp] = func.coalesce(columns.pickup_time, now)
+        elif timestamp:
+            values[timestamp] = now
+        if new_status == OrderStatus.CANCELLED.value:
+            values['cancellation_reason'] = reason
+        return values
+    
+    @staticmethod
+    def _record_transitions(changes, new_status, changed_by_id, reason, now, notify=True):
+        """History, rollups, events and notifications for (order, from_status) pairs in the current transaction"""
+        db.session.execute(OrderStatusHistory.__table__.insert(), [
+            {
+                'id': str(uuid.uuid4()),
+                'order_id': order.id,
+                'from_status': from_status,
+                'to_status': new_status,
+                'changed_by': changed_by_id,
+                'reason': reason,
+                'created_at': now,
+                'updated_at': now,
+            }
+            for order, from_status in changes
+        ])
+        increments = [AnalyticsService.transition_increments(order, from_status, new_status) for order, from_status in changes]
+        if any(increments):
+            AnalyticsService.apply_increments([(now, counters) for counters in increments if counters])
+        EventService.record_many([
+            ('order', order.id, ORDER_STATUS_CHANGED, {
+                'customer_id': order.customer_id,
+                'from': from_status,
+                'to': new_status,
+                'changed_by': changed_by_id,
+                'reason': reason,
+            })
+            for order, from_status in changes
+        ])
+        if notify:
+            for order, _ in changes:
+                NotificationService.order_status_changed(order)
+        return [
+            OrderTransition(order.id, order.customer_id, from_status, new_status, (order.pickup_latitude, order.pickup_longitude))
+            for order, from_status in changes
+        ]
+    
+    @staticmethod
+    def after_commit(transitions):
+        """Invalidate cached responses and update surge counts for committed transitions"""
+        if not transitions:
+            return
+        # The guarded UPDATEs bypass the ORM events that invalidate cached ETags
+        bump_versions({
+            key for transition in transitions
+            for key in (('order', transition.order_id), ('customer_orders', transition.customer_id))
+        })
+        for transition in transitions:
+            if transition.from_status in OPEN_STATUSES and transition.to_status not in OPEN_STATUSES:
+                surge.order_closed(*transition.pickup)
+    
     @staticmethod
     def _log_status_change(order_id, from_status, to_status, changed_by_id, reason=None):
         """Log order status change"""
@@ -106,6 +557,7 @@ class OrderService:
         db.session.add(history)
     
     @staticmethod
+    @replica_read
     def get_order(order_id):
         """Get order by ID"""
         order = Order.query.get(order_id)
@@ -114,6 +566,7 @@ class OrderService:
         return order
     
     @staticmethod
+    @replica_read
     def get_customer_orders(customer_id, limit=50, offset=0):
         """Get customer's orders"""
         orders = Order.query.filter_by(customer_id=customer_id).order_by(Order.created_at.desc()).limit(limit).offset(offset).all()
@@ -121,11 +574,7 @@ class OrderService:
         return orders, total
     
     @staticmethod
-    def cancel_order(order_id, cancellation_reason):
+    @primary_only
+    def cancel_order(order_id, cancellation_reason, cancelled_by_id):
         """Cancel order"""
-        order = OrderService.get_order(order_id)
-        
-        if order.status in [OrderStatus.DELIVERED.value, OrderStatus.CANCELLED.value]:
-            raise ValidationError(f'Cannot cancel order with status {order.status}')
-        
-        return OrderService.update_order_status(order_id, OrderStatus.CANCELLED.value, None, cancellation_reason)
+        return OrderService.update_order_status(order_id, OrderStatus.CANCELLED.value, cancelled_by_id, cancellation_reason)
@@ -1,9 +1,14 @@
 from app import db
-from models.payment import Payment, PaymentStatus, UserWallet, WalletTransaction
-from models.order import Order
+from models.payment import Payment, PaymentStatus, UserWallet
+from models.order import Order, PaymentMethod
 from utils.errors import NotFoundError, ValidationError
 from utils.validators import validate_amount
-from datetime import datetime
+from utils.payment_processor import payment_processor
+from services.ledger_service import LedgerService
+from services.refund_service import RefundService
+from services.event_service import EventService, payment_event
+from sqlalchemy import select, update, bindparam
+from datetime import datetime, timedelta
 
 class PaymentService:
     """Payment management service"""
@@ -24,20 +29,100 @@ class PaymentService:
         if existing_payment:
             raise ValidationError(f'Payment already exists for order {order_id}')
         
-        # Create payment
+        # Card payments are charged by the payment workers; the request does not wait for the gateway
+        if payment_method == PaymentMethod.CASH_ON_DELIVERY.value:
+            status = PaymentStatus.PENDING.value
+        elif payment_method == PaymentMethod.WALLET.value:
+            status = PaymentStatus.COMPLETED.value
+        else:
+            status = PaymentStatus.PROCESSING.value
+        
         payment = Payment(
             order_id=order_id,
             user_id=user_id,
             amount=amount,
             payment_method=payment_method,
-            status=PaymentStatus.PENDING.value
+            status=status
         )
         
         db.session.add(payment)
-        db.session.commit()
+        db.session.flush()
+        EventService.record(*payment_event(payment, None))
+        if payment_method == PaymentMethod.WALLET.value:
+            payment.gateway = 'wallet'
+            payment.processed_at = datetime.utcnow()
+            # Commits the debit together with the payment row
+            LedgerService.post(user_id, amount, 'debit', f'Payment for order {order.order_number}', order_id=order_id)
+        else:
+            db.session.commit()
+        
+        if status == PaymentStatus.PROCESSING.value:
+            payment_processor.submit(payment.id, amount, payment_method)
+            # With PAYMENT_WORKERS = 0 the charge has already been written
+            db.session.expire(payment)
         
         return payment
     
+    @staticmethod
+    def apply_gateway_results(results):
+        """Write final charge statuses in one statement; payments no longer processing are left alone"""
+        if not results:
+            return 0
+        table = Payment.__table__
+        now = datetime.utcnow()
+        updated = db.session.execute(
+            update(table).where(
+                table.c.id == bindparam('payment_id'),
+                table.c.status == PaymentStatus.PROCESSING.value
+            ).values(
+                status=bindparam('new_status'),
+                transaction_id=bindparam('new_transaction_id'),
+                gateway=bindparam('new_gateway'),
+                processed_at=now,
+                updated_at=now,
+                metadata=bindparam('new_metadata')
+            ),
+            [{
+                'payment_id': result.payment_id,
+                'new_status': result.status,
+                'new_transaction_id': result.transaction_id,
+                'new_gateway': result.gateway,
+                'new_metadata': {'attempts': result.attempts, 'error': result.error},
+            } for result in results]
+        ).rowcount
+        if updated:
+            # Payments another writer finished first were skipped; the ones written here carry ``now``
+            changed = db.session.execute(
+                select(table.c.id, table.c.order_id, table.c.user_id, table.c.amount, table.c.payment_method, table.c.status)
+                .where(table.c.id.in_([result.payment_id for result in results]), table.c.processed_at == now)
+            ).all()
+            EventService.record_many([payment_event(row, PaymentStatus.PROCESSING.value) for row in changed])
+        db.session.commit()
+        return updated
+    
+    @staticmethod
+    def handle_webhook(data):
+        """Queue the final status a gateway reported for a charge"""
+        status = data.get('status')
+        if status not in (PaymentStatus.COMPLETED.value, PaymentStatus.FAILED.value):
+            raise ValidationError("Webhook status must be 'completed' or 'failed'")
+        if not data.get('payment_id'):
+            raise ValidationError('Missing required field: payment_id')
+        payment_processor.record_result(data['payment_id'], status, data.get('transaction_id'), data.get('error'))
+    
+    @staticmethod
+    def requeue_stale_payments(older_than_seconds):
+        """Resubmit payments left processing, e.g. by a worker that restarted; returns how many"""
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than_seconds)
+        stale = db.session.query(Payment.id, Payment.amount, Payment.payment_method).filter(
+            Payment.status == PaymentStatus.PROCESSING.value,
+            Payment.updated_at < cutoff
+        ).all()
+        db.session.commit()
+        for payment_id, amount, payment_method in stale:
+            payment_processor.submit(payment_id, amount, payment_method)
+        return len(stale)
+    
     @staticmethod
     def process_payment(payment_id, transaction_id, gateway='stripe'):
         """Process payment"""
@@ -45,10 +130,13 @@ class PaymentService:
         if not payment:
             raise NotFoundError(f'Payment {payment_id} not found')
         
+        old_status = payment.status
         payment.status = PaymentStatus.COMPLETED.value
         payment.transaction_id = transaction_id
         payment.gateway = gateway
         payment.processed_at = datetime.utcnow()
+        if old_status != payment.status:
+            EventService.record(*payment_event(payment, old_status))
         
         db.session.commit()
         
@@ -64,10 +152,11 @@ class PaymentService:
         if payment.status != PaymentStatus.COMPLETED.value:
             raise ValidationError(f'Can only refund completed payments. Current status: {payment.status}')
         
-        payment.status = PaymentStatus.REFUNDED.value
-        payment.refunded_at = datetime.utcnow()
-        payment.refund_reason = reason
-        
+        # Same path as bulk refunds: card payments go back through the gateway, others to the wallet
+        _, errors = RefundService.refund_payments([payment], reason)
+        if errors:
+            db.session.rollback()
+            raise ValidationError(f"Refund failed: {errors[0]['error']}")
         db.session.commit()
         
         return payment
@@ -77,59 +166,22 @@ class PaymentService:
         """Get or create user wallet"""
         wallet = UserWallet.query.filter_by(user_id=user_id).first()
         if not wallet:
-            wallet = UserWallet(user_id=user_id, balance=0)
-            db.session.add(wallet)
+            LedgerService.ensure_wallets([user_id])
             db.session.commit()
+            wallet = UserWallet.query.filter_by(user_id=user_id).first()
         return wallet
     
     @staticmethod
     def add_wallet_balance(user_id, amount, description):
         """Add balance to wallet"""
-        amount = validate_amount(amount)
-        
-        wallet = PaymentService.get_or_create_wallet(user_id)
-        
-        transaction = WalletTransaction(
-            wallet_id=wallet.id,
-            amount=amount,
-            transaction_type='credit',
-            description=description,
-            balance_before=wallet.balance,
-            balance_after=wallet.balance + amount
-        )
-        
-        wallet.balance += amount
-        wallet.total_added += amount
-        
-        db.session.add(transaction)
-        db.session.commit()
-        
-        return wallet, transaction
+        return LedgerService.post(user_id, amount, 'credit', description)
     
     @staticmethod
     def deduct_wallet_balance(user_id, amount, order_id, description):
         """Deduct balance from wallet"""
-        amount = validate_amount(amount)
-        
-        wallet = PaymentService.get_or_create_wallet(user_id)
-        
-        if wallet.balance < amount:
-            raise ValidationError('Insufficient wallet balance')
-        
-        transaction = WalletTransaction(
-            wallet_id=wallet.id,
-            order_id=order_id,
-            amount=amount,
-            transaction_type='debit',
-            description=description,
-            balance_before=wallet.balance,
-            balance_after=wallet.balance - amount
-        )
-        
-        wallet.balance -= amount
-        wallet.total_spent += amount
-        
-        db.session.add(transaction)
-        db.session.commit()
-        
-        return wallet, transaction
+        return LedgerService.post(user_id, amount, 'debit', description, order_id=order_id)
+    
+    @staticmethod
+    def post_wallet_entries(entries, chunk_size=1000):
+        """Apply many wallet credits and debits, e.g. courier payouts"""
+        return LedgerService.post_bulk(entries, chunk_size)
@@ -0,0 +1,267 @@
+from app import db
+from models.delivery import Delivery
+from models.order import Order, OrderStatus
+from models.payment import PayoutRun, PayoutLine, PayoutStatus
+from services.ledger_service import LedgerService
+from utils.errors import ValidationError
+from flask import current_app
+from sqlalchemy import select, func, insert
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import groupby
+import multiprocessing
+import logging
+import csv
+import os
+import uuid
+
+try:
+    import numpy as np
+except ImportError:  # optional; the pure-Python path gives the same results, slower
+    np = None
+
+logger = logging.getLogger(__name__)
+
+def shard_bounds(shard, shard_count):
+    """[low, high) courier id range of a shard; ids are UUIDs, so ranges split on the leading hex byte"""
+    low = f'{shard * 256 // shard_count:02x}' if shard else None
+    high = f'{(shard + 1) * 256 // shard_count:02x}' if shard < shard_count - 1 else None
+    return low, high
+
+class EarningsAccumulator:
+    """Per-courier delivery counts and fare totals from rows sorted by courier
+
+    Chunks are reduced a whole array at a time; the last courier of a
+    chunk may continue in the next one, so it is held back until then.
+    """
+
+    def __init__(self):
+        self._carry = None  # [courier_id, deliveries, gross]
+
+    def add_chunk(self, couriers, fares):
+        """Return the (courier_id, deliveries, gross) couriers completed by this chunk"""
+        if not couriers:
+            return []
+        if np is not None:
+            couriers = np.asarray(couriers, dtype=object)
+            fares = np.asarray(fares, dtype=float)
+            starts = np.flatnonzero(np.concatenate(([True], couriers[1:] != couriers[:-1])))
+            totals = zip(couriers[starts].tolist(),
+                         np.diff(np.append(starts, len(couriers))).tolist(),
+                         np.add.reduceat(fares, starts).tolist())
+        else:
+            totals = []
+            for courier_id, group in groupby(zip(couriers, fares), key=lambda row: row[0]):
+                group = [fare for _, fare in group]
+                totals.append((courier_id, len(group), sum(group)))
+
+        done = []
+        for courier_id, deliveries, gross in totals:
+            if self._carry is not None and self._carry[0] == courier_id:
+                self._carry[1] += deliveries
+                self._carry[2] += gross
+                continue
+            if self._carry is not None:
+                done.append(tuple(self._carry))
+            self._carry = [courier_id, deliveries, gross]
+        return done
+
+    def finish(self):
+        done, self._carry = ([tuple(self._carry)] if self._carry else []), None
+        return done
+
+_worker_app = None
+
+def _init_worker():
+    # Forked workers must not share the parent's pooled connections
+    with _worker_app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+def _process_shard_in_worker(run_id, shard):
+    with _worker_app.app_context():
+        return PayoutService.process_shard(run_id, shard)
+
+class PayoutService:
+    """Courier payouts from delivered orders
+
+    Each shard streams its couriers' delivered orders sorted by courier,
+    sums earnings a chunk at a time and credits wallets in batches.
+    Every batch commits its wallet credits and payout lines together, so a
+    rerun of a failed run continues after the last paid courier of each
+    shard and never pays anyone twice.
+    """
+
+    @staticmethod
+    def start_run(period_start, period_end, shard_count=None):
+        """Create the run for a period, or return the unfinished one to resume"""
+        if period_end <= period_start:
+            raise ValidationError("'end' must be after 'start'")
+        if period_end > datetime.utcnow():
+            raise ValidationError('Payout periods must have ended')
+
+        run = PayoutRun.query.filter_by(period_start=period_start, period_end=period_end).first()
+        if run is not None:
+            if run.status == PayoutStatus.COMPLETED.value:
+                raise ValidationError('This period has already been paid out')
+            run.status = PayoutStatus.RUNNING.value
+            run.error = None
+            db.session.commit()
+            return run
+
+        overlapping = PayoutRun.query.filter(
+            PayoutRun.period_start < period_end,
+            PayoutRun.period_end > period_start
+        ).first()
+        if overlapping is not None:
+            raise ValidationError(
+                f'Period overlaps payout run {overlapping.id} '
+                f'({overlapping.period_start.isoformat()} to {overlapping.period_end.isoformat()})'
+            )
+
+        config = current_app.config
+        run = PayoutRun(
+            period_start=period_start,
+            period_end=period_end,
+            shard_count=shard_count or config.get('PAYOUT_SHARDS', 8),
+            courier_share=config.get('PAYOUT_COURIER_SHARE', 0.8),
+        )
+        db.session.add(run)
+        db.session.commit()
+        return run
+
+    @staticmethod
+    def run(period_start, period_end, shard_count=None, workers=1):
+        """Pay couriers for a period; returns the completed run"""
+        run = PayoutService.start_run(period_start, period_end, shard_count)
+        run_id, shards = run.id, range(run.shard_count)
+
+        try:
+            if workers > 1:
+                global _worker_app
+                _worker_app = current_app._get_current_object()
+                with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'),
+                                         initializer=_init_worker) as pool:
+                    results = list(pool.map(_process_shard_in_worker, [run_id] * len(shards), shards))
+            else:
+                results = [PayoutService.process_shard(run_id, shard) for shard in shards]
+        except Exception as e:
+            db.session.rollback()
+            run = db.session.get(PayoutRun, run_id)
+            run.status = PayoutStatus.FAILED.value
+            run.error = str(e)
+            db.session.commit()
+            raise
+
+        paid = sum(couriers for couriers, _ in results)
+        logger.info("Payout run %s paid %s couriers this pass", run_id, paid)
+        return PayoutService._complete(db.session.get(PayoutRun, run_id))
+
+    @staticmethod
+    def process_shard(run_id, shard):
+        """Pay one shard's unpaid couriers; returns (couriers, deliveries) paid in this call"""
+        run = db.session.get(PayoutRun, run_id)
+        config = current_app.config
+        batch_size = config.get('PAYOUT_BATCH_SIZE', 1000)
+        stream_chunk = config.get('PAYOUT_STREAM_CHUNK', 50000)
+
+        # Couriers up to the shard's last payout line are already paid
+        checkpoint = db.session.query(func.max(PayoutLine.courier_id)).filter(
+            PayoutLine.run_id == run_id, PayoutLine.shard == shard
+        ).scalar()
+        db.session.commit()
+
+        low, high = shard_bounds(shard, run.shard_count)
+        query = select(
+            Delivery.courier_id,
+            func.coalesce(Order.base_fare, 0) + func.coalesce(Order.distance_fare, 0) + func.coalesce(Order.surcharge, 0)
+        ).join(Order, Order.id == Delivery.order_id).where(
+            Order.status == OrderStatus.DELIVERED.value,
+            Order.delivery_time >= run.period_start,
+            Order.delivery_time < run.period_end,
+        ).order_by(Delivery.courier_id)
+        if checkpoint is not None or low is not None:
+            query = query.where(Delivery.courier_id > checkpoint if checkpoint is not None else Delivery.courier_id >= low)
+        if high is not None:
+            query = query.where(Delivery.courier_id < high)
+
+        accumulator = EarningsAccumulator()
+        pending, paid, deliveries = [], 0, 0
+        # The stream has its own connection so batches can commit while it is open
+        with db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=stream_chunk).execute(query)
+            for rows in result.partitions():
+                couriers, fares = zip(*rows)
+                pending.extend(accumulator.add_chunk(couriers, fares))
+                while len(pending) >= batch_size:
+                    paid, deliveries = PayoutService._settle(run, shard, pending[:batch_size], paid, deliveries)
+                    pending = pending[batch_size:]
+        pending.extend(accumulator.finish())
+        if pending:
+            paid, deliveries = PayoutService._settle(run, shard, pending, paid, deliveries)
+        return paid, deliveries
+
+    @staticmethod
+    def _settle(run, shard, totals, paid, deliveries):
+        """Credit a batch of couriers and record their payout lines in one transaction"""
+        description = f'Courier payout {run.period_start.date().isoformat()} to {run.period_end.date().isoformat()}'
+        entries, lines = [], []
+        for courier_id, count, gross in totals:
+            amount = round(gross * run.courier_share, 2)
+            if amount > 0:
+                entries.append((len(entries), courier_id, amount, 'credit', description, None))
+            lines.append({
+                'id': str(uuid.uuid4()),
+                'run_id': run.id,
+                'courier_id': courier_id,
+                'shard': shard,
+                'deliveries': count,
+                'gross_fares': round(gross, 2),
+                'amount': max(amount, 0.0),
+                'wallet_transaction_id': None,
+            })
+
+        try:
+            posted, _ = LedgerService.apply_chunk(entries)
+            transaction_ids = {entries[index][1]: values['id'] for index, values in posted}
+            for line in lines:
+                line['wallet_transaction_id'] = transaction_ids.get(line['courier_id'])
+            now = datetime.utcnow()
+            db.session.execute(insert(PayoutLine.__table__), [dict(line, created_at=now, updated_at=now) for line in lines])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return paid + len(lines), deliveries + sum(line['deliveries'] for line in lines)
+
+    @staticmethod
+    def _complete(run):
+        couriers, deliveries, total = db.session.query(
+            func.count(PayoutLine.id), func.sum(PayoutLine.deliveries), func.sum(PayoutLine.amount)
+        ).filter(PayoutLine.run_id == run.id).one()
+        run.couriers = couriers
+        run.deliveries = deliveries or 0
+        run.total_amount = round(total or 0.0, 2)
+        run.file_path = PayoutService.write_payout_file(run)
+        run.status = PayoutStatus.COMPLETED.value
+        run.completed_at = datetime.utcnow()
+        db.session.commit()
+        return run
+
+    @staticmethod
+    def write_payout_file(run):
+        """Write the run's payout lines to a CSV file; returns its path"""
+        directory = current_app.config.get('PAYOUT_DIR', 'payouts')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'payout-{run.period_start:%Y%m%d}-{run.period_end:%Y%m%d}-{run.id[:8]}.csv')
+
+        query = select(
+            PayoutLine.courier_id, PayoutLine.deliveries, PayoutLine.gross_fares,
+            PayoutLine.amount, PayoutLine.wallet_transaction_id
+        ).where(PayoutLine.run_id == run.id).order_by(PayoutLine.courier_id)
+        with open(path, 'w', newline='') as f, db.engine.connect() as conn:
+            writer = csv.writer(f)
+            writer.writerow(['courier_id', 'deliveries', 'gross_fares', 'amount', 'wallet_transaction_id'])
+            for rows in conn.execution_options(stream_results=True, yield_per=10000).execute(query).partitions():
+                writer.writerows(rows)
+        return path
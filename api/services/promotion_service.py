@@ -0,0 +1,186 @@
+from app import db
+from models.promotion import PromoCode, PromoRedemption
+from utils.errors import NotFoundError, ValidationError, ConflictError
+from utils.promo_catalog import PromoCatalog, normalize_code
+from utils.validators import validate_amount
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from collections import namedtuple
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+Redemption = namedtuple('Redemption', 'promo discount number')
+
+class PromoStore:
+    """PromoCatalog storage on the promo_codes table
+
+    Usage writes run on their own short transaction so a lease never holds
+    the promo row lock for the length of an order transaction.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def load(self):
+        with self.app.app_context():
+            now = datetime.utcnow()
+            rows = db.session.execute(
+                select(PromoCode.__table__).where(PromoCode.is_active.is_(True), PromoCode.valid_till >= now)
+            ).mappings().all()
+            db.session.rollback()
+            return rows
+
+    def reserve(self, promo_id, count):
+        """Add up to ``count`` uses without passing max_uses; returns how many were granted"""
+        table = PromoCode.__table__
+        with self.app.app_context(), db.engine.begin() as conn:
+            row = conn.execute(
+                select(table.c.current_uses, table.c.max_uses).where(table.c.id == promo_id).with_for_update()
+            ).first()
+            if row is None:
+                return 0
+            current, limit = row.current_uses or 0, row.max_uses
+            granted = count if limit is None else max(0, min(count, limit - current))
+            if granted:
+                conn.execute(update(table).where(table.c.id == promo_id).values(current_uses=current + granted))
+            return granted
+
+    def add_uses(self, deltas):
+        table = PromoCode.__table__
+        with self.app.app_context(), db.engine.begin() as conn:
+            for promo_id, delta in sorted(deltas.items()):
+                conn.execute(
+                    update(table).where(table.c.id == promo_id).values(current_uses=table.c.current_uses + delta)
+                )
+
+def get_catalog():
+    """The app's promo catalog, created on first use"""
+    app = current_app._get_current_object()
+    catalog = app.extensions.get('promo_catalog')
+    if catalog is None:
+        config = app.config
+        catalog = app.extensions.setdefault('promo_catalog', PromoCatalog(
+            PromoStore(app),
+            refresh_seconds=config.get('PROMO_REFRESH_SECONDS', 30),
+            flush_seconds=config.get('PROMO_FLUSH_SECONDS', 5),
+            lease_size=config.get('PROMO_LEASE_SIZE', 20),
+            lease_idle_seconds=config.get('PROMO_LEASE_IDLE_SECONDS', 30),
+        ))
+    return catalog
+
+class PromotionService:
+    """Promo code management and redemption"""
+
+    @staticmethod
+    def validate_code(code, user, order_amount=None):
+        """Check a code for a user without redeeming it"""
+        promo, discount = get_catalog().check(code, order_amount, user.role)
+        used = PromotionService._user_uses(promo.id, user.id)
+        if promo.max_uses_per_user is not None and used >= promo.max_uses_per_user:
+            raise ValidationError('You have already used this promo code')
+        return promo, discount
+
+    @staticmethod
+    def _user_uses(promo_id, user_id):
+        return PromoRedemption.query.filter_by(promo_code_id=promo_id, user_id=user_id).count()
+
+    @staticmethod
+    def reserve(code, user_id, user_role, order_amount):
+        """Check a code and claim one use before the order is written
+
+        Returns a Redemption for record_redemption(); the caller must pass
+        it to finish_redemption() whether or not the order commits.
+        """
+        catalog = get_catalog()
+        promo, discount = catalog.check(code, order_amount, user_role)
+
+        used = PromotionService._user_uses(promo.id, user_id)
+        if promo.max_uses_per_user is not None and used >= promo.max_uses_per_user:
+            raise ValidationError('You have already used this promo code')
+
+        catalog.claim(promo)
+        return Redemption(promo, discount, used + 1)
+
+    @staticmethod
+    def record_redemption(redemption, order):
+        """Insert the redemption row in the order's transaction"""
+        try:
+            # A concurrent redemption of the same per-user slot fails here
+            with db.session.begin_nested():
+                db.session.add(PromoRedemption(
+                    promo_code_id=redemption.promo.id,
+                    user_id=order.customer_id,
+                    order_id=order.id,
+                    redemption_number=redemption.number,
+                    discount_amount=redemption.discount,
+                ))
+        except IntegrityError:
+            raise ValidationError('You have already used this promo code')
+
+    @staticmethod
+    def finish_redemption(redemption, committed):
+        """Count a committed redemption or hand back the claimed use"""
+        catalog = get_catalog()
+        if committed:
+            catalog.redeemed(redemption.promo)
+            catalog.maybe_flush()
+        else:
+            catalog.release(redemption.promo)
+
+    # ========== Admin ==========
+
+    @staticmethod
+    def create_code(data):
+        """Create a promo code"""
+        discount_type = data.get('discount_type', 'fixed')
+        if discount_type not in ('percentage', 'fixed'):
+            raise ValidationError('Invalid discount type. Must be one of: percentage, fixed')
+        try:
+            valid_from = datetime.fromisoformat(data['valid_from']) if data.get('valid_from') else datetime.utcnow()
+            valid_till = datetime.fromisoformat(data['valid_till'])
+        except ValueError:
+            raise ValidationError('Invalid date. Use ISO 8601, e.g. 2024-01-31T12:00:00')
+        if valid_till <= valid_from:
+            raise ValidationError("'valid_till' must be after 'valid_from'")
+
+        code = normalize_code(data['code'])
+        if PromoCode.query.filter_by(code=code).first():
+            raise ConflictError(f'Promo code {code} already exists')
+
+        promo = PromoCode(
+            code=code,
+            description=data.get('description'),
+            discount_type=discount_type,
+            discount_value=validate_amount(data['discount_value']),
+            max_discount=validate_amount(data['max_discount']) if data.get('max_discount') is not None else None,
+            min_order_amount=validate_amount(data.get('min_order_amount', 0)),
+            max_uses=data.get('max_uses'),
+            max_uses_per_user=data.get('max_uses_per_user', 1),
+            valid_from=valid_from,
+            valid_till=valid_till,
+            applicable_roles=data.get('applicable_roles'),
+        )
+        db.session.add(promo)
+        db.session.commit()
+        get_catalog().invalidate()
+        return promo
+
+    @staticmethod
+    def deactivate_code(promo_id):
+        """Stop accepting a code; other workers drop it at their next refresh"""
+        promo = PromoCode.query.get(promo_id)
+        if not promo:
+            raise NotFoundError(f'Promo code {promo_id} not found')
+        promo.is_active = False
+        db.session.commit()
+        get_catalog().invalidate()
+        return promo
+
+    @staticmethod
+    def list_codes(limit=50, offset=0):
+        """Promo codes, newest first"""
+        query = PromoCode.query.order_by(PromoCode.created_at.desc())
+        return query.limit(limit).offset(offset).all(), query.count()
@@ -3,6 +3,7 @@ from models.rating import Rating
 from models.order import Order
 from utils.errors import NotFoundError, ValidationError
 from utils.validators import validate_rating
+from utils.replicas import replica_read
 
 class RatingService:
     """Rating management service"""
@@ -39,6 +40,7 @@ class RatingService:
         return new_rating
     
     @staticmethod
+    @replica_read
     def get_ratings(user_id, limit=50, offset=0):
         """Get ratings for user"""
         ratings = Rating.query.filter_by(ratee_id=user_id).order_by(Rating.created_at.desc()).limit(limit).offset(offset).all()
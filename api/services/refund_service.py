@@ -0,0 +1,408 @@
+from app import db
+from models.order import Order, OrderStatus, PaymentMethod
+from models.payment import Payment, PaymentStatus, RefundJob, RefundJobStatus
+from services.ledger_service import LedgerService
+from services.event_service import EventService, payment_event
+from utils.errors import NotFoundError, ValidationError, ConflictError
+from utils.geo import geohash_bounds
+from utils.payment_gateway import GatewayError
+from utils.payment_processor import payment_processor
+from flask import current_app
+from sqlalchemy import select, update, func, or_, and_
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from functools import partial
+from datetime import datetime, timedelta
+import threading
+import logging
+import time
+import csv
+
+logger = logging.getLogger(__name__)
+
+# Settlement file statuses and the payment status each one corresponds to
+SETTLEMENT_STATUSES = {
+    'completed': PaymentStatus.COMPLETED.value,
+    'settled': PaymentStatus.COMPLETED.value,
+    'captured': PaymentStatus.COMPLETED.value,
+    'refunded': PaymentStatus.REFUNDED.value,
+}
+AMOUNT_TOLERANCE = 0.005
+LOOKUP_CHUNK = 1000
+
+def _parse_datetime(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f"Invalid '{name}' date. Use ISO 8601, e.g. 2024-01-31 or 2024-01-31T12:00:00")
+
+class RefundService:
+    """Bulk refunds and gateway settlement reconciliation
+
+    A refund job selects completed payments by order criteria and refunds
+    them in id order, a chunk per transaction, with the gateway calls of a
+    chunk running concurrently. Card payments are refunded through the
+    gateway; wallet and cash payments are credited back to the customer's
+    wallet. Each chunk commits its payment updates, wallet credits and the
+    job's progress together, so an interrupted job resumes after its last
+    chunk. Payments whose gateway refund failed stay completed and are
+    picked up by a new job with the same criteria.
+
+    A runner claims its job, and each chunk's payments, with guarded
+    UPDATEs before calling the gateway, so two runners never work on the
+    same job or refund the same payment twice.
+    """
+
+    @staticmethod
+    def parse_criteria(data):
+        """Validate refund criteria; at least one is required so a job never refunds everything"""
+        criteria = {}
+        if data.get('order_ids'):
+            if not isinstance(data['order_ids'], list) or not all(isinstance(i, str) for i in data['order_ids']):
+                raise ValidationError("'order_ids' must be a list of order ids")
+            criteria['order_ids'] = data['order_ids']
+        if data.get('zone'):
+            try:
+                geohash_bounds(data['zone'])
+            except (KeyError, TypeError):
+                raise ValidationError("'zone' must be a geohash cell, e.g. 'tdr1v'")
+            criteria['zone'] = data['zone']
+        for name in ('created_from', 'created_to'):
+            if data.get(name):
+                criteria[name] = _parse_datetime(data[name], name).isoformat()
+        if data.get('order_status'):
+            statuses = data['order_status'] if isinstance(data['order_status'], list) else [data['order_status']]
+            valid = {s.value for s in OrderStatus}
+            if not set(statuses) <= valid:
+                raise ValidationError(f'Invalid order status. Must be one of: {", ".join(sorted(valid))}')
+            criteria['order_status'] = statuses
+        if data.get('payment_method'):
+            if data['payment_method'] not in {m.value for m in PaymentMethod}:
+                raise ValidationError('Invalid payment method')
+            criteria['payment_method'] = data['payment_method']
+        if not criteria:
+            raise ValidationError('At least one of order_ids, zone, created_from, created_to, '
+                                  'order_status or payment_method is required')
+        return criteria
+
+    @staticmethod
+    def _selection(criteria, *columns):
+        """Completed payments matching the criteria; zones match on the pickup location"""
+        stmt = select(*columns).join(Order, Order.id == Payment.order_id).where(
+            Payment.status == PaymentStatus.COMPLETED.value
+        )
+        if criteria.get('order_ids'):
+            stmt = stmt.where(Order.id.in_(criteria['order_ids']))
+        if criteria.get('zone'):
+            min_lat, min_lon, max_lat, max_lon = geohash_bounds(criteria['zone'])
+            stmt = stmt.where(
+                Order.pickup_latitude >= min_lat, Order.pickup_latitude < max_lat,
+                Order.pickup_longitude >= min_lon, Order.pickup_longitude < max_lon
+            )
+        if criteria.get('created_from'):
+            stmt = stmt.where(Order.created_at >= datetime.fromisoformat(criteria['created_from']))
+        if criteria.get('created_to'):
+            stmt = stmt.where(Order.created_at < datetime.fromisoformat(criteria['created_to']))
+        if criteria.get('order_status'):
+            stmt = stmt.where(Order.status.in_(criteria['order_status']))
+        if criteria.get('payment_method'):
+            stmt = stmt.where(Payment.payment_method == criteria['payment_method'])
+        return stmt
+
+    # ========== Jobs ==========
+
+    @staticmethod
+    def create_job(criteria, reason, created_by=None):
+        if not reason:
+            raise ValidationError('Missing required field: reason')
+        job = RefundJob(criteria=RefundService.parse_criteria(criteria), reason=reason, created_by=created_by)
+        db.session.add(job)
+        db.session.commit()
+        return job
+
+    @staticmethod
+    def get_job(job_id):
+        job = db.session.get(RefundJob, job_id)
+        if not job:
+            raise NotFoundError(f'Refund job {job_id} not found')
+        return job
+
+    @staticmethod
+    def start_job(job_id):
+        """Run a job on a background thread; progress is read back with get_job()"""
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                try:
+                    RefundService.run_job(job_id)
+                except Exception as e:
+                    logger.error("Refund job %s failed: %s", job_id, e)
+
+        threading.Thread(target=run, name=f'refund-job-{job_id[:8]}', daemon=True).start()
+
+    @staticmethod
+    def run_job(job_id):
+        """Refund a job's payments, continuing after its checkpoint; returns the job"""
+        job = RefundService.get_job(job_id)
+        if job.status == RefundJobStatus.COMPLETED.value:
+            raise ValidationError('This refund job has already completed')
+
+        config = current_app.config
+        chunk_size = config.get('REFUND_CHUNK_SIZE', 200)
+        max_errors = config.get('REFUND_MAX_ERRORS', 100)
+
+        RefundService._claim_job(job_id, config.get('REFUND_JOB_LEASE_SECONDS', 600))
+        db.session.refresh(job)
+        if job.total is None:
+            job.total = db.session.execute(RefundService._selection(job.criteria, func.count(Payment.id))).scalar()
+        db.session.commit()
+
+        columns = (Payment.id, Payment.user_id, Payment.order_id, Payment.amount,
+                   Payment.payment_method, Payment.transaction_id)
+        try:
+            with ThreadPoolExecutor(config.get('REFUND_CONCURRENCY', 8), thread_name_prefix='refund') as pool:
+                while True:
+                    stmt = RefundService._selection(job.criteria, *columns).order_by(Payment.id).limit(chunk_size)
+                    if job.last_payment_id:
+                        stmt = stmt.where(Payment.id > job.last_payment_id)
+                    rows = db.session.execute(stmt).all()
+                    if not rows:
+                        break
+
+                    refunded, errors = RefundService.refund_payments(rows, job.reason, pool)
+                    job.processed += len(rows)
+                    job.refunded += len(refunded)
+                    job.failed += len(errors)
+                    job.amount_refunded += sum(amount for _, amount in refunded)
+                    job.last_payment_id = rows[-1].id
+                    if errors and len(job.errors or []) < max_errors:
+                        job.errors = ((job.errors or []) + errors)[:max_errors]
+                    db.session.commit()
+                    logger.info("Refund job %s: %s of %s payments processed", job.id, job.processed, job.total)
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(RefundJob, job_id)
+            job.status = RefundJobStatus.FAILED.value
+            job.error = str(e)
+            db.session.commit()
+            raise
+
+        job.status = RefundJobStatus.COMPLETED.value
+        job.completed_at = datetime.utcnow()
+        db.session.commit()
+        return job
+
+    @staticmethod
+    def _claim_job(job_id, lease_seconds):
+        """Mark a job running, unless another runner has checkpointed it within the lease"""
+        table = RefundJob.__table__
+        now = datetime.utcnow()
+        # Every chunk commit bumps updated_at, so a stale running job lost its runner
+        claimed = db.session.execute(
+            update(table).where(
+                table.c.id == job_id,
+                or_(
+                    table.c.status.in_([RefundJobStatus.PENDING.value, RefundJobStatus.FAILED.value]),
+                    and_(table.c.status == RefundJobStatus.RUNNING.value,
+                         table.c.updated_at < now - timedelta(seconds=lease_seconds)),
+                )
+            ).values(
+                status=RefundJobStatus.RUNNING.value,
+                started_at=func.coalesce(table.c.started_at, now),
+                error=None,
+                updated_at=now
+            )
+        ).rowcount
+        db.session.commit()
+        if not claimed:
+            raise ConflictError(f'Refund job {job_id} is already running or has completed')
+
+    @staticmethod
+    def refund_payments(payments, reason, pool=None):
+        """Refund completed payments in the current transaction without committing
+
+        ``payments`` are rows or Payment objects with id, user_id, order_id,
+        amount, payment_method and transaction_id. Gateway calls run on
+        ``pool`` when given. Returns ([(payment_id, amount)], [{payment_id,
+        error}]); payments refunded concurrently by someone else are in
+        neither list.
+        """
+        table = Payment.__table__
+        now = datetime.utcnow()
+        # Claim before calling the gateway: the UPDATE locks the rows until the
+        # caller commits, and a concurrent runner's claim waits and then finds
+        # them refunded, so no payment is refunded at the gateway twice
+        claimed = set(db.session.execute(
+            update(table).where(
+                table.c.id.in_([payment.id for payment in payments]),
+                table.c.status == PaymentStatus.COMPLETED.value
+            ).values(updated_at=now).returning(table.c.id)
+        ).scalars())
+        payments = [payment for payment in payments if payment.id in claimed]
+        if not payments:
+            return [], []
+
+        config = current_app.config
+        # Pool threads have no app context, so they get the settings up front
+        refund = partial(
+            RefundService._gateway_refund,
+            timeout=config.get('PAYMENT_GATEWAY_TIMEOUT', 10),
+            max_attempts=config.get('PAYMENT_MAX_ATTEMPTS', 4),
+            backoff=config.get('PAYMENT_RETRY_BACKOFF', 0.5),
+        )
+        results = list((pool.map if pool else map)(refund, payments))
+        done = [payment for payment, error in results if error is None]
+        errors = [{'payment_id': payment.id, 'error': error} for payment, error in results if error is not None]
+        if not done:
+            return [], errors
+
+        refunded_ids = set(db.session.execute(
+            update(table).where(
+                table.c.id.in_([payment.id for payment in done]),
+                table.c.status == PaymentStatus.COMPLETED.value
+            ).values(
+                status=PaymentStatus.REFUNDED.value,
+                refunded_at=now,
+                refund_reason=reason,
+                updated_at=now
+            ).returning(table.c.id)
+        ).scalars())
+
+        credits = [
+            (index, payment.user_id, payment.amount, 'credit', f'Refund: {reason}', payment.order_id)
+            for index, payment in enumerate(done)
+            if payment.id in refunded_ids and payment.payment_method != PaymentMethod.CARD.value
+        ]
+        if credits:
+            LedgerService.apply_chunk(credits)
+        EventService.record_many([
+            payment_event(payment, PaymentStatus.COMPLETED.value, PaymentStatus.REFUNDED.value)
+            for payment in done if payment.id in refunded_ids
+        ])
+        return [(payment.id, payment.amount) for payment in done if payment.id in refunded_ids], errors
+
+    @staticmethod
+    def _gateway_refund(payment, timeout, max_attempts, backoff):
+        """Refund a card payment at the gateway with retries; returns (payment, error or None)"""
+        if payment.payment_method != PaymentMethod.CARD.value:
+            return payment, None
+        for attempt in range(1, max_attempts + 1):
+            try:
+                result = payment_processor.gateway.refund(payment.id, payment.transaction_id, payment.amount, timeout)
+            except GatewayError as e:
+                if attempt == max_attempts:
+                    return payment, str(e)
+                time.sleep(backoff * 2 ** (attempt - 1))
+                continue
+            if result.status != PaymentStatus.COMPLETED.value:
+                return payment, result.error or 'Refund declined by the gateway'
+            return payment, None
+
+    # ========== Reconciliation ==========
+
+    @staticmethod
+    def parse_period(args):
+        start = _parse_datetime(args.get('start'), 'start')
+        end = _parse_datetime(args.get('end'), 'end')
+        if (start is None) != (end is None):
+            raise ValidationError("Give both 'start' and 'end', or neither")
+        if start is not None and start >= end:
+            raise ValidationError("'start' must be before 'end'")
+        return start, end
+
+    @staticmethod
+    def reconcile(lines, start=None, end=None):
+        """Compare a gateway settlement CSV with the payments table
+
+        The file needs transaction_id and amount columns and may have a
+        status column (completed, settled, captured or refunded). It is
+        loaded into a hash table keyed by transaction id, which the
+        payments processed in [start, end) are streamed against; file rows
+        left over are looked up by transaction id in chunks. Without a
+        period only the second pass runs, so payments missing from the
+        file are not reported.
+        """
+        reader = csv.DictReader(lines)
+        if not {'transaction_id', 'amount'} <= set(reader.fieldnames or ()):
+            raise ValidationError('Settlement file needs transaction_id and amount columns')
+
+        mismatches = []
+        settlement = {}
+        rows = 0
+        for line, row in enumerate(reader, start=2):
+            rows += 1
+            transaction_id = (row['transaction_id'] or '').strip()
+            status = SETTLEMENT_STATUSES.get((row.get('status') or 'completed').strip().lower())
+            try:
+                amount = float(row['amount'])
+            except (TypeError, ValueError):
+                amount = None
+            if not transaction_id or amount is None or status is None:
+                mismatches.append({'kind': 'invalid_row', 'line': line, 'transaction_id': transaction_id or None})
+            elif transaction_id in settlement:
+                mismatches.append({'kind': 'duplicate_in_settlement', 'line': line, 'transaction_id': transaction_id})
+            else:
+                settlement[transaction_id] = (amount, status, line)
+
+        counts = Counter()
+        matched = {}  # transaction id -> (payment id, line) of the payment that took its settlement row
+
+        def compare(payment_id, transaction_id, amount, status):
+            settled = settlement.pop(transaction_id, None)
+            if settled is None:
+                # A second payment with a transaction id whose settlement row is already taken
+                first_payment_id, line = matched[transaction_id]
+                mismatches.append({'kind': 'duplicate_in_payments', 'payment_id': payment_id,
+                                   'transaction_id': transaction_id, 'line': line,
+                                   'first_payment_id': first_payment_id})
+                return
+            settled_amount, settled_status, line = settled
+            matched[transaction_id] = (payment_id, line)
+            found = {'payment_id': payment_id, 'transaction_id': transaction_id, 'line': line}
+            if abs(settled_amount - amount) > AMOUNT_TOLERANCE:
+                mismatches.append(dict(found, kind='amount_mismatch', amount=amount, settled_amount=settled_amount))
+            elif settled_status != status:
+                mismatches.append(dict(found, kind='status_mismatch', status=status, settled_status=settled_status))
+            else:
+                counts['matched'] += 1
+
+        columns = (Payment.id, Payment.transaction_id, Payment.amount, Payment.status)
+        if start is not None:
+            query = select(*columns).where(
+                Payment.transaction_id.isnot(None),
+                Payment.status.in_((PaymentStatus.COMPLETED.value, PaymentStatus.REFUNDED.value)),
+                Payment.processed_at >= start,
+                Payment.processed_at < end,
+            )
+            with db.engine.connect() as conn:
+                for chunk in conn.execution_options(stream_results=True, yield_per=10000).execute(query).partitions():
+                    for payment_id, transaction_id, amount, status in chunk:
+                        counts['checked'] += 1
+                        if transaction_id in settlement or transaction_id in matched:
+                            compare(payment_id, transaction_id, amount, status)
+                        else:
+                            mismatches.append({'kind': 'missing_in_settlement', 'payment_id': payment_id,
+                                               'transaction_id': transaction_id, 'amount': amount, 'status': status})
+
+        # Settled outside the period, or unknown to us
+        leftover = list(settlement)
+        for offset in range(0, len(leftover), LOOKUP_CHUNK):
+            for payment_id, transaction_id, amount, status in db.session.execute(
+                    select(*columns).where(Payment.transaction_id.in_(leftover[offset:offset + LOOKUP_CHUNK]))):
+                counts['checked'] += 1
+                compare(payment_id, transaction_id, amount, status)
+        for transaction_id, (amount, status, line) in settlement.items():
+            mismatches.append({'kind': 'missing_in_payments', 'transaction_id': transaction_id, 'line': line,
+                               'settled_amount': amount, 'settled_status': status})
+        db.session.commit()
+
+        return {
+            'settlement_rows': rows,
+            'payments_checked': counts['checked'],
+            'matched': counts['matched'],
+            'mismatch_counts': dict(Counter(m['kind'] for m in mismatches)),
+            'mismatches': mismatches,
+        }
@@ -0,0 +1,284 @@
+from app import db
+from models.order import Order
+from models.user import User
+from models.support import SupportTicket
+from utils.errors import ValidationError
+from utils.search_index import InvertedIndex, KEY, words, digits
+from flask import current_app
+from sqlalchemy import select, func, cast, case, or_, and_, event, literal, literal_column, Numeric
+from sqlalchemy.orm import Session
+from decimal import Decimal, InvalidOperation
+import threading
+import logging
+import base64
+import json
+import time
+import re
+
+logger = logging.getLogger(__name__)
+
+TEXT_CONFIG = 'simple'  # no stemming or stop words: names, addresses and ids are not prose
+_PHONE_QUERY = re.compile(r'[\d\s()+.-]+')
+_WEIGHT_LABELS = {3: 'A', 2: 'B', 1: 'C'}
+
+class SearchResource:
+    """A searchable table: weighted text columns, identifiers and phone numbers matched by prefix"""
+    __slots__ = ('name', 'model', 'weights', 'keys', 'phones', 'serialize')
+
+    def __init__(self, name, model, weights, keys, phones, serialize):
+        self.name = name
+        self.model = model
+        self.weights = weights  # column -> 3, 2 or 1
+        self.keys = keys
+        self.phones = phones
+        self.serialize = serialize
+
+    @property
+    def table(self):
+        return self.model.__tablename__
+
+    @property
+    def columns(self):
+        return list(dict.fromkeys([*self.weights, *self.keys, *self.phones]))
+
+    def document_sql(self):
+        """tsvector expression; indexes and queries must spell it identically for the planner to match them"""
+        parts = []
+        for weight in sorted(set(self.weights.values()), reverse=True):
+            text = " || ' ' || ".join(f"coalesce({column}, '')" for column, w in self.weights.items() if w == weight)
+            parts.append(f"setweight(to_tsvector('{TEXT_CONFIG}', {text}), '{_WEIGHT_LABELS[weight]}')")
+        return ' || '.join(parts)
+
+    @staticmethod
+    def phone_sql(column):
+        return f"regexp_replace({column}, '\\D', '', 'g')"
+
+    def terms(self, values):
+        """Inverted index terms of one row"""
+        terms = {}
+        for column, weight in self.weights.items():
+            for word in words(values[column]):
+                if weight > terms.get(word, 0):
+                    terms[word] = weight
+        for column in self.keys:
+            if values[column]:
+                terms[KEY + values[column].lower()] = 3
+        for column in self.phones:
+            number = digits(values[column])
+            if number:
+                terms[KEY + number] = 3
+        return terms
+
+SEARCH_RESOURCES = {resource.name: resource for resource in (
+    SearchResource('orders', Order, {
+        'order_number': 3,
+        'pickup_contact': 2, 'delivery_contact': 2,
+        'pickup_address': 1, 'delivery_address': 1,
+    }, ['order_number'], ['pickup_phone', 'delivery_phone'], Order.to_dict),
+    SearchResource('users', User, {
+        'email': 3,
+        'first_name': 2, 'last_name': 2,
+    }, ['email'], ['phone'], User.to_dict),
+    SearchResource('tickets', SupportTicket, {
+        'ticket_number': 3,
+        'subject': 2,
+        'description': 1,
+    }, ['ticket_number'], [], SupportTicket.to_dict),
+)}
+
+def _encode_cursor(rank, row_id):
+    return base64.urlsafe_b64encode(json.dumps([str(rank), row_id]).encode()).decode()
+
+def _decode_cursor(cursor):
+    try:
+        rank, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return Decimal(rank), str(row_id)
+    except (ValueError, TypeError, InvalidOperation):
+        raise ValidationError('Invalid cursor')
+
+class _MemoryIndexes:
+    """Per-process inverted indexes for databases without full-text search
+
+    Each index is built from its table on first use and rebuilt once it is
+    older than SEARCH_MEMORY_REFRESH_SECONDS. Rows committed through the
+    ORM in this process are applied straight away; other workers' writes
+    and Core bulk inserts show up at the next rebuild.
+    """
+
+    def __init__(self):
+        self._indexes = {}  # resource name -> (index, built at)
+        self._lock = threading.Lock()
+        self._tracking = False
+
+    def get(self, resource, max_age):
+        with self._lock:
+            if not self._tracking:
+                event.listen(Session, 'after_flush', self._collect_changes)
+                event.listen(Session, 'after_commit', self._apply_changes)
+                event.listen(Session, 'after_rollback', self._discard_changes)
+                self._tracking = True
+            entry = self._indexes.get(resource.name)
+            if entry is None or time.monotonic() - entry[1] > max_age:
+                entry = self._indexes[resource.name] = (self._build(resource), time.monotonic())
+            return entry[0]
+
+    @staticmethod
+    def _build(resource):
+        start = time.perf_counter()
+        index = InvertedIndex()
+        table = resource.model.__table__
+        query = select(table.c.id, *[table.c[column] for column in resource.columns])
+        with db.engine.connect() as conn:
+            for rows in conn.execution_options(stream_results=True, yield_per=5000).execute(query).partitions():
+                for row in rows:
+                    index.add(row.id, resource.terms(row._mapping))
+        logger.info("Built %s search index: %s rows in %.2fs", resource.name, len(index), time.perf_counter() - start)
+        return index
+
+    def _collect_changes(self, session, flush_context):
+        pending = session.info.setdefault('search_changes', [])
+        for deleted, objects in ((False, session.new), (False, session.dirty), (True, session.deleted)):
+            for obj in objects:
+                for resource in SEARCH_RESOURCES.values():
+                    if isinstance(obj, resource.model):
+                        terms = None if deleted else resource.terms({c: getattr(obj, c) for c in resource.columns})
+                        pending.append((resource, obj.id, terms))
+
+    def _apply_changes(self, session):
+        pending = session.info.pop('search_changes', None)
+        for resource, row_id, terms in pending or ():
+            entry = self._indexes.get(resource.name)
+            if entry is None:
+                continue
+            if terms is None:
+                entry[0].remove(row_id)
+            else:
+                entry[0].add(row_id, terms)
+
+    def _discard_changes(self, session):
+        session.info.pop('search_changes', None)
+
+memory_indexes = _MemoryIndexes()
+
+class SearchService:
+    """Ranked search over orders, users and support tickets
+
+    On Postgres, words match a weighted tsvector by prefix through a GIN
+    index, and order numbers, emails, ticket numbers and phone digits also
+    match by prefix through pg_trgm GIN indexes (see create_indexes()).
+    Other databases use in-process inverted indexes with the same
+    matching rules. Results are ordered by rank, then id, and paged with
+    an opaque (rank, id) cursor instead of an offset.
+    """
+
+    @staticmethod
+    def search(resource_name, q, limit=20, cursor=None):
+        """Return (results, next cursor or None)"""
+        resource = SEARCH_RESOURCES.get(resource_name)
+        if resource is None:
+            raise ValidationError(f'Invalid type. Must be one of: {", ".join(SEARCH_RESOURCES)}')
+        q = (q or '').strip()
+        config = current_app.config
+        if len(q) < config.get('SEARCH_MIN_QUERY_LENGTH', 2):
+            raise ValidationError(f"'q' must be at least {config.get('SEARCH_MIN_QUERY_LENGTH', 2)} characters")
+        limit = max(1, min(limit, config.get('SEARCH_MAX_LIMIT', 100)))
+        after = _decode_cursor(cursor) if cursor else None
+
+        query_words = words(q)
+        keys = [q.lower()]
+        if _PHONE_QUERY.fullmatch(q) and len(digits(q)) >= 3:
+            keys.append(digits(q))
+
+        if SearchService.backend() == 'postgres':
+            ranked = SearchService._search_postgres(resource, query_words, keys, limit + 1, after)
+        else:
+            ranked = SearchService._search_memory(resource, query_words, keys, limit + 1, after)
+
+        next_cursor = _encode_cursor(*ranked[limit - 1]) if len(ranked) > limit else None
+        ranked = ranked[:limit]
+        objects = {obj.id: obj for obj in resource.model.query.filter(resource.model.id.in_([i for _, i in ranked]))}
+        results = [
+            dict(resource.serialize(objects[row_id]), rank=float(rank))
+            for rank, row_id in ranked if row_id in objects
+        ]
+        return results, next_cursor
+
+    @staticmethod
+    def backend():
+        backend = current_app.config.get('SEARCH_BACKEND', 'auto')
+        if backend == 'auto':
+            return 'postgres' if db.engine.dialect.name == 'postgresql' else 'memory'
+        return backend
+
+    @staticmethod
+    def _search_postgres(resource, query_words, keys, limit, after):
+        table = resource.model.__table__
+        conditions, scores = [], []
+        if query_words:
+            document = literal_column(f'({resource.document_sql()})')
+            tsquery = func.to_tsquery(literal(TEXT_CONFIG), ' & '.join(f'{word}:*' for word in query_words))
+            conditions.append(document.op('@@')(tsquery))
+            scores.append(func.ts_rank_cd(document, tsquery))
+        # Prefix boosts mirror the inverted index: an identifier or phone prefix outranks a word match
+        pattern = keys[0].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        for column in resource.keys:
+            match = table.c[column].ilike(pattern, escape='\\')
+            conditions.append(match)
+            scores.append(case((match, 1.0), else_=0.0))
+        if len(keys) > 1:
+            for column in resource.phones:
+                match = literal_column(resource.phone_sql(column)).like(keys[1] + '%')
+                conditions.append(match)
+                scores.append(case((match, 1.0), else_=0.0))
+
+        rank = func.round(cast(sum(scores[1:], scores[0]), Numeric), 6)
+        ranked = select(table.c.id.label('id'), rank.label('rank')).where(or_(*conditions)).subquery()
+        stmt = select(ranked.c.rank, ranked.c.id).order_by(ranked.c.rank.desc(), ranked.c.id).limit(limit)
+        if after is not None:
+            stmt = stmt.where(or_(ranked.c.rank < after[0], and_(ranked.c.rank == after[0], ranked.c.id > after[1])))
+        return [(rank, row_id) for rank, row_id in db.session.execute(stmt)]
+
+    @staticmethod
+    def _search_memory(resource, query_words, keys, limit, after):
+        index = memory_indexes.get(resource, current_app.config.get('SEARCH_MEMORY_REFRESH_SECONDS', 300))
+        ranked = sorted(
+            ((Decimal(str(round(score, 6))), row_id) for row_id, score in index.search(query_words, keys).items()),
+            key=lambda item: (-item[0], item[1])
+        )
+        if after is not None:
+            ranked = [item for item in ranked if (-item[0], item[1]) > (-after[0], after[1])]
+        return ranked[:limit]
+
+    @staticmethod
+    def index_statements():
+        """DDL for the Postgres search indexes"""
+        statements = ['CREATE EXTENSION IF NOT EXISTS pg_trgm']
+        for resource in SEARCH_RESOURCES.values():
+            table = resource.table
+            statements.append(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_search ON {table} '
+                f'USING gin (({resource.document_sql()}))'
+            )
+            for column in resource.keys:
+                statements.append(
+                    f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_{column}_trgm ON {table} '
+                    f'USING gin ({column} gin_trgm_ops)'
+                )
+            for column in resource.phones:
+                statements.append(
+                    f'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{table}_{column}_digits_trgm ON {table} '
+                    f'USING gin (({resource.phone_sql(column)}) gin_trgm_ops)'
+                )
+        return statements
+
+    @staticmethod
+    def create_indexes():
+        """Create the Postgres search indexes without blocking writes; returns the statements run"""
+        if db.engine.dialect.name != 'postgresql':
+            raise ValidationError('Search indexes are only needed on Postgres')
+        statements = SearchService.index_statements()
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            for statement in statements:
+                logger.info("Running: %s", statement)
+                conn.exec_driver_sql(statement)
+        return statements
@@ -0,0 +1,265 @@
+from app import db
+from models.analytics import SlaStat
+from models.delivery import Delivery
+from models.order import Order, OrderStatus, OrderStatusHistory
+from utils.errors import ValidationError
+from utils.geo import geohash
+from utils.replicas import replica_read
+from flask import current_app
+from sqlalchemy import case, func
+from datetime import datetime, timedelta
+from itertools import islice
+import logging
+import math
+import uuid
+
+try:
+    import numpy as np
+except ImportError:  # optional; the pure-Python path gives the same results, slower
+    np = None
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('assign_to_pickup', 'pickup_to_deliver', 'assign_to_deliver')
+PERCENTILES = (50, 90, 95)
+SLA_SCOPES = ('courier', 'zone')
+SORT_FIELDS = ('late_rate', 'deliveries', 'score', 'assign_to_deliver_p90')
+
+def _seconds(start, end):
+    if start is None or end is None:
+        return math.nan
+    return max(0.0, (end - start).total_seconds())
+
+def _percentiles(values, percentiles=PERCENTILES):
+    """Linear-interpolated percentiles of a list without NaNs, as numpy computes them"""
+    values = sorted(values)
+    if not values:
+        return [None] * len(percentiles)
+    result = []
+    for p in percentiles:
+        rank = (len(values) - 1) * p / 100
+        low = int(rank)
+        high = min(low + 1, len(values) - 1)
+        result.append(round(values[low] + (values[high] - values[low]) * (rank - low), 1))
+    return result
+
+class DeliveryColumns:
+    """Delivered orders of one SLA run as parallel columns
+
+    Courier ids and zones are stored as integer codes so grouping works
+    on plain arrays; chunks are appended as they stream in.
+    """
+
+    def __init__(self):
+        self.keys = {'courier': {}, 'zone': {}}
+        self.codes = {'courier': [], 'zone': []}
+        self.durations = {stage: [] for stage in STAGES}
+        self.late = []  # 1.0, 0.0 or NaN when there is no estimate
+        self.count = 0
+
+    def append_chunk(self, rows, precision):
+        couriers, zones, late = [], [], []
+        durations = {stage: [] for stage in STAGES}
+        for courier_id, latitude, longitude, assigned_at, picked_up_at, delivered_at, estimate in rows:
+            couriers.append(self.keys['courier'].setdefault(courier_id, len(self.keys['courier'])))
+            zone = geohash(latitude, longitude, precision)
+            zones.append(self.keys['zone'].setdefault(zone, len(self.keys['zone'])))
+            durations['assign_to_pickup'].append(_seconds(assigned_at, picked_up_at))
+            durations['pickup_to_deliver'].append(_seconds(picked_up_at, delivered_at))
+            durations['assign_to_deliver'].append(_seconds(assigned_at, delivered_at))
+            late.append(math.nan if estimate is None else float(delivered_at > estimate))
+
+        if np is not None:
+            couriers, zones, late = np.array(couriers, dtype=np.int32), np.array(zones, dtype=np.int32), np.array(late)
+            durations = {stage: np.array(values) for stage, values in durations.items()}
+        self.codes['courier'].append(couriers)
+        self.codes['zone'].append(zones)
+        for stage, values in durations.items():
+            self.durations[stage].append(values)
+        self.late.append(late)
+        self.count += len(late)
+
+    def summarize(self, scope):
+        """{key: stats} for every courier or zone"""
+        names = {code: key for key, code in self.keys[scope].items()}
+        if not self.count:
+            return {}
+        if np is not None:
+            return self._summarize_numpy(scope, names)
+        return self._summarize_python(scope, names)
+
+    def _summarize_numpy(self, scope, names):
+        codes = np.concatenate(self.codes[scope])
+        durations = {stage: np.concatenate(chunks) for stage, chunks in self.durations.items()}
+        late = np.concatenate(self.late)
+
+        # Sort once so every group is a contiguous slice
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+        durations = {stage: values[order] for stage, values in durations.items()}
+        late = late[order]
+
+        result = {}
+        for code, key in names.items():
+            group = slice(bounds[code], bounds[code + 1])
+            stats = {'deliveries': int(bounds[code + 1] - bounds[code])}
+            for stage, values in durations.items():
+                values = values[group]
+                values = values[~np.isnan(values)]
+                pcts = np.percentile(values, PERCENTILES).round(1).tolist() if values.size else [None] * len(PERCENTILES)
+                stats.update({f'{stage}_p{p}': v for p, v in zip(PERCENTILES, pcts)})
+            known = late[group][~np.isnan(late[group])]
+            stats['late_deliveries'] = int(known.sum())
+            stats['late_rate'] = float(known.mean()) if known.size else None
+            result[key] = stats
+        return result
+
+    def _summarize_python(self, scope, names):
+        codes = [code for chunk in self.codes[scope] for code in chunk]
+        durations = {stage: [v for chunk in chunks for v in chunk] for stage, chunks in self.durations.items()}
+        late = [v for chunk in self.late for v in chunk]
+
+        groups = {}
+        for i, code in enumerate(codes):
+            groups.setdefault(code, []).append(i)
+
+        result = {}
+        for code, rows in groups.items():
+            stats = {'deliveries': len(rows)}
+            for stage, values in durations.items():
+                pcts = _percentiles([values[i] for i in rows if not math.isnan(values[i])])
+                stats.update({f'{stage}_p{p}': v for p, v in zip(PERCENTILES, pcts)})
+            known = [late[i] for i in rows if not math.isnan(late[i])]
+            stats['late_deliveries'] = int(sum(known))
+            stats['late_rate'] = sum(known) / len(known) if known else None
+            result[names[code]] = stats
+        return result
+
+    def fleet_median(self, stage):
+        chunks = self.durations[stage]
+        if np is not None:
+            values = np.concatenate(chunks) if chunks else np.array([])
+            values = values[~np.isnan(values)]
+            return float(np.median(values)) if values.size else None
+        return _percentiles([v for chunk in chunks for v in chunk if not math.isnan(v)], (50,))[0]
+
+class SlaService:
+    """Delivery-time percentiles and late rates from delivery and status history"""
+
+    @staticmethod
+    @replica_read
+    def _collect(since, precision, chunk_size):
+        """Stream delivered orders since `since` into columns"""
+        # Fallback timestamps for orders moved through OrderService, which
+        # logs history but leaves the delivery row's timestamps empty
+        history = db.session.query(
+            OrderStatusHistory.order_id.label('order_id'),
+            func.min(case((OrderStatusHistory.to_status == OrderStatus.IN_TRANSIT.value, OrderStatusHistory.created_at))).label('picked_up'),
+            func.min(case((OrderStatusHistory.to_status == OrderStatus.DELIVERED.value, OrderStatusHistory.created_at))).label('delivered'),
+        ).filter(
+            OrderStatusHistory.to_status.in_([OrderStatus.IN_TRANSIT.value, OrderStatus.DELIVERED.value]),
+            OrderStatusHistory.created_at >= since
+        ).group_by(OrderStatusHistory.order_id).subquery()
+
+        picked_up_at = func.coalesce(Delivery.pickup_at, Order.pickup_time, history.c.picked_up)
+        delivered_at = func.coalesce(Delivery.delivery_at, Order.delivery_time, history.c.delivered)
+        query = db.session.query(
+            Delivery.courier_id,
+            Order.pickup_latitude,
+            Order.pickup_longitude,
+            Delivery.assigned_at,
+            picked_up_at,
+            delivered_at,
+            func.coalesce(Order.estimated_delivery_time, Delivery.estimated_arrival),
+        ).join(
+            Order, Order.id == Delivery.order_id
+        ).outerjoin(
+            history, history.c.order_id == Delivery.order_id
+        ).filter(
+            delivered_at >= since
+        ).execution_options(stream_results=True, yield_per=chunk_size)
+
+        columns = DeliveryColumns()
+        rows = iter(query)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            columns.append_chunk(chunk, precision)
+        return columns
+
+    @staticmethod
+    def courier_score(stats, fleet_median, min_deliveries):
+        """0-100 blend of on-time rate and speed relative to the fleet median"""
+        if stats['deliveries'] < min_deliveries:
+            return None
+        on_time = 1 - stats['late_rate'] if stats['late_rate'] is not None else None
+        median = stats['assign_to_deliver_p50']
+        speed = min(1.0, fleet_median / median) if fleet_median and median else None
+        if on_time is None and speed is None:
+            return None
+        if on_time is None:
+            return round(100 * speed, 1)
+        if speed is None:
+            return round(100 * on_time, 1)
+        return round(100 * (0.6 * on_time + 0.4 * speed), 1)
+
+    @staticmethod
+    def compute(window_days=None, chunk_size=5000):
+        """Recompute SLA stats over the trailing window and replace the stored rows"""
+        config = current_app.config
+        window_days = window_days or config.get('SLA_WINDOW_DAYS', 30)
+        precision = config.get('SLA_ZONE_PRECISION', 5)
+        min_deliveries = config.get('SLA_MIN_DELIVERIES', 5)
+        now = datetime.utcnow()
+
+        columns = SlaService._collect(now - timedelta(days=window_days), precision, chunk_size)
+        fleet_median = columns.fleet_median('assign_to_deliver')
+
+        rows = []
+        for scope in SLA_SCOPES:
+            for key, stats in columns.summarize(scope).items():
+                stats['score'] = SlaService.courier_score(stats, fleet_median, min_deliveries) if scope == 'courier' else None
+                rows.append(dict(
+                    id=str(uuid.uuid4()), scope=scope, scope_key=key, window_days=window_days,
+                    computed_at=now, created_at=now, updated_at=now, **stats
+                ))
+
+        # Readers see either the previous run or this one
+        SlaStat.query.filter_by(window_days=window_days).delete(synchronize_session=False)
+        for i in range(0, len(rows), chunk_size):
+            db.session.execute(SlaStat.__table__.insert(), rows[i:i + chunk_size])
+        db.session.commit()
+
+        logger.info("SLA stats computed: %s deliveries, %s rows", columns.count, len(rows))
+        return {
+            'deliveries': columns.count,
+            'couriers': len(columns.keys['courier']),
+            'zones': len(columns.keys['zone']),
+            'window_days': window_days,
+        }
+
+    @staticmethod
+    @replica_read
+    def get_stats(scope, window_days=None, sort='late_rate', limit=50, offset=0):
+        """Stored stats for one scope, worst first"""
+        if scope not in SLA_SCOPES:
+            raise ValidationError(f'Invalid scope. Must be one of: {", ".join(SLA_SCOPES)}')
+        if sort not in SORT_FIELDS:
+            raise ValidationError(f'Invalid sort. Must be one of: {", ".join(SORT_FIELDS)}')
+        window_days = window_days or current_app.config.get('SLA_WINDOW_DAYS', 30)
+
+        column = getattr(SlaStat, sort)
+        # Low scores are the worst; for everything else high is
+        ordering = column.asc() if sort == 'score' else column.desc()
+        query = SlaStat.query.filter_by(scope=scope, window_days=window_days)
+        total = query.count()
+        stats = query.order_by(column.is_(None), ordering, SlaStat.scope_key).limit(limit).offset(offset).all()
+        return stats, total
+
+    @staticmethod
+    @replica_read
+    def get_courier_sla(courier_id, window_days=None):
+        """A courier's stored stats, or None before the first run"""
+        window_days = window_days or current_app.config.get('SLA_WINDOW_DAYS', 30)
+        return SlaStat.query.filter_by(scope='courier', scope_key=courier_id, window_days=window_days).first()
@@ -1,66 +1,306 @@
-from api.models import SupportTicket, TicketStatus, User
-from api.database import db
-from api.utils.errors import NotFoundError, ValidationError
-from api.utils.logger import get_logger
+from app import db
+from models.support import SupportTicket, TicketMessage, TicketStatus, TicketPriority
+from models.user import User, UserRole
+from utils.errors import NotFoundError, ValidationError
+from utils.ticket_queue import ticket_queue, sla_deadline
+from utils.notification_hub import notification_hub
+from flask import current_app
+from sqlalchemy import select, update, func, or_, and_
+from datetime import datetime
+import logging
+import base64
+import json
+import time
 import uuid
 
-logger = get_logger(__name__)
+logger = logging.getLogger(__name__)
+
+# Tickets waiting for an agent, and tickets counting towards an agent's load
+WAITING = (TicketStatus.OPEN.value, TicketStatus.REOPENED.value)
+ACTIVE = (TicketStatus.OPEN.value, TicketStatus.IN_PROGRESS.value, TicketStatus.REOPENED.value)
+CLAIM_ATTEMPTS = 5
 
 class SupportService:
-    """Support ticket business logic"""
-    
+    """Support tickets and their routing to agents
+
+    Unassigned tickets wait in the in-process TicketQueue, which is loaded
+    from the database and refreshed every SUPPORT_QUEUE_REFRESH_SECONDS.
+    New tickets go to the least-loaded agent below
+    SUPPORT_MAX_OPEN_PER_AGENT, and agents pull the most urgent remaining
+    ticket with claim_next(). Every assignment is an UPDATE guarded on the
+    ticket still being unassigned, so concurrent agents and workers never
+    take the same ticket.
+    """
+
+    @staticmethod
+    def _queue():
+        max_age = current_app.config.get('SUPPORT_QUEUE_REFRESH_SECONDS', 60)
+        if ticket_queue.loaded_at is None or time.monotonic() - ticket_queue.loaded_at > max_age:
+            SupportService.reload_queue()
+        return ticket_queue
+
+    @staticmethod
+    def reload_queue():
+        """Rebuild the queue and agent loads from the database"""
+        sla_hours = current_app.config['SUPPORT_SLA_HOURS']
+        waiting = db.session.execute(
+            select(SupportTicket.id, SupportTicket.priority, SupportTicket.sla_due_at, SupportTicket.created_at)
+            .where(SupportTicket.assigned_to.is_(None), SupportTicket.status.in_(WAITING))
+        ).all()
+        agents = db.session.execute(
+            select(User.id).where(User.role.in_(current_app.config['SUPPORT_AGENT_ROLES']), User.is_active.is_(True))
+        ).scalars().all()
+        loads = dict(db.session.execute(
+            select(SupportTicket.assigned_to, func.count(SupportTicket.id))
+            .where(SupportTicket.assigned_to.isnot(None), SupportTicket.status.in_(ACTIVE))
+            .group_by(SupportTicket.assigned_to)
+        ).all())
+        db.session.commit()
+        ticket_queue.load(
+            [(ticket_id, priority, due or sla_deadline(priority, created_at, sla_hours), created_at)
+             for ticket_id, priority, due, created_at in waiting],
+            agents,
+            loads
+        )
+
     @staticmethod
     def create_ticket(user_id, data):
-        """Create support ticket"""
+        """Create support ticket and route it"""
+        priority = data.get('priority', TicketPriority.MEDIUM.value)
+        if priority not in {p.value for p in TicketPriority}:
+            raise ValidationError(f'Invalid priority. Must be one of: {", ".join(p.value for p in TicketPriority)}')
+
+        now = datetime.utcnow()
         ticket = SupportTicket(
-            ticket_number=f"TKT{uuid.uuid4().hex[:10].upper()}",
+            ticket_number=f"TICKET-{uuid.uuid4().hex[:8].upper()}",
             user_id=user_id,
             order_id=data.get('order_id'),
-            subject=data.get('subject'),
-            description=data.get('description'),
-            category=data.get('category'),
-            priority=data.get('priority', 'normal'),
-            status=TicketStatus.OPEN
+            subject=data['subject'],
+            description=data['description'],
+            priority=priority,
+            status=TicketStatus.OPEN.value,
+            sla_due_at=sla_deadline(priority, now, current_app.config['SUPPORT_SLA_HOURS']),
+            created_at=now
         )
-        
         db.session.add(ticket)
         db.session.commit()
-        
-        logger.info(f"Support ticket created: {ticket.ticket_number}")
-        
+
+        SupportService._queue().push(ticket.id, ticket.priority, ticket.sla_due_at, ticket.created_at)
+        SupportService.dispatch()
+        db.session.refresh(ticket)
         return ticket
-    
+
     @staticmethod
-    def update_ticket(ticket_id, data):
-        """Update support ticket"""
-        ticket = SupportTicket.query.get(ticket_id)
+    def update_status(ticket_id, status, resolution_notes=None):
+        """Change a ticket's status, freeing or requeueing it as needed"""
+        if status not in {s.value for s in TicketStatus}:
+            raise ValidationError(f'Invalid status. Must be one of: {", ".join(s.value for s in TicketStatus)}')
+        ticket = db.session.get(SupportTicket, ticket_id)
         if not ticket:
-            raise NotFoundError('Support Ticket')
-        
-        if 'status' in data:
-            ticket.status = TicketStatus[data['status'].upper()]
-        
-        if 'resolution' in data:
-            ticket.resolution = data['resolution']
-        
-        if 'assigned_to' in data:
-            ticket.assigned_to = data['assigned_to']
-        
+            raise NotFoundError(f'Ticket {ticket_id} not found')
+
+        queue = SupportService._queue()
+        was_active = ticket.status in ACTIVE
+        ticket.status = status
+        if status == TicketStatus.RESOLVED.value:
+            ticket.resolved_at = datetime.utcnow()
+        if resolution_notes is not None:
+            ticket.resolution_notes = resolution_notes
         db.session.commit()
-        logger.info(f"Support ticket updated: {ticket_id}")
-        
+
+        if status in ACTIVE:
+            if ticket.assigned_to is None:
+                queue.push(ticket.id, ticket.priority,
+                           ticket.sla_due_at or sla_deadline(ticket.priority, ticket.created_at,
+                                                             current_app.config['SUPPORT_SLA_HOURS']),
+                           ticket.created_at)
+            elif not was_active:
+                queue.change_load(ticket.assigned_to, 1)
+        else:
+            queue.remove(ticket.id)
+            if was_active and ticket.assigned_to is not None:
+                queue.change_load(ticket.assigned_to, -1)
+        SupportService.dispatch()
+        notification_hub.publish(_topic(ticket.id))
+        db.session.refresh(ticket)
         return ticket
-    
+
+    @staticmethod
+    def _assign(ticket_id, agent_id):
+        """Give a waiting ticket to an agent unless someone else took it first"""
+        now = datetime.utcnow()
+        table = SupportTicket.__table__
+        return db.session.execute(
+            update(table).where(
+                table.c.id == ticket_id,
+                table.c.assigned_to.is_(None),
+                table.c.status.in_(WAITING)
+            ).values(
+                assigned_to=agent_id,
+                assigned_at=now,
+                status=TicketStatus.IN_PROGRESS.value,
+                updated_at=now
+            )
+        ).rowcount == 1
+
     @staticmethod
-    def get_tickets(user_id=None, status=None, page=1, per_page=20):
-        """Get support tickets"""
+    def dispatch():
+        """Hand waiting tickets to the least-loaded agents with spare capacity; returns how many"""
+        config = current_app.config
+        if not config.get('SUPPORT_AUTO_ASSIGN', True):
+            return 0
+        queue = SupportService._queue()
+        capacity = config.get('SUPPORT_MAX_OPEN_PER_AGENT', 10)
+        assigned = 0
+        while True:
+            agent_id = queue.least_loaded(capacity)
+            if agent_id is None:
+                break
+            ticket_id = queue.pop()
+            if ticket_id is None:
+                break
+            if SupportService._assign(ticket_id, agent_id):
+                db.session.commit()
+                queue.change_load(agent_id, 1)
+                assigned += 1
+                logger.info("Ticket %s assigned to agent %s", ticket_id, agent_id)
+        db.session.commit()
+        return assigned
+
+    @staticmethod
+    def claim_next(agent_id):
+        """Assign the most urgent waiting ticket to the calling agent; returns it, or None if none wait"""
+        queue = SupportService._queue()
+        for _ in range(CLAIM_ATTEMPTS):
+            ticket_id = queue.pop()
+            if ticket_id is None:
+                break
+            if SupportService._assign(ticket_id, agent_id):
+                return SupportService._claimed(ticket_id, agent_id)
+
+        # The queue is empty or stale: take the first unlocked waiting ticket from the database.
+        # SKIP LOCKED lets concurrent agents each take a different row instead of queueing on one.
+        ticket_id = db.session.execute(
+            select(SupportTicket.id)
+            .where(SupportTicket.assigned_to.is_(None), SupportTicket.status.in_(WAITING))
+            .order_by(SupportTicket.sla_due_at, SupportTicket.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar()
+        if ticket_id is not None and SupportService._assign(ticket_id, agent_id):
+            queue.remove(ticket_id)
+            return SupportService._claimed(ticket_id, agent_id)
+        db.session.commit()
+        return None
+
+    @staticmethod
+    def _claimed(ticket_id, agent_id):
+        db.session.commit()
+        ticket_queue.change_load(agent_id, 1)
+        logger.info("Ticket %s claimed by agent %s", ticket_id, agent_id)
+        return db.session.get(SupportTicket, ticket_id)
+
+    @staticmethod
+    def get_tickets(user_id=None, status=None, limit=20, cursor=None):
+        """Newest tickets first with a keyset cursor; returns (tickets, next cursor or None)"""
         query = SupportTicket.query
-        
         if user_id:
-            query = query.filter_by(user_id=user_id)
-        
+            query = query.filter(SupportTicket.user_id == user_id)
         if status:
-            query = query.filter_by(status=TicketStatus[status.upper()])
-        
-        tickets = query.paginate(page=page, per_page=per_page)
-        return tickets
+            query = query.filter(SupportTicket.status == status)
+        if cursor:
+            try:
+                created_at, ticket_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+                created_at = datetime.fromisoformat(created_at)
+            except (ValueError, TypeError):
+                raise ValidationError('Invalid cursor')
+            query = query.filter(or_(
+                SupportTicket.created_at < created_at,
+                and_(SupportTicket.created_at == created_at, SupportTicket.id < ticket_id)
+            ))
+
+        tickets = query.order_by(SupportTicket.created_at.desc(), SupportTicket.id.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(tickets) > limit:
+            last = tickets[limit - 1]
+            next_cursor = base64.urlsafe_b64encode(json.dumps([last.created_at.isoformat(), last.id]).encode()).decode()
+        return tickets[:limit], next_cursor
+
+    # ========== Message threads ==========
+
+    @staticmethod
+    def get_ticket(ticket_id, user):
+        """Ticket visible to its customer, admins and support agents"""
+        ticket = db.session.get(SupportTicket, ticket_id)
+        if ticket is None or not (
+            ticket.user_id == user.id
+            or user.role == UserRole.ADMIN.value
+            or user.role in current_app.config['SUPPORT_AGENT_ROLES']
+        ):
+            raise NotFoundError(f'Ticket {ticket_id} not found')
+        return ticket
+
+    @staticmethod
+    def add_message(ticket, sent_by, message, attachment=None):
+        """Append a message to the thread and wake anyone waiting on it"""
+        # The increment locks the ticket row until commit, so seqs are handed out in commit order
+        # and a reader that has seen seq n can never later find a message below it
+        table = SupportTicket.__table__
+        seq = db.session.execute(
+            update(table).where(table.c.id == ticket.id)
+            .values(message_count=table.c.message_count + 1, updated_at=datetime.utcnow())
+            .returning(table.c.message_count)
+        ).scalar()
+        entry = TicketMessage(ticket_id=ticket.id, seq=seq, sent_by=sent_by, message=message, attachment=attachment)
+        db.session.add(entry)
+        db.session.commit()
+        notification_hub.publish(_topic(ticket.id))
+        return entry
+
+    @staticmethod
+    def get_messages(ticket_id, since=0, before=None, limit=None):
+        """Messages after seq ``since``, oldest first; with ``before``, the latest ones below it instead"""
+        limit = limit or current_app.config.get('SUPPORT_MESSAGES_PAGE_SIZE', 50)
+        query = TicketMessage.query.filter(TicketMessage.ticket_id == ticket_id)
+        if before is not None:
+            messages = query.filter(TicketMessage.seq < before).order_by(TicketMessage.seq.desc()).limit(limit).all()
+            return messages[::-1]
+        return query.filter(TicketMessage.seq > since).order_by(TicketMessage.seq).limit(limit).all()
+
+    @staticmethod
+    def wait_for_messages(ticket_id, since, timeout):
+        """Long-poll: (messages after seq ``since``, ticket status) once a message arrives, the
+        status changes or ``timeout`` passes
+
+        Posts in this process wake the wait at once; the database is
+        rechecked every SUPPORT_POLL_CHECK_SECONDS for posts handled by
+        other workers. No connection is held while waiting.
+        """
+        check_every = current_app.config.get('SUPPORT_POLL_CHECK_SECONDS', 3)
+        topic = _topic(ticket_id)
+        deadline = time.monotonic() + timeout
+        first_status = None
+        while True:
+            version = notification_hub.version(topic)
+            messages = [m.to_dict() for m in SupportService.get_messages(ticket_id, since)]
+            status = db.session.execute(select(SupportTicket.status).where(SupportTicket.id == ticket_id)).scalar()
+            # Return the connection to the pool before blocking
+            db.session.close()
+            first_status = first_status or status
+            remaining = deadline - time.monotonic()
+            if messages or status != first_status or remaining <= 0:
+                return messages, status
+            notification_hub.wait(topic, version, min(remaining, check_every))
+
+    @staticmethod
+    def queue_stats(count=10):
+        """Waiting tickets, the next few due and each agent's open tickets"""
+        queue = SupportService._queue()
+        return {
+            'waiting': len(queue),
+            'next': [{'ticket_id': ticket_id, 'sla_due_at': due.isoformat()} for ticket_id, due in queue.peek(count)],
+            'agent_loads': queue.loads(),
+        }
+
+def _topic(ticket_id):
+    return f'ticket:{ticket_id}'
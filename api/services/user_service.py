@@ -2,6 +2,10 @@ from app import db
 from models.user import User, UserRole
 from utils.errors import NotFoundError, ValidationError
 from utils.validators import validate_email, validate_coordinates
+from utils.metrics import registry as metrics
+from utils.replicas import replica_read
+from services.sla_service import SlaService
+from utils.surge import surge
 from datetime import datetime
 
 class UserService:
@@ -45,11 +49,19 @@ class UserService:
         
         user.latitude = lat
         user.longitude = lon
+        is_courier = user.role == UserRole.COURIER.value
         
         db.session.commit()
+        
+        if is_courier:
+            surge.courier_seen(user_id, lat, lon)
+            surge.maybe_resync()
+        
+        metrics.inc('location_updates_total', (('source', 'user'),))
         return user
     
     @staticmethod
+    @replica_read
     def get_courier_stats(courier_id):
         """Get courier statistics"""
         from models.delivery import Delivery, DeliveryStatus
@@ -74,12 +86,16 @@ class UserService:
         # Total reviews
         total_reviews = Rating.query.filter_by(ratee_id=courier_id).count()
         
+        # Precomputed by the SLA job
+        sla = SlaService.get_courier_sla(courier_id)
+        
         return {
             'total_deliveries': total_deliveries,
             'completed_deliveries': completed_deliveries,
             'average_rating': round(average_rating, 2),
             'total_reviews': total_reviews,
-            'success_rate': round((completed_deliveries / total_deliveries * 100) if total_deliveries > 0 else 0, 2)
+            'success_rate': round((completed_deliveries / total_deliveries * 100) if total_deliveries > 0 else 0, 2),
+            'sla': sla.to_dict() if sla else None
         }
     
     @staticmethod
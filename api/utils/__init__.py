@@ -1,11 +1,9 @@
 from .errors import APIError, ValidationError, AuthenticationError, AuthorizationError, NotFoundError, ConflictError
-from .decorators import require_auth, require_role, validate_json, rate_limit
 from .validators import validate_email, validate_phone, validate_password, validate_coordinates, validate_rating, validate_amount
 from .logger import setup_logger, get_logger
 
 __all__ = [
     'APIError', 'ValidationError', 'AuthenticationError', 'AuthorizationError', 'NotFoundError', 'ConflictError',
-    'require_auth', 'require_role', 'validate_json', 'rate_limit',
     'validate_email', 'validate_phone', 'validate_password', 'validate_coordinates', 'validate_rating', 'validate_amount',
     'setup_logger', 'get_logger',
 ]
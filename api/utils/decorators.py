@@ -1,7 +1,7 @@
 from functools import wraps
 from flask import request, jsonify
-from app import limiter
-from utils.errors import AuthenticationError, ValidationError
+from utils.rate_limiter import limiter
+from utils.errors import AuthenticationError, ValidationError, RateLimitError
 from services.auth_service import AuthService
 import logging
 
@@ -28,7 +28,7 @@ def require_auth(f):
             user = AuthService.verify_token(token)
             request.user = user
         except Exception as e:
-            logger.error(f"Token verification failed: {e}")
+            logger.error("Token verification failed: %s", e)
             raise AuthenticationError('Invalid or expired token')
         
         return f(*args, **kwargs)
@@ -69,12 +69,24 @@ def validate_json(*required_fields):
         return decorated_function
     return decorator
 
-def rate_limit(limit='50 per hour'):
-    """Rate limit decorator"""
+def rate_limit(policy='50 per hour'):
+    """Rate limit decorator
+    
+    ``policy`` names an entry in RATE_LIMIT_POLICIES (or is a legacy
+    '10 per hour' string). Authenticated calls are limited per user, so
+    place this below require_auth; anonymous calls are limited per client
+    IP, as resolved from X-Forwarded-For by ProxyFix (PROXY_FIX_X_FOR).
+    """
     def decorator(f):
         @wraps(f)
-        @limiter.limit(limit)
         def decorated_function(*args, **kwargs):
+            user = getattr(request, 'user', None)
+            identity = f'user:{user.id}' if user is not None else f'ip:{request.remote_addr}'
+            
+            allowed, retry_after = limiter.hit(policy, identity)
+            if not allowed:
+                raise RateLimitError(retry_after=retry_after)
+            
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -0,0 +1,230 @@
+import calendar
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from utils.geo import geohash, geohash_bounds
+
+logger = logging.getLogger(__name__)
+
+DEMAND_KINDS = ('pickup', 'dropoff')
+
+class MemoryGridBackend:
+    """Per-process cell counts in time slots, with a running total per window
+
+    Totals are adjusted as slots enter and leave each window, so reading
+    the current window costs one dict copy whatever the order volume.
+    Each worker counts only the orders it created itself plus what it
+    loaded at warm-up; use Redis to share one grid between workers.
+    """
+    shared = False
+
+    def __init__(self, windows):
+        self.windows = sorted(windows)
+        self.max_window = self.windows[-1]
+        self._slots = {}  # slot -> {kind: Counter(cell -> count)}
+        self._totals = {w: {kind: Counter() for kind in DEMAND_KINDS} for w in self.windows}
+        self._current = None
+        self._lock = threading.Lock()
+
+    def _expire(self, slot, window):
+        for kind, cells in self._slots.get(slot, {}).items():
+            totals = self._totals[window][kind]
+            for cell, count in cells.items():
+                left = totals[cell] - count
+                if left > 0:
+                    totals[cell] = left
+                else:
+                    totals.pop(cell, None)
+
+    def _advance(self, slot):
+        current = self._current
+        if current is not None and slot <= current:
+            return
+        self._current = slot
+        if current is None:
+            return
+        for window in self.windows:
+            if slot - current >= window:
+                for totals in self._totals[window].values():
+                    totals.clear()
+                continue
+            # Slots (current - window, slot - window] drop out of this window
+            for old in range(current - window + 1, slot - window + 1):
+                self._expire(old, window)
+        for old in [s for s in self._slots if s <= slot - self.max_window]:
+            del self._slots[old]
+
+    def add_many(self, events, now_slot):
+        """Add (kind, cell, slot, count) events"""
+        with self._lock:
+            self._advance(now_slot)
+            for kind, cell, slot, count in events:
+                age = self._current - slot
+                if age >= self.max_window or age < 0:
+                    continue
+                self._slots.setdefault(slot, {}).setdefault(kind, Counter())[cell] += count
+                for window in self.windows:
+                    if age < window:
+                        self._totals[window][kind][cell] += count
+
+    def counts(self, kind, window, now_slot):
+        with self._lock:
+            self._advance(now_slot)
+            return dict(self._totals[window][kind])
+
+class RedisGridBackend:
+    """Cell counts in one Redis hash per kind and slot, shared by all workers
+
+    A window read fetches its slots' hashes in one pipeline; the number of
+    slots is fixed by the window length, not by order volume.
+    """
+    shared = True
+
+    def __init__(self, url, windows, slot_seconds):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self.max_window = max(windows)
+        self.ttl = (self.max_window + 1) * slot_seconds
+
+    def add_many(self, events, now_slot):
+        pipe = self._client.pipeline(transaction=False)
+        keys = set()
+        for kind, cell, slot, count in events:
+            if now_slot - slot >= self.max_window:
+                continue
+            key = f'demand:{kind}:{slot}'
+            pipe.hincrby(key, cell, count)
+            keys.add(key)
+        for key in keys:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def counts(self, kind, window, now_slot):
+        pipe = self._client.pipeline(transaction=False)
+        for slot in range(now_slot - window + 1, now_slot + 1):
+            pipe.hgetall(f'demand:{kind}:{slot}')
+        totals = Counter()
+        for cells in pipe.execute():
+            for cell, count in cells.items():
+                totals[cell.decode()] += int(count)
+        return dict(totals)
+
+class DemandGrid:
+    """Order demand binned into geohash cells over sliding time windows
+
+    Pickups and drop-offs are counted per cell as orders are created;
+    reading a window never touches the orders table.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize from app config"""
+        self.precision = app.config.get('DEMAND_GRID_PRECISION', 6)
+        self.slot_seconds = app.config.get('DEMAND_GRID_SLOT_SECONDS', 60)
+        self.window_minutes = sorted(app.config.get('DEMAND_GRID_WINDOWS', (15, 60)))
+        windows = [self._slots_for(minutes) for minutes in self.window_minutes]
+
+        url = app.config.get('DEMAND_GRID_STORAGE_URL', 'memory://')
+        if url.startswith(('redis://', 'rediss://', 'unix://')):
+            self.backend = RedisGridBackend(url, windows, self.slot_seconds)
+        elif url.startswith('memory://'):
+            self.backend = MemoryGridBackend(windows)
+        else:
+            raise ValueError(f'Unsupported demand grid storage: {url}')
+
+        # A fresh per-process grid loads recent orders once before its first read
+        self.started_at = datetime.utcnow()
+        self._warm = self.backend.shared
+        self._warm_lock = threading.Lock()
+        app.extensions['demand_grid'] = self
+
+    def _slots_for(self, minutes):
+        return max(1, -(-minutes * 60 // self.slot_seconds))
+
+    def _slot(self, timestamp):
+        return int(timestamp // self.slot_seconds)
+
+    def _events(self, points, timestamp):
+        slot = self._slot(timestamp)
+        counts = Counter()
+        for pickup_lat, pickup_lon, dropoff_lat, dropoff_lon in points:
+            counts[('pickup', geohash(pickup_lat, pickup_lon, self.precision), slot)] += 1
+            counts[('dropoff', geohash(dropoff_lat, dropoff_lon, self.precision), slot)] += 1
+        return [(kind, cell, slot, count) for (kind, cell, slot), count in counts.items()]
+
+    def record_orders(self, points, created_at=None):
+        """Count (pickup_lat, pickup_lon, dropoff_lat, dropoff_lon) points; never raises"""
+        if self.backend is None:
+            return
+        timestamp = calendar.timegm(created_at.utctimetuple()) if created_at else time.time()
+        try:
+            self.backend.add_many(self._events(points, timestamp), self._slot(time.time()))
+        except Exception as e:
+            logger.error("Demand grid update failed: %s", e)
+
+    def _warm_up(self):
+        from app import db
+        from models.order import Order
+        from datetime import timedelta
+
+        since = self.started_at - timedelta(minutes=self.window_minutes[-1])
+        rows = db.session.query(
+            Order.created_at, Order.pickup_latitude, Order.pickup_longitude,
+            Order.delivery_latitude, Order.delivery_longitude
+        ).filter(Order.created_at >= since, Order.created_at < self.started_at)
+
+        events = Counter()
+        for created_at, *point in rows:
+            for kind, cell, slot, count in self._events([point], calendar.timegm(created_at.utctimetuple())):
+                events[(kind, cell, slot)] += count
+        self.backend.add_many([key + (count,) for key, count in events.items()], self._slot(time.time()))
+        logger.info("Demand grid warmed with %s cell slots", len(events))
+
+    def heatmap(self, kind='pickup', window=None, precision=None, limit=None):
+        """Cells of the current window, busiest first
+
+        ``precision`` below the grid's merges cells by geohash prefix.
+        """
+        if not self._warm:
+            with self._warm_lock:
+                if not self._warm:
+                    self._warm_up()
+                    self._warm = True
+
+        window = window or self.window_minutes[0]
+        precision = min(precision or self.precision, self.precision)
+        counts = self.backend.counts(kind, self._slots_for(window), self._slot(time.time()))
+        if precision < self.precision:
+            merged = Counter()
+            for cell, count in counts.items():
+                merged[cell[:precision]] += count
+            counts = merged
+
+        cells = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        if limit:
+            cells = cells[:limit]
+        result = []
+        for cell, count in cells:
+            min_lat, min_lon, max_lat, max_lon = geohash_bounds(cell)
+            result.append({
+                'cell': cell,
+                'count': count,
+                'latitude': round((min_lat + max_lat) / 2, 6),
+                'longitude': round((min_lon + max_lon) / 2, 6),
+                'bounds': [round(v, 6) for v in (min_lat, min_lon, max_lat, max_lon)],
+            })
+        return {
+            'kind': kind,
+            'window_minutes': window,
+            'precision': precision,
+            'total': sum(counts.values()),
+            'cells': result,
+        }
+
+demand_grid = DemandGrid()
@@ -33,5 +33,6 @@ class ConflictError(APIError):
 
 class RateLimitError(APIError):
     """Rate limit exceeded"""
-    def __init__(self, message='Too many requests', code='RATE_LIMIT_EXCEEDED'):
+    def __init__(self, message='Too many requests', code='RATE_LIMIT_EXCEEDED', retry_after=None):
         super().__init__(message, code, 429)
+        self.retry_after = retry_after
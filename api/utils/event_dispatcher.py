@@ -0,0 +1,189 @@
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import datetime
+from utils.metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.counter('domain_events_delivered_total', 'Domain events handed to in-process subscribers by subscriber and result')
+metrics.histogram('domain_event_lag_seconds', 'Time from an event being written to a subscriber handling it',
+                  buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+
+class Subscription:
+    """A registered handler and the event types it wants (None for all)"""
+
+    def __init__(self, handler, types=None):
+        self.handler = handler
+        self.types = frozenset(types) if types else None
+        self.retry_at = 0.0  # monotonic time before which a failed handler is not called again
+
+class EventDispatcher:
+    """Delivers the domain event log to in-process subscribers
+
+    Each subscriber is a named consumer with its own offset in
+    event_consumers, so subscribers do not each poll the log: one poller
+    thread per process reads a batch once, from the slowest subscriber,
+    hands every subscriber the events past its offset and acknowledges
+    them. A lease on the consumer row lets only one process deliver a
+    subscriber's events; another takes over once it stops renewing for
+    EVENT_LEASE_SECONDS. A handler that raises gets the same events again
+    after EVENT_RETRY_SECONDS without holding up the other subscribers.
+    The poller wakes at once when this process commits events and
+    otherwise every EVENT_POLL_SECONDS. Nothing runs without subscribers.
+    """
+
+    def __init__(self, app=None):
+        self.subscribers = {}
+        self.app = None
+        self._pid = None
+        self._registered = set()
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stopping = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize from app config"""
+        from services.event_service import EventService
+        from werkzeug.utils import import_string
+
+        config = app.config
+        for name, spec in (config.get('EVENT_SUBSCRIBERS') or {}).items():
+            self.subscribe(name, import_string(spec) if isinstance(spec, str) else spec)
+        self.app = app
+        self.start = config.get('EVENT_SUBSCRIBER_START', 'earliest')
+        self.batch_size = config.get('EVENT_BATCH_SIZE', 500)
+        self.poll_interval = config.get('EVENT_POLL_SECONDS', 1)
+        self.lease_seconds = config.get('EVENT_LEASE_SECONDS', 30)
+        self.retry_interval = config.get('EVENT_RETRY_SECONDS', 5)
+        EventService.track_events(self.wake)
+        # Serving processes poll even if they never write events themselves
+        app.before_request(self._ensure_started)
+        app.extensions['event_dispatcher'] = self
+
+    def subscribe(self, name, handler=None, types=None):
+        """Deliver batches of events to ``handler(events)`` as consumer ``name``; also a decorator
+
+        ``types`` limits the events to those event types; the offset still
+        moves past the others.
+        """
+        def register(handler):
+            self.subscribers[name] = Subscription(handler, types)
+            return handler
+        return register(handler) if handler is not None else register
+
+    @property
+    def owner(self):
+        """Lease holder name of this process"""
+        return f'{socket.gethostname()}:{os.getpid()}'[:100]
+
+    def _ensure_started(self):
+        if not self.subscribers or self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping = False
+            threading.Thread(target=self._poller, name='events-poller', daemon=True).start()
+            self._pid = os.getpid()
+
+    def wake(self):
+        """Events were committed: deliver them now instead of at the next poll"""
+        if not self.subscribers:
+            return
+        self._ensure_started()
+        self._idle.clear()
+        self._wake.set()
+
+    # ========== Delivery ==========
+
+    def run_once(self):
+        """Read one batch and deliver it to every subscriber due; returns how many events were read"""
+        from services.event_service import EventService
+
+        with self.app.app_context():
+            names = list(self.subscribers)
+            new = [name for name in names if name not in self._registered]
+            if new:
+                EventService.register(new, self.start)
+                self._registered.update(new)
+            held = EventService.lease(names, self.owner, self.lease_seconds)
+            now = time.monotonic()
+            due = {name: position for name, position in held.items() if self.subscribers[name].retry_at <= now}
+            if not due:
+                return 0
+            events = EventService.read(min(due.values()), self.batch_size)
+            if not events:
+                return 0
+            for name, position in due.items():
+                if position < events[-1]['position']:
+                    self._deliver(name, position, events)
+            return len(events)
+
+    def _deliver(self, name, position, events):
+        from app import db
+        from services.event_service import EventService
+
+        subscription = self.subscribers[name]
+        batch = [
+            e for e in events
+            if e['position'] > position and (subscription.types is None or e['type'] in subscription.types)
+        ]
+        try:
+            if batch:
+                subscription.handler(batch)
+        except Exception as e:
+            logger.error("Event subscriber %s failed at position %s: %s", name, batch[0]['position'], e)
+            metrics.inc('domain_events_delivered_total', (('subscriber', name), ('result', 'error')), len(batch))
+            subscription.retry_at = time.monotonic() + self.retry_interval
+            db.session.rollback()
+            return
+        if batch:
+            metrics.inc('domain_events_delivered_total', (('subscriber', name), ('result', 'ok')), len(batch))
+            lag = datetime.utcnow() - datetime.fromisoformat(batch[-1]['created_at'])
+            metrics.observe('domain_event_lag_seconds', lag.total_seconds())
+        if not EventService.acknowledge(name, events[-1]['position'], self.owner):
+            logger.warning("Lost the lease on event consumer %s; another process delivers it now", name)
+
+    def _poller(self):
+        while not self._stopping:
+            read = 0
+            try:
+                read = self.run_once()
+            except Exception as e:
+                logger.error("Event dispatch failed: %s", e)
+            if read == self.batch_size:
+                continue
+            if not self._wake.is_set():
+                self._idle.set()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def drain(self, timeout=30):
+        """Wait until the poller has caught up; for tests, benchmarks and shutdown"""
+        if not self.subscribers:
+            return True
+        self._ensure_started()
+        self._idle.clear()
+        self._wake.set()
+        return self._idle.wait(timeout)
+
+    def shutdown(self, timeout=30):
+        """Stop polling and hand this process's consumers to another one straight away"""
+        from services.event_service import EventService
+
+        if self._pid is None:
+            return
+        self.drain(timeout)
+        self._stopping = True
+        self._wake.set()
+        with self.app.app_context():
+            EventService.release(self.owner)
+        self._pid = None
+
+event_dispatcher = EventDispatcher()
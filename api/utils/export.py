@@ -0,0 +1,96 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, date
+from decimal import Decimal
+from flask import Response, stream_with_context
+from utils.errors import ValidationError
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Rows are buffered into chunks of about this size before being sent
+CHUNK_BYTES = 64 * 1024
+
+def parse_export_filters(args):
+    """Read format, date range, status and gzip options from query args"""
+    fmt = args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValidationError(f'Invalid format. Must be one of: {", ".join(EXPORT_FORMATS)}')
+
+    filters = {
+        'format': fmt,
+        'status': args.get('status') or None,
+        'date_from': _parse_date(args.get('from'), 'from'),
+        'date_to': _parse_date(args.get('to'), 'to'),
+        'gzip': args.get('gzip', 'false').lower() in ('1', 'true', 'yes'),
+    }
+    if filters['date_from'] and filters['date_to'] and filters['date_from'] >= filters['date_to']:
+        raise ValidationError("'from' must be before 'to'")
+    return filters
+
+def _parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValidationError(f"Invalid '{name}' date. Use ISO 8601, e.g. 2024-01-31 or 2024-01-31T12:00:00")
+
+def _plain(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def encode_rows(rows, columns, fmt):
+    """Encode an iterable of row tuples as CSV or NDJSON byte chunks"""
+    buffer = io.StringIO()
+
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        write = lambda row: writer.writerow([_plain(v) for v in row])
+    else:
+        write = lambda row: buffer.write(json.dumps(dict(zip(columns, map(_plain, row))), default=str) + '\n')
+
+    for row in rows:
+        write(row)
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def gzip_stream(chunks, level=6):
+    """Gzip a stream of byte chunks on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_response(rows, columns, filename, filters):
+    """Streaming attachment response; rows are pulled only as the client reads"""
+    fmt = filters['format']
+    chunks = encode_rows(rows, columns, fmt)
+    filename = f'{filename}.{fmt}'
+    mimetype = EXPORT_FORMATS[fmt]
+
+    if filters['gzip']:
+        chunks = gzip_stream(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,103 @@
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cache backends that every worker process sees; a per-process version
+# token would let one worker answer 304 for a row another worker changed.
+_LOCAL_CACHE_TYPES = {'null', 'nullcache', 'simple', 'simplecache'}
+
+_tracking = False
+
+def shared_cache_configured(config):
+    """Whether version tokens can be trusted across workers"""
+    override = config.get('ETAG_VERSION_TOKENS')
+    if override is not None:
+        return override
+    cache_type = str(config.get('CACHE_TYPE', 'null')).rsplit('.', 1)[-1].lower()
+    return cache_type not in _LOCAL_CACHE_TYPES
+
+def _version_key(scope, key):
+    return f'etag:{scope}:{key}'
+
+def _new_token():
+    return format(time.time_ns(), 'x')
+
+def get_version(scope, key, ttl):
+    """Current version token for a resource, created on first use"""
+    from app import cache
+    cache_key = _version_key(scope, key)
+    token = cache.get(cache_key)
+    if token is None:
+        # add() so a concurrent bump is never overwritten by an older seed
+        cache.add(cache_key, _new_token(), timeout=ttl)
+        token = cache.get(cache_key)
+    return token
+
+def bump_versions(keys, ttl=None):
+    """Invalidate ETags for (scope, key) pairs after their rows changed"""
+    if not keys:
+        return
+    from app import cache
+    from flask import current_app
+    if not shared_cache_configured(current_app.config):
+        return
+    if ttl is None:
+        ttl = current_app.config.get('ETAG_VERSION_TTL', 86400)
+    token = _new_token()
+    try:
+        cache.set_many({_version_key(scope, key): token for scope, key in keys}, timeout=ttl)
+    except Exception as e:
+        # Fail closed: drop the tokens so the next request re-seeds them
+        logger.error("ETag version bump failed: %s", e)
+        try:
+            cache.delete_many(*[_version_key(scope, key) for scope, key in keys])
+        except Exception as e:
+            logger.error("ETag version delete failed: %s", e)
+
+def _changed_keys(obj):
+    """Version scopes affected by a changed row"""
+    from models.order import Order
+    from models.delivery import Delivery, DeliveryLocationHistory
+
+    if isinstance(obj, Order):
+        return [('order', obj.id), ('customer_orders', obj.customer_id)]
+    if isinstance(obj, Delivery):
+        return [('delivery', obj.id)]
+    if isinstance(obj, DeliveryLocationHistory):
+        return [('delivery', obj.delivery_id)]
+    return []
+
+def _collect_changes(session, flush_context):
+    pending = session.info.setdefault('etag_bumps', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        pending.update(_changed_keys(obj))
+
+def _publish_changes(session):
+    # Bump only after commit so a reader holding the new token always sees the new rows
+    pending = session.info.pop('etag_bumps', None)
+    if pending:
+        bump_versions(pending)
+
+def track_versions():
+    """Bump version tokens whenever orders or deliveries are committed through the ORM"""
+    global _tracking
+    if _tracking:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    event.listen(Session, 'after_flush', _collect_changes)
+    # Changes from rolled-back flushes are kept; an extra bump only costs a refetch
+    event.listen(Session, 'after_commit', _publish_changes)
+    _tracking = True
+
+def make_etag(scope, key, version, variant=b''):
+    """Weak ETag from resource identity and version; variant covers query args"""
+    suffix = hashlib.blake2b(variant, digest_size=4).hexdigest() if variant else ''
+    return f'{scope}-{key}-{version}{"-" + suffix if suffix else ""}'
+
+def body_etag(data):
+    """Fallback ETag hashed from the serialized body"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
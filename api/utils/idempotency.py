@@ -0,0 +1,298 @@
+import math
+import time
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, make_response, g
+from utils.errors import APIError
+from utils.metrics import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+class IdempotencyKeyReusedError(APIError):
+    """Idempotency key sent again with a different request body"""
+    def __init__(self, message='Idempotency-Key was already used with a different request', code='IDEMPOTENCY_KEY_REUSED'):
+        super().__init__(message, code, 422)
+
+class IdempotencyKeyInProgressError(APIError):
+    """The first request with this idempotency key has not finished yet"""
+    def __init__(self, message='A request with this Idempotency-Key is still in progress',
+                 code='IDEMPOTENCY_KEY_IN_PROGRESS', retry_after=None):
+        super().__init__(message, code, 409)
+        self.retry_after = retry_after
+
+class SQLAlchemyIdempotencyBackend:
+    """idempotency_keys rows written through the app's primary engine
+
+    Every call runs in its own short transaction, outside the request's
+    session, so a claim is visible to other workers at once and survives
+    the handler rolling back. Plain INSERT and guarded UPDATE work on
+    every dialect.
+    """
+
+    def claim(self, key, fingerprint, now, locked_until, expires_at):
+        """Insert the key, or take over an expired or abandoned one; returns (claimed, row)"""
+        from app import db
+        from models.idempotency import IdempotencyKey
+        from sqlalchemy import select, update, or_, and_
+        from sqlalchemy.exc import IntegrityError
+
+        table = IdempotencyKey.__table__
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.insert().values(
+                    key=key, fingerprint=fingerprint, locked_until=locked_until, expires_at=expires_at
+                ))
+            return True, None
+        except IntegrityError:
+            pass
+        with db.engine.begin() as conn:
+            taken = conn.execute(
+                update(table).where(
+                    table.c.key == key,
+                    or_(
+                        table.c.expires_at <= now,
+                        and_(table.c.status_code.is_(None), table.c.locked_until <= now,
+                             table.c.fingerprint == fingerprint),
+                    )
+                ).values(fingerprint=fingerprint, status_code=None, content_type=None, body=None,
+                         locked_until=locked_until, expires_at=expires_at)
+            ).rowcount
+            if taken:
+                return True, None
+            row = conn.execute(
+                select(table.c.fingerprint, table.c.status_code, table.c.content_type, table.c.body)
+                .where(table.c.key == key)
+            ).first()
+        return False, row
+
+    def complete(self, key, status_code, content_type, body):
+        from app import db
+        from models.idempotency import IdempotencyKey
+        from sqlalchemy import update
+
+        table = IdempotencyKey.__table__
+        with db.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.key == key).values(
+                status_code=status_code, content_type=content_type, body=body
+            ))
+
+    def release(self, key):
+        from app import db
+        from models.idempotency import IdempotencyKey
+        from sqlalchemy import delete
+
+        table = IdempotencyKey.__table__
+        with db.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.key == key, table.c.status_code.is_(None)))
+
+    def purge(self, now):
+        from app import db
+        from models.idempotency import IdempotencyKey
+        from sqlalchemy import delete
+
+        table = IdempotencyKey.__table__
+        with db.engine.begin() as conn:
+            return conn.execute(delete(table).where(table.c.expires_at <= now)).rowcount
+
+class PsycopgIdempotencyBackend:
+    """idempotency_keys rows on Postgres through raw psycopg2 connections, for index.py"""
+
+    def __init__(self, connect):
+        self.connect = connect
+
+    def _execute(self, sql, params, fetch=False):
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            result = cur.fetchone() if fetch else cur.rowcount
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    def claim(self, key, fingerprint, now, locked_until, expires_at):
+        """Insert the key, or take over an expired or abandoned one; returns (claimed, row)"""
+        claimed = self._execute('''
+            INSERT INTO idempotency_keys (key, fingerprint, locked_until, expires_at)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (key) DO UPDATE SET
+                fingerprint = EXCLUDED.fingerprint, status_code = NULL, content_type = NULL, body = NULL,
+                locked_until = EXCLUDED.locked_until, expires_at = EXCLUDED.expires_at
+            WHERE idempotency_keys.expires_at <= %s
+               OR (idempotency_keys.status_code IS NULL AND idempotency_keys.locked_until <= %s
+                   AND idempotency_keys.fingerprint = EXCLUDED.fingerprint)
+            RETURNING key
+        ''', (key, fingerprint, locked_until, expires_at, now, now), fetch=True)
+        if claimed:
+            return True, None
+        row = self._execute(
+            'SELECT fingerprint, status_code, content_type, body FROM idempotency_keys WHERE key = %s',
+            (key,), fetch=True
+        )
+        return False, row
+
+    def complete(self, key, status_code, content_type, body):
+        self._execute(
+            'UPDATE idempotency_keys SET status_code = %s, content_type = %s, body = %s WHERE key = %s',
+            (status_code, content_type, body, key)
+        )
+
+    def release(self, key):
+        self._execute('DELETE FROM idempotency_keys WHERE key = %s AND status_code IS NULL', (key,))
+
+    def purge(self, now):
+        return self._execute('DELETE FROM idempotency_keys WHERE expires_at <= %s', (now,))
+
+class IdempotencyStore:
+    """Responses of completed requests keyed by idempotency key, shared by every worker
+
+    Keys live in the database, so a retry is recognised whichever worker
+    or serverless instance it reaches. The first request claims its key;
+    duplicates that arrive while it runs find the claim and wait for the
+    stored response. A claim that is neither completed nor released by
+    IDEMPOTENCY_LOCK_SECONDS belonged to a worker that died, and the next
+    retry takes it over. Expired rows are deleted every few minutes by
+    whichever process notices first.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize from app config"""
+        config = app.config
+        self.configure(
+            SQLAlchemyIdempotencyBackend(),
+            ttl=config.get('IDEMPOTENCY_TTL', 86400),
+            lock_seconds=config.get('IDEMPOTENCY_LOCK_SECONDS', 60),
+        )
+        app.extensions['idempotency'] = self
+
+    def configure(self, backend, ttl=86400, lock_seconds=60, purge_interval=300):
+        self.backend = backend
+        self.ttl = ttl
+        self.lock_seconds = lock_seconds
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+
+    def _maybe_purge(self, now):
+        if time.monotonic() - self._purged_at < self.purge_interval:
+            return
+        self._purged_at = time.monotonic()
+        try:
+            self.backend.purge(now)
+        except Exception as e:
+            logger.error("Purging expired idempotency keys failed: %s", e)
+
+    def begin(self, key, fingerprint):
+        """Claim a key; returns (owner, cached) where owner means the caller must run the request
+
+        ``cached`` is the stored (body, status, headers) once the first
+        request has succeeded, or None while it is still running.
+        """
+        if self.backend is None:
+            raise RuntimeError('Idempotency store is not configured')
+        now = datetime.utcnow()
+        self._maybe_purge(now)
+        claimed, row = self.backend.claim(
+            key, fingerprint, now, now + timedelta(seconds=self.lock_seconds), now + timedelta(seconds=self.ttl)
+        )
+        if claimed:
+            return True, None
+        if row is None:
+            # Released or purged since the claim failed; the caller tries again
+            return False, None
+        stored_fingerprint, status_code, content_type, body = row
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyKeyReusedError()
+        if status_code is None:
+            return False, None
+        return False, (bytes(body), status_code, [('Content-Type', content_type)])
+
+    def complete(self, key, response):
+        """Store the response for replays"""
+        body, status_code, headers = response
+        self.backend.complete(key, status_code, dict(headers).get('Content-Type'), body)
+
+    def abandon(self, key):
+        """Forget a key whose request failed so a retry runs again"""
+        self.backend.release(key)
+
+store = IdempotencyStore()
+
+def _replay(cached):
+    body, status, headers = cached
+    response = make_response(body, status)
+    for name, value in headers:
+        response.headers[name] = value
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _user_id():
+    user = getattr(request, 'user', None)
+    user_id = user.id if user is not None else g.get('user_id')
+    if user_id is None:
+        raise RuntimeError('idempotent() must be placed below the authentication decorator')
+    return user_id
+
+def idempotent(wait_timeout=5, poll_interval=0.05, max_poll_interval=1.0):
+    """Replay the stored response when a client retries with the same Idempotency-Key
+
+    Keys are scoped to the authenticated user, so place this below the
+    auth decorator: a stored response is only ever replayed to the user
+    who made the original request. Requests without the header run
+    normally. A duplicate of a request that is still running waits for it,
+    polling at doubling intervals, and gets 409 with Retry-After if it has
+    not finished within ``wait_timeout`` seconds.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return f(*args, **kwargs)
+
+            scope = f'{_user_id()}\n{request.method}\n{request.path}\n{key}'
+            store_key = hashlib.sha256(scope.encode('utf-8')).hexdigest()
+            fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+            deadline = time.monotonic() + wait_timeout
+            delay = poll_interval
+            while True:
+                owner, cached = store.begin(store_key, fingerprint)
+                if owner:
+                    break
+                if cached is not None:
+                    record_cache_lookup('idempotency', True)
+                    return _replay(cached)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # Free the worker; the client retries and usually gets the replay
+                    raise IdempotencyKeyInProgressError(retry_after=math.ceil(max_poll_interval))
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, max_poll_interval)
+
+            record_cache_lookup('idempotency', False)
+            try:
+                response = make_response(f(*args, **kwargs))
+            except Exception:
+                store.abandon(store_key)
+                raise
+
+            # Only successes are replayed: route handlers here map unexpected
+            # errors to 4xx, so a failed attempt must stay retryable.
+            if response.status_code >= 400 or response.is_streamed:
+                store.abandon(store_key)
+            else:
+                headers = [('Content-Type', response.headers.get('Content-Type', 'application/json'))]
+                store.complete(store_key, (response.get_data(), response.status_code, headers))
+            return response
+        return decorated_function
+    return decorator
@@ -1,28 +1,138 @@
 import logging
 import sys
-from logging.handlers import RotatingFileHandler
+import copy
+import json
+import queue
+import atexit
+import itertools
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from flask import g, has_request_context
+from utils.metrics import registry as metrics
 import os
 
+_listener = None
+_exception_formatter = logging.Formatter()
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'source': f'{record.filename}:{record.lineno}',
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            data['request_id'] = request_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            data.update(fields)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        elif record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request id so log lines can be correlated"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keep one in N INFO-and-below records tagged with a sample key
+
+    Records opt in with ``extra={'sample': 'location'}``. Warnings and
+    errors are never sampled away.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.every = {key: max(1, int(round(1 / rate))) for key, rate in rates.items() if rate > 0}
+        self.dropped = {key for key, rate in rates.items() if rate <= 0}
+        self.counters = {key: itertools.count() for key in self.every}
+
+    def filter(self, record):
+        key = getattr(record, 'sample', None)
+        if key is None or record.levelno >= logging.WARNING:
+            return True
+        if key in self.dropped:
+            return False
+        every = self.every.get(key)
+        if every is None:
+            return True
+        return next(self.counters[key]) % every == 0
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that never blocks request threads on low-priority records
+
+    When the queue is full, records below ``block_level`` are dropped and
+    counted in ``log_records_dropped_total``; higher-priority records wait
+    at most ``block_timeout`` seconds.
+    """
+
+    def __init__(self, log_queue, block_level=logging.WARNING, block_timeout=0.05):
+        super().__init__(log_queue)
+        self.block_level = block_level
+        self.block_timeout = block_timeout
+
+    def prepare(self, record):
+        # Merge args here, on the request thread, so the listener never
+        # touches objects that may change or expire after the request ends.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        if record.levelno >= self.block_level:
+            try:
+                self.queue.put(record, timeout=self.block_timeout)
+                return
+            except queue.Full:
+                pass
+
+        metrics.inc('log_records_dropped_total', (('level', record.levelname),))
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
 def setup_logger(app):
     """Setup application logging"""
-    
+    global _listener
+
     # Create logs directory
     if not os.path.exists('logs'):
         os.makedirs('logs')
-    
-    # Remove default handler
+
+    # Remove default handler; app.logger propagates to the root pipeline
     app.logger.handlers.clear()
-    
+
     # Create formatters
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
-    )
-    
+    formatter = JsonFormatter()
+
     # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
     console_handler.setLevel(logging.INFO)
-    
+
     # File handler
     file_handler = RotatingFileHandler(
         'logs/courier_app.log',
@@ -31,7 +141,7 @@ def setup_logger(app):
     )
     file_handler.setFormatter(formatter)
     file_handler.setLevel(logging.DEBUG)
-    
+
     # Error file handler
     error_handler = RotatingFileHandler(
         'logs/courier_app_errors.log',
@@ -40,13 +150,32 @@ def setup_logger(app):
     )
     error_handler.setFormatter(formatter)
     error_handler.setLevel(logging.ERROR)
-    
-    # Add handlers
-    app.logger.addHandler(console_handler)
-    app.logger.addHandler(file_handler)
-    app.logger.addHandler(error_handler)
-    app.logger.setLevel(logging.DEBUG)
-    
+
+    # The slow handlers run on the listener thread; request threads only enqueue
+    if _listener is not None:
+        _listener.stop()
+    else:
+        # Registered once; stops whichever listener is current at exit
+        atexit.register(_stop_listener)
+
+    log_queue = queue.Queue(maxsize=app.config.get('LOG_QUEUE_SIZE', 10000))
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(app.config.get('LOG_SAMPLE_RATES', {})))
+    queue_handler.addFilter(RequestIdFilter())
+
+    _listener = QueueListener(log_queue, console_handler, file_handler, error_handler, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+
+    app.logger.setLevel(logging.NOTSET)
+    app.logger.propagate = True
+
     return app.logger
 
 def get_logger(name):
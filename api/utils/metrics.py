@@ -0,0 +1,405 @@
+import os
+import json
+import time
+import threading
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - multiprocess mode needs a POSIX host
+    fcntl = None
+
+# Request latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Counters and histograms of exited workers, merged so their files can go
+AGGREGATE_FILE = 'metrics_aggregate.json'
+
+class MetricsRegistry:
+    """Process-local metrics with lock-free hot paths
+
+    Every thread writes into its own shard, so increments are plain dict
+    operations with no lock. Shards are only summed when the registry is
+    scraped, and the shard of a finished thread is folded into a base
+    shard so thread-per-request servers do not pile them up. In multiprocess mode each worker periodically writes its
+    snapshot to a shared directory and a scrape merges every worker file.
+    The first flush of a new worker folds the files of exited workers into
+    one aggregate file and deletes them, so the directory does not grow
+    with every worker restart.
+    """
+
+    def __init__(self, multiproc_dir=None, flush_interval=5.0):
+        self._local = threading.local()
+        self._base = _new_shard()
+        self._shards = [self._base]
+        self._shards_lock = threading.Lock()
+        self._types = {}
+        self._help = {}
+        self._buckets = {}
+        self._callbacks = {}
+        self._derived = {}
+        self.multiproc_dir = multiproc_dir
+        self.flush_interval = flush_interval
+        self._last_flush = 0.0
+        self._flushing_pid = None
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = _new_shard()
+            # The thread-local sentinel dies with the thread and hands the shard back
+            self._local.sentinel = sentinel = _ThreadSentinel()
+            weakref.finalize(sentinel, self._retire, shard)
+            self._local.shard = shard
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard):
+        """Fold the shard of a finished thread into the base shard"""
+        with self._shards_lock:
+            _merge_shard(shard, self._base)
+            # By identity: list.remove() compares dicts by value and could drop the base
+            self._shards = [other for other in self._shards if other is not shard]
+
+    # ========== Declaration ==========
+
+    def counter(self, name, documentation):
+        """Declare a counter"""
+        self._types[name] = 'counter'
+        self._help[name] = documentation
+
+    def gauge(self, name, documentation, callback=None, derive=None):
+        """Declare a gauge, optionally computed at scrape time
+
+        ``callback()`` reads outside state; ``derive(snapshot)`` computes
+        the gauge from the metrics the scrape already collected.
+        """
+        self._types[name] = 'gauge'
+        self._help[name] = documentation
+        if callback is not None:
+            self._callbacks[name] = callback
+        if derive is not None:
+            self._derived[name] = derive
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        """Declare a histogram"""
+        self._types[name] = 'histogram'
+        self._help[name] = documentation
+        self._buckets[name] = tuple(buckets)
+
+    # ========== Hot path ==========
+
+    def inc(self, name, labels=(), value=1):
+        """Increment a counter"""
+        counters = self._shard()['counters']
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def add(self, name, labels=(), value=1):
+        """Add to a gauge (use a negative value to decrement)"""
+        gauges = self._shard()['gauges']
+        key = (name, labels)
+        gauges[key] = gauges.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        """Record a histogram observation"""
+        histograms = self._shard()['histograms']
+        key = (name, labels)
+        state = histograms.get(key)
+        buckets = self._buckets[name]
+        if state is None:
+            # One slot per bucket, one for +Inf, then sum
+            state = [0] * (len(buckets) + 1) + [0.0]
+            histograms[key] = state
+        state[bisect_left(buckets, value)] += 1
+        state[-1] += value
+
+    # ========== Aggregation ==========
+
+    def snapshot(self):
+        """Sum every thread shard into one snapshot"""
+        snap = _new_shard()
+        # Held while summing so a retiring shard is counted exactly once
+        with self._shards_lock:
+            for shard in self._shards:
+                _merge_shard(shard, snap)
+        return snap
+
+    def maybe_flush(self):
+        """Write this worker's snapshot if the flush interval has elapsed"""
+        if self.multiproc_dir is None:
+            return
+        now = time.monotonic()
+        if now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        self.flush()
+
+    def flush(self):
+        """Write this worker's snapshot to the multiprocess directory"""
+        if self.multiproc_dir is None:
+            return
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        if self._flushing_pid != os.getpid():
+            # First flush in this worker: any file with our pid is left over
+            # from an exited worker that had the same pid
+            self.merge_dead_workers()
+            self._flushing_pid = os.getpid()
+
+        snap = self.snapshot()
+        payload = {
+            'pid': os.getpid(),
+            'counters': [[k[0], list(k[1]), v] for k, v in snap['counters'].items()],
+            'gauges': [[k[0], list(k[1]), v] for k, v in snap['gauges'].items()],
+            'histograms': [[k[0], list(k[1]), v] for k, v in snap['histograms'].items()],
+        }
+        _write_json(os.path.join(self.multiproc_dir, f'metrics_{os.getpid()}.json'), payload)
+
+    def merge_dead_workers(self):
+        """Fold the files of exited workers into the aggregate file and delete them
+
+        Like prometheus_client's mark_process_dead: counters and histograms
+        are kept so totals never go backwards, gauges are dropped because
+        they describe a dead process. Returns the number of files merged.
+        """
+        if self.multiproc_dir is None:
+            return 0
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        with self._directory_lock(exclusive=True):
+            aggregate_path = os.path.join(self.multiproc_dir, AGGREGATE_FILE)
+            counters, histograms = {}, {}
+            payload = _read_json(aggregate_path)
+            if payload is not None:
+                _merge_payload(payload, counters, {}, histograms)
+
+            dead = []
+            for filename, payload in self._worker_files():
+                pid = payload['pid']
+                stale_own = pid == os.getpid() and self._flushing_pid != pid
+                if stale_own or not _pid_alive(pid):
+                    _merge_payload(payload, counters, {}, histograms)
+                    dead.append(filename)
+            if not dead:
+                return 0
+
+            _write_json(aggregate_path, {
+                'pid': None,
+                'counters': [[k[0], list(k[1]), v] for k, v in counters.items()],
+                'gauges': [],
+                'histograms': [[k[0], list(k[1]), v] for k, v in histograms.items()],
+            })
+            for filename in dead:
+                try:
+                    os.remove(os.path.join(self.multiproc_dir, filename))
+                except FileNotFoundError:
+                    pass
+            return len(dead)
+
+    def _worker_files(self):
+        for filename in os.listdir(self.multiproc_dir):
+            if not filename.startswith('metrics_') or not filename.endswith('.json') or filename == AGGREGATE_FILE:
+                continue
+            payload = _read_json(os.path.join(self.multiproc_dir, filename))
+            if payload is not None:
+                yield filename, payload
+
+    @contextmanager
+    def _directory_lock(self, exclusive):
+        """Keep scrapes from reading a dead worker's file and the aggregate it was just merged into"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.multiproc_dir, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def collect(self):
+        """Collect metrics for this process or, in multiprocess mode, all workers"""
+        if self.multiproc_dir is None:
+            return self.snapshot()
+
+        self.flush()
+        counters, gauges, histograms = {}, {}, {}
+        with self._directory_lock(exclusive=False):
+            payload = _read_json(os.path.join(self.multiproc_dir, AGGREGATE_FILE))
+            if payload is not None:
+                _merge_payload(payload, counters, gauges, histograms)
+            for _, payload in self._worker_files():
+                # Workers that exited since the last merge keep their counters;
+                # their gauges are dropped because they describe a dead process.
+                alive_gauges = gauges if _pid_alive(payload['pid']) else {}
+                _merge_payload(payload, counters, alive_gauges, histograms)
+
+        return {'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        snap = self.collect()
+        computed = [(name, callback) for name, callback in self._callbacks.items()]
+        computed += [(name, lambda derive=derive: derive(snap)) for name, derive in self._derived.items()]
+        for name, compute in computed:
+            try:
+                for labels, value in compute():
+                    snap['gauges'][(name, labels)] = value
+            except Exception:
+                continue
+
+        by_name = {}
+        for kind in ('counters', 'gauges', 'histograms'):
+            for (name, labels), value in snap[kind].items():
+                by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(by_name):
+            metric_type = self._types.get(name, 'untyped')
+            if name in self._help:
+                lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+            for labels, value in sorted(by_name[name]):
+                if metric_type == 'histogram':
+                    lines.extend(self._render_histogram(name, labels, value))
+                else:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, name, labels, state):
+        buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+        cumulative = 0
+        for bound, count in zip(buckets, state):
+            cumulative += count
+            yield f'{name}_bucket{_format_labels(labels + (("le", repr(bound)),))} {cumulative}'
+        cumulative += state[len(buckets)]
+        yield f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {cumulative}'
+        yield f'{name}_sum{_format_labels(labels)} {_format_value(state[-1])}'
+        yield f'{name}_count{_format_labels(labels)} {cumulative}'
+
+class track_in_flight:
+    """Context manager that counts concurrent executions in a gauge"""
+    __slots__ = ('name', 'labels')
+
+    def __init__(self, name, labels=()):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        registry.add(self.name, self.labels, 1)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        registry.add(self.name, self.labels, -1)
+        return False
+
+class _ThreadSentinel:
+    """Weak-referenceable marker kept in a thread's locals"""
+    __slots__ = ('__weakref__',)
+
+def _new_shard():
+    return {'counters': {}, 'gauges': {}, 'histograms': {}}
+
+def _merge_shard(shard, into):
+    counters, gauges, histograms = into['counters'], into['gauges'], into['histograms']
+    for key, value in list(shard['counters'].items()):
+        counters[key] = counters.get(key, 0) + value
+    for key, value in list(shard['gauges'].items()):
+        gauges[key] = gauges.get(key, 0) + value
+    for key, state in list(shard['histograms'].items()):
+        merged = histograms.get(key)
+        if merged is None:
+            histograms[key] = list(state)
+        else:
+            for i, v in enumerate(state):
+                merged[i] += v
+
+def _merge_payload(payload, counters, gauges, histograms):
+    for name, labels, value in payload['counters']:
+        key = (name, tuple(tuple(l) for l in labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, state in payload['histograms']:
+        key = (name, tuple(tuple(l) for l in labels))
+        merged = histograms.get(key)
+        if merged is None:
+            histograms[key] = list(state)
+        else:
+            for i, v in enumerate(state):
+                merged[i] += v
+    for name, labels, value in payload['gauges']:
+        key = (name, tuple(tuple(l) for l in labels))
+        gauges[key] = gauges.get(key, 0) + value
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, payload):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+registry = MetricsRegistry(
+    multiproc_dir=os.getenv('METRICS_MULTIPROC_DIR') or None,
+    flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', '5')),
+)
+
+registry.counter('http_requests_total', 'HTTP requests by blueprint, route, method and status')
+registry.histogram('http_request_duration_seconds', 'HTTP request latency by blueprint and route')
+registry.gauge('http_requests_in_flight', 'HTTP requests currently being served')
+registry.counter('cache_requests_total', 'Cache lookups by cache and result')
+registry.gauge('cache_hit_ratio', 'Cache hit ratio since process start', derive=lambda snap: _cache_hit_ratios(snap))
+registry.gauge('bcrypt_in_flight', 'Password hashes being computed or waiting for a CPU')
+registry.histogram('bcrypt_duration_seconds', 'Time spent hashing or checking passwords',
+                   buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0))
+registry.counter('location_updates_total', 'Location updates ingested by source')
+registry.counter('log_records_dropped_total', 'Log records dropped because the log queue was full')
+
+def record_cache_lookup(cache_name, hit):
+    """Count a cache lookup"""
+    registry.inc('cache_requests_total', (('cache', cache_name), ('result', 'hit' if hit else 'miss')))
+
+def _cache_hit_ratios(snap):
+    totals = {}
+    for (name, labels), value in snap['counters'].items():
+        if name != 'cache_requests_total':
+            continue
+        label_map = dict(labels)
+        hits, total = totals.get(label_map['cache'], (0, 0))
+        if label_map['result'] == 'hit':
+            hits += value
+        totals[label_map['cache']] = (hits, total + value)
+    return [((('cache', cache_name),), hits / total) for cache_name, (hits, total) in totals.items() if total]
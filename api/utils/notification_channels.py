@@ -0,0 +1,53 @@
+import time
+import random
+import threading
+
+class ChannelError(Exception):
+    """Transient delivery failure; the notification may be retried"""
+
+class FakeChannel:
+    """Local stand-in for an SMS, push or email provider, for development, tests and benchmarks
+
+    Each send sleeps for a random latency and fails transiently at
+    ``error_rate``. Delivered messages are kept in ``sent`` (the most
+    recent ``keep`` of them) so tests can inspect them.
+    """
+
+    def __init__(self, name, latency_ms=(20, 120), error_rate=0.02, keep=1000, seed=None):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.keep = keep
+        self.sent = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def send(self, recipient, subject, body):
+        """Deliver one message; ``recipient`` has id, email, phone and first_name"""
+        with self._lock:
+            roll = self._random.random()
+            latency = self._random.uniform(*self.latency_ms) / 1000
+        time.sleep(latency)
+        if roll < self.error_rate:
+            raise ChannelError(f'{self.name} provider temporarily unavailable')
+        with self._lock:
+            self.sent.append((recipient['id'], subject, body))
+            del self.sent[:-self.keep]
+
+def load_channel(name, spec, **options):
+    """Channel adapter from a NOTIFICATION_CHANNELS entry: 'fake' or 'package.module:Class'
+
+    Adapters take the channel name and keyword options and provide
+    ``name`` and ``send(recipient, subject, body)``, raising ChannelError
+    for failures worth retrying. A recipient without an address for the
+    channel (no phone for SMS, say) should simply be skipped. There is no
+    default: the fake channel delivers nothing, so it has to be asked for
+    by name.
+    """
+    if not spec:
+        raise ValueError(f"NOTIFICATION_CHANNELS['{name}'] is not set; use 'package.module:Class', "
+                         "or 'fake' outside production")
+    if spec == 'fake':
+        return FakeChannel(name, **options)
+    from werkzeug.utils import import_string
+    return import_string(spec)(name, **options)
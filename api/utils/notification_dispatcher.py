@@ -0,0 +1,245 @@
+import os
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from utils.metrics import registry as metrics
+from utils.notification_channels import ChannelError, load_channel
+
+logger = logging.getLogger(__name__)
+
+metrics.counter('notifications_sent_total', 'Notification send attempts by channel and result')
+metrics.counter('notifications_coalesced_total', 'Outbox rows folded into another message to the same recipient')
+metrics.histogram('notification_lag_seconds', 'Time from the change to the notification being sent',
+                  buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900))
+
+# Outcome of one coalesced message: status is 'sent', 'retry' or 'failed'
+NotificationResult = namedtuple('NotificationResult', 'ids status error retry_in')
+
+class NotificationDispatcher:
+    """Sends outbox notifications on a pool of worker threads
+
+    Status changes only insert outbox rows in their own transaction, so
+    writes never wait on an SMS or push provider. A poller thread claims
+    due rows in batches through ``claim``, coalesces the rows of each
+    recipient and channel into one message, fans the messages out to the
+    worker pool and records outcomes in batches through ``complete``. Transient
+    channel errors are retried with exponential backoff up to
+    NOTIFICATION_MAX_ATTEMPTS. The poller wakes at once when this process
+    commits outbox rows and otherwise every NOTIFICATION_POLL_SECONDS, so
+    rows written elsewhere (or left by a crashed dispatcher) are picked up
+    too. With NOTIFICATION_WORKERS = 0 nothing runs in the background and
+    wake() sends inline.
+    """
+
+    def __init__(self, app=None):
+        self.channels = {}
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize from app config"""
+        from services.notification_service import NotificationService
+
+        config = app.config
+        options = config.get('NOTIFICATION_CHANNEL_OPTIONS') or {}
+        channels = {
+            name: load_channel(name, spec, **options.get(name, {}))
+            for name, spec in (config.get('NOTIFICATION_CHANNELS') or {}).items()
+        }
+
+        def claim(limit):
+            with app.app_context():
+                return NotificationService.claim(limit)
+
+        def complete(results):
+            with app.app_context():
+                NotificationService.complete(results)
+
+        self.configure(
+            channels,
+            claim,
+            complete,
+            NotificationService.render,
+            workers=config.get('NOTIFICATION_WORKERS', 16),
+            batch_size=config.get('NOTIFICATION_BATCH_SIZE', 500),
+            poll_interval=config.get('NOTIFICATION_POLL_SECONDS', 2),
+            flush_interval=config.get('NOTIFICATION_STATUS_FLUSH_SECONDS', 0.2),
+            max_attempts=config.get('NOTIFICATION_MAX_ATTEMPTS', 5),
+            retry_backoff=config.get('NOTIFICATION_RETRY_BACKOFF', 5),
+        )
+        NotificationService.track_outbox(self.wake)
+        app.extensions['notification_dispatcher'] = self
+
+    def configure(self, channels, claim, complete, render, workers=16, batch_size=500, poll_interval=2,
+                  flush_interval=0.2, max_attempts=5, retry_backoff=5):
+        self.channels = channels
+        self.claim = claim
+        self.complete = complete
+        self.render = render
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._results = []
+        self._results_lock = threading.Lock()
+        self._in_flight = 0  # messages handed to the workers and not yet finished
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._start_lock = threading.Lock()
+        self._executor = None
+        self._stopping = False
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping = False
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='notifications-send')
+            threading.Thread(target=self._poller, name='notifications-poller', daemon=True).start()
+            self._pid = os.getpid()
+
+    def wake(self):
+        """Outbox rows were committed: send them now instead of at the next poll"""
+        if not self.workers:
+            while self.run_once() == self.batch_size:
+                pass
+            return
+        self._ensure_started()
+        self._idle.clear()
+        self._wake.set()
+
+    # ========== Sending ==========
+
+    def run_once(self):
+        """Claim, send and record one batch inline; returns how many outbox rows it held"""
+        rows = self.claim(self.batch_size)
+        if not rows:
+            return 0
+        self.complete([self._send(message) for message in self._coalesce(rows)])
+        return len(rows)
+
+    def _coalesce(self, rows):
+        messages = coalesce(rows)
+        metrics.inc('notifications_coalesced_total', value=len(rows) - len(messages))
+        return messages
+
+    def _send(self, message):
+        ids = [row['id'] for row in message]
+        first = message[0]
+        channel = self.channels.get(first['channel'])
+        if channel is None:
+            return NotificationResult(ids, 'failed', f"Unknown channel {first['channel']}", None)
+
+        attempts = max(row['attempts'] for row in message) + 1
+        try:
+            updates = [(row['event'], row['payload']) for row in latest(message)]
+            subject, body = self.render(first['channel'], first['recipient'], updates)
+            channel.send(first['recipient'], subject, body)
+        except ChannelError as e:
+            metrics.inc('notifications_sent_total', (('channel', channel.name), ('result', 'retryable_error')))
+            if attempts < self.max_attempts:
+                return NotificationResult(ids, 'retry', str(e), self.retry_backoff * 2 ** (attempts - 1))
+            return NotificationResult(ids, 'failed', str(e), None)
+        except Exception as e:
+            logger.error("Notification to %s via %s crashed: %s", first['recipient']['id'], channel.name, e)
+            metrics.inc('notifications_sent_total', (('channel', channel.name), ('result', 'crashed')))
+            return NotificationResult(ids, 'failed', str(e), None)
+
+        metrics.inc('notifications_sent_total', (('channel', channel.name), ('result', 'sent')))
+        lag = datetime.utcnow() - min(row['created_at'] for row in message)
+        metrics.observe('notification_lag_seconds', lag.total_seconds())
+        return NotificationResult(ids, 'sent', None, None)
+
+    def _dispatch(self, message):
+        result = self._send(message)
+        with self._results_lock:
+            self._results.append(result)
+            self._in_flight -= 1
+
+    def flush(self):
+        """Record finished sends now; returns how many messages were recorded"""
+        with self._results_lock:
+            results, self._results = self._results, []
+        if not results:
+            return 0
+        try:
+            self.complete(results)
+        except Exception as e:
+            logger.error("Recording %s notification results failed: %s", len(results), e)
+            with self._results_lock:
+                self._results[:0] = results
+            return 0
+        return len(results)
+
+    def _poller(self):
+        # The next batch is claimed as soon as workers run short of messages rather than when the
+        # last send of the batch finishes, so one slow send never holds up the others. Claiming
+        # whole batches keeps coalescing effective under a backlog. Finished sends are recorded
+        # every flush interval.
+        while not self._stopping:
+            claimed = 0
+            try:
+                self.flush()
+                with self._results_lock:
+                    starving = self._in_flight < self.workers
+                if starving:
+                    rows = self.claim(self.batch_size)
+                    claimed = len(rows)
+                    messages = self._coalesce(rows) if rows else []
+                    with self._results_lock:
+                        self._in_flight += len(messages)
+                    for message in messages:
+                        self._executor.submit(self._dispatch, message)
+            except Exception as e:
+                logger.error("Notification dispatch failed: %s", e)
+            if claimed == self.batch_size:
+                continue
+            with self._results_lock:
+                busy = bool(self._in_flight or self._results)
+            if not busy and not self._wake.is_set():
+                self._idle.set()
+            self._wake.wait(self.flush_interval if busy else self.poll_interval)
+            self._wake.clear()
+
+    def drain(self, timeout=30):
+        """Wait until the poller finds nothing due; for tests, benchmarks and shutdown"""
+        if not self.workers:
+            self.wake()
+            return True
+        self._ensure_started()
+        self._idle.clear()
+        self._wake.set()
+        return self._idle.wait(timeout)
+
+    def shutdown(self, timeout=30):
+        self.drain(timeout)
+        self._stopping = True
+        self._wake.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self.flush()
+        self._pid = None
+
+def coalesce(rows):
+    """Group claimed rows into one message per recipient and channel, oldest first"""
+    messages = {}
+    for row in sorted(rows, key=lambda row: row['created_at']):
+        messages.setdefault((row['recipient']['id'], row['channel']), []).append(row)
+    return list(messages.values())
+
+def latest(message):
+    """The newest row per topic of a message, in order of first appearance"""
+    rows = {}
+    for row in message:
+        rows[row['topic']] = row
+    return list(rows.values())
+
+notification_dispatcher = NotificationDispatcher()
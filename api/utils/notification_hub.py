@@ -0,0 +1,61 @@
+import itertools
+import threading
+from collections import OrderedDict
+from utils.metrics import registry as metrics
+
+class NotificationHub:
+    """Wakes requests waiting on a topic, such as a support ticket, when it changes
+
+    Publishing stamps the topic with a new version from a process-wide
+    counter; a waiter passes the version it last saw and returns as soon as
+    the topic's version differs. Taking the version before querying and
+    waiting on it afterwards means a publish in between is never missed.
+    Conditions exist only while someone waits, so quiet topics cost one
+    dict entry, and the oldest of those are dropped past ``max_topics``.
+
+    The hub only sees publishes from its own process; waiters on other
+    workers must also recheck the database every so often.
+    """
+
+    def __init__(self, max_topics=100000):
+        self._lock = threading.Lock()
+        self._versions = OrderedDict()  # topic -> version of its last publish, oldest first
+        self._waiting = {}  # topic -> [Condition, number of waiters]
+        self._sequence = itertools.count(1)
+        self._max_topics = max_topics
+        metrics.gauge('notification_hub_waiters', 'Requests waiting for a notification', callback=self.waiters)
+
+    def version(self, topic):
+        with self._lock:
+            return self._versions.get(topic, 0)
+
+    def publish(self, topic):
+        with self._lock:
+            self._versions[topic] = next(self._sequence)
+            self._versions.move_to_end(topic)
+            if len(self._versions) > self._max_topics:
+                self._versions.popitem(last=False)
+            entry = self._waiting.get(topic)
+            if entry is not None:
+                entry[0].notify_all()
+
+    def wait(self, topic, version, timeout):
+        """Block until the topic's version differs from ``version`` or ``timeout`` passes; returns its version"""
+        with self._lock:
+            entry = self._waiting.get(topic)
+            if entry is None:
+                entry = self._waiting[topic] = [threading.Condition(self._lock), 0]
+            entry[1] += 1
+            try:
+                entry[0].wait_for(lambda: self._versions.get(topic, 0) != version, timeout)
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._waiting[topic]
+            return self._versions.get(topic, 0)
+
+    def waiters(self):
+        with self._lock:
+            return sum(count for _, count in self._waiting.values())
+
+notification_hub = NotificationHub()
@@ -0,0 +1,114 @@
+import hmac
+import time
+import random
+import hashlib
+import threading
+import uuid
+from collections import namedtuple
+
+# status is 'completed', 'failed' or 'pending' (final status arrives by webhook)
+GatewayResult = namedtuple('GatewayResult', 'status transaction_id error')
+
+class GatewayError(Exception):
+    """Transient gateway failure; the charge may be retried"""
+
+class GatewayTimeout(GatewayError):
+    """The gateway did not answer in time"""
+
+def sign_webhook(secret, body):
+    """Hex HMAC-SHA256 of a webhook body"""
+    return hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+def verify_webhook(secret, body, signature):
+    return bool(secret and signature) and hmac.compare_digest(sign_webhook(secret, body), signature)
+
+class FakeGateway:
+    """Local stand-in for a card gateway, for development, tests and benchmarks
+
+    Each charge sleeps for a random latency and then succeeds, declines,
+    fails transiently or times out at the configured rates. Charges are
+    idempotent per payment id, as with a real gateway's idempotency key,
+    so a retry after a timeout never charges twice; refunds likewise. With ``pending_rate``
+    some charges answer 'pending' and report their final status later
+    through ``notify(payment_id, status, transaction_id, error)``.
+    """
+    name = 'fake'
+
+    def __init__(self, latency_ms=(50, 300), decline_rate=0.02, error_rate=0.05, timeout_rate=0.01,
+                 pending_rate=0.0, notify=None, seed=None):
+        self.latency_ms = latency_ms
+        self.decline_rate = decline_rate
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.pending_rate = pending_rate
+        self.notify = notify
+        self._random = random.Random(seed)
+        self._charges = {}
+        self._refunds = {}
+        self._lock = threading.Lock()
+
+    def charge(self, payment_id, amount, payment_method, timeout):
+        done, roll, latency = self._call(self._charges, payment_id, timeout)
+        if done is not None:
+            return done
+
+        transaction_id = f'fake_{uuid.uuid4().hex}'
+        if roll < self.decline_rate:
+            result = GatewayResult('failed', transaction_id, 'Card declined')
+        elif roll - self.decline_rate < self.pending_rate and self.notify is not None:
+            result = GatewayResult('pending', transaction_id, None)
+            timer = threading.Timer(latency, self.notify, (payment_id, 'completed', transaction_id, None))
+            timer.daemon = True
+            timer.start()
+        else:
+            result = GatewayResult('completed', transaction_id, None)
+
+        with self._lock:
+            self._charges[payment_id] = result
+        return result
+
+    def refund(self, payment_id, transaction_id, amount, timeout):
+        done, _, _ = self._call(self._refunds, payment_id, timeout)
+        if done is not None:
+            return done
+        result = GatewayResult('completed', f'fake_refund_{uuid.uuid4().hex}', None)
+        with self._lock:
+            self._refunds[payment_id] = result
+        return result
+
+    def _call(self, done, payment_id, timeout):
+        """Simulate the round trip; returns (earlier result, roll left for the outcome, latency)"""
+        with self._lock:
+            previous = done.get(payment_id)
+            roll = self._random.random()
+            latency = self._random.uniform(*self.latency_ms) / 1000
+        if previous is not None:
+            return previous, roll, latency
+
+        if roll < self.timeout_rate:
+            time.sleep(timeout)
+            raise GatewayTimeout(f'Gateway did not answer within {timeout}s')
+        time.sleep(min(latency, timeout))
+        if latency > timeout:
+            raise GatewayTimeout(f'Gateway did not answer within {timeout}s')
+        roll -= self.timeout_rate
+        if roll < self.error_rate:
+            raise GatewayError('Gateway temporarily unavailable')
+        return None, roll - self.error_rate, latency
+
+def load_gateway(spec, **options):
+    """Gateway adapter from a PAYMENT_GATEWAY setting: 'fake' or 'package.module:Class'
+
+    Adapters take keyword options and provide ``name``,
+    ``charge(payment_id, amount, payment_method, timeout)`` and
+    ``refund(payment_id, transaction_id, amount, timeout)``, both returning
+    a GatewayResult or raising GatewayError. There is no default: the fake
+    gateway declines and fails real charges at random, so it has to be
+    asked for by name.
+    """
+    if not spec:
+        raise ValueError("PAYMENT_GATEWAY is not set; use 'package.module:Class', or 'fake' outside production")
+    if spec == 'fake':
+        return FakeGateway(**options)
+    from werkzeug.utils import import_string
+    return import_string(spec)(**options)
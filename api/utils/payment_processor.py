@@ -0,0 +1,229 @@
+import os
+import time
+import heapq
+import queue
+import logging
+import threading
+from collections import namedtuple
+from utils.metrics import registry as metrics
+from utils.payment_gateway import GatewayError, load_gateway
+
+logger = logging.getLogger(__name__)
+
+metrics.counter('payment_charges_total', 'Gateway charge attempts by result')
+metrics.histogram('payment_gateway_seconds', 'Gateway charge latency')
+
+# Final status of a charge, written to the payments table in batches
+PaymentResult = namedtuple('PaymentResult', 'payment_id status transaction_id gateway error attempts')
+
+class _Job:
+    __slots__ = ('payment_id', 'amount', 'payment_method', 'attempts')
+
+    def __init__(self, payment_id, amount, payment_method):
+        self.payment_id = payment_id
+        self.amount = amount
+        self.payment_method = payment_method
+        self.attempts = 0
+
+class PaymentProcessor:
+    """Charges payments on a pool of worker threads
+
+    submit() only enqueues, so the request that created the payment
+    returns while it is still 'processing'. Workers call the gateway
+    with a timeout; timeouts and transient errors are retried with
+    exponential backoff until PAYMENT_MAX_ATTEMPTS, then the payment
+    fails. Final statuses from workers and from gateway webhooks are
+    written by one flusher thread in batches through ``apply_results``.
+    Threads start on first use in each process, so forking servers get
+    their own pool per worker. With PAYMENT_WORKERS = 0 nothing runs in
+    the background: charges run inline and are written before submit()
+    returns, and webhook statuses before record_result() returns.
+    """
+
+    def __init__(self, app=None):
+        self.gateway = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize from app config"""
+        from services.payment_service import PaymentService
+
+        config = app.config
+        options = dict(config.get('PAYMENT_GATEWAY_OPTIONS') or {})
+        if config.get('PAYMENT_GATEWAY') == 'fake':
+            options.setdefault('notify', self.record_result)
+
+        def apply_results(results):
+            with app.app_context():
+                PaymentService.apply_gateway_results(results)
+
+        self.configure(
+            load_gateway(config.get('PAYMENT_GATEWAY'), **options),
+            apply_results,
+            workers=config.get('PAYMENT_WORKERS', 8),
+            max_attempts=config.get('PAYMENT_MAX_ATTEMPTS', 4),
+            timeout=config.get('PAYMENT_GATEWAY_TIMEOUT', 10),
+            retry_backoff=config.get('PAYMENT_RETRY_BACKOFF', 0.5),
+            flush_interval=config.get('PAYMENT_STATUS_FLUSH_SECONDS', 0.2),
+            batch_size=config.get('PAYMENT_STATUS_BATCH_SIZE', 500),
+        )
+        app.extensions['payment_processor'] = self
+
+    def configure(self, gateway, apply_results, workers=8, max_attempts=4, timeout=10, retry_backoff=0.5,
+                  flush_interval=0.2, batch_size=500):
+        self.gateway = gateway
+        self.apply_results = apply_results
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.retry_backoff = retry_backoff
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._delayed = []  # (due, sequence, job) retries waiting for their backoff
+        self._delayed_ready = threading.Condition()
+        self._sequence = 0
+        self._results = []
+        self._results_lock = threading.Lock()
+        self._flush_now = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stopping = False
+        self._pid = None
+        metrics.gauge('payment_queue_depth', 'Payments waiting for a worker', callback=self._queue.qsize)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping = False
+            threads = [self._worker] * self.workers + [self._schedule_retries, self._flusher]
+            for target in threads:
+                threading.Thread(target=target, name=f'payments-{target.__name__.strip("_")}', daemon=True).start()
+            self._pid = os.getpid()
+
+    # ========== Jobs ==========
+
+    def submit(self, payment_id, amount, payment_method):
+        """Queue a charge for a payment already committed as 'processing'"""
+        job = _Job(payment_id, amount, payment_method)
+        if not self.workers:
+            while not self._attempt(job):
+                time.sleep(self._backoff(job))
+            return
+        self._ensure_started()
+        self._queue.put(job)
+
+    def _backoff(self, job):
+        return self.retry_backoff * 2 ** (job.attempts - 1)
+
+    def _attempt(self, job):
+        """Charge once; returns False if the job should be retried"""
+        job.attempts += 1
+        start = time.perf_counter()
+        try:
+            result = self.gateway.charge(job.payment_id, job.amount, job.payment_method, self.timeout)
+        except GatewayError as e:
+            metrics.observe('payment_gateway_seconds', time.perf_counter() - start)
+            metrics.inc('payment_charges_total', (('result', 'retryable_error'),))
+            if job.attempts < self.max_attempts:
+                logger.warning("Payment %s attempt %s failed: %s", job.payment_id, job.attempts, e)
+                return False
+            self.record_result(job.payment_id, 'failed', None, str(e), job.attempts)
+            return True
+        except Exception as e:
+            logger.error("Payment %s gateway call crashed: %s", job.payment_id, e)
+            metrics.inc('payment_charges_total', (('result', 'crashed'),))
+            self.record_result(job.payment_id, 'failed', None, str(e), job.attempts)
+            return True
+
+        metrics.observe('payment_gateway_seconds', time.perf_counter() - start)
+        metrics.inc('payment_charges_total', (('result', result.status),))
+        if result.status != 'pending':
+            self.record_result(job.payment_id, result.status, result.transaction_id, result.error, job.attempts)
+        return True
+
+    def _worker(self):
+        while not self._stopping:
+            try:
+                job = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                if not self._attempt(job):
+                    with self._delayed_ready:
+                        self._sequence += 1
+                        heapq.heappush(self._delayed, (time.monotonic() + self._backoff(job), self._sequence, job))
+                        self._delayed_ready.notify()
+            finally:
+                self._queue.task_done()
+
+    def _schedule_retries(self):
+        while not self._stopping:
+            with self._delayed_ready:
+                wait = self._delayed[0][0] - time.monotonic() if self._delayed else 1.0
+                if wait > 0:
+                    self._delayed_ready.wait(min(wait, 1.0))
+                    continue
+                _, _, job = heapq.heappop(self._delayed)
+                self._queue.put(job)
+
+    # ========== Results ==========
+
+    def record_result(self, payment_id, status, transaction_id=None, error=None, attempts=None):
+        """Queue a final status, e.g. from a gateway webhook"""
+        result = PaymentResult(payment_id, status, transaction_id, self.gateway.name, error, attempts)
+        with self._results_lock:
+            self._results.append(result)
+            full = len(self._results) >= self.batch_size
+        if not self.workers:
+            self.flush()
+        elif full:
+            self._flush_now.set()
+
+    def flush(self):
+        """Write queued statuses now; returns how many were written"""
+        written = 0
+        while True:
+            with self._results_lock:
+                batch, self._results = self._results[:self.batch_size], self._results[self.batch_size:]
+            if not batch:
+                return written
+            try:
+                self.apply_results(batch)
+            except Exception as e:
+                logger.error("Writing %s payment statuses failed: %s", len(batch), e)
+                with self._results_lock:
+                    self._results[:0] = batch
+                return written
+            written += len(batch)
+
+    def _flusher(self):
+        while not self._stopping:
+            self._flush_now.wait(self.flush_interval)
+            self._flush_now.clear()
+            self.flush()
+
+    def drain(self, timeout=30):
+        """Wait until every submitted charge has a written status; for tests, benchmarks and shutdown"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._delayed_ready:
+                delayed = len(self._delayed)
+            if not delayed and self._queue.unfinished_tasks == 0:
+                with self._results_lock:
+                    if not self._results:
+                        return True
+                self.flush()
+            time.sleep(0.01)
+        return False
+
+    def shutdown(self, timeout=30):
+        self.drain(timeout)
+        self._stopping = True
+        self._pid = None
+
+payment_processor = PaymentProcessor()
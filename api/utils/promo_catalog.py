@@ -0,0 +1,199 @@
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime
+from utils.errors import ValidationError
+
+logger = logging.getLogger(__name__)
+
+def normalize_code(code):
+    return str(code or '').strip().upper()
+
+class Promo:
+    """Read-only snapshot of one promo code"""
+    __slots__ = ('id', 'code', 'discount_type', 'discount_value', 'max_discount', 'min_order_amount',
+                 'max_uses', 'current_uses', 'max_uses_per_user', 'valid_from', 'valid_till',
+                 'applicable_roles')
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.code = normalize_code(row['code'])
+        self.discount_type = row.get('discount_type') or 'fixed'
+        self.discount_value = float(row['discount_value'] or 0)
+        self.max_discount = float(row['max_discount']) if row.get('max_discount') is not None else None
+        self.min_order_amount = float(row.get('min_order_amount') or 0)
+        self.max_uses = row.get('max_uses')
+        self.current_uses = row.get('current_uses') or 0
+        self.max_uses_per_user = row.get('max_uses_per_user')
+        self.valid_from = row.get('valid_from')
+        self.valid_till = row.get('valid_till')
+        roles = row.get('applicable_roles')
+        self.applicable_roles = {r.strip() for r in roles.split(',') if r.strip()} if roles else None
+
+    def discount_for(self, amount):
+        """Discount on an order amount, capped by max_discount and the amount itself"""
+        if self.discount_type == 'percentage':
+            discount = amount * self.discount_value / 100
+            if self.max_discount is not None:
+                discount = min(discount, self.max_discount)
+        else:
+            discount = self.discount_value
+        return round(max(0.0, min(discount, amount)), 2)
+
+class _Usage:
+    """Uses of one code handed out by this process"""
+    __slots__ = ('leased', 'pending', 'used_at', 'lock')
+
+    def __init__(self):
+        self.leased = 0  # reserved in the database, not yet handed out
+        self.pending = 0  # handed out, not yet added to current_uses
+        self.used_at = 0.0
+        self.lock = threading.Lock()
+
+class PromoCatalog:
+    """Active promo codes held in memory and refreshed every ``refresh_seconds``
+
+    ``store`` loads the codes and persists usage. Uncapped codes count
+    redemptions locally and add them to ``current_uses`` in one UPDATE per
+    flush. Capped codes reserve uses from the database in blocks of
+    ``lease_size`` with a conditional UPDATE, so ``max_uses`` is never
+    exceeded while the row is written once per block rather than once
+    per redemption; blocks idle for ``lease_idle_seconds`` are handed back.
+    """
+
+    def __init__(self, store, refresh_seconds=30, flush_seconds=5, lease_size=20, lease_idle_seconds=30):
+        self.store = store
+        self.refresh_seconds = refresh_seconds
+        self.flush_seconds = flush_seconds
+        self.lease_size = lease_size
+        self.lease_idle_seconds = lease_idle_seconds
+        self._codes = None
+        self._loaded_at = 0.0
+        self._flushed_at = time.monotonic()
+        self._usage = {}
+        self._refresh_lock = threading.Lock()
+        self._usage_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        atexit.register(self.flush, force=True)
+
+    # ========== Catalog ==========
+
+    def _load(self):
+        self._codes = {normalize_code(row['code']): Promo(row) for row in self.store.load()}
+        self._loaded_at = time.monotonic()
+
+    def codes(self):
+        """Current {code: Promo}; only the first load blocks callers"""
+        if self._codes is None:
+            with self._refresh_lock:
+                if self._codes is None:
+                    self._load()
+        elif time.monotonic() - self._loaded_at > self.refresh_seconds and self._refresh_lock.acquire(blocking=False):
+            try:
+                self._load()
+            except Exception as e:
+                logger.error("Promo catalog refresh failed: %s", e)
+                self._loaded_at = time.monotonic()
+            finally:
+                self._refresh_lock.release()
+        return self._codes
+
+    def invalidate(self):
+        """Reload on next use, e.g. after an admin edit in this process"""
+        self._loaded_at = 0.0
+
+    def _usage_for(self, promo_id):
+        usage = self._usage.get(promo_id)
+        if usage is None:
+            with self._usage_lock:
+                usage = self._usage.setdefault(promo_id, _Usage())
+        return usage
+
+    def check(self, code, order_amount=None, role=None, now=None):
+        """(promo, discount) for a code, or ValidationError; no database access"""
+        promo = self.codes().get(normalize_code(code))
+        now = now or datetime.utcnow()
+        if (promo is None or (promo.valid_from and promo.valid_from > now)
+                or (promo.valid_till and promo.valid_till < now)):
+            raise ValidationError('Invalid or expired promo code')
+        if promo.applicable_roles and role not in promo.applicable_roles:
+            raise ValidationError('Promo code is not available for this account')
+        if promo.max_uses is not None:
+            usage = self._usage_for(promo.id)
+            if promo.current_uses >= promo.max_uses and not usage.leased:
+                raise ValidationError('Promo code usage limit reached')
+        if order_amount is None:
+            return promo, None
+        if order_amount < promo.min_order_amount:
+            raise ValidationError(f'Order amount must be at least {promo.min_order_amount:.2f} for this promo code')
+        return promo, promo.discount_for(order_amount)
+
+    # ========== Usage ==========
+
+    def claim(self, promo):
+        """Take one use before redeeming; release() it if the redemption rolls back"""
+        if promo.max_uses is None:
+            return
+        usage = self._usage_for(promo.id)
+        with usage.lock:
+            usage.used_at = time.monotonic()
+            if not usage.leased:
+                usage.leased = self.store.reserve(promo.id, self.lease_size)
+                if not usage.leased:
+                    raise ValidationError('Promo code usage limit reached')
+            usage.leased -= 1
+
+    def release(self, promo):
+        """Give back a claimed use whose redemption did not commit"""
+        if promo.max_uses is None:
+            return
+        usage = self._usage_for(promo.id)
+        with usage.lock:
+            usage.leased += 1
+
+    def redeemed(self, promo):
+        """Count a committed redemption; capped codes were counted when leased"""
+        if promo.max_uses is not None:
+            return
+        usage = self._usage_for(promo.id)
+        with usage.lock:
+            usage.pending += 1
+            usage.used_at = time.monotonic()
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed_at >= self.flush_seconds:
+            self.flush()
+
+    def flush(self, force=False):
+        """Write pending uses and hand back idle leases; never raises"""
+        if not self._flush_lock.acquire(blocking=force):
+            return
+        try:
+            self._flushed_at = time.monotonic()
+            deltas, taken = {}, {}
+            for promo_id, usage in list(self._usage.items()):
+                with usage.lock:
+                    idle = force or self._flushed_at - usage.used_at >= self.lease_idle_seconds
+                    returned = usage.leased if idle else 0
+                    delta = usage.pending - returned
+                    if not delta and not returned:
+                        continue
+                    taken[promo_id] = (usage.pending, returned)
+                    usage.pending = 0
+                    usage.leased -= returned
+                if delta:
+                    deltas[promo_id] = delta
+            if not deltas:
+                return
+            try:
+                self.store.add_uses(deltas)
+            except Exception as e:
+                logger.error("Promo usage flush failed: %s", e)
+                for promo_id, (pending, returned) in taken.items():
+                    usage = self._usage[promo_id]
+                    with usage.lock:
+                        usage.pending += pending
+                        usage.leased += returned
+        finally:
+            self._flush_lock.release()
@@ -0,0 +1,221 @@
+import re
+import time
+import logging
+from flask import g, has_request_context
+
+logger = logging.getLogger('query_stats')
+
+# Literals are stripped so the same statement with different parameters
+# groups under one key in the slow-query log.
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_sql(statement):
+    """Collapse literals and whitespace so similar statements compare equal"""
+    if isinstance(statement, bytes):
+        statement = statement.decode('utf-8', 'replace')
+    statement = _STRING_LITERAL.sub('?', statement)
+    statement = _NUMBER_LITERAL.sub('?', statement)
+    statement = _PLACEHOLDER_LIST.sub('(?)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+class QueryStats:
+    """Per-request database statistics"""
+    __slots__ = ('count', 'total_ms', 'rows', 'slowest_ms', 'slowest_sql', 'slow_queries')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.rows = 0
+        self.slowest_ms = 0.0
+        self.slowest_sql = None
+        self.slow_queries = []
+
+    def add(self, statement, duration_ms, rowcount):
+        """Record one executed statement"""
+        self.count += 1
+        self.total_ms += duration_ms
+        if rowcount and rowcount > 0:
+            self.rows += rowcount
+        if duration_ms > self.slowest_ms:
+            # Normalizing is only paid for statements that become the slowest
+            self.slowest_ms = duration_ms
+            self.slowest_sql = statement
+
+    def to_dict(self):
+        """Convert to dictionary"""
+        return {
+            'db_queries': self.count,
+            'db_time_ms': round(self.total_ms, 2),
+            'db_rows': self.rows,
+            'slowest_ms': round(self.slowest_ms, 2),
+            'slowest_sql': normalize_sql(self.slowest_sql) if self.slowest_sql else None,
+            'slow_queries': self.slow_queries,
+        }
+
+    def server_timing(self):
+        """Format as a Server-Timing header value"""
+        return f'db;dur={self.total_ms:.2f};desc="{self.count} queries", db-rows;desc="{self.rows}"'
+
+def current_stats():
+    """Get statistics for the current request, if any"""
+    if not has_request_context():
+        return None
+    return g.get('query_stats')
+
+def start_request():
+    """Begin collecting statistics for the current request"""
+    g.query_stats = QueryStats()
+    return g.query_stats
+
+def record_query(statement, parameters, duration_ms, rowcount, explain=None):
+    """Record an executed statement against the current request"""
+    stats = current_stats()
+    if stats is None:
+        return
+
+    stats.add(statement, duration_ms, rowcount)
+
+    threshold = g.get('slow_query_threshold_ms')
+    if threshold is None or duration_ms < threshold:
+        return
+
+    entry = {'sql': normalize_sql(statement), 'duration_ms': round(duration_ms, 2)}
+    if explain is not None and _is_explainable(statement):
+        try:
+            entry['plan'] = explain(statement, parameters)
+        except Exception as e:
+            entry['plan_error'] = str(e)
+    stats.slow_queries.append(entry)
+    logger.warning('Slow query (%.1f ms): %s', duration_ms, entry['sql'])
+
+def _is_explainable(statement):
+    """Only plain reads are explained; EXPLAIN on writes is not side-effect free with ANALYZE"""
+    if isinstance(statement, bytes):
+        statement = statement.decode('utf-8', 'replace')
+    head = statement.lstrip()[:6].upper()
+    return head == 'SELECT' or head.startswith('WITH')
+
+# ========== SQLAlchemy ==========
+
+def instrument_engine(engine_class=None):
+    """Hook SQLAlchemy engine events for every engine in the process"""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    target = engine_class or Engine
+
+    if getattr(target, '_query_stats_instrumented', False):
+        return
+    target._query_stats_instrumented = True
+
+    @event.listens_for(target, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'query_stats' in g:
+            conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(target, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start')
+        if not starts:
+            return
+        duration_ms = (time.perf_counter() - starts.pop()) * 1000
+
+        def explain(sql, params):
+            return _explain_dbapi(cursor.connection, conn.dialect.name, sql, params)
+
+        record_query(statement, parameters, duration_ms, cursor.rowcount, explain)
+
+    @event.listens_for(target, 'handle_error')
+    def _handle_error(context):
+        # A failed statement never reaches after_cursor_execute; drop its start
+        # time so later statements on this pooled connection pop their own
+        if context.connection is None or context.statement is None:
+            return
+        starts = context.connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+def _explain_dbapi(dbapi_connection, dialect, statement, parameters):
+    """Run EXPLAIN for a statement on a separate cursor"""
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    cursor = dbapi_connection.cursor()
+    try:
+        rows = _run_explain(cursor, prefix + statement, parameters or ())
+        return [' '.join(str(col) for col in row) for row in rows]
+    finally:
+        cursor.close()
+
+def _run_explain(cursor, statement, parameters):
+    """Run EXPLAIN inside a savepoint so a failing plan cannot abort the request transaction"""
+    cursor.execute('SAVEPOINT query_stats_explain')
+    try:
+        cursor.execute(statement, parameters)
+        rows = cursor.fetchall()
+    except Exception:
+        cursor.execute('ROLLBACK TO SAVEPOINT query_stats_explain')
+        raise
+    cursor.execute('RELEASE SAVEPOINT query_stats_explain')
+    return rows
+
+# ========== psycopg2 ==========
+
+_timed_cursor_classes = {}
+
+def timed_cursor_class(base):
+    """Build (once) a psycopg2 cursor subclass that times execute()"""
+    cls = _timed_cursor_classes.get(base)
+    if cls is not None:
+        return cls
+
+    def execute(self, query, vars=None):
+        if current_stats() is None:
+            return base.execute(self, query, vars)
+        start = time.perf_counter()
+        try:
+            return base.execute(self, query, vars)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            connection = self.connection
+            record_query(
+                query, vars, duration_ms, self.rowcount,
+                lambda sql, params: _explain_psycopg2(connection, sql, params)
+            )
+
+    cls = type(f'Timed{base.__name__}', (base,), {'execute': execute})
+    _timed_cursor_classes[base] = cls
+    return cls
+
+def _explain_psycopg2(connection, statement, parameters):
+    """Run EXPLAIN on an untimed cursor so it does not count against the request"""
+    import psycopg2.extensions
+    cursor = psycopg2.extensions.cursor(connection)
+    if isinstance(statement, bytes):
+        statement = statement.decode('utf-8', 'replace')
+    try:
+        return [row[0] for row in _run_explain(cursor, 'EXPLAIN ' + statement, parameters)]
+    finally:
+        cursor.close()
+
+_connection_class = None
+
+def instrumented_connection_class():
+    """psycopg2 connection class whose cursors report to the current request"""
+    global _connection_class
+    if _connection_class is not None:
+        return _connection_class
+
+    import psycopg2.extensions
+
+    class InstrumentedConnection(psycopg2.extensions.connection):
+        """Connection that wraps every cursor factory with timing"""
+
+        def cursor(self, *args, **kwargs):
+            factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+            kwargs['cursor_factory'] = timed_cursor_class(factory)
+            return super().cursor(*args, **kwargs)
+
+    _connection_class = InstrumentedConnection
+    return _connection_class
@@ -0,0 +1,172 @@
+import os
+import re
+import mmap
+import math
+import time
+import fcntl
+import struct
+import hashlib
+import tempfile
+import threading
+from utils.metrics import registry as metrics
+
+metrics.counter('rate_limit_checks_total', 'Rate limit checks by policy and result')
+
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+_LEGACY_LIMIT = re.compile(r'^\s*(\d+)\s*(?:per|/)\s*(second|minute|hour|day)s?\s*$')
+
+class Policy:
+    """Token bucket policy: ``limit`` requests per ``period`` seconds, bursting to ``burst``"""
+    __slots__ = ('name', 'rate', 'capacity')
+
+    def __init__(self, name, limit, period, burst=None):
+        self.name = name
+        self.rate = limit / period
+        self.capacity = float(burst if burst is not None else limit)
+
+    @classmethod
+    def parse(cls, name, spec):
+        """Build a policy from a config dict or a legacy '10 per hour' string"""
+        if isinstance(spec, dict):
+            return cls(name, spec['limit'], spec.get('period', 60), spec.get('burst'))
+        match = _LEGACY_LIMIT.match(spec)
+        if not match:
+            raise ValueError(f'Invalid rate limit: {spec}')
+        return cls(name, int(match.group(1)), _PERIODS[match.group(2)])
+
+def _key_hash(key):
+    """Stable 64-bit hash; the builtin hash() differs between worker processes"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class SharedMemoryBackend:
+    """Token buckets in a memory-mapped file shared by every worker on the host
+
+    The file is a fixed array of slots, so a check is one hash, one
+    byte-range lock and one read-modify-write of 24 bytes. Keys that
+    collide on a slot evict each other, which at worst resets a bucket.
+    """
+    SLOT = struct.Struct('<Qdd')  # key hash, tokens, updated_at
+    THREAD_STRIPES = 64
+
+    def __init__(self, path, slots=65536):
+        self.slots = slots
+        size = self.SLOT.size * slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mm = mmap.mmap(self._fd, size)
+        # fcntl locks are per process, so threads of one worker also need a lock
+        self._thread_locks = [threading.Lock() for _ in range(self.THREAD_STRIPES)]
+
+    def take(self, key, rate, capacity, cost=1.0):
+        """Take ``cost`` tokens; returns (allowed, tokens_left)"""
+        h = _key_hash(key)
+        index = h % self.slots
+        offset = index * self.SLOT.size
+
+        with self._thread_locks[index % self.THREAD_STRIPES]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.SLOT.size, offset)
+            try:
+                now = time.time()
+                stored_hash, tokens, updated_at = self.SLOT.unpack_from(self._mm, offset)
+                if stored_hash != h:
+                    tokens, updated_at = capacity, now
+                tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                self.SLOT.pack_into(self._mm, offset, h, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.SLOT.size, offset)
+
+        return allowed, tokens
+
+class RedisBackend:
+    """Token buckets in Redis, updated atomically by a Lua script"""
+
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def take(self, key, rate, capacity, cost=1.0):
+        """Take ``cost`` tokens; returns (allowed, tokens_left)"""
+        allowed, tokens = self._script(keys=[f'ratelimit:{key}'], args=[rate, capacity, cost])
+        return bool(allowed), float(tokens)
+
+def create_backend(url, slots=65536):
+    """Create a limit store from RATELIMIT_STORAGE_URL"""
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    if url.startswith('shm://'):
+        path = url[len('shm://'):]
+    elif url.startswith('memory://'):
+        shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        path = os.path.join(shm_dir, 'courier_ratelimit')
+    else:
+        raise ValueError(f'Unsupported rate limit storage: {url}')
+    return SharedMemoryBackend(path, slots)
+
+class RateLimiter:
+    """Rate limiter extension with named token bucket policies"""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.policies = {}
+        self.enabled = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize from app config"""
+        self.enabled = app.config.get('RATELIMIT_ENABLED', True)
+        self.backend = create_backend(
+            app.config.get('RATELIMIT_STORAGE_URL', 'memory://'),
+            app.config.get('RATELIMIT_SHM_SLOTS', 65536)
+        )
+        self.policies = {
+            name: Policy.parse(name, spec)
+            for name, spec in app.config.get('RATE_LIMIT_POLICIES', {}).items()
+        }
+        app.extensions['rate_limiter'] = self
+
+    def policy(self, name):
+        """Look up a named policy, accepting legacy '10 per hour' strings"""
+        policy = self.policies.get(name)
+        if policy is None:
+            policy = Policy.parse(name, name)
+            self.policies[name] = policy
+        return policy
+
+    def hit(self, policy_name, identity, cost=1.0):
+        """Consume from the bucket; returns (allowed, retry_after_seconds)"""
+        if not self.enabled or self.backend is None:
+            return True, 0
+        policy = self.policy(policy_name)
+        allowed, tokens = self.backend.take(f'{policy.name}:{identity}', policy.rate, policy.capacity, cost)
+        metrics.inc('rate_limit_checks_total', (('policy', policy.name), ('result', 'allowed' if allowed else 'rejected')))
+        if allowed:
+            return True, 0
+        return False, math.ceil((cost - tokens) / policy.rate)
+
+limiter = RateLimiter()
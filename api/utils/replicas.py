@@ -0,0 +1,257 @@
+import time
+import random
+import logging
+import threading
+from functools import wraps
+from utils.metrics import registry as metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.counter('db_reads_total', 'Reads routed by @replica_read, by target')
+
+# Zero when the replica has replayed everything it received, so an idle
+# primary does not look like lag; otherwise the age of the last replayed
+# transaction. A server that is not in recovery is a primary: no lag.
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+class Replica:
+    """One read replica and its last observed health"""
+    __slots__ = ('name', 'handle', 'lag', 'healthy', 'checked_at', 'lock')
+
+    def __init__(self, name, handle):
+        self.name = name
+        self.handle = handle
+        self.lag = None
+        self.healthy = False
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+class ReplicaSet:
+    """Pick a replica whose replication lag is within bounds
+
+    ``probe(handle)`` returns the replica's lag in seconds. Probes run on
+    the request path at most once per ``check_interval`` per replica and
+    never concurrently; other threads use the last result meanwhile.
+    Users who wrote within ``sticky_seconds`` read from the primary.
+    """
+
+    def __init__(self, replicas, probe, max_lag=5.0, check_interval=5.0, sticky_seconds=10.0, sticky_cache=None):
+        self.replicas = [Replica(name, handle) for name, handle in replicas]
+        self.probe = probe
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.sticky_seconds = sticky_seconds
+        self.sticky_cache = sticky_cache
+        self._sticky = {}
+        self._sticky_lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def _check(self, replica, now):
+        if not replica.lock.acquire(blocking=False):
+            return
+        try:
+            replica.lag = float(self.probe(replica.handle))
+            replica.healthy = True
+        except Exception as e:
+            logger.warning("Replica %s health check failed: %s", replica.name, e)
+            replica.healthy = False
+        finally:
+            replica.checked_at = now
+            replica.lock.release()
+
+    def choose(self):
+        """A healthy replica within max_lag, or None to use the primary"""
+        now = time.monotonic()
+        candidates = []
+        for replica in self.replicas:
+            if now - replica.checked_at >= self.check_interval:
+                self._check(replica, now)
+            if replica.healthy and replica.lag is not None and replica.lag <= self.max_lag:
+                candidates.append(replica)
+        return random.choice(candidates) if candidates else None
+
+    def mark_failed(self, replica):
+        """Take a replica out of rotation until its next health check"""
+        replica.healthy = False
+        replica.checked_at = time.monotonic()
+
+    def lag_gauge(self):
+        return [((('replica', r.name),), r.lag if r.healthy and r.lag is not None else -1) for r in self.replicas]
+
+    # ========== Read-your-writes ==========
+
+    def mark_write(self, user_id):
+        """Pin a user's reads to the primary for the sticky window"""
+        if not user_id or not self.sticky_seconds:
+            return
+        if self.sticky_cache is not None:
+            self.sticky_cache.set(f'rw_sticky:{user_id}', 1, timeout=max(1, int(self.sticky_seconds)))
+            return
+        with self._sticky_lock:
+            now = time.monotonic()
+            if len(self._sticky) > 10000:
+                self._sticky = {k: v for k, v in self._sticky.items() if v > now}
+            self._sticky[user_id] = now + self.sticky_seconds
+
+    def is_sticky(self, user_id):
+        if not user_id or not self.sticky_seconds:
+            return False
+        if self.sticky_cache is not None:
+            return self.sticky_cache.get(f'rw_sticky:{user_id}') is not None
+        return self._sticky.get(user_id, 0) > time.monotonic()
+
+def replica_name(url):
+    """Host part of a database URL, safe to log and label metrics with"""
+    rest = str(url).split('://', 1)[-1]
+    return rest.rsplit('@', 1)[-1].split('/', 1)[0]
+
+# ========== SQLAlchemy integration ==========
+
+def _probe_engine(engine):
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        return conn.execute(text(LAG_SQL)).scalar() or 0
+
+def init_replicas(app):
+    """Create replica engines from SQLALCHEMY_REPLICA_URIS and track writes"""
+    from sqlalchemy import create_engine
+    from utils.http_cache import shared_cache_configured
+
+    urls = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+    options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    sticky_cache = None
+    if shared_cache_configured(app.config):
+        from app import cache
+        sticky_cache = cache
+
+    replica_set = ReplicaSet(
+        [(replica_name(url), create_engine(url, **options)) for url in urls],
+        _probe_engine,
+        max_lag=app.config.get('REPLICA_MAX_LAG_SECONDS', 5.0),
+        check_interval=app.config.get('REPLICA_LAG_CHECK_INTERVAL', 5.0),
+        sticky_seconds=app.config.get('REPLICA_STICKY_SECONDS', 10.0),
+        sticky_cache=sticky_cache,
+    )
+    app.extensions['replicas'] = replica_set
+    if not replica_set:
+        return replica_set
+
+    metrics.gauge('db_replica_lag_seconds', 'Last observed replica lag; -1 when unhealthy',
+                  callback=replica_set.lag_gauge)
+
+    _track_writes()
+    return replica_set
+
+_tracking_writes = False
+
+def _remember_write(session, flush_context):
+    session.info['wrote'] = True
+
+def _remember_dml(orm_execute_state):
+    # Core insert/update statements run through Session.execute skip flush events
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+def _start_sticky_window(session):
+    from flask import current_app, request, has_request_context
+    if not session.info.get('wrote') or not has_request_context():
+        return
+    user = getattr(request, 'user', None)
+    replica_set = current_app.extensions.get('replicas')
+    if user is not None and replica_set:
+        replica_set.mark_write(user.id)
+
+def _track_writes():
+    global _tracking_writes
+    if _tracking_writes:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    event.listen(Session, 'after_flush', _remember_write)
+    event.listen(Session, 'do_orm_execute', _remember_dml)
+    event.listen(Session, 'after_commit', _start_sticky_window)
+    _tracking_writes = True
+
+def _must_use_primary(session, replica_set):
+    if session.info.get('primary') or session.info.get('wrote'):
+        return True
+    if session.new or session.dirty or session.deleted:
+        return True
+    from flask import request, has_request_context
+    if has_request_context():
+        user = getattr(request, 'user', None)
+        if user is not None and replica_set.is_sticky(user.id):
+            return True
+    return False
+
+def replica_read(f):
+    """Run a read-only service method against a replica when one is fresh enough
+
+    Falls back to the primary when no replica is within the lag bound,
+    when the session has pending writes or wrote earlier in the request,
+    and for users inside their read-your-writes window. A replica that
+    fails mid-read is taken out of rotation and the read retried on the
+    primary.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        from flask import current_app, g, has_app_context, has_request_context
+        from sqlalchemy.exc import DBAPIError, OperationalError
+        from app import db
+
+        replica_set = current_app.extensions.get('replicas') if has_app_context() else None
+        if not replica_set:
+            return f(*args, **kwargs)
+
+        session = db.session()
+        if session.info.get('replica') is not None or _must_use_primary(session, replica_set):
+            if session.info.get('replica') is None:
+                metrics.inc('db_reads_total', (('target', 'primary'),))
+            return f(*args, **kwargs)
+
+        replica = replica_set.choose()
+        if replica is None:
+            metrics.inc('db_reads_total', (('target', 'primary'),))
+            return f(*args, **kwargs)
+
+        metrics.inc('db_reads_total', (('target', 'replica'),))
+        session.info['replica'] = replica.handle
+        if has_request_context():
+            g.replica_read = True
+        try:
+            return f(*args, **kwargs)
+        except DBAPIError as e:
+            # Disconnects, refused connections and recovery conflicts; not SQL errors
+            if not (e.connection_invalidated or isinstance(e, OperationalError)):
+                raise
+            logger.warning("Replica %s failed, retrying on primary: %s", replica.name, e)
+            replica_set.mark_failed(replica)
+            session.info.pop('replica', None)
+            session.rollback()
+            return f(*args, **kwargs)
+        finally:
+            session.info.pop('replica', None)
+    return decorated_function
+
+def primary_only(f):
+    """Keep every read inside a write path on the primary"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        from app import db
+        session = db.session()
+        previous = session.info.get('primary')
+        session.info['primary'] = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            if previous is None:
+                session.info.pop('primary', None)
+    return decorated_function
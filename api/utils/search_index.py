@@ -0,0 +1,121 @@
+import re
+import bisect
+import threading
+
+_WORD = re.compile(r'[0-9a-z]+')
+_NON_DIGIT = re.compile(r'\D')
+# Whole identifiers are stored with this marker, apart from the words they contain
+KEY = '#'
+# Checking one candidate's tokens costs about this many postings entries
+CHECK_COST = 8
+
+def words(text):
+    """Lowercase alphanumeric words of a text"""
+    return _WORD.findall((text or '').lower())
+
+def digits(text):
+    return _NON_DIGIT.sub('', text or '')
+
+class InvertedIndex:
+    """Token postings with prefix lookup, for databases without full-text search
+
+    Tokens are kept in a sorted list beside the postings, so the tokens
+    starting with a prefix are one bisect away. A query expands only its
+    rarest word through the postings and checks its other words against
+    those candidates' own tokens. New tokens are appended and the list is
+    re-sorted on the next lookup, which for a mostly sorted list costs
+    about one pass, so bulk loads stay linear. Documents are dicts of
+    token to weight; identifiers such as order numbers are added whole
+    under KEY so a query can match them by prefix.
+    """
+
+    def __init__(self):
+        self._postings = {}  # token -> {doc_id: weight}
+        self._tokens = []  # keys of _postings, sorted unless _unsorted
+        self._unsorted = False
+        self._docs = {}  # doc_id -> its tokens
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc_id, terms):
+        """Index a document, replacing any earlier version of it"""
+        with self._lock:
+            self.remove(doc_id)
+            for token, weight in terms.items():
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = {}
+                    self._tokens.append(token)
+                    self._unsorted = True
+                postings[doc_id] = weight
+            self._docs[doc_id] = tuple(terms)
+
+    def remove(self, doc_id):
+        with self._lock:
+            for token in self._docs.pop(doc_id, ()):
+                postings = self._postings[token]
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[token]
+                    del self._tokens[bisect.bisect_left(self._sorted_tokens(), token)]
+
+    def _sorted_tokens(self):
+        if self._unsorted:
+            self._tokens.sort()
+            self._unsorted = False
+        return self._tokens
+
+    def _expand(self, prefix):
+        tokens = self._sorted_tokens()
+        for position in range(bisect.bisect_left(tokens, prefix), len(tokens)):
+            if not tokens[position].startswith(prefix):
+                break
+            yield tokens[position]
+
+    def prefix(self, prefix):
+        """{doc_id: best weight} of documents with a token starting with prefix; exact tokens count double"""
+        matches = {}
+        with self._lock:
+            for token in self._expand(prefix):
+                boost = 2.0 if token == prefix else 1.0
+                if not matches:
+                    matches = {doc_id: weight * boost for doc_id, weight in self._postings[token].items()}
+                    continue
+                for doc_id, weight in self._postings[token].items():
+                    score = weight * boost
+                    if score > matches.get(doc_id, 0.0):
+                        matches[doc_id] = score
+        return matches
+
+    def _score(self, doc_id, prefix):
+        """Best weight of a document's tokens starting with prefix, as prefix() scores it"""
+        best = 0.0
+        for token in self._docs[doc_id]:
+            if token.startswith(prefix):
+                score = self._postings[token][doc_id] * (2.0 if token == prefix else 1.0)
+                best = max(best, score)
+        return best
+
+    def search(self, query_words, keys=()):
+        """{doc_id: score} of documents containing every query word as a prefix of one of
+        their words, or with an identifier starting with one of ``keys``"""
+        results = {}
+        if query_words:
+            with self._lock:
+                counts = {word: sum(len(self._postings[t]) for t in self._expand(word)) for word in query_words}
+                rarest, *others = sorted(query_words, key=counts.get)
+                results = self.prefix(rarest)
+                for word in others:
+                    if len(results) * CHECK_COST < counts[word]:
+                        # Few candidates left: check their own tokens rather than expand a common word
+                        scored = ((doc_id, score, self._score(doc_id, word)) for doc_id, score in results.items())
+                        results = {doc_id: score + extra for doc_id, score, extra in scored if extra}
+                    else:
+                        matches = self.prefix(word)
+                        results = {doc_id: results[doc_id] + matches[doc_id] for doc_id in results.keys() & matches.keys()}
+        for key in keys:
+            for doc_id, score in self.prefix(KEY + key).items():
+                results[doc_id] = results.get(doc_id, 0.0) + score
+        return results
@@ -0,0 +1,78 @@
+from models.order import OrderStatus
+from models.delivery import DeliveryStatus
+from utils.errors import ValidationError
+
+class StateMachine:
+    """Allowed status transitions of one kind of record, compiled once at import
+
+    ``transitions`` maps a status to the statuses it may move to; statuses
+    missing from it are terminal. Lookups are frozenset membership tests,
+    and the error text for unknown statuses is built here rather than on
+    every request.
+    """
+
+    def __init__(self, name, statuses, transitions):
+        self.name = name
+        self.statuses = tuple(statuses)
+        self._known = frozenset(self.statuses)
+        self._next = {status: frozenset(transitions.get(status, ())) for status in self.statuses}
+        self._previous = {
+            status: tuple(source for source in self.statuses if status in self._next[source])
+            for status in self.statuses
+        }
+        self._invalid = f'Invalid status. Must be one of: {", ".join(self.statuses)}'
+
+    def validate(self, status):
+        """Raise ValidationError unless ``status`` is one of the machine's statuses"""
+        if status not in self._known:
+            raise ValidationError(self._invalid)
+
+    def predecessors(self, status):
+        """Statuses that may move to ``status``, in declaration order"""
+        return self._previous[status]
+
+    def check(self, from_status, to_status):
+        """Whether moving from ``from_status`` changes anything; raises ValidationError if it is not allowed"""
+        if from_status == to_status:
+            return False
+        if to_status not in self._next.get(from_status, ()):
+            raise ValidationError(f'Cannot change {self.name} status from {from_status} to {to_status}')
+        return True
+
+ORDER_STATES = StateMachine('order', [s.value for s in OrderStatus], {
+    OrderStatus.PENDING.value: (OrderStatus.CONFIRMED.value, OrderStatus.ASSIGNED.value,
+                                OrderStatus.CANCELLED.value, OrderStatus.FAILED.value),
+    OrderStatus.CONFIRMED.value: (OrderStatus.ASSIGNED.value, OrderStatus.CANCELLED.value, OrderStatus.FAILED.value),
+    OrderStatus.ASSIGNED.value: (OrderStatus.IN_TRANSIT.value, OrderStatus.CANCELLED.value, OrderStatus.FAILED.value),
+    OrderStatus.IN_TRANSIT.value: (OrderStatus.DELIVERED.value, OrderStatus.FAILED.value),
+})
+
+# A courier may skip the optional steps, but never go back
+DELIVERY_STATES = StateMachine('delivery', [s.value for s in DeliveryStatus], {
+    DeliveryStatus.ASSIGNED.value: (DeliveryStatus.PICKED_UP.value, DeliveryStatus.IN_TRANSIT.value,
+                                    DeliveryStatus.FAILED.value),
+    DeliveryStatus.PICKED_UP.value: (DeliveryStatus.IN_TRANSIT.value, DeliveryStatus.REACHED_DESTINATION.value,
+                                     DeliveryStatus.DELIVERED.value, DeliveryStatus.FAILED.value),
+    DeliveryStatus.IN_TRANSIT.value: (DeliveryStatus.REACHED_DESTINATION.value, DeliveryStatus.DELIVERED.value,
+                                      DeliveryStatus.FAILED.value),
+    DeliveryStatus.REACHED_DESTINATION.value: (DeliveryStatus.DELIVERED.value, DeliveryStatus.FAILED.value),
+})
+
+# Order status a delivery status implies; other delivery statuses leave the order alone
+DELIVERY_ORDER_STATUS = {
+    DeliveryStatus.PICKED_UP.value: OrderStatus.IN_TRANSIT.value,
+    DeliveryStatus.IN_TRANSIT.value: OrderStatus.IN_TRANSIT.value,
+    DeliveryStatus.DELIVERED.value: OrderStatus.DELIVERED.value,
+    DeliveryStatus.FAILED.value: OrderStatus.FAILED.value,
+}
+
+# Timestamp column set when an order or delivery enters a status
+ORDER_STATUS_TIMESTAMPS = {
+    OrderStatus.IN_TRANSIT.value: 'pickup_time',
+    OrderStatus.DELIVERED.value: 'delivery_time',
+    OrderStatus.CANCELLED.value: 'cancelled_at',
+}
+DELIVERY_STATUS_TIMESTAMPS = {
+    DeliveryStatus.PICKED_UP.value: 'pickup_at',
+    DeliveryStatus.DELIVERED.value: 'delivery_at',
+}
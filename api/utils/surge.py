@@ -0,0 +1,243 @@
+import math
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from utils.geo import geohash
+
+logger = logging.getLogger(__name__)
+
+# Order statuses still waiting for a courier
+OPEN_STATUSES = ('pending', 'confirmed')
+
+class Zone:
+    """Supply and demand of one geohash zone"""
+    __slots__ = ('open_orders', 'couriers', 'multiplier', 'updated_at')
+
+    def __init__(self):
+        self.open_orders = 0
+        self.couriers = OrderedDict()  # courier id -> last seen, oldest first
+        self.multiplier = 1.0
+        self.updated_at = None
+
+class SurgeEngine:
+    """Per-zone surge multipliers from live open orders and idle couriers
+
+    Order and courier events adjust in-memory counts; a quote is one dict
+    lookup plus arithmetic. Each zone's multiplier moves toward its
+    target with an exponential moving average over SURGE_SMOOTHING_SECONDS
+    so prices do not jump on every event. Counts are rebuilt from the
+    database every SURGE_RESYNC_SECONDS, piggybacking on write events,
+    which also folds in events handled by other workers.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._zones = {}
+        self._courier_zones = {}  # courier id -> zone holding it
+        self._busy = set()  # couriers with an active delivery
+        self._lock = threading.Lock()
+        self._resync_lock = threading.Lock()
+        self._resynced_at = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Initialize from app config"""
+        config = app.config
+        self.enabled = config.get('SURGE_ENABLED', True)
+        self.precision = config.get('SURGE_ZONE_PRECISION', 5)
+        self.courier_ttl = config.get('SURGE_COURIER_TTL', 300)
+        self.smoothing = config.get('SURGE_SMOOTHING_SECONDS', 120)
+        self.balanced_ratio = config.get('SURGE_BALANCED_RATIO', 1.0)
+        self.sensitivity = config.get('SURGE_SENSITIVITY', 0.25)
+        self.max_multiplier = config.get('SURGE_MAX_MULTIPLIER', 3.0)
+        self.resync_seconds = config.get('SURGE_RESYNC_SECONDS', 30)
+        app.extensions['surge'] = self
+
+    def zone_of(self, latitude, longitude):
+        return geohash(latitude, longitude, self.precision)
+
+    def _zone(self, key):
+        zone = self._zones.get(key)
+        if zone is None:
+            zone = self._zones[key] = Zone()
+        return zone
+
+    def _available(self, zone, now):
+        # Couriers silent for courier_ttl are assumed offline
+        while zone.couriers:
+            courier_id, seen = next(iter(zone.couriers.items()))
+            if now - seen <= self.courier_ttl:
+                break
+            zone.couriers.popitem(last=False)
+            self._courier_zones.pop(courier_id, None)
+        return len(zone.couriers)
+
+    def _target(self, zone, now):
+        available = self._available(zone, now)
+        if not zone.open_orders:
+            return 1.0
+        ratio = zone.open_orders / max(available, 1)
+        return min(self.max_multiplier, 1.0 + self.sensitivity * max(0.0, ratio - self.balanced_ratio))
+
+    def _update(self, zone, now):
+        target = self._target(zone, now)
+        if zone.updated_at is None:
+            zone.multiplier = target
+        else:
+            alpha = 1.0 - math.exp(-(now - zone.updated_at) / self.smoothing) if self.smoothing else 1.0
+            zone.multiplier += alpha * (target - zone.multiplier)
+        zone.updated_at = now
+        return zone.multiplier
+
+    # ========== Events ==========
+
+    def order_opened(self, latitude, longitude, count=1):
+        """An order is waiting for a courier"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            zone = self._zone(self.zone_of(latitude, longitude))
+            self._update(zone, now)
+            zone.open_orders += count
+
+    def order_closed(self, latitude, longitude):
+        """An open order was assigned or cancelled"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            zone = self._zone(self.zone_of(latitude, longitude))
+            self._update(zone, now)
+            zone.open_orders = max(0, zone.open_orders - 1)
+
+    def courier_seen(self, courier_id, latitude, longitude, finished_delivery=False):
+        """A courier reported a location; ignored while they are on a delivery"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        key = self.zone_of(latitude, longitude)
+        with self._lock:
+            if finished_delivery:
+                self._busy.discard(courier_id)
+            elif courier_id in self._busy:
+                return
+            previous = self._courier_zones.get(courier_id)
+            if previous is not None and previous != key:
+                self._remove_courier(courier_id, now)
+            zone = self._zone(key)
+            self._update(zone, now)
+            zone.couriers[courier_id] = now
+            zone.couriers.move_to_end(courier_id)
+            self._courier_zones[courier_id] = key
+
+    def courier_busy(self, courier_id):
+        """A courier took a delivery"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._busy.add(courier_id)
+            self._remove_courier(courier_id, time.monotonic())
+
+    def _remove_courier(self, courier_id, now):
+        key = self._courier_zones.pop(courier_id, None)
+        if key is None:
+            return
+        zone = self._zones[key]
+        self._update(zone, now)
+        zone.couriers.pop(courier_id, None)
+
+    # ========== Quotes ==========
+
+    def quote(self, latitude, longitude):
+        """Current multiplier and counts for a pickup point"""
+        key = self.zone_of(latitude, longitude)
+        if not self.enabled:
+            return {'zone': key, 'multiplier': 1.0, 'open_orders': None, 'available_couriers': None}
+        now = time.monotonic()
+        with self._lock:
+            zone = self._zones.get(key)
+            if zone is None:
+                return {'zone': key, 'multiplier': 1.0, 'open_orders': 0, 'available_couriers': 0}
+            multiplier = self._update(zone, now)
+            return {
+                'zone': key,
+                'multiplier': round(multiplier, 2),
+                'open_orders': zone.open_orders,
+                'available_couriers': len(zone.couriers),
+            }
+
+    def multiplier(self, latitude, longitude):
+        return self.quote(latitude, longitude)['multiplier']
+
+    def surcharge(self, latitude, longitude, fare):
+        """(multiplier, surcharge) for a fare before surge"""
+        multiplier = self.multiplier(latitude, longitude)
+        return multiplier, round(max(0.0, fare) * (multiplier - 1.0), 2)
+
+    # ========== Resync ==========
+
+    def maybe_resync(self):
+        """Rebuild counts from the database if they are older than SURGE_RESYNC_SECONDS; never raises"""
+        if not self.enabled or time.monotonic() - self._resynced_at < self.resync_seconds:
+            return
+        if not self._resync_lock.acquire(blocking=False):
+            return
+        try:
+            self._resync()
+        except Exception as e:
+            logger.error("Surge resync failed: %s", e)
+        finally:
+            self._resynced_at = time.monotonic()
+            self._resync_lock.release()
+
+    def _resync(self):
+        from app import db
+        from models.order import Order
+        from models.delivery import Delivery, DeliveryStatus
+        from models.user import User, UserRole
+        from datetime import timedelta
+
+        utcnow = datetime.utcnow()
+        open_orders = {}
+        for latitude, longitude in db.session.query(Order.pickup_latitude, Order.pickup_longitude).filter(
+                Order.status.in_(OPEN_STATUSES)):
+            key = self.zone_of(latitude, longitude)
+            open_orders[key] = open_orders.get(key, 0) + 1
+
+        busy = {courier_id for (courier_id,) in db.session.query(Delivery.courier_id).filter(Delivery.status.in_([
+            DeliveryStatus.ASSIGNED.value, DeliveryStatus.PICKED_UP.value,
+            DeliveryStatus.IN_TRANSIT.value, DeliveryStatus.REACHED_DESTINATION.value,
+        ])).distinct()}
+        couriers = db.session.query(User.id, User.latitude, User.longitude, User.updated_at).filter(
+            User.role == UserRole.COURIER.value,
+            User.is_active.is_(True),
+            User.latitude.isnot(None),
+            User.updated_at >= utcnow - timedelta(seconds=self.courier_ttl)
+        ).order_by(User.updated_at).all()
+
+        now = time.monotonic()
+        with self._lock:
+            for zone in self._zones.values():
+                self._update(zone, now)
+                zone.open_orders = 0
+                zone.couriers.clear()
+            self._courier_zones.clear()
+            self._busy = busy
+            for key, count in open_orders.items():
+                self._zone(key).open_orders = count
+            for courier_id, latitude, longitude, updated_at in couriers:
+                if courier_id in busy:
+                    continue
+                key = self.zone_of(latitude, longitude)
+                self._zone(key).couriers[courier_id] = now - (utcnow - updated_at).total_seconds()
+                self._courier_zones[courier_id] = key
+            # Zones with nothing left and a settled multiplier are dropped
+            for key in [k for k, z in self._zones.items()
+                        if not z.open_orders and not z.couriers and z.multiplier < 1.01]:
+                del self._zones[key]
+
+surge = SurgeEngine()
@@ -0,0 +1,130 @@
+import heapq
+import itertools
+import threading
+import time
+from datetime import timedelta
+from utils.metrics import registry as metrics
+
+# Lower ranks are served first when deadlines tie
+PRIORITY_RANK = {'critical': 0, 'high': 1, 'medium': 2, 'low': 3}
+
+def sla_deadline(priority, created_at, sla_hours):
+    """When a ticket's first response is due"""
+    return created_at + timedelta(hours=sla_hours.get(priority, sla_hours.get('medium', 24)))
+
+class TicketQueue:
+    """Waiting support tickets and agent workloads, for routing without table scans
+
+    Tickets wait in a heap ordered by SLA deadline, then priority, then
+    age: each priority's SLA sets the deadline, so urgent tickets jump
+    ahead while old low-priority ones still come up in time. Agents sit in
+    a second heap keyed by their open ticket count, so the least-loaded
+    one is found in O(log n). Both heaps delete lazily: removed tickets
+    and outdated agent loads stay in place until they reach the top.
+
+    The queue is per process and only a routing hint; every assignment is
+    a guarded UPDATE in the database, so a ticket claimed by another
+    worker is simply skipped.
+    """
+
+    def __init__(self):
+        self._tickets = []  # [deadline, rank, created_at, sequence, ticket_id or None when removed]
+        self._entries = {}  # ticket_id -> its heap entry
+        self._agents = []  # (load, agent_id), possibly outdated
+        self._loads = {}  # agent_id -> open tickets
+        self._sequence = itertools.count()  # tie-breaker, so removed entries never compare their None id
+        self._lock = threading.Lock()
+        self.loaded_at = None
+        metrics.gauge('support_queue_depth', 'Support tickets waiting for an agent', callback=self.__len__)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, tickets, agents, loads):
+        """Replace the contents from the database
+
+        ``tickets`` are (ticket_id, priority, deadline, created_at) of
+        unassigned tickets; ``loads`` maps agent id to open tickets.
+        """
+        with self._lock:
+            self._tickets = [
+                [deadline, PRIORITY_RANK.get(priority, 2), created_at, next(self._sequence), ticket_id]
+                for ticket_id, priority, deadline, created_at in tickets
+            ]
+            heapq.heapify(self._tickets)
+            self._entries = {entry[-1]: entry for entry in self._tickets}
+            self._loads = {agent_id: loads.get(agent_id, 0) for agent_id in agents}
+            self._agents = [(load, agent_id) for agent_id, load in self._loads.items()]
+            heapq.heapify(self._agents)
+            self.loaded_at = time.monotonic()
+
+    # ========== Tickets ==========
+
+    def push(self, ticket_id, priority, deadline, created_at):
+        with self._lock:
+            self._remove(ticket_id)
+            entry = [deadline, PRIORITY_RANK.get(priority, 2), created_at, next(self._sequence), ticket_id]
+            self._entries[ticket_id] = entry
+            heapq.heappush(self._tickets, entry)
+
+    def remove(self, ticket_id):
+        with self._lock:
+            self._remove(ticket_id)
+
+    def _remove(self, ticket_id):
+        entry = self._entries.pop(ticket_id, None)
+        if entry is not None:
+            entry[-1] = None
+
+    def pop(self):
+        """Take the most urgent waiting ticket id, or None"""
+        with self._lock:
+            while self._tickets:
+                ticket_id = heapq.heappop(self._tickets)[-1]
+                if ticket_id is not None:
+                    del self._entries[ticket_id]
+                    return ticket_id
+            return None
+
+    def peek(self, count):
+        """The most urgent waiting tickets as (ticket_id, deadline), without taking them"""
+        with self._lock:
+            live = (entry for entry in self._tickets if entry[-1] is not None)
+            return [(entry[-1], entry[0]) for entry in heapq.nsmallest(count, live)]
+
+    # ========== Agents ==========
+
+    def set_agent(self, agent_id, active=True):
+        with self._lock:
+            if not active:
+                self._loads.pop(agent_id, None)
+            elif agent_id not in self._loads:
+                self._loads[agent_id] = 0
+                heapq.heappush(self._agents, (0, agent_id))
+
+    def change_load(self, agent_id, delta):
+        with self._lock:
+            if agent_id not in self._loads:
+                return
+            self._loads[agent_id] = max(0, self._loads[agent_id] + delta)
+            heapq.heappush(self._agents, (self._loads[agent_id], agent_id))
+            if len(self._agents) > 4 * len(self._loads) + 64:
+                self._agents = [(load, agent) for agent, load in self._loads.items()]
+                heapq.heapify(self._agents)
+
+    def least_loaded(self, capacity=None):
+        """Agent with the fewest open tickets, or None if none has fewer than ``capacity``"""
+        with self._lock:
+            while self._agents:
+                load, agent_id = self._agents[0]
+                if self._loads.get(agent_id) != load:
+                    heapq.heappop(self._agents)
+                    continue
+                return agent_id if capacity is None or load < capacity else None
+            return None
+
+    def loads(self):
+        with self._lock:
+            return dict(self._loads)
+
+ticket_queue = TicketQueue()
@@ -0,0 +1,68 @@
+"""Overhead benchmark for the in-process metrics registry
+
+Run from the repository root:
+
+    python benchmarks/bench_metrics.py
+
+Prints the per-call cost of the operations executed on every request, so
+changes to utils/metrics.py can be checked against the sub-microsecond
+budget.
+"""
+import os
+import sys
+import tempfile
+import threading
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+from utils.metrics import MetricsRegistry
+
+ITERATIONS = 1_000_000
+
+def bench(label, stmt, number=ITERATIONS):
+    seconds = timeit.timeit(stmt, number=number)
+    print(f'{label:<40} {seconds / number * 1e9:8.1f} ns/op')
+
+def main():
+    registry = MetricsRegistry()
+    registry.counter('requests_total', 'bench')
+    registry.gauge('in_flight', 'bench')
+    registry.histogram('latency_seconds', 'bench')
+
+    route = (('blueprint', 'orders'), ('endpoint', 'orders.get_order'))
+    labels = route + (('method', 'GET'), ('status', 200))
+
+    bench('counter inc', lambda: registry.inc('requests_total', labels))
+    bench('gauge add', lambda: registry.add('in_flight'))
+    bench('histogram observe', lambda: registry.observe('latency_seconds', 0.042, route))
+
+    def full_request():
+        registry.add('in_flight')
+        registry.observe('latency_seconds', 0.042, route)
+        registry.inc('requests_total', route + (('method', 'GET'), ('status', 200)))
+        registry.add('in_flight', value=-1)
+
+    bench('full request (4 updates)', full_request)
+
+    # Contended: the same work spread over 8 threads
+    threads = [threading.Thread(target=lambda: [full_request() for _ in range(ITERATIONS // 8)]) for _ in range(8)]
+    start = timeit.default_timer()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = timeit.default_timer() - start
+    print(f'{"full request, 8 threads":<40} {elapsed / ITERATIONS * 1e9:8.1f} ns/op')
+
+    bench('render (in-process)', registry.render, number=1000)
+
+    with tempfile.TemporaryDirectory() as multiproc_dir:
+        multi = MetricsRegistry(multiproc_dir=multiproc_dir)
+        multi.counter('requests_total', 'bench')
+        multi.inc('requests_total', labels)
+        bench('flush snapshot to multiproc dir', multi.flush, number=1000)
+        bench('render (multiprocess merge)', multi.render, number=1000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Benchmark of the notification dispatcher against local fake channels
+
+Writes --events order status changes for --recipients customers into an
+in-memory outbox while a NotificationDispatcher with --workers threads
+drains it through FakeChannels that sleep and fail at the given rate,
+then prints throughput, how many rows were coalesced into each message
+and the lag from outbox write to send:
+
+    python benchmarks/bench_notifications.py --events 20000 --recipients 2000 --workers 32
+
+No database is needed: claim() and complete() work on a list with the
+same lease rules as NotificationService. Exits with status 1 if any row
+is never completed or completed twice.
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+STATUSES = ['confirmed', 'assigned', 'picked_up', 'in_transit', 'delivered']
+
+class MemoryOutbox:
+    """Outbox rows in a list, claimed and completed like the notification_outbox table"""
+
+    def __init__(self, lease_seconds=60):
+        self.rows = {}
+        self.lease = timedelta(seconds=lease_seconds)
+        self.completed = Counter()
+        self.lags = []
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    def add(self, recipient_id, channel, order_id, status):
+        now = datetime.utcnow()
+        row_id = str(uuid.uuid4())
+        with self._lock:
+            self.rows[row_id] = {
+                'id': row_id, 'recipient_id': recipient_id, 'channel': channel, 'topic': f'order:{order_id}',
+                'event': 'order_status', 'payload': {'order_number': order_id[:8], 'status': status},
+                'attempts': 0, 'created_at': now, 'available_at': now, 'status': 'pending',
+            }
+
+    def claim(self, limit):
+        now = datetime.utcnow()
+        with self._lock:
+            due = [row for row in self.rows.values()
+                   if row['status'] in ('pending', 'sending') and row['available_at'] <= now]
+            due = sorted(due, key=lambda row: row['available_at'])[:limit]
+            for row in due:
+                row['status'] = 'sending'
+                row['available_at'] = now + self.lease
+            return [dict(row, recipient={'id': row['recipient_id'], 'first_name': 'Ann'}) for row in due]
+
+    def complete(self, results):
+        now = datetime.utcnow()
+        with self._lock:
+            for result in results:
+                self.messages += result.status == 'sent'
+                for row_id in result.ids:
+                    row = self.rows[row_id]
+                    row['attempts'] += 1
+                    if result.status == 'retry':
+                        row['status'] = 'pending'
+                        row['available_at'] = now + timedelta(seconds=result.retry_in)
+                        continue
+                    row['status'] = result.status
+                    self.completed[row_id] += 1
+                    if result.status == 'sent':
+                        self.lags.append((now - row['created_at']).total_seconds())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--recipients', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, nargs=2, default=(20, 120))
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--rate', type=float, default=2000, help='status changes written per second')
+    args = parser.parse_args()
+
+    import app  # noqa: F401  services import db from the app module
+    from services.notification_service import NotificationService
+    from utils.notification_channels import FakeChannel
+    from utils.notification_dispatcher import NotificationDispatcher
+    logging.getLogger('utils.notification_dispatcher').setLevel(logging.ERROR)
+
+    outbox = MemoryOutbox()
+    channels = {
+        name: FakeChannel(name, latency_ms=tuple(args.latency_ms), error_rate=args.error_rate, seed=seed)
+        for seed, name in enumerate(('push', 'sms'))
+    }
+    dispatcher = NotificationDispatcher()
+    dispatcher.configure(channels, outbox.claim, outbox.complete, NotificationService.render,
+                         workers=args.workers, batch_size=args.batch_size, poll_interval=0.1, flush_interval=0.1,
+                         max_attempts=5, retry_backoff=0.05)
+
+    rng = random.Random(1)
+    customers = [str(uuid.uuid4()) for _ in range(args.recipients)]
+    orders = {}
+    start = time.perf_counter()
+    for i in range(args.events):
+        customer = rng.choice(customers)
+        order_id, step = orders.get(customer, (str(uuid.uuid4()), 0))
+        orders[customer] = (order_id, step + 1) if step + 1 < len(STATUSES) else (str(uuid.uuid4()), 0)
+        for channel in channels:
+            outbox.add(customer, channel, order_id, STATUSES[step])
+        if i % 100 == 99:
+            dispatcher.wake()
+            time.sleep(max(0.0, start + (i + 1) / args.rate - time.perf_counter()))
+    written = time.perf_counter() - start
+    while sum(outbox.completed.values()) < len(outbox.rows) and time.perf_counter() - start < 300:
+        dispatcher.drain(timeout=5)
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    dispatcher.shutdown()
+
+    rows = len(outbox.rows)
+    statuses = Counter(row['status'] for row in outbox.rows.values())
+    lags = sorted(outbox.lags)
+    print(f'{rows:,} outbox rows ({args.events:,} status changes x {len(channels)} channels) written in {written:.2f}s, '
+          f'all completed after {elapsed:.2f}s ({rows / elapsed:,.0f} rows/s)')
+    print(f'{outbox.messages:,} messages sent, {rows / max(outbox.messages, 1):.2f} rows per message; statuses {dict(statuses)}')
+    if lags:
+        print(f'lag p50 {statistics.median(lags) * 1000:.0f}ms  p99 {lags[int(len(lags) * 0.99) - 1] * 1000:.0f}ms  '
+              f'max {lags[-1] * 1000:.0f}ms')
+
+    missing = [row_id for row_id in outbox.rows if not outbox.completed[row_id]]
+    duplicated = [row_id for row_id, count in outbox.completed.items() if count > 1]
+    for label, ids in (('never completed', missing), ('completed twice', duplicated)):
+        if ids:
+            print(f'FAIL {len(ids)} row(s) {label}, e.g. {ids[0]}')
+    ok = not missing and not duplicated
+    print('OK: every outbox row was completed once' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark of the payment processor against the local fake gateway
+
+Submits --payments charges to a PaymentProcessor with --workers threads
+and a FakeGateway that sleeps, fails, times out and answers 'pending' at
+the given rates, then prints throughput, retry counts and the number of
+status batches written, and checks that every payment reached exactly
+one final status:
+
+    python benchmarks/bench_payments.py --payments 5000 --workers 32 --latency-ms 50 300
+
+No database is needed: status batches are collected in memory instead of
+being written by PaymentService.apply_gateway_results. Exits with status
+1 if any payment is missing or reported twice.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payments', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--latency-ms', type=float, nargs=2, default=(50, 300))
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--timeout-rate', type=float, default=0.01)
+    parser.add_argument('--decline-rate', type=float, default=0.02)
+    parser.add_argument('--pending-rate', type=float, default=0.1)
+    parser.add_argument('--timeout', type=float, default=1.0, help='gateway timeout in seconds')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    from utils.payment_gateway import FakeGateway
+    from utils.payment_processor import PaymentProcessor
+    logging.getLogger('utils.payment_processor').setLevel(logging.ERROR)  # one warning per retry otherwise
+
+    batches, statuses, seen, lock = [], Counter(), Counter(), threading.Lock()
+    retries = 0
+
+    def apply_results(results):
+        nonlocal retries
+        with lock:
+            batches.append(len(results))
+            for result in results:
+                seen[result.payment_id] += 1
+                statuses[result.status] += 1
+                retries += (result.attempts or 1) - 1
+
+    processor = PaymentProcessor()
+    gateway = FakeGateway(
+        latency_ms=tuple(args.latency_ms),
+        decline_rate=args.decline_rate,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        pending_rate=args.pending_rate,
+        notify=processor.record_result,
+        seed=1,
+    )
+    processor.configure(gateway, apply_results, workers=args.workers, timeout=args.timeout,
+                        retry_backoff=0.05, batch_size=args.batch_size)
+
+    payment_ids = [str(uuid.uuid4()) for _ in range(args.payments)]
+    start = time.perf_counter()
+    for payment_id in payment_ids:
+        processor.submit(payment_id, 25.0, 'card')
+    submitted = time.perf_counter() - start
+    # Pending charges report back on gateway timers after the queue has emptied
+    while len(seen) < len(payment_ids) and time.perf_counter() - start < 120:
+        processor.drain(timeout=5)
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    processor.shutdown()
+
+    print(f'{args.payments:,} payments on {args.workers} workers in {elapsed:.2f}s '
+          f'({args.payments / elapsed:,.0f}/s); submitting took {submitted * 1000:.0f}ms')
+    print(f'statuses: {dict(statuses)}; {len(batches)} status batches, largest {max(batches, default=0)}')
+    print(f'{retries:,} retried attempts after gateway errors and timeouts')
+
+    missing = [p for p in payment_ids if not seen[p]]
+    duplicated = [p for p, count in seen.items() if count > 1]
+    for label, ids in (('missing', missing), ('reported twice', duplicated)):
+        if ids:
+            print(f'FAIL {len(ids)} payment(s) {label}, e.g. {ids[0]}')
+    ok = not missing and not duplicated
+    print('OK: every payment reached one final status' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Benchmark of the courier payout run on synthetic deliveries
+
+Fills a scratch database with delivered orders spread over two days,
+then pays the first day in one process and the second across --workers
+processes, printing throughput and checking the totals:
+
+    python benchmarks/bench_payouts.py \\
+        --database-url postgresql://localhost/courier_bench --deliveries 1000000 --workers 4
+
+--aggregate-only skips the database and times the per-courier
+aggregation alone, with and without numpy. Use a throwaway database: the
+synthetic rows are left in place so runs can be inspected afterwards.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+INSERT_BATCH = 10000
+
+def bench_aggregate(deliveries, couriers):
+    import app  # noqa: F401  services import db from the app module
+    import services.payout_service as payouts
+
+    rng = random.Random(1)
+    ids = sorted(str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(couriers))
+    rows = sorted((rng.choice(ids), round(rng.uniform(5, 40), 2)) for _ in range(deliveries))
+    courier_column, fare_column = [r[0] for r in rows], [r[1] for r in rows]
+
+    numpy = payouts.np
+    for label, module in (('numpy', numpy), ('pure Python', None)):
+        if label == 'numpy' and numpy is None:
+            print('numpy not installed; skipping the vectorized pass')
+            continue
+        payouts.np = module
+        accumulator = payouts.EarningsAccumulator()
+        start = time.perf_counter()
+        totals = []
+        for offset in range(0, deliveries, 50000):
+            totals.extend(accumulator.add_chunk(courier_column[offset:offset + 50000], fare_column[offset:offset + 50000]))
+        totals.extend(accumulator.finish())
+        elapsed = time.perf_counter() - start
+        print(f'{label:<12} {deliveries / elapsed:12,.0f} deliveries/s  ({len(totals)} couriers, {elapsed:.2f}s)')
+    payouts.np = numpy
+
+def seed(deliveries, couriers, day):
+    from app import db
+    from models.user import User
+    from models.order import Order
+    from models.delivery import Delivery
+
+    now = datetime.utcnow()
+    base = {'password_hash': '!', 'first_name': 'Bench', 'last_name': 'Payout', 'phone': '0000000000',
+            'created_at': now, 'updated_at': now}
+    customer_id = str(uuid.uuid4())
+    courier_ids = [str(uuid.uuid4()) for _ in range(couriers)]
+    db.session.execute(User.__table__.insert(), [
+        dict(base, id=user_id, email=f'bench-payout-{user_id}@example.invalid', role=role)
+        for user_id, role in [(customer_id, 'customer')] + [(c, 'courier') for c in courier_ids]
+    ])
+    db.session.commit()
+
+    rng = random.Random(2)
+    expected_fares = 0.0
+    prefix = uuid.uuid4().hex[:8]
+    for offset in range(0, deliveries, INSERT_BATCH):
+        orders, rows = [], []
+        for i in range(offset, min(offset + INSERT_BATCH, deliveries)):
+            delivered_at = day + timedelta(days=i % 2, seconds=rng.randrange(86400))
+            base_fare, distance_fare = round(rng.uniform(3, 10), 2), round(rng.uniform(1, 25), 2)
+            expected_fares += base_fare + distance_fare
+            order_id = str(uuid.uuid4())
+            orders.append({
+                'id': order_id, 'order_number': f'BENCH-{prefix}-{i}', 'customer_id': customer_id,
+                'pickup_address': 'a', 'pickup_latitude': 0.0, 'pickup_longitude': 0.0,
+                'pickup_contact': 'a', 'pickup_phone': '0',
+                'delivery_address': 'b', 'delivery_latitude': 0.0, 'delivery_longitude': 0.0,
+                'delivery_contact': 'b', 'delivery_phone': '0',
+                'package_description': 'bench', 'package_weight': 1.0,
+                'base_fare': base_fare, 'distance_fare': distance_fare, 'surcharge': 0.0, 'discount': 0.0,
+                'total_amount': base_fare + distance_fare, 'status': 'delivered', 'payment_method': 'card',
+                'delivery_time': delivered_at, 'created_at': delivered_at, 'updated_at': delivered_at,
+            })
+            rows.append({
+                'id': str(uuid.uuid4()), 'order_id': order_id, 'courier_id': rng.choice(courier_ids),
+                'status': 'delivered', 'assigned_at': delivered_at, 'delivery_at': delivered_at,
+                'created_at': delivered_at, 'updated_at': delivered_at,
+            })
+        db.session.execute(Order.__table__.insert(), orders)
+        db.session.execute(Delivery.__table__.insert(), rows)
+        db.session.commit()
+    return expected_fares
+
+def bench_run(args):
+    from config import Config
+    from app import create_app
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database_url
+        SQLALCHEMY_REPLICA_URIS = []
+        SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True}
+        PAYOUT_DIR = tempfile.mkdtemp(prefix='payouts-')
+        SURGE_ENABLED = False
+        PAYMENT_GATEWAY = 'fake'
+        NOTIFICATION_CHANNELS = {'push': 'fake', 'sms': 'fake'}
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        from services.payout_service import PayoutService
+
+        # Two whole days that have already ended, far enough back not to overlap real runs
+        day = datetime(2000, 1, 1) + timedelta(days=random.randrange(3000) * 2)
+        start = time.perf_counter()
+        expected_fares = seed(args.deliveries, args.couriers, day)
+        print(f'seeded {args.deliveries:,} deliveries for {args.couriers:,} couriers in {time.perf_counter() - start:.1f}s')
+
+        paid = 0.0
+        for offset, workers in ((0, 1), (1, args.workers)):
+            period_start = day + timedelta(days=offset)
+            start = time.perf_counter()
+            run = PayoutService.run(period_start, period_start + timedelta(days=1), workers=workers)
+            elapsed = time.perf_counter() - start
+            paid += run.total_amount
+            print(f'{workers} worker(s): {run.deliveries:,} deliveries, {run.couriers:,} couriers, '
+                  f'{run.total_amount:,.2f} paid in {elapsed:.1f}s ({run.deliveries / elapsed:,.0f} deliveries/s)')
+            print(f'  payout file: {run.file_path}')
+
+        expected = expected_fares * app.config['PAYOUT_COURIER_SHARE']
+        # Each courier's amount is rounded to the cent once
+        ok = abs(paid - expected) <= 0.005 * 2 * args.couriers + 0.01
+        print(f'expected {expected:,.2f}, paid {paid:,.2f}: {"OK" if ok else "MISMATCH"}')
+        return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.getenv('SUPABASE_POSTGRES_URL'))
+    parser.add_argument('--deliveries', type=int, default=1_000_000)
+    parser.add_argument('--couriers', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--aggregate-only', action='store_true', help='time the in-memory aggregation only')
+    args = parser.parse_args()
+
+    if args.aggregate_only:
+        bench_aggregate(args.deliveries, args.couriers)
+        return
+    if not args.database_url:
+        parser.error('--database-url or SUPABASE_POSTGRES_URL is required')
+    sys.exit(0 if bench_run(args) else 1)
+
+if __name__ == '__main__':
+    main()
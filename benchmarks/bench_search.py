@@ -0,0 +1,78 @@
+"""Benchmark of the in-process search index used when the database has no full-text search
+
+Indexes --rows synthetic orders with the same terms the search service
+builds and times name, address, order number and phone lookups:
+
+    python benchmarks/bench_search.py --rows 1000000
+
+On Postgres the GIN indexes from `flask create-search-indexes` do this
+work; time those with EXPLAIN ANALYZE on the statements SearchService
+issues.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+SYLLABLES = ['ma', 'ri', 'jo', 'han', 'li', 'wei', 'ah', 'med', 'so', 'fi', 'ken', 'ji', 'ol', 'ga', 'pe', 'dro',
+             'lo', 'pez', 'smi', 'th', 'kha', 'ros', 'si', 'ta', 'na', 'ka', 'va', 'sil', 'ok', 'for', 'mul', 'ler']
+_names = random.Random(0)
+# Thousands of distinct names, as in real data; with a dozen every name would match most rows
+FIRST = sorted({''.join(_names.sample(SYLLABLES, 2)) for _ in range(1500)})
+LAST = sorted({''.join(_names.sample(SYLLABLES, 3)) for _ in range(6000)})
+STREETS = ['main', 'oak', 'pine', 'maple', 'cedar', 'elm', 'harbor', 'river', 'station', 'market', 'church']
+
+def make_terms(rng, i):
+    from utils.search_index import KEY, words
+
+    name = f'{rng.choice(FIRST)} {rng.choice(LAST)}'
+    address = f'{rng.randrange(1, 2000)} {rng.choice(STREETS)} street'
+    terms = {}
+    for text, weight in ((name, 2), (address, 1)):
+        for word in words(text):
+            terms[word] = max(weight, terms.get(word, 0))
+    terms[KEY + f'ord-2024{i:08d}'] = 3
+    terms[KEY + f'1555{rng.randrange(10 ** 7):07d}'] = 3
+    return terms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    from utils.search_index import InvertedIndex
+
+    rng = random.Random(1)
+    index = InvertedIndex()
+    start = time.perf_counter()
+    for i in range(args.rows):
+        index.add(f'{i:032x}', make_terms(rng, i))
+    print(f'indexed {args.rows:,} rows in {time.perf_counter() - start:.1f}s')
+
+    kinds = {
+        'name': lambda: ([rng.choice(FIRST), rng.choice(LAST)[:3]], ['']),
+        'address': lambda: ([str(rng.randrange(1, 2000)), rng.choice(STREETS)], ['']),
+        'order number': lambda: ([], [f'ord-2024{rng.randrange(args.rows):08d}'[:14]]),
+        'phone': lambda: ([], [f'1555{rng.randrange(10 ** 7):07d}'[:9]]),
+    }
+    for label, make_query in kinds.items():
+        timings, hits = [], 0
+        for _ in range(args.queries):
+            query_words, keys = make_query()
+            keys = [key for key in keys if key]
+            start = time.perf_counter()
+            results = index.search(query_words, keys)
+            top = sorted(results.items(), key=lambda item: (-item[1], item[0]))[:20]
+            timings.append((time.perf_counter() - start) * 1000)
+            hits += len(results)
+        timings.sort()
+        print(f'{label:<13} p50 {statistics.median(timings):7.2f}ms  p99 {timings[int(len(timings) * 0.99) - 1]:7.2f}ms  '
+              f'{hits / args.queries:,.0f} matches/query, last top {len(top)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Load comparison of the WSGI and ASGI deployments
+
+Opens N concurrent keep-alive HTTP/1.1 clients against each base URL and
+hammers the tracking endpoint (and optionally order reads) for a fixed
+duration, then prints throughput and latency percentiles side by side.
+
+Start both servers against the same database, e.g.
+
+    gunicorn --chdir api -w 4 --threads 8 -b :8000 "app:create_app()"
+    uvicorn asgi:app --app-dir api --workers 4 --port 8001
+
+then run from the repository root:
+
+    python benchmarks/load_test_tracking.py \\
+        --wsgi http://127.0.0.1:8000 --asgi http://127.0.0.1:8001 \\
+        --delivery-id <id> [--order-id <id> --token <jwt>] --clients 1000
+
+Only the standard library is used so the client is never the bottleneck
+being measured; raise the open file limit (ulimit -n) above --clients.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+async def _client(host, port, requests, deadline, latencies, errors):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        errors['connect'] = errors.get('connect', 0) + 1
+        return
+
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            payload = requests[i % len(requests)]
+            i += 1
+            start = time.perf_counter()
+            writer.write(payload)
+            status, _ = await _read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors[status] = errors.get(status, 0) + 1
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        errors['io'] = errors.get('io', 0) + 1
+    finally:
+        writer.close()
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    status = int(status_line.split(b' ', 2)[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value.strip())
+    body = await reader.readexactly(length) if length else b''
+    return status, body
+
+def _build_requests(base_url, args):
+    parts = urlsplit(base_url)
+    host_header = parts.netloc
+    paths = [(f'/api/v1/deliveries/{args.delivery_id}/track', None)]
+    if args.order_id and args.token:
+        paths.append((f'/api/v1/orders/{args.order_id}', args.token))
+
+    requests = []
+    for path, token in paths:
+        lines = [f'GET {path} HTTP/1.1', f'Host: {host_header}', 'Connection: keep-alive']
+        if token:
+            lines.append(f'Authorization: Bearer {token}')
+        requests.append(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    return parts.hostname, parts.port or 80, requests
+
+async def run(base_url, args):
+    host, port, requests = _build_requests(base_url, args)
+    latencies, errors = [], {}
+    deadline = time.perf_counter() + args.duration
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _client(host, port, requests, deadline, latencies, errors)
+        for _ in range(args.clients)
+    ))
+    elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+def _report(label, latencies, errors, elapsed):
+    if not latencies:
+        print(f'{label:<6} no responses; errors={errors}')
+        return
+    ordered = sorted(latencies)
+    pct = lambda p: ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+    print(
+        f'{label:<6} {len(ordered) / elapsed:9.0f} req/s  '
+        f'p50 {pct(0.50):7.1f} ms  p95 {pct(0.95):7.1f} ms  p99 {pct(0.99):7.1f} ms  '
+        f'mean {statistics.fmean(ordered) * 1000:7.1f} ms  errors={errors or 0}'
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--wsgi', help='Base URL of the WSGI (gunicorn) deployment')
+    parser.add_argument('--asgi', help='Base URL of the ASGI (uvicorn) deployment')
+    parser.add_argument('--delivery-id', required=True)
+    parser.add_argument('--order-id')
+    parser.add_argument('--token', help='Access token used for the order read')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=30.0)
+    args = parser.parse_args()
+
+    for label, base_url in (('wsgi', args.wsgi), ('asgi', args.asgi)):
+        if base_url:
+            _report(label, *asyncio.run(run(base_url, args)))
+
+if __name__ == '__main__':
+    main()
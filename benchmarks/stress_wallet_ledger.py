@@ -0,0 +1,205 @@
+"""Concurrency stress test for the wallet ledger
+
+Hammers a small set of wallets from many threads with single credits,
+single debits and mixed bulk batches, then checks that no money was
+created or lost:
+
+- every wallet's balance equals the sum of the entries the workers were
+  told succeeded
+- the balance equals total_added - total_spent and the sum of its
+  wallet_transactions rows
+- no balance went negative
+
+Run from the repository root against a scratch database:
+
+    python benchmarks/stress_wallet_ledger.py \\
+        --database-url postgresql://localhost/courier_stress --threads 16 --seconds 20
+
+Few wallets and many threads maximise contention. The users, wallets and
+transactions it creates are deleted afterwards unless --keep is given.
+Exits with status 1 if any check fails.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+TOLERANCE = 0.01
+
+def build_app(database_url, pool_size):
+    from config import Config
+    from app import create_app
+
+    class StressConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        SQLALCHEMY_REPLICA_URIS = []
+        SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': pool_size, 'max_overflow': 0, 'pool_pre_ping': True}
+        RATELIMIT_ENABLED = False
+        PAYMENT_GATEWAY = 'fake'
+        NOTIFICATION_CHANNELS = {'push': 'fake', 'sms': 'fake'}
+
+    return create_app(StressConfig)
+
+def create_users(count):
+    from app import db
+    from models.user import User
+
+    run = uuid.uuid4().hex[:8]
+    rows = [{
+        'id': str(uuid.uuid4()),
+        'email': f'ledger-stress-{run}-{i}@example.invalid',
+        'password_hash': '!',
+        'first_name': 'Ledger',
+        'last_name': 'Stress',
+        'phone': '0000000000',
+    } for i in range(count)]
+    db.session.execute(User.__table__.insert(), rows)
+    db.session.commit()
+    return [row['id'] for row in rows]
+
+def worker(app, user_ids, deadline, bulk_size, expected, stats, lock):
+    from services.ledger_service import LedgerService
+    from utils.errors import ValidationError
+
+    rng = random.Random()
+    net = defaultdict(float)
+    counts = Counter()
+    with app.app_context():
+        while time.perf_counter() < deadline:
+            roll = rng.random()
+            try:
+                if roll < 0.8:
+                    user_id = rng.choice(user_ids)
+                    kind = 'debit' if roll < 0.45 else 'credit'
+                    amount = round(rng.uniform(1, 20), 2)
+                    try:
+                        LedgerService.post(user_id, amount, kind, 'stress')
+                    except ValidationError:
+                        counts['rejected'] += 1
+                        continue
+                    net[user_id] += amount if kind == 'credit' else -amount
+                    counts['posted'] += 1
+                else:
+                    entries = [{
+                        'user_id': rng.choice(user_ids),
+                        'amount': round(rng.uniform(1, 20), 2),
+                        'transaction_type': rng.choice(('credit', 'debit')),
+                        'description': 'stress bulk',
+                    } for _ in range(bulk_size)]
+                    posted, errors = LedgerService.post_bulk(entries)
+                    for index, values in posted:
+                        entry = entries[index]
+                        net[entry['user_id']] += entry['amount'] if entry['transaction_type'] == 'credit' else -entry['amount']
+                    counts['posted'] += len(posted)
+                    counts['rejected'] += len(errors)
+                    counts['batches'] += 1
+            except Exception as e:
+                counts['failed'] += 1
+                counts[f'failed: {type(e).__name__}'] += 1
+
+    with lock:
+        for user_id, amount in net.items():
+            expected[user_id] += amount
+        stats.update(counts)
+
+def verify(user_ids, expected):
+    from app import db
+    from models.payment import UserWallet, WalletTransaction
+    from sqlalchemy import func, case
+
+    wallets = {w.user_id: w for w in UserWallet.query.filter(UserWallet.user_id.in_(user_ids))}
+    ledger = dict(db.session.query(
+        WalletTransaction.wallet_id,
+        func.sum(case((WalletTransaction.transaction_type == 'credit', WalletTransaction.amount),
+                      else_=-WalletTransaction.amount))
+    ).filter(WalletTransaction.wallet_id.in_([w.id for w in wallets.values()])).group_by(WalletTransaction.wallet_id))
+
+    failures = []
+    for user_id in user_ids:
+        wallet = wallets.get(user_id)
+        if wallet is None:
+            failures.append(f'{user_id}: wallet missing')
+            continue
+        checks = {
+            'expected': expected[user_id],
+            'total_added - total_spent': wallet.total_added - wallet.total_spent,
+            'transaction sum': ledger.get(wallet.id) or 0.0,
+        }
+        for label, value in checks.items():
+            if abs(wallet.balance - value) > TOLERANCE:
+                failures.append(f'{user_id}: balance {wallet.balance:.2f} != {label} {value:.2f}')
+        if wallet.balance < -TOLERANCE:
+            failures.append(f'{user_id}: negative balance {wallet.balance:.2f}')
+    return failures
+
+def cleanup(user_ids):
+    from app import db
+    from models.user import User
+    from models.payment import UserWallet, WalletTransaction
+
+    wallet_ids = [w for (w,) in db.session.query(UserWallet.id).filter(UserWallet.user_id.in_(user_ids))]
+    WalletTransaction.query.filter(WalletTransaction.wallet_id.in_(wallet_ids)).delete(synchronize_session=False)
+    UserWallet.query.filter(UserWallet.id.in_(wallet_ids)).delete(synchronize_session=False)
+    User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+    db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.getenv('SUPABASE_POSTGRES_URL'))
+    parser.add_argument('--wallets', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--bulk-size', type=int, default=50, help='entries per bulk batch')
+    parser.add_argument('--initial', type=float, default=100, help='starting balance of every wallet')
+    parser.add_argument('--keep', action='store_true', help='leave the test rows in the database')
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url or SUPABASE_POSTGRES_URL is required')
+
+    app = build_app(args.database_url, args.threads + 2)
+    with app.app_context():
+        from services.ledger_service import LedgerService
+
+        user_ids = create_users(args.wallets)
+        LedgerService.post_bulk([
+            {'user_id': user_id, 'amount': args.initial, 'transaction_type': 'credit', 'description': 'stress seed'}
+            for user_id in user_ids
+        ])
+
+    expected = defaultdict(float, {user_id: args.initial for user_id in user_ids})
+    stats, lock = Counter(), threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=worker, args=(app, user_ids, deadline, args.bulk_size, expected, stats, lock))
+               for _ in range(args.threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    print(f'{args.threads} threads on {args.wallets} wallets for {elapsed:.1f}s')
+    print(f'posted {stats["posted"]} entries ({stats["posted"] / elapsed:.0f}/s), '
+          f'{stats["batches"]} bulk batches, {stats["rejected"]} rejected for insufficient balance')
+    for key, count in sorted(stats.items()):
+        if key.startswith('failed: '):
+            print(f'{key} x{count}')
+
+    with app.app_context():
+        failures = verify(user_ids, expected)
+        if not args.keep:
+            cleanup(user_ids)
+
+    for failure in failures:
+        print('FAIL', failure)
+    print('OK: no money created or lost' if not failures else f'{len(failures)} check(s) failed')
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
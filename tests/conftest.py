@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api')
+
+# The api modules import each other as top-level packages (utils, services, ...)
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+@pytest.fixture
+def app():
+    from config import TestingConfig
+    from app import create_app
+
+    class Config(TestingConfig):
+        SURGE_SMOOTHING_SECONDS = 0
+        SURGE_RESYNC_SECONDS = 3600
+
+    return create_app(Config)
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def login(app, client):
+    """Register a user and return Authorization headers for them"""
+    from app import db
+    from models.user import User
+
+    def login(email, role=None):
+        client.post('/api/v1/auth/register', json={
+            'email': email, 'password': 'Passw0rdX', 'first_name': 'Ann', 'last_name': 'Lee', 'phone': '1234567890'
+        })
+        if role:
+            with app.app_context():
+                User.query.filter_by(email=email).first().role = role
+                db.session.commit()
+        tokens = client.post('/api/v1/auth/login', json={'email': email, 'password': 'Passw0rdX'}).get_json()
+        token = tokens.get('access_token') or tokens['tokens']['access_token']
+        return {'Authorization': f'Bearer {token}'}
+    return login
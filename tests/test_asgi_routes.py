@@ -0,0 +1,44 @@
+import asyncio
+import importlib
+import json
+import uuid
+
+import pytest
+
+@pytest.fixture(scope='module')
+def asgi():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('FLASK_ENV', 'testing')
+        yield importlib.import_module('asgi')
+
+def call(app, method, path, query=b''):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'headers': [],
+             'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80), 'root_path': ''}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    status = next(m['status'] for m in messages if m['type'] == 'http.response.start')
+    body = b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body')
+    return status, json.loads(body)
+
+def test_order_ids_route_to_asyncpg(asgi):
+    order_id = str(uuid.uuid4())
+    handler, endpoint, args = asgi.resolve('GET', f'/api/v1/orders/{order_id}')
+    assert endpoint == 'orders.get_order'
+    assert args == (order_id,)
+    assert asgi.resolve('GET', '/api/v1/orders/my-orders')[1] == 'orders.get_my_orders'
+
+@pytest.mark.parametrize('path', ['/api/v1/orders/quote', '/api/v1/orders/bulk', '/api/v1/orders/not-an-id'])
+def test_fixed_order_paths_fall_through_to_flask(asgi, path):
+    assert asgi.resolve('GET', path) is None
+
+def test_quote_served_on_asgi_stack(asgi):
+    status, body = call(asgi.app, 'GET', '/api/v1/orders/quote', b'latitude=40.71&longitude=-74.0&fare=10')
+    assert status == 200, body
+    assert body['quote']['multiplier'] >= 1
@@ -0,0 +1,56 @@
+import json
+
+from utils.surge import surge
+
+ADDRESS = {'address': '1 Main St', 'latitude': 40.71, 'longitude': -74.0, 'contact': 'Ann', 'phone': '1234567890'}
+
+def bulk_order(**fields):
+    order = {
+        'pickup_address': ADDRESS,
+        'delivery_address': ADDRESS,
+        'package_details': {'description': 'box', 'weight': 2},
+        'pricing': {'base_fare': 8, 'distance_fare': 2, 'surcharge': 50, 'total_amount': 60},
+    }
+    order.update(fields)
+    return order
+
+def created_orders(app, response):
+    from models.order import Order
+
+    with app.app_context():
+        ids = [created['id'] for created in response.get_json()['orders']]
+        return [Order.query.get(order_id) for order_id in ids]
+
+def test_bulk_import_ignores_forged_surcharge(app, client, login):
+    headers = login('bulk@example.com')
+    # A zone no other test has opened orders in, so there is no surge
+    quiet = dict(ADDRESS, latitude=51.5, longitude=-0.12)
+    orders = [bulk_order(pickup_address=quiet), bulk_order(pickup_address=quiet)]
+    response = client.post('/api/v1/orders/bulk', data=json.dumps(orders),
+                           content_type='application/json', headers=headers)
+    assert response.status_code == 201, response.get_json()
+    for order in created_orders(app, response):
+        assert order.surcharge == 0
+        assert order.total_amount == 10
+
+def test_bulk_import_applies_surge(app, client, login):
+    headers = login('surge@example.com')
+    surge.order_opened(ADDRESS['latitude'], ADDRESS['longitude'], count=5)
+    multiplier, surcharge = surge.surcharge(ADDRESS['latitude'], ADDRESS['longitude'], 10)
+    assert multiplier > 1
+
+    response = client.post('/api/v1/orders/bulk', data=json.dumps([bulk_order()]),
+                           content_type='application/json', headers=headers)
+    assert response.status_code == 201, response.get_json()
+    order, = created_orders(app, response)
+    assert order.surcharge == surcharge
+    assert order.total_amount == round(10 + surcharge, 2)
+
+def test_bulk_import_rejects_promo_codes(client, login):
+    headers = login('promo@example.com')
+    response = client.post('/api/v1/orders/bulk', data=json.dumps([bulk_order(promo_code='SAVE10'), bulk_order()]),
+                           content_type='application/json', headers=headers)
+    body = response.get_json()
+    assert response.status_code == 201
+    assert len(body['orders']) == 1
+    assert body['errors'] == [{'index': 0, 'error': 'Promo codes cannot be used in bulk imports'}]
@@ -0,0 +1,46 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api')
+
+def run_without_env(code, *names):
+    env = {key: value for key, value in os.environ.items() if key not in names}
+    return subprocess.run([sys.executable, '-c', code], cwd=API_DIR, env=env, capture_output=True, text=True)
+
+def test_payment_gateway_is_only_required_in_production():
+    result = run_without_env('''
+import pytest
+from config import DevelopmentConfig, ProductionConfig
+from utils.payment_gateway import load_gateway, FakeGateway
+
+assert isinstance(load_gateway(DevelopmentConfig.PAYMENT_GATEWAY), FakeGateway)
+with pytest.raises(ValueError, match='PAYMENT_GATEWAY is not set'):
+    load_gateway(ProductionConfig.PAYMENT_GATEWAY)
+''', 'PAYMENT_GATEWAY')
+    assert result.returncode == 0, result.stderr
+
+def test_notification_channels_are_only_required_in_production():
+    result = run_without_env('''
+import pytest
+from config import DevelopmentConfig, ProductionConfig
+from utils.notification_channels import load_channel, FakeChannel
+
+for name, spec in DevelopmentConfig.NOTIFICATION_CHANNELS.items():
+    assert isinstance(load_channel(name, spec), FakeChannel)
+with pytest.raises(ValueError, match="NOTIFICATION_CHANNELS\\\\['push'\\\\] is not set"):
+    load_channel('push', ProductionConfig.NOTIFICATION_CHANNELS['push'])
+''', 'NOTIFICATION_PUSH_CHANNEL', 'NOTIFICATION_SMS_CHANNEL')
+    assert result.returncode == 0, result.stderr
+
+def test_create_app_refuses_to_start_without_channel_adapters():
+    from config import TestingConfig
+    from app import create_app
+
+    class Config(TestingConfig):
+        NOTIFICATION_CHANNELS = {'push': 'fake', 'sms': None}
+
+    with pytest.raises(ValueError, match=r"NOTIFICATION_CHANNELS\['sms'\] is not set"):
+        create_app(Config)
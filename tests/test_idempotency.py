@@ -0,0 +1,120 @@
+import hashlib
+import json
+
+import pytest
+from flask import g
+
+from utils import idempotency
+from utils.idempotency import IdempotencyKeyReusedError, idempotent, store
+
+ADDRESS = {'address': '1 Main St', 'latitude': 40.71, 'longitude': -74.0, 'contact': 'Ann', 'phone': '1234567890'}
+ORDER = {
+    'pickup_address': ADDRESS,
+    'delivery_address': ADDRESS,
+    'package_details': {'description': 'box', 'weight': 2},
+    'pricing': {'base_fare': 8, 'distance_fare': 2, 'total_amount': 10},
+}
+
+def create_order(client, headers, key, order=ORDER):
+    return client.post('/api/v1/orders', data=json.dumps(order), content_type='application/json',
+                       headers=dict(headers, **{'Idempotency-Key': key}))
+
+def order_count(app):
+    from models.order import Order
+
+    with app.app_context():
+        return Order.query.count()
+
+def test_retry_replays_the_first_response(app, client, login):
+    headers = login('retry@example.com')
+    first = create_order(client, headers, 'key-1')
+    retry = create_order(client, headers, 'key-1')
+    assert first.status_code == 201
+    assert retry.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json()['order']['id'] == first.get_json()['order']['id']
+    assert order_count(app) == 1
+
+def test_key_reused_with_another_body_is_rejected(client, login):
+    headers = login('reuse@example.com')
+    assert create_order(client, headers, 'key-1').status_code == 201
+    changed = dict(ORDER, pricing=dict(ORDER['pricing'], total_amount=99))
+    assert create_order(client, headers, 'key-1', changed).status_code == 422
+
+def test_keys_are_scoped_to_the_authenticated_user(app, client, login):
+    first = create_order(client, login('owner@example.com'), 'shared-key')
+    other = create_order(client, login('other@example.com'), 'shared-key')
+    assert other.status_code == 201
+    assert 'Idempotent-Replayed' not in other.headers
+    assert other.get_json()['order']['id'] != first.get_json()['order']['id']
+    assert order_count(app) == 2
+
+def test_replay_needs_valid_authentication(client, login):
+    headers = login('auth@example.com')
+    assert create_order(client, headers, 'key-1').status_code == 201
+    response = create_order(client, {'Authorization': 'Bearer forged'}, 'key-1')
+    assert response.status_code == 401
+    assert 'Idempotent-Replayed' not in response.headers
+
+def test_retry_on_another_worker_is_replayed(tmp_path):
+    from config import TestingConfig
+    from app import create_app
+
+    class Config(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'shared.db'}"
+
+    # Two app instances over one database stand in for two gunicorn workers
+    workers = [create_app(Config), create_app(Config)]
+    first_client, second_client = (worker.test_client() for worker in workers)
+    first_client.post('/api/v1/auth/register', json={
+        'email': 'worker@example.com', 'password': 'Passw0rdX', 'first_name': 'Ann', 'last_name': 'Lee', 'phone': '1234567890'
+    })
+    tokens = first_client.post('/api/v1/auth/login', json={'email': 'worker@example.com', 'password': 'Passw0rdX'}).get_json()
+    headers = {'Authorization': f"Bearer {tokens.get('access_token') or tokens['tokens']['access_token']}"}
+
+    first = create_order(first_client, headers, 'key-1')
+    retry = create_order(second_client, headers, 'key-1')
+    assert retry.headers.get('Idempotent-Replayed') == 'true'
+    assert retry.get_json()['order']['id'] == first.get_json()['order']['id']
+    assert order_count(workers[1]) == 1
+
+def test_running_claim_makes_duplicates_wait(app):
+    with app.app_context():
+        assert store.begin('running', 'body') == (True, None)
+        assert store.begin('running', 'body') == (False, None)
+
+def test_abandoned_claim_is_taken_over(app, monkeypatch):
+    # A worker that died mid-request never completes or releases its claim
+    monkeypatch.setattr(store, 'lock_seconds', 0)
+    with app.app_context():
+        assert store.begin('abandoned', 'body') == (True, None)
+        assert store.begin('abandoned', 'body') == (True, None)
+        with pytest.raises(IdempotencyKeyReusedError):
+            store.begin('abandoned', 'other body')
+
+def test_duplicate_of_a_running_request_backs_off_then_gets_409(app, monkeypatch):
+    clock, sleeps = [0.0], []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr(idempotency.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(idempotency.time, 'sleep', sleep)
+
+    @app.route('/slow', methods=['POST'])
+    @idempotent(wait_timeout=3)
+    def slow():
+        return {'ran': True}
+
+    app.before_request(lambda: setattr(g, 'user_id', 'u1'))
+    scope = 'u1\nPOST\n/slow\nkey-1'
+    with app.app_context():
+        assert store.begin(hashlib.sha256(scope.encode('utf-8')).hexdigest(), hashlib.sha256(b'{}').hexdigest())[0]
+
+    response = app.test_client().post('/slow', data='{}', headers={'Idempotency-Key': 'key-1'})
+
+    assert response.status_code == 409
+    assert response.get_json()['code'] == 'IDEMPOTENCY_KEY_IN_PROGRESS'
+    assert response.headers['Retry-After'] == '1'
+    assert sleeps == pytest.approx([0.05, 0.1, 0.2, 0.4, 0.8, 1.0, 0.45])
@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api')
+
+# Installed for the Flask-SQLAlchemy app (api/app.py) but not in requirements.txt,
+# which is all the Vercel function gets
+NOT_DEPLOYED = ('flask_sqlalchemy', 'flask_caching', 'sqlalchemy', 'numpy', 'redis')
+
+IMPORT_INDEX = f'''
+import sys
+
+class Block:
+    def find_spec(self, name, path=None, target=None):
+        if name.split('.')[0] in {NOT_DEPLOYED!r}:
+            raise ImportError(f'{{name}} is not in requirements.txt')
+
+sys.meta_path.insert(0, Block())
+import index
+assert index.app.url_map
+'''
+
+def test_index_imports_with_requirements_only():
+    env = dict(os.environ, PAYMENT_GATEWAY='fake')
+    result = subprocess.run([sys.executable, '-c', IMPORT_INDEX], cwd=API_DIR, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
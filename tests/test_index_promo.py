@@ -0,0 +1,21 @@
+import importlib
+import os
+
+import jwt
+import pytest
+
+@pytest.fixture(scope='module')
+def index_client():
+    os.environ.setdefault('PAYMENT_GATEWAY', 'fake')
+    index = importlib.import_module('index')
+    token = jwt.encode({'user_id': 'u1', 'role': 'customer'}, index.JWT_SECRET, algorithm=index.JWT_ALGORITHM)
+    client = index.app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    return client
+
+@pytest.mark.parametrize('order_amount', ['abc', [12], {'value': 12}, -5])
+def test_bad_order_amount_is_rejected(index_client, order_amount):
+    response = index_client.post('/api/promo-codes/validate', json={'code': 'SAVE10', 'order_amount': order_amount})
+
+    assert response.status_code == 400
+    assert response.get_json()['error'] in ('Invalid amount format', 'Amount cannot be negative')
@@ -0,0 +1,80 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from utils.metrics import MetricsRegistry, AGGREGATE_FILE
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+def write_worker_file(directory, pid, requests, in_flight):
+    with open(os.path.join(directory, f'metrics_{pid}.json'), 'w') as f:
+        json.dump({
+            'pid': pid,
+            'counters': [['http_requests_total', [['status', 200]], requests]],
+            'gauges': [['http_requests_in_flight', [], in_flight]],
+            'histograms': [],
+        }, f)
+
+def requests_total(snapshot):
+    return snapshot['counters'].get(('http_requests_total', (('status', 200),)), 0)
+
+def test_worker_start_merges_files_of_exited_workers(tmp_path):
+    first, second = dead_pid(), dead_pid()
+    write_worker_file(tmp_path, first, 3, 1)
+    write_worker_file(tmp_path, second, 4, 2)
+
+    registry = MetricsRegistry(multiproc_dir=str(tmp_path))
+    registry.inc('http_requests_total', (('status', 200),))
+    snapshot = registry.collect()
+
+    assert sorted(os.listdir(tmp_path)) == sorted(['.lock', AGGREGATE_FILE, f'metrics_{os.getpid()}.json'])
+    assert requests_total(snapshot) == 8
+    assert ('http_requests_in_flight', ()) not in snapshot['gauges']
+
+    # A later worker start merges into the same aggregate
+    write_worker_file(tmp_path, dead_pid(), 5, 1)
+    assert registry.merge_dead_workers() == 1
+    assert requests_total(registry.collect()) == 13
+
+def test_file_left_by_a_dead_worker_with_the_same_pid_is_kept(tmp_path):
+    previous = MetricsRegistry(multiproc_dir=str(tmp_path))
+    previous.inc('http_requests_total', (('status', 200),), 2)
+    previous.flush()
+
+    # A new worker reusing the pid must not overwrite the old worker's counts
+    registry = MetricsRegistry(multiproc_dir=str(tmp_path))
+    registry.inc('http_requests_total', (('status', 200),))
+
+    assert requests_total(registry.collect()) == 3
+    assert requests_total(registry.collect()) == 3
+
+def test_shards_of_finished_threads_are_folded_into_the_base_shard():
+    registry = MetricsRegistry()
+
+    def handle_request():
+        registry.inc('http_requests_total', (('status', 200),))
+
+    for _ in range(20):
+        thread = threading.Thread(target=handle_request)
+        thread.start()
+        thread.join()
+
+    assert len(registry._shards) == 1
+    assert requests_total(registry.snapshot()) == 20
+
+def test_scrape_collects_once():
+    registry = MetricsRegistry()
+    registry.gauge('requests_seen', 'Requests counted in this scrape',
+                   derive=lambda snap: [((), requests_total(snap))])
+    registry.inc('http_requests_total', (('status', 200),), 3)
+    collect = registry.collect
+    calls = []
+    registry.collect = lambda: calls.append(1) or collect()
+
+    assert 'requests_seen 3' in registry.render().splitlines()
+    assert len(calls) == 1
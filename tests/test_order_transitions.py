@@ -0,0 +1,80 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from models.order import OrderStatusHistory
+from services.order_service import OrderService
+from utils.errors import ConflictError, NotFoundError, ValidationError
+from test_bulk_orders import bulk_order
+
+@pytest.fixture
+def order_id(app, client, login):
+    headers = login('transitions@example.com')
+    response = client.post('/api/v1/orders/bulk', data=json.dumps([bulk_order()]),
+                           content_type='application/json', headers=headers)
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['orders'][0]['id']
+
+@pytest.fixture
+def admin_id(app, login):
+    from models.user import User
+
+    login('admin@example.com', role='admin')
+    with app.app_context():
+        return User.query.filter_by(email='admin@example.com').first().id
+
+@contextmanager
+def order_reads():
+    """SELECTs against the orders table, to check the hit path does not read before updating"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'FROM orders' in statement:
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+def history(order_id):
+    return [(h.from_status, h.to_status) for h in OrderStatusHistory.query.filter_by(order_id=order_id)
+            .order_by(OrderStatusHistory.created_at) if h.from_status]
+
+def test_transition_updates_without_reading_first(app, order_id, admin_id):
+    with app.app_context(), order_reads() as reads:
+        order, transition = OrderService.transition(order_id, 'confirmed', admin_id)
+        db.session.commit()
+
+        assert reads == []
+        assert (order.status, order.version) == ('confirmed', 2)
+        assert (transition.from_status, transition.to_status) == ('pending', 'confirmed')
+
+def test_transition_records_the_predecessor_it_moved_from(app, order_id, admin_id):
+    with app.app_context():
+        OrderService.transition(order_id, 'confirmed', admin_id)
+        order, transition = OrderService.transition(order_id, 'cancelled', admin_id, reason='changed my mind')
+        db.session.commit()
+
+        assert transition.from_status == 'confirmed'
+        assert order.cancellation_reason == 'changed my mind'
+        assert history(order_id) == [('pending', 'confirmed'), ('confirmed', 'cancelled')]
+
+def test_transition_misses_are_explained(app, order_id, admin_id):
+    with app.app_context():
+        order, transition = OrderService.transition(order_id, 'pending', admin_id)
+        assert transition is None and order.version == 1
+
+        with pytest.raises(ValidationError, match='from pending to delivered'):
+            OrderService.transition(order_id, 'delivered', admin_id)
+        with pytest.raises(ConflictError, match='version 1'):
+            OrderService.transition(order_id, 'confirmed', admin_id, expected_version=3)
+        with pytest.raises(NotFoundError):
+            OrderService.transition('00000000-0000-0000-0000-000000000000', 'confirmed', admin_id)
+
+        order, transition = OrderService.transition(order_id, 'confirmed', admin_id, expected_version=1)
+        assert transition is not None and order.version == 2
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from app import db
+from models.analytics import OrderRollup
+from services.analytics_service import AnalyticsService, ROLLUP_COUNTERS
+
+def test_rollup_fallback_inserts_then_increments(app):
+    at = datetime(2024, 3, 1, 18, 30)
+    with app.app_context():
+        buckets = AnalyticsService._bucket_totals([(at, {'orders_created': 2, 'revenue': 10.0})])
+        AnalyticsService._increment_or_insert(AnalyticsService._bucket_rows(buckets, shard=0))
+        buckets = AnalyticsService._bucket_totals([(at, {'orders_created': 1, 'revenue': 5.0})])
+        AnalyticsService._increment_or_insert(AnalyticsService._bucket_rows(buckets, shard=0))
+        db.session.commit()
+
+        rows = {row.granularity: row for row in OrderRollup.query.filter_by(shard=0)}
+        assert set(rows) == {'hour', 'day'}
+        for row in rows.values():
+            assert (row.orders_created, row.revenue) == (3, 15.0)
+
+def test_rollup_fallback_matches_on_conflict_upsert(app):
+    events = [(datetime(2024, 3, 1, hour), {'orders_created': 1, 'orders_delivered': hour % 2}) for hour in range(24)]
+    with app.app_context():
+        rows = AnalyticsService._bucket_rows(AnalyticsService._bucket_totals(events), shard=1)
+        AnalyticsService._upsert(rows)
+        AnalyticsService._upsert(AnalyticsService._bucket_rows(AnalyticsService._bucket_totals(events), shard=1))
+        AnalyticsService._increment_or_insert(AnalyticsService._bucket_rows(AnalyticsService._bucket_totals(events), shard=2))
+        AnalyticsService._increment_or_insert(AnalyticsService._bucket_rows(AnalyticsService._bucket_totals(events), shard=2))
+        db.session.commit()
+
+        def totals(shard):
+            return sorted(
+                (row.granularity, row.bucket_start, *(getattr(row, counter) for counter in ROLLUP_COUNTERS))
+                for row in OrderRollup.query.filter_by(shard=shard)
+            )
+        assert totals(1) == totals(2)
+
+def test_wallet_fallback_creates_only_missing_wallets(app, login):
+    from models.payment import UserWallet
+    from models.user import User
+    from services.ledger_service import LedgerService
+
+    login('first@example.com')
+    login('second@example.com')
+    with app.app_context():
+        user_ids = [user.id for user in User.query.order_by(User.email)]
+        LedgerService.ensure_wallets(user_ids[:1])
+        db.session.commit()
+        existing = UserWallet.query.filter_by(user_id=user_ids[0]).one().id
+
+        now = datetime.utcnow()
+        rows = [{'id': f'wallet-{user_id}', 'user_id': user_id, 'balance': 0, 'total_added': 0, 'total_spent': 0,
+                 'created_at': now, 'updated_at': now} for user_id in user_ids]
+        LedgerService._insert_missing_wallets(rows)
+        LedgerService._insert_missing_wallets(rows)
+        db.session.commit()
+
+        wallets = {wallet.user_id: wallet.id for wallet in UserWallet.query.filter(UserWallet.user_id.in_(user_ids))}
+        assert wallets == {user_ids[0]: existing, user_ids[1]: f'wallet-{user_ids[1]}'}
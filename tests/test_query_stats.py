@@ -0,0 +1,17 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from utils import query_stats
+
+def test_failed_statement_does_not_leave_a_start_time_behind(app):
+    with app.test_request_context(), db.engine.connect() as conn:
+        query_stats.start_request()
+        with pytest.raises(OperationalError):
+            conn.execute(text('SELECT * FROM no_such_table'))
+        assert conn.info.get('query_start') == []
+
+        conn.execute(text('SELECT 1'))
+        assert conn.info['query_start'] == []
+        assert query_stats.current_stats().count == 1
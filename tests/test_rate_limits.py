@@ -0,0 +1,32 @@
+import pytest
+
+from config import TestingConfig
+from app import create_app
+
+class RateLimitedConfig(TestingConfig):
+    RATELIMIT_ENABLED = True
+    PROXY_FIX_X_FOR = 1
+    RATE_LIMIT_POLICIES = dict(TestingConfig.RATE_LIMIT_POLICIES, login={'limit': 1, 'period': 3600, 'burst': 2})
+
+@pytest.fixture
+def client(tmp_path):
+    class Config(RateLimitedConfig):
+        RATELIMIT_STORAGE_URL = f'shm://{tmp_path}/ratelimit'
+
+    return create_app(Config).test_client()
+
+def login_from(client, ip):
+    return client.post('/api/v1/auth/login', json={'email': 'nobody@example.com', 'password': 'wrong'},
+                       headers={'X-Forwarded-For': ip})
+
+def test_anonymous_clients_behind_a_proxy_get_their_own_buckets(client):
+    assert [login_from(client, '203.0.113.1').status_code for _ in range(3)] == [401, 401, 429]
+    assert login_from(client, '203.0.113.2').status_code == 401
+
+def test_exhausted_logins_do_not_block_registration(client):
+    for _ in range(3):
+        login_from(client, '203.0.113.1')
+    response = client.post('/api/v1/auth/register', headers={'X-Forwarded-For': '203.0.113.1'}, json={
+        'email': 'new@example.com', 'password': 'Passw0rdX', 'first_name': 'Ann', 'last_name': 'Lee', 'phone': '1234567890'
+    })
+    assert response.status_code == 201
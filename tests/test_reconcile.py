@@ -0,0 +1,48 @@
+import io
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+
+from app import db
+from models.payment import Payment
+from services.refund_service import RefundService
+
+PROCESSED_AT = datetime(2024, 3, 1, 12, 0)
+
+@pytest.fixture
+def payments_without_unique_transaction_ids(app):
+    # Tables created by index.py's init_db do not make transaction_id unique
+    with app.app_context():
+        db.session.execute(text('ALTER TABLE payments RENAME TO payments_constrained'))
+        db.session.execute(text('CREATE TABLE payments AS SELECT * FROM payments_constrained WHERE 0'))
+        db.session.commit()
+    return app
+
+def add_payment(transaction_id, amount=25.0, status='completed'):
+    now = datetime.utcnow()
+    db.session.execute(Payment.__table__.insert().values(
+        id=str(uuid.uuid4()), order_id=str(uuid.uuid4()), user_id=str(uuid.uuid4()), amount=amount,
+        status=status, payment_method='card', transaction_id=transaction_id, processed_at=PROCESSED_AT,
+        created_at=now, updated_at=now,
+    ))
+
+def settlement(*rows):
+    return io.StringIO('transaction_id,amount,status\n' + ''.join(f'{t},{a},{s}\n' for t, a, s in rows))
+
+@pytest.mark.parametrize('period', [(None, None), (datetime(2024, 3, 1), datetime(2024, 3, 2))])
+def test_duplicate_transaction_ids_are_reported(payments_without_unique_transaction_ids, period):
+    with payments_without_unique_transaction_ids.app_context():
+        add_payment('tx_dup')
+        add_payment('tx_dup')
+        add_payment('tx_ok')
+        db.session.commit()
+
+        report = RefundService.reconcile(settlement(('tx_dup', 25, 'settled'), ('tx_ok', 25, 'settled')), *period)
+
+    assert report['matched'] == 2
+    assert report['mismatch_counts'] == {'duplicate_in_payments': 1}
+    duplicate, = report['mismatches']
+    assert duplicate['transaction_id'] == 'tx_dup'
+    assert duplicate['first_payment_id'] != duplicate['payment_id']
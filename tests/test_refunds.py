@@ -0,0 +1,74 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from models.payment import Payment, PaymentStatus, RefundJob, RefundJobStatus
+from services.refund_service import RefundService
+from utils.errors import ConflictError
+from utils.payment_processor import payment_processor
+
+def add_payment(status='completed'):
+    now = datetime.utcnow()
+    payment_id = str(uuid.uuid4())
+    db.session.execute(Payment.__table__.insert().values(
+        id=payment_id, order_id=str(uuid.uuid4()), user_id=str(uuid.uuid4()), amount=25.0, status=status,
+        payment_method='card', transaction_id=f'tx_{payment_id}', created_at=now, updated_at=now,
+    ))
+    db.session.commit()
+    return db.session.get(Payment, payment_id)
+
+@pytest.fixture
+def gateway_refunds(monkeypatch):
+    calls = []
+    refund = payment_processor.gateway.refund
+
+    def record(payment_id, *args):
+        calls.append(payment_id)
+        return refund(payment_id, *args)
+
+    monkeypatch.setattr(payment_processor.gateway, 'refund', record)
+    return calls
+
+def test_only_admins_refund_payments(app, client, login):
+    with app.app_context():
+        payment_id = add_payment().id
+
+    response = client.post(f'/api/v1/payments/{payment_id}/refund', json={'reason': 'mine now'},
+                           headers=login('customer@example.com'))
+    assert response.status_code == 401
+    assert response.get_json()['error'] == 'Insufficient permissions'
+
+    response = client.post(f'/api/v1/payments/{payment_id}/refund', json={'reason': 'outage'},
+                           headers=login('admin@example.com', role='admin'))
+    assert response.status_code == 200, response.get_json()
+
+def test_payments_refunded_by_another_runner_are_not_sent_to_the_gateway(app, gateway_refunds):
+    with app.app_context():
+        stale, fresh = add_payment(), add_payment()
+        rows = [db.session.get(Payment, stale.id), db.session.get(Payment, fresh.id)]
+        # Another runner refunds the first payment after this one selected its chunk
+        RefundService.refund_payments([stale], 'outage')
+        db.session.commit()
+
+        refunded, errors = RefundService.refund_payments(rows, 'outage')
+        db.session.commit()
+
+        assert (refunded, errors) == ([(fresh.id, 25.0)], [])
+        assert gateway_refunds == [stale.id, fresh.id]
+        assert db.session.get(Payment, fresh.id).status == PaymentStatus.REFUNDED.value
+
+def test_a_running_job_is_not_claimed_twice(app):
+    with app.app_context():
+        job = RefundService.create_job({'order_ids': [str(uuid.uuid4())]}, 'outage')
+        job.status = RefundJobStatus.RUNNING.value
+        db.session.commit()
+
+        with pytest.raises(ConflictError):
+            RefundService.run_job(job.id)
+
+        # A runner that stopped checkpointing loses the job after the lease
+        db.session.execute(RefundJob.__table__.update().values(updated_at=datetime.utcnow() - timedelta(hours=1)))
+        db.session.commit()
+        assert RefundService.run_job(job.id).status == RefundJobStatus.COMPLETED.value